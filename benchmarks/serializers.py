@@ -0,0 +1,118 @@
+"""
+Compare the cost of the multi-lang serializers for different Tuple sizes.
+
+Usage::
+
+    python benchmarks/serializers.py [--messages 20000]
+
+For each Tuple shape, this times encoding an ``emit`` message (what a Python
+component does for every Tuple it emits) and decoding an incoming Tuple
+message (what a Python bolt does for every Tuple it receives).
+"""
+
+import argparse
+import io
+import random
+import string
+import threading
+import time
+
+from streamparse.storm.serializers import _SERIALIZERS
+from streamparse.util import print_stats_table
+
+# (number of fields, characters per field)
+TUPLE_SHAPES = [(1, 8), (4, 32), (8, 128), (16, 1024)]
+
+
+def _random_values(num_fields, field_size):
+    values = []
+    for i in range(num_fields):
+        if i % 2:
+            values.append(random.randint(0, 2**31))
+        else:
+            values.append(
+                "".join(random.choice(string.ascii_letters) for _ in range(field_size))
+            )
+    return values
+
+
+def _make_serializer(name, input_bytes=b""):
+    return _SERIALIZERS[name](
+        io.BytesIO(input_bytes), io.BytesIO(), threading.RLock(), threading.RLock()
+    )
+
+
+def _to_bytes(serialized):
+    return serialized.encode("utf-8") if isinstance(serialized, str) else serialized
+
+
+def bench_serializer(name, num_fields, field_size, num_messages):
+    """Time encoding emits and decoding Tuples with the named serializer.
+
+    :returns: a `dict` of per-message costs in microseconds and frame size.
+    """
+    values = _random_values(num_fields, field_size)
+    emit_msg = {
+        "command": "emit",
+        "tuple": values,
+        "anchors": ["-6955786537413359385"],
+        "stream": "default",
+        "need_task_ids": False,
+    }
+    tuple_msg = {
+        "id": "-6955786537413359385",
+        "comp": "word_spout",
+        "stream": "default",
+        "task": 9,
+        "tuple": values,
+    }
+    serializer = _make_serializer(name)
+    start = time.perf_counter()
+    for _ in range(num_messages):
+        serializer.serialize_dict(emit_msg)
+    encode_secs = time.perf_counter() - start
+
+    frame = _to_bytes(serializer.serialize_dict(tuple_msg))
+    serializer = _make_serializer(name, frame * num_messages)
+    start = time.perf_counter()
+    for _ in range(num_messages):
+        serializer.read_message()
+    decode_secs = time.perf_counter() - start
+
+    return {
+        "serializer": name,
+        "fields": num_fields,
+        "field size": field_size,
+        "frame bytes": len(frame),
+        "encode us": round(encode_secs / num_messages * 1e6, 2),
+        "decode us": round(decode_secs / num_messages * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--messages",
+        type=int,
+        default=20000,
+        help="Messages to encode and decode per measurement. (default: %(default)s)",
+    )
+    args = parser.parse_args()
+    rows = [
+        bench_serializer(name, num_fields, field_size, args.messages)
+        for num_fields, field_size in TUPLE_SHAPES
+        for name in sorted(_SERIALIZERS)
+    ]
+    columns = [
+        "serializer",
+        "fields",
+        "field size",
+        "frame bytes",
+        "encode us",
+        "decode us",
+    ]
+    print_stats_table("Serializer cost per message", rows, columns, "r")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@ from collections import Counter
 
 from redis import StrictRedis
 
-from streamparse import Bolt
+from streamparse import AsyncBolt, Bolt, TicklessBatchingBolt
 
 
 class WordCountBolt(Bolt):
@@ -24,6 +24,18 @@ class WordCountBolt(Bolt):
         self.emit([word, self.counter[word]])
 
 
+class PersistentWordCountBolt(Bolt):
+    """WordCountBolt that keeps its counts in SQLite, snapshotted on ticks."""
+
+    outputs = ["word", "count"]
+    state_backend = "sqlite"
+    config = {"topology.tick.tuple.freq.secs": 5}
+
+    def process(self, tup):
+        word = tup.values[0]
+        self.emit([word, self.state.incr(word, 10 if word == "dog" else 1)])
+
+
 class RedisWordCountBolt(Bolt):
     outputs = ["word", "count"]
 
@@ -41,3 +53,47 @@ class RedisWordCountBolt(Bolt):
         if self.total % 1000 == 0:
             self.logger.info("counted %i words", self.total)
         self.emit([word, count])
+
+
+class AsyncRedisWordCountBolt(AsyncBolt):
+    outputs = ["word", "count"]
+    max_in_flight = 32
+
+    def initialize(self, conf, ctx):
+        self.redis = StrictRedis()
+        self.total = 0
+
+    async def process(self, tup):
+        word = tup.values[0]
+        inc_by = 10 if word == "dog" else 1
+        # redis-py blocks, so run it in the event loop's thread pool
+        count = await self.loop.run_in_executor(
+            None, self.redis.zincrby, "words", word, inc_by
+        )
+        self.total += inc_by
+        if self.total % 1000 == 0:
+            self.logger.info("counted %i words", self.total)
+        self.emit([word, count])
+
+
+class RedisBatchingWordCountBolt(TicklessBatchingBolt):
+    outputs = ["word", "count"]
+    secs_between_batches = 1
+
+    def initialize(self, conf, ctx):
+        self.redis = StrictRedis()
+        self.total = 0
+
+    def process_columns(self, key, columns):
+        counts = Counter(columns["word"])
+        if "dog" in counts:
+            counts["dog"] *= 10
+        # One round trip to Redis per batch instead of one per word
+        pipe = self.redis.pipeline()
+        for word, inc_by in counts.items():
+            pipe.zincrby("words", word, inc_by)
+        new_counts = pipe.execute()
+        self.total += sum(counts.values())
+        self.logger.info("counted %i words", self.total)
+        for word, count in zip(counts, new_counts):
+            self.emit([word, count])
@@ -9,6 +9,7 @@ import logging
 from . import bolt, cli, component, dsl, spout, storm
 from .dsl import Grouping, Stream, Topology
 from .storm import (
+    AsyncBolt,
     BatchingBolt,
     Bolt,
     JavaBolt,
@@ -20,6 +21,7 @@ from .storm import (
     StormHandler,
     TicklessBatchingBolt,
     Tuple,
+    WindowedBolt,
 )
 from .version import __version__, VERSION
 
@@ -28,6 +30,7 @@ from .version import __version__, VERSION
 logging.getLogger(__name__).addHandler(logging.NullHandler())
 
 __all__ = [
+    "AsyncBolt",
     "BatchingBolt",
     "Bolt",
     "bolt",
@@ -48,6 +51,7 @@ __all__ = [
     "TicklessBatchingBolt",
     "Topology",
     "Tuple",
+    "WindowedBolt",
 ]
 
 __license__ = """
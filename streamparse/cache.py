@@ -0,0 +1,94 @@
+"""
+A small on-disk cache for information about Storm clusters.
+
+Looking up the workers or config of a cluster, or anything in the Storm UI,
+means opening an SSH tunnel and making a request every time ``sparse`` runs.
+Results are kept as JSON files in ``_cache`` in the project directory, for
+``cache_ttl`` seconds (or ``ui_cache_ttl`` for the Storm UI) as set for the
+environment in ``config.json``.  Use ``sparse --refresh`` to ignore what is
+cached and fetch everything again.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+
+import simplejson as json
+
+CACHE_DIR = "_cache"
+DEFAULT_CACHE_TTL = 300
+DEFAULT_UI_CACHE_TTL = 30
+
+_refresh = False
+
+
+def set_refresh(refresh=True):
+    """Ignore cached values for the rest of this process, while still caching
+    what is fetched.
+    """
+    global _refresh
+    _refresh = refresh
+
+
+def is_refreshing():
+    """Whether ``sparse --refresh`` asked for cached values to be ignored."""
+    return _refresh
+
+
+def _cache_path(namespace, key):
+    digest = hashlib.sha1(
+        json.dumps(list(key), sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return os.path.join(CACHE_DIR, namespace, f"{digest}.json")
+
+
+def load(namespace, key, ttl):
+    """Get the value cached for `key` in `namespace`.
+
+    :param key: a sequence of JSON-serializable parts of the key.
+    :param ttl: the age in seconds after which cached values are ignored.
+    :returns: the cached value, or ``None`` if there is no fresh value.
+    """
+    if _refresh or not ttl or ttl <= 0:
+        return None
+    path = _cache_path(namespace, key)
+    try:
+        if time.time() - os.path.getmtime(path) >= ttl:
+            return None
+        with open(path, encoding="utf-8") as cache_file:
+            return json.load(cache_file)["value"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def store(namespace, key, value):
+    """Cache `value` for `key` in `namespace`.
+
+    Caching is best-effort, so failing to write is not an error.
+    """
+    path = _cache_path(namespace, key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as cache_file:
+            json.dump({"key": list(key), "value": value}, cache_file)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def cached(namespace, key, ttl, fetch):
+    """Get the value cached for `key`, or call `fetch` and cache its result."""
+    value = load(namespace, key, ttl)
+    if value is None:
+        value = fetch()
+        if ttl and ttl > 0:
+            store(namespace, key, value)
+    return value
@@ -0,0 +1,234 @@
+"""
+Record the messages Storm sends to a component, so they can be replayed later.
+
+Capturing is enabled per topology or component with these Storm options:
+
+``streamparse.capture.enabled``
+    Set to ``true`` to record the messages each task receives.
+``streamparse.capture.sample_rate``
+    The fraction of Tuples and commands to record, between 0 and 1.  Tick
+    Tuples are always recorded, and heartbeats never are.  Default is ``1.0``.
+``streamparse.capture.path``
+    The directory to write captures to.  Defaults to ``pystorm.log.path``, or
+    the system temporary directory.
+``streamparse.capture.max_bytes``
+    How large a capture file can get before it is rotated.  Default is 100 MB.
+``streamparse.capture.backup_count``
+    How many rotated capture files to keep.  Default is ``1``.
+``streamparse.capture.flush_secs``
+    The longest time recorded messages are buffered before they are written
+    out, so little is lost if the worker is killed.  Default is ``1.0``.
+
+Capture files are a short header followed by one record per message: an
+8-byte timestamp, a 4-byte length, and the message as JSON.  The first record
+of every file is the handshake (the component class, Storm config, and
+context), so every file can be replayed on its own with ``sparse replay``.
+The lists of task IDs Storm sends back for emits are recorded along with the
+Tuple being processed, so emits with ``need_task_ids`` get them on replay.
+"""
+
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+
+import simplejson as json
+
+CAPTURE_MAGIC = b"SPCAP\x01"
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_FLUSH_SECS = 1.0
+DEFAULT_FLUSH_BYTES = 64 * 1024
+_RECORD_HEADER = struct.Struct(">dI")
+
+
+def _encode(msg):
+    return json.dumps(msg, namedtuple_as_object=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+
+
+class CaptureWriter:
+    """Writes sampled messages to a size-capped, rotated capture file.
+
+    :param path: the path of the capture file.
+    :param handshake: the handshake record to start every file with.
+    :param sample_rate: the fraction of messages to record.
+    :param max_bytes: the size at which to rotate the file.
+    :param backup_count: how many rotated files to keep.
+    :param flush_secs: the longest time to buffer records before writing them
+                       out.
+    :param flush_bytes: how many bytes of records to buffer before writing
+                        them out.
+    """
+
+    def __init__(
+        self,
+        path,
+        handshake,
+        sample_rate=1.0,
+        max_bytes=DEFAULT_MAX_BYTES,
+        backup_count=1,
+        flush_secs=DEFAULT_FLUSH_SECS,
+        flush_bytes=DEFAULT_FLUSH_BYTES,
+    ):
+        self.path = path
+        self.handshake = handshake
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_secs = flush_secs
+        self.flush_bytes = flush_bytes
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._unflushed_bytes = 0
+        self._last_flush = time.monotonic()
+        # Whether each command read but not yet taken by the component was
+        # sampled, and whether the one it is working on now was
+        self._sampled_commands = deque()
+        self._sampling_current = False
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, "wb")
+        self._file.write(CAPTURE_MAGIC)
+        self._write(self.handshake)
+        self._flush()
+
+    def _write(self, msg):
+        payload = _encode(msg)
+        self._file.write(_RECORD_HEADER.pack(time.time(), len(payload)))
+        self._file.write(payload)
+        self._unflushed_bytes += _RECORD_HEADER.size + len(payload)
+
+    def _flush(self):
+        self._file.flush()
+        self._unflushed_bytes = 0
+        self._last_flush = time.monotonic()
+
+    def _rotate(self):
+        self._file.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        self._open()
+
+    def record(self, msg):
+        """Record `msg` if it is sampled.
+
+        Lists of task IDs are recorded if the command the component is
+        working on, which they are the reply to an emit from, was sampled.
+        """
+        if isinstance(msg, list):
+            sampled = self.sample_rate >= 1 or self._sampling_current
+        else:
+            stream = msg.get("stream")
+            sampled = stream != "__heartbeat" and (
+                stream == "__tick"
+                or self.sample_rate >= 1
+                or random.random() < self.sample_rate
+            )
+            if self.sample_rate < 1:
+                self._sampled_commands.append(sampled)
+        with self._lock:
+            if sampled:
+                if self._file.tell() >= self.max_bytes:
+                    self._rotate()
+                self._write(msg)
+                self.records += 1
+            # Heartbeats come every second, so this happens even when idle
+            if self._unflushed_bytes and (
+                self._unflushed_bytes >= self.flush_bytes
+                or time.monotonic() - self._last_flush >= self.flush_secs
+            ):
+                self._flush()
+
+    def command_taken(self):
+        """Note that the component has taken the oldest command it read, and
+        is now working on it.
+
+        Commands can be read ahead while waiting for task IDs, so this is
+        what tells which command later task IDs are for.
+        """
+        if self._sampled_commands:
+            self._sampling_current = self._sampled_commands.popleft()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def open_capture(component, storm_conf, context):
+    """Start capturing messages for `component` if its config asks for it.
+
+    :returns: a :class:`CaptureWriter`, or ``None`` if capturing is disabled.
+    """
+    if not storm_conf.get("streamparse.capture.enabled", False):
+        return None
+    capture_dir = (
+        storm_conf.get("streamparse.capture.path")
+        or storm_conf.get("pystorm.log.path")
+        or tempfile.gettempdir()
+    )
+    os.makedirs(capture_dir, exist_ok=True)
+    file_name = (
+        f"streamparse_capture_{component.topology_name}_{component.component_name}"
+        f"_{component.task_id}_{component.pid}.spcap"
+    )
+    cls = component.__class__
+    handshake = {
+        "class": f"{cls.__module__}.{cls.__name__}",
+        "conf": storm_conf,
+        "context": context,
+    }
+    return CaptureWriter(
+        os.path.join(capture_dir, file_name),
+        handshake,
+        sample_rate=storm_conf.get("streamparse.capture.sample_rate", 1.0),
+        max_bytes=storm_conf.get("streamparse.capture.max_bytes", DEFAULT_MAX_BYTES),
+        backup_count=storm_conf.get("streamparse.capture.backup_count", 1),
+        flush_secs=storm_conf.get("streamparse.capture.flush_secs", DEFAULT_FLUSH_SECS),
+    )
+
+
+def read_capture(capture_file):
+    """Read the records in a capture file.
+
+    A record cut off by the file being copied while it was written is
+    ignored.
+
+    :param capture_file: a binary file object.
+    :returns: a `tuple` of the handshake record, and an iterator of
+              ``(timestamp, message)`` pairs for the rest of the records.
+    """
+    name = getattr(capture_file, "name", "Capture")
+    if capture_file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+        raise ValueError(f"{name} is not a streamparse capture file.")
+
+    def records():
+        while True:
+            header = capture_file.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+            timestamp, length = _RECORD_HEADER.unpack(header)
+            payload = capture_file.read(length)
+            if len(payload) < length:
+                return
+            yield timestamp, json.loads(payload.decode("utf-8"))
+
+    messages = records()
+    try:
+        _, handshake = next(messages)
+    except StopIteration:
+        raise ValueError(f"{name} has no handshake record.")
+    return handshake, messages
@@ -0,0 +1,550 @@
+"""
+Benchmark a Python bolt from a topology outside of Storm.
+
+The bolt is started in a subprocess with ``streamparse_run``, exactly like
+Storm would start it, and fed synthetic Tuples (random values for each field
+of its inputs) or recorded ones over the multi-lang protocol.  Throughput,
+latency percentiles, serializer cost, and memory growth are reported.
+
+Recorded Tuples are read from a file with one JSON value per line, either a
+list of Tuple values, or an object like ``{"comp": "word_spout", "stream":
+"default", "tuple": ["dog"]}``.
+"""
+
+import io
+import itertools
+import math
+import os
+import queue
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import simplejson as json
+
+from ..storm.serializers import _SERIALIZERS
+from ..util import (
+    get_config,
+    get_env_config,
+    get_topology_definition,
+    get_topology_from_file,
+    print_stats_table,
+)
+from .common import add_config, add_environment, add_name, add_options
+
+HEARTBEAT_SECS = 1
+
+
+def _read_rss_kb(pid):
+    """Return the resident set size of `pid` in kB, or ``None`` if unknown."""
+    try:
+        with open(f"/proc/{pid}/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    # Rounding first keeps float error from pushing the rank up by one
+    index = max(math.ceil(round(percent * len(sorted_values) / 100, 9)) - 1, 0)
+    return sorted_values[index]
+
+
+def get_bolt_spec(topology_class, component_name):
+    """Find the spec for the Python bolt `component_name` in a topology."""
+    for spec in topology_class.specs:
+        if spec.name == component_name:
+            break
+    else:
+        raise ValueError(
+            f"No component named {component_name!r} in {topology_class.__name__}. "
+            f"Options are: {sorted(spec.name for spec in topology_class.specs)!r}"
+        )
+    shell = spec.component_object.shell
+    if not spec.inputs or shell is None or shell.execution_command != "streamparse_run":
+        raise ValueError(f"{component_name!r} is not a Python bolt.")
+    return spec
+
+
+def get_input_fields(topology_class, spec):
+    """Return a `dict` mapping from (component, stream) pairs to the fields of
+    every stream `spec` subscribes to.
+    """
+    specs = {other.name: other for other in topology_class.specs}
+    return {
+        (stream_id.componentId, stream_id.streamId): specs[stream_id.componentId]
+        .outputs[stream_id.streamId]
+        .output_fields
+        for stream_id in spec.inputs
+    }
+
+
+def synthetic_tuples(input_fields, value_size=16, distinct_values=1000):
+    """Endlessly generate random Tuples for the given input streams.
+
+    String values are drawn from `distinct_values` random strings of
+    `value_size` characters, so fields groupings and caches see a realistic
+    mix of repeated keys.
+
+    :returns: an iterator of ``(component, stream, values)`` tuples.
+    """
+    vocabulary = [
+        "".join(random.choice(string.ascii_lowercase) for _ in range(value_size))
+        for _ in range(distinct_values)
+    ]
+    streams = sorted(input_fields.items())
+    for (component, stream), fields in itertools.cycle(streams):
+        yield component, stream, [random.choice(vocabulary) for _ in fields]
+
+
+def recorded_tuples(input_file, input_fields):
+    """Endlessly replay the Tuples recorded in `input_file`.
+
+    :returns: an iterator of ``(component, stream, values)`` tuples.
+    """
+    default_component, default_stream = sorted(input_fields)[0]
+    recorded = []
+    for line in input_file:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if isinstance(record, dict):
+            recorded.append(
+                (
+                    record.get("comp", default_component),
+                    record.get("stream", default_stream),
+                    record["tuple"],
+                )
+            )
+        else:
+            recorded.append((default_component, default_stream, record))
+    if not recorded:
+        raise ValueError("No recorded Tuples found.")
+    return itertools.cycle(recorded)
+
+
+def serializer_cost_us(serializer_name, tuples, num_samples=1000):
+    """Time encoding and decoding Tuple messages with a serializer.
+
+    :returns: the average cost per Tuple in microseconds.
+    """
+    messages = [
+        {"id": str(i), "comp": component, "stream": stream, "task": 1, "tuple": values}
+        for i, (component, stream, values) in enumerate(
+            itertools.islice(tuples, num_samples)
+        )
+    ]
+    serializer_cls = _SERIALIZERS[serializer_name]
+    encoder = serializer_cls(
+        io.BytesIO(), io.BytesIO(), threading.RLock(), threading.RLock()
+    )
+    start = time.perf_counter()
+    frames = [encoder.serialize_dict(msg) for msg in messages]
+    encode_secs = time.perf_counter() - start
+    data = frames[0][:0].join(frames)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    decoder = serializer_cls(
+        io.BytesIO(data), io.BytesIO(), threading.RLock(), threading.RLock()
+    )
+    start = time.perf_counter()
+    for _ in messages:
+        decoder.read_message()
+    decode_secs = time.perf_counter() - start
+    return (encode_secs + decode_secs) / len(messages) * 1e6
+
+
+class ComponentProcess:
+    """A Python component run by ``streamparse_run`` in a subprocess, which we
+    talk to like Storm would.
+
+    :param spec: the spec of the component to run.
+    :param conf: the Storm config to send in the handshake.
+    :param context: the topology context to send in the handshake.
+    :param serializer: the name of the serializer to use.
+    :param command_prefix: arguments to run before ``-m streamparse.run``,
+                           like ``["-m", "cProfile", "-o", "out.prof"]``.
+    """
+
+    def __init__(self, spec, conf, context, serializer="json", command_prefix=None):
+        cls = spec.component_cls
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(path or os.getcwd() for path in sys.path)
+        self.pid_dir = tempfile.mkdtemp(prefix="streamparse_bench_")
+        self.process = subprocess.Popen(
+            [sys.executable]
+            + list(command_prefix or [])
+            + [
+                "-m",
+                "streamparse.run",
+                "-s",
+                serializer,
+                f"{cls.__module__}.{cls.__name__}",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env,
+        )
+        self.serializer = _SERIALIZERS[serializer](
+            self.process.stdout,
+            self.process.stdin,
+            threading.RLock(),
+            threading.RLock(),
+        )
+        self.messages = queue.Queue()
+        self.send({"pidDir": self.pid_dir, "conf": conf, "context": context})
+        self.pid = self.serializer.read_message()["pid"]
+        threading.Thread(target=self._read_messages, daemon=True).start()
+
+    def _read_messages(self):
+        try:
+            while True:
+                self.messages.put(self.serializer.read_message())
+        except Exception:
+            # Almost always EOF because the process exited
+            self.messages.put(None)
+
+    def send(self, msg):
+        self.serializer.send_message(msg)
+
+    def close(self, timeout=10):
+        """Close the component's stdin, and wait for it to exit."""
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        for file_name in os.listdir(self.pid_dir):
+            os.remove(os.path.join(self.pid_dir, file_name))
+        os.rmdir(self.pid_dir)
+
+
+def make_handshake(topology_class, spec, topology_name, options=None):
+    """Build the Storm config and topology context for running `spec`.
+
+    :returns: a `tuple` of ``(conf, context)``.
+    """
+    conf = dict(topology_class.config)
+    conf.update(json.loads(spec.config))
+    conf.update(options or {})
+    conf["topology.name"] = topology_name
+    source_stream_fields = {}
+    for (component, stream), fields in get_input_fields(topology_class, spec).items():
+        source_stream_fields.setdefault(component, {})[stream] = fields
+    context = {
+        "taskid": 1,
+        "componentid": spec.name,
+        "task->component": {"1": spec.name},
+        "source->stream->fields": source_stream_fields,
+    }
+    return conf, context
+
+
+def run_benchmark(
+    component,
+    tuples,
+    num_tuples=10000,
+    warmup=1000,
+    max_pending=100,
+    timeout=60,
+    tick_freq_secs=None,
+):
+    """Feed `tuples` to a :class:`ComponentProcess` and measure how it does.
+
+    Each Tuple's latency is measured from when the bolt could have started
+    processing it (when it was sent, or when the previous Tuple was acked,
+    whichever is later) until it is acked or failed, which is the bolt's
+    process latency when it handles Tuples in order.
+
+    :returns: a `dict` of results.
+    """
+    total = warmup + num_tuples
+    send_times = {}
+    latencies = []
+    acked = failed = errors = emitted = 0
+    next_id = 0
+    done = 0
+    last_done_time = None
+    start_time = None
+    rss_start_kb = None
+    now = time.perf_counter()
+    if not warmup:
+        # Otherwise set once the last warmup Tuple is done
+        start_time = now
+        rss_start_kb = _read_rss_kb(component.pid)
+    deadline = now + timeout
+    next_heartbeat_time = now + HEARTBEAT_SECS
+    next_tick_time = None if not tick_freq_secs else now + tick_freq_secs
+
+    while done < total:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        if now >= next_heartbeat_time:
+            next_heartbeat_time = now + HEARTBEAT_SECS
+            component.send(
+                {
+                    "id": "-1",
+                    "comp": None,
+                    "stream": "__heartbeat",
+                    "task": -1,
+                    "tuple": [],
+                }
+            )
+        if next_tick_time is not None and now >= next_tick_time:
+            next_tick_time = now + tick_freq_secs
+            component.send(
+                {
+                    "id": "-2",
+                    "comp": "__system",
+                    "stream": "__tick",
+                    "task": -1,
+                    "tuple": [tick_freq_secs],
+                }
+            )
+        while next_id < total and len(send_times) < max_pending:
+            source, stream, values = next(tuples)
+            tup_id = str(next_id)
+            next_id += 1
+            send_times[tup_id] = time.perf_counter()
+            component.send(
+                {
+                    "id": tup_id,
+                    "comp": source,
+                    "stream": stream,
+                    "task": 1,
+                    "tuple": values,
+                }
+            )
+        wait = next_heartbeat_time - now
+        if next_tick_time is not None:
+            wait = min(wait, next_tick_time - now)
+        try:
+            msg = component.messages.get(timeout=max(wait, 0))
+        except queue.Empty:
+            continue
+        if msg is None:
+            break
+        if isinstance(msg, list):
+            continue
+        command = msg.get("command")
+        if command in ("ack", "fail"):
+            sent = send_times.pop(msg["id"], None)
+            if sent is None:
+                # Tick or heartbeat
+                continue
+            done_time = time.perf_counter()
+            done += 1
+            if done == warmup:
+                start_time = done_time
+                rss_start_kb = _read_rss_kb(component.pid)
+            elif done > warmup:
+                started = sent if last_done_time is None else max(sent, last_done_time)
+                latencies.append(done_time - started)
+                if command == "ack":
+                    acked += 1
+                else:
+                    failed += 1
+            last_done_time = done_time
+        elif command == "emit":
+            emitted += 1
+            if "task" not in msg and msg.get("need_task_ids", True):
+                component.send([])
+        elif command == "error":
+            errors += 1
+            print(msg.get("msg"), file=sys.stderr)
+
+    end_time = time.perf_counter()
+    rss_end_kb = _read_rss_kb(component.pid)
+    if start_time is None:
+        start_time = end_time
+    elapsed = end_time - start_time
+    latencies.sort()
+    results = {
+        "tuples": len(latencies),
+        "acked": acked,
+        "failed": failed,
+        "errors": errors,
+        "emitted": emitted,
+        "timed_out": done < total,
+        "elapsed_secs": round(elapsed, 3),
+        "tuples_per_sec": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "rss_start_kb": rss_start_kb,
+        "rss_end_kb": rss_end_kb,
+        "rss_growth_kb": (
+            rss_end_kb - rss_start_kb
+            if rss_start_kb is not None and rss_end_kb is not None
+            else None
+        ),
+    }
+    for name, percent in (("p50", 50), ("p99", 99), ("p999", 99.9)):
+        value = _percentile(latencies, percent)
+        results[f"latency_{name}_ms"] = None if value is None else round(value * 1e3, 3)
+    return results
+
+
+def bench_component(
+    component_name,
+    name=None,
+    env_name=None,
+    options=None,
+    config_file=None,
+    input_file=None,
+    num_tuples=10000,
+    warmup=1000,
+    max_pending=100,
+    value_size=16,
+    timeout=60,
+    serializer=None,
+):
+    """Benchmark the bolt `component_name` of a topology.
+
+    :returns: a `dict` of results.
+    """
+    name, topology_file = get_topology_definition(name, config_file=config_file)
+    config = get_config(config_file=config_file)
+    env_name, env_config = get_env_config(env_name, config_file=config_file)
+    topology_class = get_topology_from_file(topology_file)
+    spec = get_bolt_spec(topology_class, component_name)
+    if serializer is None:
+        serializer = env_config.get("serializer", config.get("serializer", "json"))
+
+    input_fields = get_input_fields(topology_class, spec)
+    if input_file is not None:
+        input_file = list(input_file)
+
+    def make_tuples():
+        if input_file is None:
+            return synthetic_tuples(input_fields, value_size=value_size)
+        return recorded_tuples(input_file, input_fields)
+
+    conf, context = make_handshake(topology_class, spec, name, options=options)
+    component = ComponentProcess(spec, conf, context, serializer=serializer)
+    try:
+        results = run_benchmark(
+            component,
+            make_tuples(),
+            num_tuples=num_tuples,
+            warmup=warmup,
+            max_pending=max_pending,
+            timeout=timeout,
+            tick_freq_secs=conf.get("topology.tick.tuple.freq.secs"),
+        )
+    finally:
+        component.close()
+    results.update(
+        {
+            "component": component_name,
+            "class": f"{spec.component_cls.__module__}.{spec.component_cls.__name__}",
+            "serializer": serializer,
+            "serializer_us": round(serializer_cost_us(serializer, make_tuples()), 2),
+        }
+    )
+    return results
+
+
+def subparser_hook(subparsers):
+    """Hook to add subparser for this command."""
+    subparser = subparsers.add_parser("bench", description=__doc__, help=main.__doc__)
+    subparser.set_defaults(func=main)
+    subparser.add_argument(
+        "component", help="Name of the bolt in the topology to benchmark."
+    )
+    add_config(subparser)
+    add_environment(subparser)
+    subparser.add_argument(
+        "-i",
+        "--input",
+        type=open,
+        help="File of recorded Tuples to send, one JSON value per line. "
+        "Random Tuples are generated if this is not given.",
+    )
+    subparser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the results as JSON, for tracking regressions.",
+    )
+    subparser.add_argument(
+        "--max_pending",
+        default=100,
+        type=int,
+        help="Maximum number of Tuples sent to the bolt without being acked "
+        "or failed. (default: %(default)s)",
+    )
+    add_name(subparser)
+    add_options(subparser)
+    subparser.add_argument(
+        "-s",
+        "--serializer",
+        choices=sorted(_SERIALIZERS),
+        help="Serializer to use. Defaults to the one in config.json, or json.",
+    )
+    subparser.add_argument(
+        "-t",
+        "--tuples",
+        default=10000,
+        type=int,
+        help="Number of Tuples to measure. (default: %(default)s)",
+    )
+    subparser.add_argument(
+        "--timeout",
+        default=60,
+        type=float,
+        help="Seconds to wait for the benchmark to finish. (default: %(default)s)",
+    )
+    subparser.add_argument(
+        "--value_size",
+        default=16,
+        type=int,
+        help="Characters in each randomly generated value. (default: %(default)s)",
+    )
+    subparser.add_argument(
+        "-w",
+        "--warmup",
+        default=1000,
+        type=int,
+        help="Number of Tuples to send before measuring. (default: %(default)s)",
+    )
+
+
+def main(args):
+    """Benchmark a Python bolt from a topology"""
+    results = bench_component(
+        args.component,
+        name=args.name,
+        env_name=args.environment,
+        options=args.options,
+        config_file=args.config,
+        input_file=args.input,
+        num_tuples=args.tuples,
+        warmup=args.warmup,
+        max_pending=args.max_pending,
+        value_size=args.value_size,
+        timeout=args.timeout,
+        serializer=args.serializer,
+    )
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        columns = sorted(results)
+        print_stats_table(
+            f"Benchmark of {args.component}",
+            [{"metric": key, "value": results[key]} for key in columns],
+            ["metric", "value"],
+            "l",
+        )
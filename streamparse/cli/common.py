@@ -174,7 +174,7 @@ def add_pool_size(parser):
     parser.add_argument(
         "--pool_size",
         help="Number of simultaneous SSH connections to use when updating "
-        "virtualenvs, removing logs, or tailing logs.",
+        "virtualenvs, removing logs, or tailing or searching logs.",
         default=10,
         type=int,
     )
@@ -266,6 +266,7 @@ def add_workers(parser):
 
 VIRTUALENV_OPTIONS = (
     "install_virtualenv",
+    "prebuilt_virtualenv",
     "use_virtualenv",
     "virtualenv_flags",
     "virtualenv_root",
@@ -1,19 +1,246 @@
 """
 Create a JAR that can be used to deploy a topology to Storm.
+
+JARs are cached in ``_cache/jars``, named after a hash of everything they are
+built from except the contents of the non-JVM (usually Python) files in
+``src``.  When only those files have changed since the last build, their
+entries in the cached JAR are replaced instead of running Leiningen again.
 """
 
+import hashlib
 import os
 import shutil
 import sys
+import time
+import zipfile
 
+import simplejson as json
 from fabric.api import hide, local, settings
 
+from .. import cache
 from ..util import prepare_topology
 from .common import add_simple_jar
 
+JAR_CACHE_DIR = "jars"
+# How many built JARs to keep in the cache
+JAR_CACHE_SIZE = 3
+# Changing files in src with these suffixes always needs a Leiningen build
+JVM_SOURCE_SUFFIXES = (".clj", ".cljc", ".cljs", ".java", ".class", ".jar")
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_tree(root, exclude=None):
+    """Hash every file under `root`, except those under `exclude`.
+
+    :returns: a `dict` mapping paths relative to `root`, with ``/``
+              separators, to the SHA-256 hashes of their contents.
+    """
+    hashes = {}
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(
+            dir_name
+            for dir_name in dir_names
+            if os.path.join(dir_path, dir_name) != exclude
+        )
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            rel_path = os.path.relpath(path, root).replace(os.sep, "/")
+            hashes[rel_path] = _hash_file(path)
+    return hashes
+
+
+def get_build_key(src_hashes, simple_jar=False):
+    """Hash everything Leiningen builds a JAR from, except the contents of
+    files in ``src`` that can be replaced in a built JAR.
+
+    :param src_hashes: the hashes of the files in ``src``, from
+                       :func:`_hash_tree`.
+    """
+    inputs = {
+        "simple_jar": simple_jar,
+        "project.clj": _hash_file("project.clj")
+        if os.path.exists("project.clj")
+        else None,
+        "_resources": _hash_tree(
+            "_resources", exclude=os.path.join("_resources", "resources")
+        ),
+        "src": {
+            rel_path: file_hash if rel_path.endswith(JVM_SOURCE_SUFFIXES) else None
+            for rel_path, file_hash in src_hashes.items()
+        },
+    }
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _get_entry_names(rel_paths):
+    """Map the names of the JAR entries for files in ``src`` to their paths.
+
+    Leiningen puts every file in ``src`` in the JAR twice: under
+    ``resources/`` from ``_resources``, and at the top level because ``src``
+    is a source path.
+    """
+    rel_paths = list(rel_paths)
+    entry_names = {f"resources/{rel_path}": rel_path for rel_path in rel_paths}
+    for rel_path in rel_paths:
+        entry_names.setdefault(rel_path, rel_path)
+    return entry_names
+
+
+def _write_cached_jar(jar, cached_jar, src_hashes):
+    """Copy `jar` to `cached_jar`, with the entries for files in ``src``
+    that can be replaced moved to the end.
+    """
+    entry_names = _get_entry_names(
+        rel_path
+        for rel_path in src_hashes
+        if not rel_path.endswith(JVM_SOURCE_SUFFIXES)
+    )
+    tmp_path = f"{cached_jar}.tmp"
+    with zipfile.ZipFile(jar) as built, zipfile.ZipFile(tmp_path, "w") as cached:
+        # Sorting is stable, so everything else keeps its order
+        for info in sorted(
+            built.infolist(), key=lambda info: info.filename in entry_names
+        ):
+            cached.writestr(info, built.read(info))
+    os.replace(tmp_path, cached_jar)
+
+
+def _patch_jar(cached_jar, old_hashes, new_hashes):
+    """Replace the entries for the files in ``src`` that changed from
+    `old_hashes` to `new_hashes` in `cached_jar`.
+
+    Only entries at the end of the JAR are rewritten, by truncating it at the
+    first changed entry and appending the rest again.  Files Leiningen left
+    out of the JAR stay out of it.
+
+    :returns: the number of entries replaced.
+    """
+    entry_names = _get_entry_names(
+        rel_path
+        for rel_path, file_hash in new_hashes.items()
+        if old_hashes.get(rel_path) != file_hash
+    )
+    # Appending to something that is not a zip file would start a new one
+    if not zipfile.is_zipfile(cached_jar):
+        raise zipfile.BadZipFile(f"{cached_jar} is not a JAR")
+    with zipfile.ZipFile(cached_jar, "a") as jar:
+        infos = jar.infolist()
+        changed = [info for info in infos if info.filename in entry_names]
+        if not changed:
+            return 0
+        tail_offset = min(info.header_offset for info in changed)
+        kept = [info for info in infos if info.header_offset < tail_offset]
+        tail = [
+            (info, jar.read(info))
+            for info in infos
+            if info.header_offset >= tail_offset and info.filename not in entry_names
+        ]
+        for info in changed:
+            path = os.path.join("src", entry_names[info.filename])
+            new_info = zipfile.ZipInfo(
+                info.filename, date_time=time.localtime(os.path.getmtime(path))[:6]
+            )
+            new_info.compress_type = info.compress_type
+            new_info.external_attr = info.external_attr
+            with open(path, "rb") as src_file:
+                tail.append((new_info, src_file.read()))
+        # Forget everything from the first changed entry on, so it gets
+        # overwritten, and the central directory is rewritten on close
+        jar.filelist = kept
+        jar.NameToInfo = {info.filename: info for info in kept}
+        jar.start_dir = tail_offset
+        for info, data in tail:
+            jar.writestr(info, data)
+    return len(changed)
+
+
+def _read_manifest(manifest_path):
+    try:
+        with open(manifest_path, encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(manifest_path, src_hashes):
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(src_hashes, manifest_file)
+    os.replace(tmp_path, manifest_path)
+
+
+def _prune_jar_cache(jar_dir, keep=JAR_CACHE_SIZE):
+    """Remove all but the `keep` most recently used JARs from the cache."""
+    jars = sorted(
+        (
+            os.path.join(jar_dir, file_name)
+            for file_name in os.listdir(jar_dir)
+            if file_name.endswith(".jar")
+        ),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for jar in jars[keep:]:
+        for path in (jar, f"{jar[:-4]}.json"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
 
 def jar_for_deploy(simple_jar=False):
-    """ Build a jar to use for deploying the topology. """
+    """Build a jar to use for deploying the topology, or update the one
+    built last time if only Python files have changed since.
+
+    ``sparse --refresh`` always builds a new one.
+
+    :returns: the path of the JAR.
+    """
+    if not os.path.exists("src"):
+        raise FileNotFoundError('Your project must have a "src" directory.')
+    jar_type = "JAR" if simple_jar else "Uber-JAR"
+    src_hashes = _hash_tree("src")
+    build_key = get_build_key(src_hashes, simple_jar=simple_jar)
+    jar_dir = os.path.join(cache.CACHE_DIR, JAR_CACHE_DIR)
+    cached_jar = os.path.join(jar_dir, f"{build_key}.jar")
+    manifest_path = os.path.join(jar_dir, f"{build_key}.json")
+    old_hashes = None
+    if not cache.is_refreshing() and os.path.exists(cached_jar):
+        old_hashes = _read_manifest(manifest_path)
+    if old_hashes == src_hashes:
+        os.utime(cached_jar)
+        print(f"{jar_type} is up to date: {cached_jar}")
+        return cached_jar
+    if old_hashes is not None:
+        # Without a manifest, a JAR left half-patched is rebuilt next time
+        os.remove(manifest_path)
+        try:
+            num_changed = _patch_jar(cached_jar, old_hashes, src_hashes)
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f"Unable to update cached {jar_type}, rebuilding it: {e}")
+        else:
+            _write_manifest(manifest_path, src_hashes)
+            print(f"Updated {num_changed} entries in {jar_type}: {cached_jar}")
+            return cached_jar
+    jar = _build_jar(simple_jar=simple_jar)
+    os.makedirs(jar_dir, exist_ok=True)
+    _write_cached_jar(jar, cached_jar, src_hashes)
+    _write_manifest(manifest_path, src_hashes)
+    _prune_jar_cache(jar_dir)
+    return cached_jar
+
+
+def _build_jar(simple_jar=False):
+    """ Build a jar with Leiningen. """
     # Create _resources folder which will contain Python code in JAR
     prepare_topology()
     # Use Leiningen to clean up and build JAR
@@ -0,0 +1,280 @@
+"""
+Search the logs of a topology on every Storm worker.
+
+The search runs on each worker, so only matching log entries are sent back,
+which are then merged by timestamp.  Rotated and gzipped pystorm log files are
+searched too.
+"""
+
+import base64
+import heapq
+import inspect
+import re
+import sys
+from collections import deque
+from datetime import datetime, timedelta
+
+import simplejson as json
+from fabric.api import env, execute, hide, parallel, run, settings
+
+from .. import logsearch
+from ..logsearch import normalize_timestamp
+from ..remote import get_executor
+from ..util import activate_env, die, get_env_config, get_topology_definition
+from .common import (
+    add_config,
+    add_environment,
+    add_name,
+    add_override_name,
+    add_pattern,
+    add_pool_size,
+)
+
+DEFAULT_MAX_RESULTS = 1000
+# The Python to search with on the workers, which only needs the stdlib
+SEARCH_PYTHON = "python3"
+_AGE_RE = re.compile(r"^(\d+)([smhd])$")
+_AGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_time(value, now=None):
+    """Get a time given as a timestamp, a date, or an age like ``30m``, ``2h``,
+    or ``1d``, as a timestamp that can be compared with the ones in logs.
+
+    Ages are from the current local time, and log timestamps are in the local
+    time of each worker, so they should be in the same time zone.
+    """
+    match = _AGE_RE.match(value)
+    if match is not None:
+        age = timedelta(seconds=int(match.group(1)) * _AGE_UNITS[match.group(2)])
+        value = ((now or datetime.now()) - age).strftime("%Y-%m-%d %H:%M:%S")
+    elif re.match(r"^\d{4}-\d{2}-\d{2}$", value):
+        value += " 00:00:00"
+    timestamp = normalize_timestamp(value)
+    if timestamp is None:
+        raise ValueError(
+            f"Cannot understand the time {value!r}.  Use YYYY-MM-DD, "
+            "YYYY-MM-DD HH:MM:SS, or an age like 30m, 2h, or 1d."
+        )
+    return timestamp
+
+
+def get_search_cmd(
+    topology_name,
+    regex=None,
+    ignore_case=False,
+    start=None,
+    end=None,
+    max_results=DEFAULT_MAX_RESULTS,
+    pattern=None,
+):
+    """Get the command that searches the log files of `topology_name` on a
+    worker, and prints the matches as JSON lines.
+
+    The search script and its arguments are base64 encoded, so they come
+    through the shell as they are, however Fabric quotes them.
+    """
+    if env.log_path is None:
+        raise ValueError(
+            "Cannot find log files if you do not set `log_path` "
+            "or the `path` key in the `log` dict for your "
+            "environment in your config.json."
+        )
+    options = {
+        "log_path": env.log_path,
+        "topology_name": topology_name,
+        "regex": regex,
+        "ignore_case": ignore_case,
+        "start": start,
+        "end": end,
+        "max_results": max_results,
+        "file_regex": pattern,
+    }
+    source = base64.b64encode(inspect.getsource(logsearch).encode("utf-8"))
+    encoded_options = base64.b64encode(json.dumps(options).encode("utf-8"))
+    return (
+        f"{SEARCH_PYTHON} -c 'import base64, sys; "
+        f"exec(base64.b64decode(sys.argv[1]))' {source.decode('ascii')} "
+        f"{encoded_options.decode('ascii')}"
+    )
+
+
+@parallel
+def _search_logs(search_cmd):
+    """
+    Actual task to search logs on all servers in parallel.
+    """
+    with hide("output", "running"), settings(warn_only=True):
+        result = run(search_cmd)
+    if result.failed:
+        print(f"Failed to search logs on {env.host_string}: {result}", file=sys.stderr)
+    return str(result)
+
+
+def merge_matches(outputs, max_results=DEFAULT_MAX_RESULTS):
+    """Merge the matches found on every host by timestamp.
+
+    :param outputs: a `dict` mapping each host to the output of the search
+                    command there.
+    :param max_results: the most matches to keep, keeping the newest ones.
+    :returns: a `tuple` of the matches, oldest first, with their ``host``
+              added, and whether any matches were left out.
+    """
+    host_matches = []
+    num_matches = 0
+    for host, output in sorted(outputs.items()):
+        matches = []
+        for line in (output or "").splitlines():
+            try:
+                match = json.loads(line)
+            except ValueError:
+                # Something else printed by the shell, like a login banner
+                continue
+            match["host"] = host
+            matches.append(match)
+        num_matches += len(matches)
+        host_matches.append(matches)
+    merged = heapq.merge(*host_matches, key=lambda match: match["timestamp"])
+    if max_results is not None:
+        merged = deque(merged, maxlen=max_results)
+    merged = list(merged)
+    return merged, len(merged) < num_matches
+
+
+def search_logs(
+    topology_name=None,
+    env_name=None,
+    regex=None,
+    ignore_case=False,
+    since=None,
+    until=None,
+    max_results=DEFAULT_MAX_RESULTS,
+    pattern=None,
+    override_name=None,
+    config_file=None,
+):
+    """Search the log files of a topology on every worker, and print the
+    newest matches, oldest first.
+
+    :returns: the matches, as `dict` objects with the ``host``,
+              ``component``, ``timestamp``, ``file``, and ``text`` of each.
+    """
+    if override_name is not None:
+        topology_name = override_name
+    else:
+        topology_name = get_topology_definition(topology_name, config_file=config_file)[
+            0
+        ]
+    if regex is not None:
+        try:
+            re.compile(regex)
+        except re.error as e:
+            die(f"Invalid regular expression {regex!r}: {e}")
+    env_name, _ = get_env_config(env_name, config_file=config_file)
+    activate_env(env_name, config_file=config_file)
+    search_cmd = get_search_cmd(
+        topology_name,
+        regex=regex,
+        ignore_case=ignore_case,
+        start=since,
+        end=until,
+        max_results=max_results,
+        pattern=pattern,
+    )
+    executor = get_executor()
+    if executor is None:
+        outputs = execute(_search_logs, search_cmd, hosts=env.storm_workers)
+    else:
+        results = executor.run(env.storm_workers, search_cmd, stream=False)
+        outputs = {}
+        for host, result in results.items():
+            if not result.succeeded:
+                print(
+                    f"Failed to search logs on {host}: {result.output.strip()}",
+                    file=sys.stderr,
+                )
+            outputs[host] = result.output
+    matches, truncated = merge_matches(outputs, max_results=max_results)
+    for match in matches:
+        print(f"[{match['host']}] [{match['component']}] {match['text']}")
+    if truncated:
+        print(
+            f"Showing the {max_results} newest matches.  Narrow the search, or "
+            "raise --max_results, to see more.",
+            file=sys.stderr,
+        )
+    return matches
+
+
+def subparser_hook(subparsers):
+    """ Hook to add subparser for this command. """
+    subparser = subparsers.add_parser("logs", description=__doc__, help=main.__doc__)
+    subparser.set_defaults(func=main)
+    logs_subparsers = subparser.add_subparsers(title="logs commands")
+    search_subparser = logs_subparsers.add_parser(
+        "search",
+        description="Search the log files of a topology on every worker, and "
+        "print the newest matches, oldest first.",
+        help=main_search.__doc__,
+    )
+    search_subparser.set_defaults(func=main_search)
+    search_subparser.add_argument(
+        "regex",
+        nargs="?",
+        help="Python regular expression log entries must contain.  Entries "
+        "include any lines after their first one, like tracebacks.  "
+        "(default: match every entry)",
+    )
+    add_config(search_subparser)
+    add_environment(search_subparser)
+    search_subparser.add_argument(
+        "-i",
+        "--ignore_case",
+        action="store_true",
+        help="Match REGEX case-insensitively.",
+    )
+    search_subparser.add_argument(
+        "-m",
+        "--max_results",
+        default=DEFAULT_MAX_RESULTS,
+        type=int,
+        help="Show at most this many of the newest matches. (default: %(default)s)",
+    )
+    add_name(search_subparser)
+    add_override_name(search_subparser)
+    add_pattern(search_subparser)
+    add_pool_size(search_subparser)
+    search_subparser.add_argument(
+        "--since",
+        type=parse_time,
+        help="Only search entries from this time on, given as YYYY-MM-DD, "
+        "YYYY-MM-DD HH:MM:SS, or an age like 30m, 2h, or 1d.",
+    )
+    search_subparser.add_argument(
+        "--until",
+        type=parse_time,
+        help="Only search entries from before this time, given like --since.",
+    )
+
+
+def main(args):
+    """ Search the logs of Storm topologies on Storm workers. """
+    print("Choose a logs command, like: sparse logs search REGEX", file=sys.stderr)
+    sys.exit(1)
+
+
+def main_search(args):
+    """ Search the logs of a Storm topology on every Storm worker. """
+    env.pool_size = args.pool_size
+    search_logs(
+        topology_name=args.name,
+        env_name=args.environment,
+        regex=args.regex,
+        ignore_case=args.ignore_case,
+        since=args.since,
+        until=args.until,
+        max_results=args.max_results,
+        pattern=args.pattern,
+        override_name=args.override_name,
+        config_file=args.config,
+    )
@@ -0,0 +1,156 @@
+"""
+Fetch the sampling profiles of a topology from every Storm worker and merge
+them into one flame graph.
+
+Components only write profiles when the ``streamparse.profile.enabled`` option
+is set for them or their topology.  Profiles are written as collapsed stacks;
+give an output file ending in ``.svg`` to render them with ``flamegraph.pl``
+or ``inferno-flamegraph``, if either is on your ``PATH``.
+"""
+
+import io
+import shutil
+import subprocess
+from collections import Counter
+
+from fabric.api import env, execute, hide, parallel, run, settings
+
+from ..profiler import read_collapsed, write_collapsed
+from ..util import (
+    _get_file_names_command,
+    activate_env,
+    die,
+    get_env_config,
+    get_topology_definition,
+)
+from .common import (
+    add_config,
+    add_environment,
+    add_name,
+    add_override_name,
+    add_pattern,
+    add_pool_size,
+)
+
+FLAMEGRAPH_COMMANDS = ("flamegraph.pl", "inferno-flamegraph")
+
+
+def get_profiles_cmd(topology_name, pattern=None):
+    """Get the command that prints every profile for `topology_name` on a
+    worker, optionally filtered by an ``egrep`` `pattern`.
+    """
+    if env.log_path is None:
+        raise ValueError(
+            "Cannot find profiles if you do not set `log_path` or the `path` "
+            "key in the `log` dict for your environment in your config.json."
+        )
+    ls_cmd = _get_file_names_command(
+        env.log_path, [f"*streamparse_profile_{topology_name}_*.folded"]
+    )
+    if pattern is not None:
+        ls_cmd += f" | egrep '{pattern}'"
+    return ls_cmd + " | xargs -r cat"
+
+
+@parallel
+def _fetch_profiles(topology_name, pattern):
+    """
+    Actual task to print profiles on all servers in parallel.
+    """
+    with hide("output", "running"), settings(warn_only=True):
+        return run(get_profiles_cmd(topology_name, pattern))
+
+
+def render_flamegraph(samples, output):
+    """Render `samples` as an SVG flame graph at `output`."""
+    for command in FLAMEGRAPH_COMMANDS:
+        command_path = shutil.which(command)
+        if command_path:
+            break
+    else:
+        die(
+            f"Rendering {output} needs one of {', '.join(FLAMEGRAPH_COMMANDS)} "
+            "on your PATH.  Write a .folded file instead to render it elsewhere."
+        )
+    collapsed = io.StringIO()
+    write_collapsed(collapsed, samples)
+    with open(output, "wb") as svg_file:
+        subprocess.run(
+            [command_path],
+            input=collapsed.getvalue().encode("utf-8"),
+            stdout=svg_file,
+            check=True,
+        )
+
+
+def profile_topology(
+    topology_name=None,
+    env_name=None,
+    pattern=None,
+    output=None,
+    override_name=None,
+    config_file=None,
+):
+    """Merge the profiles of a topology from every worker into `output`.
+
+    :returns: the merged samples, as a :class:`collections.Counter`.
+    """
+    if override_name is not None:
+        topology_name = override_name
+    else:
+        topology_name = get_topology_definition(topology_name, config_file=config_file)[
+            0
+        ]
+    env_name, _ = get_env_config(env_name, config_file=config_file)
+    activate_env(env_name, config_file=config_file)
+    results = execute(_fetch_profiles, topology_name, pattern, hosts=env.storm_workers)
+    samples = Counter()
+    for result in results.values():
+        read_collapsed(str(result or "").splitlines(), samples)
+    if not samples:
+        die(
+            f"No profiles found for {topology_name}.  Is "
+            "streamparse.profile.enabled set for it?"
+        )
+    output = output or f"{topology_name}.folded"
+    if output.endswith(".svg"):
+        render_flamegraph(samples, output)
+    else:
+        with open(output, "w", encoding="utf-8") as profile_file:
+            write_collapsed(profile_file, samples)
+    print(
+        f"Merged {sum(samples.values())} samples from {len(results)} workers "
+        f"into {output}."
+    )
+    return samples
+
+
+def subparser_hook(subparsers):
+    """Hook to add subparser for this command."""
+    subparser = subparsers.add_parser("profile", description=__doc__, help=main.__doc__)
+    subparser.set_defaults(func=main)
+    add_config(subparser)
+    add_environment(subparser)
+    add_name(subparser)
+    subparser.add_argument(
+        "-o",
+        "--output",
+        help="File to write the merged profile to.  Ends in .svg to render a "
+        "flame graph.  (default: <topology name>.folded)",
+    )
+    add_override_name(subparser)
+    add_pattern(subparser)
+    add_pool_size(subparser)
+
+
+def main(args):
+    """Merge sampling profiles from Storm workers into a flame graph."""
+    env.pool_size = args.pool_size
+    profile_topology(
+        topology_name=args.name,
+        env_name=args.environment,
+        pattern=args.pattern,
+        output=args.output,
+        override_name=args.override_name,
+        config_file=args.config,
+    )
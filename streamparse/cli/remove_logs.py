@@ -4,6 +4,7 @@ Remove all logs from Storm workers for the specified Storm topology.
 
 from fabric.api import env, execute, parallel
 
+from ..remote import as_user, get_executor, warn_about_results
 from .common import (
     add_config,
     add_environment,
@@ -25,13 +26,10 @@ from ..util import (
 )
 
 
-@parallel
-def _remove_logs(
-    topology_name, pattern, remove_worker_logs, user, remove_all_artifacts
+def get_remove_logs_cmd(
+    topology_name, pattern, remove_worker_logs, remove_all_artifacts
 ):
-    """
-    Actual task to remove logs on all servers in parallel.
-    """
+    """Get the command that removes the log files of a topology on a worker."""
     ls_cmd = get_logfiles_cmd(
         topology_name=topology_name,
         pattern=pattern,
@@ -39,7 +37,23 @@ def _remove_logs(
         include_all_artifacts=remove_all_artifacts,
     )
     rm_pipe = " | xargs rm -f"
-    run_cmd(ls_cmd + rm_pipe, user, warn_only=True)
+    return ls_cmd + rm_pipe
+
+
+@parallel
+def _remove_logs(
+    topology_name, pattern, remove_worker_logs, user, remove_all_artifacts
+):
+    """
+    Actual task to remove logs on all servers in parallel.
+    """
+    run_cmd(
+        get_remove_logs_cmd(
+            topology_name, pattern, remove_worker_logs, remove_all_artifacts
+        ),
+        user,
+        warn_only=True,
+    )
 
 
 def remove_logs(
@@ -62,16 +76,26 @@ def remove_logs(
     env_name, env_config = get_env_config(env_name, config_file=config_file)
     storm_options = resolve_options(options, env_config, topology_class, topology_name)
     activate_env(env_name, storm_options, config_file=config_file)
-    execute(
-        _remove_logs,
-        topology_name,
-        pattern,
-        remove_worker_logs,
-        # TODO: Remove "user" in next major version
-        user or storm_options["sudo_user"],
-        remove_all_artifacts,
-        hosts=env.storm_workers,
+    # TODO: Remove "user" in next major version
+    user = user or storm_options["sudo_user"]
+    executor = get_executor()
+    if executor is None:
+        execute(
+            _remove_logs,
+            topology_name,
+            pattern,
+            remove_worker_logs,
+            user,
+            remove_all_artifacts,
+            hosts=env.storm_workers,
+        )
+        return
+    rm_cmd = get_remove_logs_cmd(
+        topology_name, pattern, remove_worker_logs, remove_all_artifacts
     )
+    # Failures are only warned about, like with Fabric
+    results = executor.run(env.storm_workers, as_user(rm_cmd, user, env.user))
+    warn_about_results(results, f"remove logs for {topology_name}")
 
 
 def subparser_hook(subparsers):
@@ -0,0 +1,237 @@
+"""
+Replay a capture of the messages Storm sent to a component, and profile it.
+
+Captures are recorded by components run with the
+``streamparse.capture.enabled`` option set, and are written next to the
+pystorm logs on each worker.  Copy one here and run this command in your
+project directory to feed every recorded message to the same component class
+again, in this process, under a profiler.
+
+Only the main thread of the component is profiled.  The ``cprofile`` profiler
+traces every call, while ``sample`` samples the stack like
+``streamparse.profile.enabled`` does on workers, and writes collapsed stacks
+for flame graph tools.
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import shutil
+import tempfile
+import time
+from collections import Counter
+
+import simplejson as json
+from pystorm.exceptions import StormWentAwayError
+
+from ..capture import read_capture
+from ..profiler import DEFAULT_HZ, SamplingProfiler
+from ..run import load_component_class
+
+PROFILERS = ("cprofile", "sample", "none")
+
+log = logging.getLogger(__name__)
+
+
+def _write_frames(frame_file, handshake, messages, pid_dir):
+    """Write the handshake and messages as JSON multi-lang frames.
+
+    :returns: the number of messages written, not counting the handshake.
+    """
+    conf = dict(handshake["conf"])
+    # Don't capture the replay, or write to log paths from the worker
+    conf["streamparse.capture.enabled"] = False
+    conf.pop("pystorm.log.path", None)
+    count = -1
+    for count, msg in enumerate(
+        [{"pidDir": pid_dir, "conf": conf, "context": handshake["context"]}]
+        + list(messages)
+    ):
+        frame_file.write(json.dumps(msg, namedtuple_as_object=False))
+        frame_file.write("\nend\n")
+    return count
+
+
+def _run_component(component):
+    """Run `component` until it runs out of input.
+
+    This is ``Component.run`` without exiting the process at the end.
+    """
+    storm_conf, context = component.read_handshake()
+    root_log = logging.getLogger()
+    handlers = list(root_log.handlers)
+    component._setup_component(storm_conf, context)
+    # Log here instead of sending log messages to a Storm that isn't there
+    for handler in list(root_log.handlers):
+        if handler not in handlers:
+            root_log.removeHandler(handler)
+    component.initialize(storm_conf, context)
+    while True:
+        try:
+            component._run()
+        except StormWentAwayError:
+            return
+        except Exception:
+            log.exception("Exception in %s.run()", component.__class__.__name__)
+            if component.exit_on_exception:
+                return
+
+
+def replay_capture(
+    capture_path,
+    profiler="cprofile",
+    output=None,
+    repeat=1,
+    import_path=None,
+    sort="cumulative",
+    top=30,
+    hz=DEFAULT_HZ,
+):
+    """Replay a capture file into the component class that recorded it.
+
+    :param capture_path: the path to the capture file.
+    :param profiler: one of ``PROFILERS``.
+    :param output: where to write the profile, if anywhere.  ``sample``
+                   profiles are always written, next to the capture if this
+                   is not given.
+    :param repeat: how many times to replay the recorded messages.
+    :param import_path: the directory to import the component from.  Defaults
+                        to ``src`` if it exists, or the current directory.
+    :param sort: the `pstats` sort key for the printed profile.
+    :param top: the number of functions to print.
+    :param hz: how many times per second the ``sample`` profiler samples.
+    """
+    if profiler not in PROFILERS:
+        raise ValueError(f"profiler must be one of {PROFILERS!r}.  Given: {profiler!r}")
+    if import_path is None:
+        import_path = "src" if os.path.isdir("src") else os.getcwd()
+    with open(capture_path, "rb") as capture_file:
+        handshake, records = read_capture(capture_file)
+        messages = [msg for _, msg in records]
+    component_cls = load_component_class(handshake["class"], import_path=import_path)
+
+    tmp_dir = tempfile.mkdtemp(prefix="streamparse_replay_")
+    try:
+        frame_path = os.path.join(tmp_dir, "frames")
+        with open(frame_path, "w", encoding="utf-8") as frame_file:
+            num_messages = _write_frames(
+                frame_file, handshake, messages * repeat, tmp_dir
+            )
+        with open(frame_path, "rb") as input_stream, open(
+            os.devnull, "wb"
+        ) as output_stream:
+            component = component_cls(
+                input_stream=input_stream,
+                output_stream=output_stream,
+                rdb_signal=None,
+            )
+            profile = sampler = None
+            if profiler == "cprofile":
+                profile = cProfile.Profile()
+            elif profiler == "sample":
+                sampler = SamplingProfiler(hz=hz)
+            start = time.perf_counter()
+            if profile is not None:
+                profile.runcall(_run_component, component)
+            elif sampler is not None:
+                sampler.start()
+                try:
+                    _run_component(component)
+                finally:
+                    sampler.stop()
+            else:
+                _run_component(component)
+            elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(
+        f"Replayed {num_messages} messages into {handshake['class']} in "
+        f"{elapsed:.3f}s ({num_messages / elapsed if elapsed else 0:.1f} messages/s)"
+    )
+    if profile is not None:
+        if output:
+            profile.dump_stats(output)
+            print(f"Wrote profile to {output}")
+        stats_stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stats_stream)
+        stats.sort_stats(sort).print_stats(top)
+        print(stats_stream.getvalue())
+    elif sampler is not None:
+        output = output or f"{capture_path}.folded"
+        sampler.write(output)
+        print(f"Wrote {sum(sampler.samples.values())} samples to {output}")
+        _print_top_frames(sampler.samples, top)
+
+
+def _print_top_frames(samples, top):
+    """Print the functions the most samples were taken in."""
+    self_samples = Counter()
+    for stack, count in samples.items():
+        self_samples[stack.rpartition(";")[2]] += count
+    total = sum(self_samples.values())
+    for frame, count in self_samples.most_common(top):
+        print(f"{count:>8} {100 * count / total:6.2f}%  {frame}")
+
+
+def subparser_hook(subparsers):
+    """Hook to add subparser for this command."""
+    subparser = subparsers.add_parser("replay", description=__doc__, help=main.__doc__)
+    subparser.set_defaults(func=main)
+    subparser.add_argument("capture", help="Path to the capture file to replay.")
+    subparser.add_argument(
+        "--import_path",
+        help="Directory to import the component from. Defaults to src, if it "
+        "exists, or the current directory.",
+    )
+    subparser.add_argument(
+        "-o", "--output", help="Write the profile to this file, for other tools."
+    )
+    subparser.add_argument(
+        "-p",
+        "--profiler",
+        default="cprofile",
+        choices=PROFILERS,
+        help="Profiler to run the component under. (default: %(default)s)",
+    )
+    subparser.add_argument(
+        "-r",
+        "--repeat",
+        default=1,
+        type=int,
+        help="Number of times to replay the capture. (default: %(default)s)",
+    )
+    subparser.add_argument(
+        "--sort",
+        default="cumulative",
+        help="How to sort the printed profile. (default: %(default)s)",
+    )
+    subparser.add_argument(
+        "--top",
+        default=30,
+        type=int,
+        help="Number of functions to print. (default: %(default)s)",
+    )
+    subparser.add_argument(
+        "--hz",
+        default=DEFAULT_HZ,
+        type=int,
+        help="Samples per second of CPU time for the sample profiler. "
+        "(default: %(default)s)",
+    )
+
+
+def main(args):
+    """Replay and profile a capture of a component's input"""
+    replay_capture(
+        args.capture,
+        profiler=args.profiler,
+        output=args.output,
+        repeat=args.repeat,
+        import_path=args.import_path,
+        sort=args.sort,
+        top=args.top,
+        hz=args.hz,
+    )
@@ -4,6 +4,10 @@ Run a local Storm topology.
 Note: If you have "org.apache.storm" in your uberjar-exclusions list in your
 project.clj, this will fail. Temporarily remove it to use `sparse run`. You will
 also need to add [org.apache.storm/flux-core "1.0.1"] to dependencies.
+
+With --simulate, Storm is not used at all. Python components are run directly
+by streamparse, which starts in seconds, but only works for topologies made up
+entirely of Python components.
 """
 
 from argparse import RawDescriptionHelpFormatter
@@ -12,6 +16,7 @@ from tempfile import NamedTemporaryFile
 from fabric.api import local, show
 from ruamel import yaml
 
+from ..simulator import SIMULATOR_MODES, TopologySimulator
 from ..util import (
     get_config,
     get_env_config,
@@ -19,6 +24,7 @@ from ..util import (
     get_topology_from_file,
     local_storm_version,
     set_topology_serializer,
+    set_topology_zygote,
     storm_lib_version,
 )
 from .common import (
@@ -35,28 +41,42 @@ from .jar import jar_for_deploy
 
 
 def run_local_topology(
-    name=None, env_name=None, time=0, options=None, config_file=None
+    name=None, env_name=None, time=0, options=None, config_file=None, simulate=None
 ):
-    """Run a topology locally using Flux and `storm jar`."""
+    """Run a topology locally using Flux and `storm jar`.
+
+    :param simulate: if set to one of ``SIMULATOR_MODES``, run the topology
+                     with a :class:`~streamparse.simulator.TopologySimulator`
+                     in that mode instead.
+    """
     name, topology_file = get_topology_definition(name, config_file=config_file)
     config = get_config(config_file=config_file)
     env_name, env_config = get_env_config(env_name, config_file=config_file)
     topology_class = get_topology_from_file(topology_file)
 
-    set_topology_serializer(env_config, config, topology_class)
-
     storm_options = resolve_options(
         options, env_config, topology_class, name, local_only=True
     )
     if storm_options["topology.acker.executors"] != 0:
         storm_options["topology.acker.executors"] = 1
     storm_options["topology.workers"] = 1
+    set_topology_zygote(storm_options, topology_class)
 
     # Set parallelism based on env_name if necessary
     for spec in topology_class.specs:
         if isinstance(spec.par, dict):
             spec.par = spec.par.get(env_name)
 
+    if simulate:
+        simulator = TopologySimulator(
+            topology_class, name=name, options=storm_options, mode=simulate
+        )
+        simulator.run(secs=time if time > 0 else None)
+        return
+
+    # The simulator talks to components directly, so only Storm needs this
+    set_topology_serializer(env_config, config, topology_class)
+
     # Check Storm version is the same
     local_version = local_storm_version()
     project_version = storm_lib_version()
@@ -94,7 +114,7 @@ def run_local_topology(
 
 
 def subparser_hook(subparsers):
-    """ Hook to add subparser for this command. """
+    """Hook to add subparser for this command."""
     subparser = subparsers.add_parser(
         "run",
         description=__doc__,
@@ -117,6 +137,15 @@ def subparser_hook(subparsers):
         "running. If time <= 0, run indefinitely. "
         "(default: %(default)s)",
     )
+    subparser.add_argument(
+        "--simulate",
+        nargs="?",
+        const="thread",
+        choices=SIMULATOR_MODES,
+        help="Run the topology's Python components directly, without Storm, "
+        "as threads (the default) or processes. Only works for topologies "
+        "without Java or other non-Python components.",
+    )
     add_workers(subparser)
 
 
@@ -128,4 +157,5 @@ def main(args):
         options=args.options,
         env_name=args.environment,
         config_file=args.config,
+        simulate=args.simulate,
     )
@@ -12,6 +12,7 @@ import os
 import pkgutil
 import sys
 
+from ..cache import set_refresh
 from ..util import die
 from ..version import __version__
 
@@ -49,6 +50,12 @@ def main():
     parser.add_argument(
         "--version", action="version", version=f"%(prog)s {__version__}"
     )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore the Storm cluster information and UI responses cached "
+        "in _cache, and fetch them again.",
+    )
     load_subparsers(subparsers)
 
     def _help_command(args):
@@ -80,6 +87,9 @@ def main():
             "waiting for user input."
         )
 
+    if args.refresh:
+        set_refresh()
+
     # http://grokbase.com/t/python/python-bugs-list/12arsq9ayf/issue16308-undocumented-behaviour-change-in-argparse-from-3-2-3-to-3-3-0
     if hasattr(args, "func"):
         args.func(args)
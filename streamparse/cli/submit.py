@@ -2,28 +2,47 @@
 Submit a Storm topology to Nimbus.
 """
 
+import getpass
+import hashlib
 import importlib
 import os
+import queue
 import sys
+import threading
 import time
+from collections import deque
 from itertools import chain
 
 import simplejson as json
 from fabric.api import env
 from pkg_resources import parse_version
+from thriftpy2.thrift import TApplicationException
+from thriftpy2.transport import TTransportException
 
 from ..dsl.component import JavaComponentSpec
-from ..thrift import ShellComponent, SubmitOptions, TopologyInitialStatus
+from ..thrift import (
+    AccessControl,
+    AccessControlType,
+    AuthorizationException,
+    KeyAlreadyExistsException,
+    KeyNotFoundException,
+    SettableBlobMeta,
+    ShellComponent,
+    SubmitOptions,
+    TopologyInitialStatus,
+)
 
 from ..util import (
     activate_env,
     get_config,
     get_env_config,
     get_nimbus_client,
+    get_nimbus_config,
     get_topology_definition,
     get_topology_from_file,
     nimbus_storm_version,
     set_topology_serializer,
+    set_topology_zygote,
     ssh_tunnel,
     warn,
 )
@@ -52,6 +71,17 @@ from .update_virtualenv import create_or_update_virtualenvs
 
 
 THRIFT_CHUNK_SIZE = 307200
+# Room to leave in each Thrift frame for everything but the chunk
+THRIFT_FRAME_OVERHEAD = 16384
+# How many chunks to have read, and sent, ahead of the last one Nimbus acked
+UPLOAD_PIPELINE_DEPTH = 4
+UPLOAD_RETRIES = 3
+# Blob store keys recording where each JAR was uploaded, by SHA-256
+JAR_BLOB_PREFIX = "streamparse_jar_"
+# How long before Nimbus would delete an uploaded JAR to stop reusing it
+JAR_REUSE_MARGIN_SECS = 300
+# AccessControl access bits
+BLOB_READ, BLOB_WRITE, BLOB_ADMIN = 0x1, 0x2, 0x4
 
 
 def get_user_tasks():
@@ -107,6 +137,7 @@ def _submit_topology(
         sys.stdout.flush()
 
     set_topology_serializer(env_config, config, topology_class)
+    set_topology_zygote(options, topology_class)
 
     # Check if topology name is okay on Storm versions that support that
     if nimbus_storm_version(nimbus_client) >= parse_version("1.1.0"):
@@ -153,26 +184,292 @@ def _post_submit_hooks(topology_name, env_name, env_config, options):
         post_submit_fabric(topology_name, env_name, env_config, options)
 
 
-def _upload_jar(nimbus_client, local_path):
+def _read_chunks(local_path, chunk_size, depth=UPLOAD_PIPELINE_DEPTH):
+    """Yield the contents of `local_path` in chunks, which are read up to
+    `depth` chunks ahead by a background thread.
+    """
+    chunks = queue.Queue(maxsize=depth)
+    done = threading.Event()
+
+    def read_ahead():
+        try:
+            with open(local_path, "rb") as local_file:
+                while not done.is_set():
+                    chunk = local_file.read(chunk_size)
+                    while not done.is_set():
+                        try:
+                            chunks.put(chunk, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    if not chunk:
+                        return
+        except OSError as e:
+            chunks.put(e)
+
+    reader = threading.Thread(target=read_ahead, daemon=True)
+    reader.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        done.set()
+
+
+def _pipeline_calls(nimbus_client, api, calls, depth=UPLOAD_PIPELINE_DEPTH):
+    """Make the Thrift `api` call with each `dict` of arguments in `calls`,
+    sending up to `depth` of them before waiting for their replies.
+
+    Nimbus answers the calls on a connection in order, so this hides the
+    round trip time of all but the last calls.
+
+    :returns: a generator of the result of each call, in order.
+    """
+    in_flight = deque()
+    for kwargs in calls:
+        if len(in_flight) >= depth:
+            in_flight.popleft()
+            yield nimbus_client._recv(api)
+        nimbus_client._send(api, **kwargs)
+        in_flight.append(kwargs)
+    while in_flight:
+        in_flight.popleft()
+        yield nimbus_client._recv(api)
+
+
+def _upload_jar(
+    nimbus_client,
+    local_path,
+    chunk_size=THRIFT_CHUNK_SIZE,
+    pipeline_depth=UPLOAD_PIPELINE_DEPTH,
+):
     upload_location = nimbus_client.beginFileUpload()
     print(
         f"Uploading topology jar {local_path} to assigned location: {upload_location}"
     )
     total_bytes = os.path.getsize(local_path)
     bytes_uploaded = 0
+    chunk_sizes = deque()
+
+    def calls():
+        for chunk in _read_chunks(local_path, chunk_size, depth=pipeline_depth):
+            chunk_sizes.append(len(chunk))
+            yield {"location": upload_location, "chunk": chunk}
+
+    print(f"Uploaded {bytes_uploaded}/{total_bytes} bytes", end="\r")
+    sys.stdout.flush()
+    for _ in _pipeline_calls(
+        nimbus_client, "uploadChunk", calls(), depth=pipeline_depth
+    ):
+        bytes_uploaded += chunk_sizes.popleft()
+        print(f"Uploaded {bytes_uploaded}/{total_bytes} bytes", end="\r")
+        sys.stdout.flush()
+    nimbus_client.finishFileUpload(upload_location)
+    print(f"Uploaded {bytes_uploaded}/{total_bytes} bytes")
+    sys.stdout.flush()
+    return upload_location
+
+
+def _hash_jar(local_path):
+    digest = hashlib.sha256()
     with open(local_path, "rb") as local_jar:
+        for chunk in iter(lambda: local_jar.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _get_leader(nimbus_client):
+    """Get the ``host:port`` of the leader Nimbus, or ``None`` if this Storm
+    is too old to say.
+    """
+    try:
+        leader = nimbus_client.getLeader()
+    except TApplicationException:
+        return None
+    return f"{leader.host}:{leader.port}"
+
+
+def _read_jar_record(nimbus_client, key):
+    """Read the record of a JAR upload from the blob store.
+
+    :returns: the record as a `dict`, or ``None`` if it cannot be read.
+    """
+    try:
+        download = nimbus_client.beginBlobDownload(key)
+        data = b""
         while True:
-            print(f"Uploaded {bytes_uploaded}/{total_bytes} bytes", end="\r")
-            sys.stdout.flush()
-            curr_chunk = local_jar.read(THRIFT_CHUNK_SIZE)
-            if not curr_chunk:
+            chunk = nimbus_client.downloadBlobChunk(download.session)
+            if not chunk:
                 break
-            nimbus_client.uploadChunk(upload_location, curr_chunk)
-            bytes_uploaded += len(curr_chunk)
-        nimbus_client.finishFileUpload(upload_location)
-        print(f"Uploaded {bytes_uploaded}/{total_bytes} bytes")
-        sys.stdout.flush()
-    return upload_location
+            data += chunk
+        upload = json.loads(data)
+    except (
+        AuthorizationException,
+        KeyNotFoundException,
+        TApplicationException,
+        ValueError,
+    ):
+        return None
+    return upload if isinstance(upload, dict) else None
+
+
+def _only_writable_by(nimbus_client, key, storm_user):
+    """Check that nobody but `storm_user` can change the blob at `key`, so
+    nobody else could have pointed it at a different JAR.
+    """
+    try:
+        acl = nimbus_client.getBlobMeta(key).settable.acl
+    except (AuthorizationException, KeyNotFoundException, TApplicationException):
+        return False
+    return all(
+        not entry.access & (BLOB_WRITE | BLOB_ADMIN)
+        or (entry.type == AccessControlType.USER and entry.name == storm_user)
+        for entry in acl
+    )
+
+
+def _find_uploaded_jar(
+    nimbus_client, jar_hash, leader, expiration_secs, storm_user=None
+):
+    """Get the location of a JAR with the SHA-256 `jar_hash` that was uploaded
+    to the `leader` Nimbus recently enough to still be in its inbox.
+
+    :param storm_user: if given, only reuse uploads recorded in blobs that
+                       nobody but this Storm user can change.
+    :returns: the location, or ``None`` if there is no such JAR.
+    """
+    key = f"{JAR_BLOB_PREFIX}{jar_hash}"
+    upload = _read_jar_record(nimbus_client, key)
+    try:
+        if (
+            upload is None
+            or upload["hash"] != jar_hash
+            or upload["leader"] != leader
+            or time.time() - upload["uploaded"]
+            >= expiration_secs - JAR_REUSE_MARGIN_SECS
+        ):
+            return None
+        location = upload["location"]
+    except (KeyError, TypeError):
+        return None
+    if storm_user is not None and not _only_writable_by(nimbus_client, key, storm_user):
+        warn(f"Not reusing the JAR recorded in {key}, since others can change it.")
+        return None
+    return location
+
+
+def _record_uploaded_jar(nimbus_client, jar_hash, leader, location):
+    """Record in the blob store that the JAR with the SHA-256 `jar_hash` was
+    uploaded to `location` on the `leader` Nimbus, so it can be reused.
+    """
+    key = f"{JAR_BLOB_PREFIX}{jar_hash}"
+    data = json.dumps(
+        {
+            "hash": jar_hash,
+            "leader": leader,
+            "location": location,
+            "uploaded": time.time(),
+        }
+    ).encode("utf-8")
+    # Let everyone read the record, but only its creator, who Storm gives
+    # full access, change it.  Storm ignores this on unsecured clusters.
+    meta = SettableBlobMeta(
+        acl=[AccessControl(type=AccessControlType.OTHER, access=BLOB_READ)]
+    )
+    try:
+        try:
+            session = nimbus_client.beginCreateBlob(key, meta)
+        except KeyAlreadyExistsException:
+            session = nimbus_client.beginUpdateBlob(key)
+        nimbus_client.uploadBlobChunk(session, data)
+        nimbus_client.finishBlobUpload(session)
+    except (AuthorizationException, KeyNotFoundException, TApplicationException) as e:
+        warn(f"Unable to record JAR upload in the Nimbus blob store: {e}")
+
+
+def _delete_expired_jar_records(nimbus_client, expiration_secs):
+    """Delete the records of JAR uploads Nimbus has deleted by now, that we
+    are allowed to delete.
+    """
+    keys = []
+    try:
+        result = nimbus_client.listBlobs("")
+        while result.keys:
+            keys.extend(key for key in result.keys if key.startswith(JAR_BLOB_PREFIX))
+            result = nimbus_client.listBlobs(result.session)
+    except (AuthorizationException, TApplicationException):
+        pass
+    for key in keys:
+        upload = _read_jar_record(nimbus_client, key)
+        try:
+            if (
+                upload is not None
+                and time.time() - upload["uploaded"] < expiration_secs
+            ):
+                continue
+        except (KeyError, TypeError):
+            pass
+        try:
+            nimbus_client.deleteBlob(key)
+        except (AuthorizationException, KeyNotFoundException, TApplicationException):
+            pass
+
+
+def upload_jar(env_config, local_path, timeout=None, retries=UPLOAD_RETRIES):
+    """Upload a JAR to Nimbus, unless the same JAR was uploaded recently.
+
+    Uploads are recorded in the Nimbus blob store under the SHA-256 of the
+    JAR, unless ``reuse_jar_uploads`` is ``false`` for the environment, and
+    records of uploads Nimbus has since deleted are cleaned up.  When the
+    blob store enforces ACLs, only uploads recorded by the ``storm_user`` of
+    the environment (by default, the local user) are reused.  If
+    the connection drops, the upload is retried through a new SSH tunnel.
+    Storm does not say how much of an upload it received, so it starts over.
+
+    :returns: the location of the JAR on Nimbus.
+    """
+    nimbus_conf = get_nimbus_config(env_config)
+    chunk_size = (
+        nimbus_conf.get("nimbus.thrift.max_buffer_size", 1048576)
+        - THRIFT_FRAME_OVERHEAD
+    )
+    chunk_size = min(env_config.get("upload_chunk_size", chunk_size), chunk_size)
+    expiration_secs = nimbus_conf.get("nimbus.inbox.jar.expiration.secs", 3600)
+    storm_user = None
+    if nimbus_conf.get("blobstore.acl.validation.enabled", False):
+        storm_user = env_config.get("storm_user") or getpass.getuser()
+    jar_hash = None
+    if env_config.get("reuse_jar_uploads", True):
+        jar_hash = _hash_jar(local_path)
+    for attempt in range(retries + 1):
+        try:
+            with ssh_tunnel(env_config) as (host, port):
+                nimbus_client = get_nimbus_client(
+                    env_config, host=host, port=port, timeout=timeout
+                )
+                leader = _get_leader(nimbus_client) if jar_hash else None
+                if leader:
+                    location = _find_uploaded_jar(
+                        nimbus_client, jar_hash, leader, expiration_secs, storm_user
+                    )
+                    if location:
+                        print(f"Reusing identical JAR uploaded to {location}")
+                        return location
+                location = _upload_jar(nimbus_client, local_path, chunk_size=chunk_size)
+                if leader:
+                    _record_uploaded_jar(nimbus_client, jar_hash, leader, location)
+                    _delete_expired_jar_records(nimbus_client, expiration_secs)
+                return location
+        except (OSError, TTransportException) as e:
+            if attempt == retries:
+                raise
+            warn(f"Uploading JAR failed ({e}), retrying through a new tunnel...")
+            time.sleep(2**attempt)
 
 
 def submit_topology(
@@ -277,15 +574,15 @@ def submit_topology(
     else:
         print(f'Deploying "{name}" topology...')
     sys.stdout.flush()
+    if remote_jar_path:
+        print(f"Reusing remote JAR on Nimbus server at path: {remote_jar_path}")
+    else:
+        remote_jar_path = upload_jar(env_config, local_jar_path, timeout=timeout)
     # Use ssh tunnel with Nimbus if use_ssh_for_nimbus is unspecified or True
     with ssh_tunnel(env_config) as (host, port):
         nimbus_client = get_nimbus_client(
             env_config, host=host, port=port, timeout=timeout
         )
-        if remote_jar_path:
-            print(f"Reusing remote JAR on Nimbus server at path: {remote_jar_path}")
-        else:
-            remote_jar_path = _upload_jar(nimbus_client, local_jar_path)
         _kill_existing_topology(override_name, force, wait, nimbus_client)
         _submit_topology(
             override_name,
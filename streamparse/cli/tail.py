@@ -5,6 +5,7 @@ Tail the specified log files.
 from fabric.api import env, execute, parallel, run
 from pkg_resources import parse_version
 
+from ..remote import get_executor
 from .common import (
     add_config,
     add_environment,
@@ -24,18 +25,23 @@ from ..util import (
 )
 
 
-@parallel
-def _tail_logs(topology_name, pattern, follow, num_lines, is_old_storm):
-    """
-    Actual task to run tail on all servers in parallel.
-    """
+def get_tail_cmd(topology_name, pattern, follow, num_lines, is_old_storm):
+    """Get the command that tails the log files of a topology on a worker."""
     ls_cmd = get_logfiles_cmd(
         topology_name=topology_name, pattern=pattern, is_old_storm=is_old_storm
     )
     tail_pipe = f" | xargs tail -n {num_lines}"
     if follow:
         tail_pipe += " -f"
-    run(ls_cmd + tail_pipe)
+    return ls_cmd + tail_pipe
+
+
+@parallel
+def _tail_logs(topology_name, pattern, follow, num_lines, is_old_storm):
+    """
+    Actual task to run tail on all servers in parallel.
+    """
+    run(get_tail_cmd(topology_name, pattern, follow, num_lines, is_old_storm))
 
 
 def tail_topology(
@@ -62,14 +68,25 @@ def tail_topology(
         nimbus_client = get_nimbus_client(env_config, host=host, port=port)
         is_old_storm = nimbus_storm_version(nimbus_client) < parse_version("1.0")
     activate_env(env_name)
-    execute(
-        _tail_logs,
-        topology_name,
-        pattern,
-        follow,
-        num_lines,
-        is_old_storm,
-        hosts=env.storm_workers,
+    executor = get_executor()
+    if executor is None:
+        execute(
+            _tail_logs,
+            topology_name,
+            pattern,
+            follow,
+            num_lines,
+            is_old_storm,
+            hosts=env.storm_workers,
+        )
+        return
+    if follow:
+        # Following never finishes, so every host has to run at once
+        executor.timeout = None
+        executor.concurrency = max(executor.concurrency, len(env.storm_workers))
+    executor.run(
+        env.storm_workers,
+        get_tail_cmd(topology_name, pattern, follow, num_lines, is_old_storm),
     )
 
 
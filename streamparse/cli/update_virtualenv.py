@@ -2,13 +2,38 @@
 Create or update a virtualenv on the Storm workers.  This will be done
 automatically upon submit, but this command is provided to help with testing
 and debugging.
+
+Every virtualenv records the requirements and streamparse version it was built
+with, and workers whose virtualenv already matches are skipped, as long as every
+requirement is pinned to one version.  With
+``prebuilt_virtualenv`` set, the virtualenv is only built on one worker, and
+copied from there to the others.
 """
 
+import hashlib
 import os
+import re
+import shlex
+import uuid
+
+import simplejson as json
 
-from fabric.api import env, execute, parallel, put, puts, run, show
-from fabric.contrib.files import exists
+from fabric.api import (
+    env,
+    execute,
+    get,
+    hide,
+    parallel,
+    put,
+    puts,
+    run,
+    settings,
+    show,
+)
 
+from .. import cache
+from ..remote import as_user, check_results, get_executor
+from ..version import __version__
 from .common import (
     add_config,
     add_environment,
@@ -30,8 +55,91 @@ from ..util import (
     get_topology_definition,
     get_topology_from_file,
     run_cmd,
+    warn,
 )
 
+# Records what a virtualenv was built from, in the virtualenv
+VIRTUALENV_MANIFEST_FILE = ".streamparse_manifest.json"
+# Where prebuilt virtualenvs are kept locally, in the cache directory
+VIRTUALENV_CACHE_DIR = "virtualenvs"
+# Identifies the platform, and the Python virtualenv builds with, on a host
+PLATFORM_CMD = "uname -sm; virtualenv --version"
+# A requirement pinned to one version, like "requests[socks]==2.31.0"
+_PINNED_REQUIREMENT_RE = re.compile(
+    r"^[A-Za-z0-9][A-Za-z0-9._-]*\s*(\[[^\]]*\])?\s*===?\s*[^\s,;*]+\s*(;.*)?$"
+)
+# Options that make pip install things not listed in the requirements file
+_UNPINNED_OPTIONS = (
+    "-r",
+    "--requirement",
+    "-c",
+    "--constraint",
+    "-e",
+    "--editable",
+)
+
+
+def _get_virtualenv_steps(
+    virtualenv_root,
+    virtualenv_name,
+    requirements_args,
+    virtualenv_flags=None,
+    overwrite_virtualenv=False,
+    manifest=None,
+):
+    """Get the steps that create or update a virtualenv, once the requirements
+    files are on the host, whether they are run one at a time with Fabric or
+    all at once as a script.
+
+    :param requirements_args: the ``-r`` arguments to ``pip install`` for the
+                              requirements files.
+    :returns: a `list` of ``(message, command)`` pairs, where either may be
+              ``None``.
+    """
+    virtualenv_path = "/".join((virtualenv_root, virtualenv_name))
+    pip_path = "/".join((virtualenv_path, "bin", "pip"))
+    steps = []
+    if overwrite_virtualenv:
+        steps.append(
+            (
+                f"Removing virtualenv if it exists in {virtualenv_root}",
+                f"rm -rf {virtualenv_path} || true",
+            )
+        )
+    steps.append(
+        (
+            None,
+            f"if [ ! -e {virtualenv_path} ]; then "
+            f"echo 'virtualenv not found in {virtualenv_root}, creating one.'; "
+            f"virtualenv --never-download {virtualenv_path} {virtualenv_flags or ''}; "
+            "fi",
+        )
+    )
+    # Make sure we're using latest pip so options work as expected
+    steps.append(
+        (
+            f"Updating virtualenv: {virtualenv_name}",
+            f"{pip_path} install --upgrade 'pip>=9.0,!=19.0' setuptools==69.5.1",
+        )
+    )
+    steps.append(
+        (
+            None,
+            f"{pip_path} install {requirements_args} --exists-action w --upgrade "
+            "--upgrade-strategy only-if-needed --progress-bar off",
+        )
+    )
+    if manifest is not None:
+        # Only written once every requirement is installed
+        steps.append(
+            (
+                None,
+                f"echo '{json.dumps(manifest, sort_keys=True)}' > "
+                f"{virtualenv_path}/{VIRTUALENV_MANIFEST_FILE}",
+            )
+        )
+    return steps
+
 
 @parallel
 def _create_or_update_virtualenv(
@@ -41,20 +149,9 @@ def _create_or_update_virtualenv(
     virtualenv_flags=None,
     overwrite_virtualenv=False,
     user=None,
+    manifest=None,
 ):
     with show("output"):
-        virtualenv_path = "/".join((virtualenv_root, virtualenv_name))
-        if overwrite_virtualenv:
-            puts(f"Removing virtualenv if it exists in {virtualenv_root}")
-            cmd = f"rm -rf {virtualenv_path}"
-            run_cmd(cmd, user, warn_only=True)
-        if not exists(virtualenv_path):
-            if virtualenv_flags is None:
-                virtualenv_flags = ""
-            puts(f"virtualenv not found in {virtualenv_root}, creating one.")
-            cmd = f"virtualenv --never-download {virtualenv_path} {virtualenv_flags}"
-            run_cmd(cmd, user)
-
         if isinstance(requirements_paths, str):
             requirements_paths = [requirements_paths]
         temp_req_paths = []
@@ -64,19 +161,453 @@ def _create_or_update_virtualenv(
             temp_req_paths.append(temp_req)
             put(requirements_path, temp_req, mode="0666")
 
-        puts(f"Updating virtualenv: {virtualenv_name}")
-        pip_path = "/".join((virtualenv_path, "bin", "pip"))
-        # Make sure we're using latest pip so options work as expected
-        run_cmd(f"{pip_path} install --upgrade 'pip>=9.0,!=19.0' setuptools==69.5.1", user)
+        try:
+            for message, cmd in _get_virtualenv_steps(
+                virtualenv_root,
+                virtualenv_name,
+                "-r " + " -r ".join(temp_req_paths),
+                virtualenv_flags=virtualenv_flags,
+                overwrite_virtualenv=overwrite_virtualenv,
+                manifest=manifest,
+            ):
+                if message is not None:
+                    puts(message)
+                if cmd is not None:
+                    run_cmd(cmd, user)
+        finally:
+            run(f"rm -f {' '.join(temp_req_paths)}")
+
+
+def get_requirements_hash(requirements_paths, virtualenv_flags=None):
+    """Hash everything a virtualenv is built from."""
+    digest = hashlib.sha256()
+    digest.update((virtualenv_flags or "").encode("utf-8"))
+    for requirements_path in requirements_paths:
+        with open(requirements_path, "rb") as requirements_file:
+            digest.update(b"\0")
+            digest.update(requirements_file.read())
+    return digest.hexdigest()
+
+
+def get_unpinned_requirements(requirements_paths):
+    """Find the requirements in `requirements_paths` that are not pinned to
+    one version with ``==``, so ``pip`` may install a newer release of them
+    each time it runs.
+
+    Nested requirements and constraints files, and editable requirements,
+    count as unpinned, because they are not part of the requirements hash.
+
+    :returns: a `list` of the unpinned requirement lines.
+    """
+    unpinned = []
+    for requirements_path in requirements_paths:
+        with open(requirements_path) as requirements_file:
+            requirements = requirements_file.read().replace("\\\n", " ")
+        for line in requirements.splitlines():
+            line = re.sub(r"(^|\s)#.*", "", line).strip()
+            line = re.sub(r"\s--hash[=\s]\S+", "", line)
+            if not line:
+                continue
+            if line.startswith("-"):
+                if line.startswith(_UNPINNED_OPTIONS):
+                    unpinned.append(line)
+            elif not _PINNED_REQUIREMENT_RE.match(line):
+                unpinned.append(line)
+    return unpinned
+
+
+def get_virtualenv_manifest(requirements_paths, virtualenv_flags=None):
+    """Describe the virtualenv that should be built from `requirements_paths`
+    by this version of streamparse.
+    """
+    return {
+        "requirements_hash": get_requirements_hash(
+            requirements_paths, virtualenv_flags
+        ),
+        "streamparse_version": __version__,
+    }
+
+
+@parallel
+def _get_virtualenv_manifest(virtualenv_path):
+    """Get the manifest of a virtualenv, or ``None`` if it has none."""
+    with hide("everything"), settings(warn_only=True):
+        result = run(f"cat {virtualenv_path}/{VIRTUALENV_MANIFEST_FILE}")
+    if not result.succeeded:
+        return None
+    try:
+        return json.loads(result)
+    except ValueError:
+        return None
+
+
+def get_stale_hosts(virtualenv_path, manifest, hosts):
+    """Find the `hosts` whose virtualenv does not match `manifest`, with one
+    command per host, run in parallel.
+    """
+    executor = get_executor()
+    if executor is None:
+        installed = execute(_get_virtualenv_manifest, virtualenv_path, hosts=hosts)
+    else:
+        results = executor.run(
+            hosts, f"cat {virtualenv_path}/{VIRTUALENV_MANIFEST_FILE}", stream=False
+        )
+        installed = {}
+        for host, result in results.items():
+            try:
+                installed[host] = (
+                    json.loads(result.output) if result.succeeded else None
+                )
+            except ValueError:
+                installed[host] = None
+    return [host for host in hosts if installed.get(host) != manifest]
+
+
+def get_virtualenv_script(
+    virtualenv_root,
+    virtualenv_name,
+    requirements_paths,
+    virtualenv_flags=None,
+    overwrite_virtualenv=False,
+    manifest=None,
+):
+    """Get a shell script that does what ``_create_or_update_virtualenv`` does,
+    with the requirements files in it, so it can be run with one command.
+    """
+    # Nothing runs until the whole function has been read, so nothing that
+    # reads stdin can eat the rest of the script
+    lines = ["main() {", "set -e", "requirements_files=''"]
+    lines.append("trap 'rm -f $requirements_files' EXIT")
+    delimiter = f"STREAMPARSE_{uuid.uuid4().hex}"
+    for requirements_path in requirements_paths:
+        with open(requirements_path) as requirements_file:
+            requirements = requirements_file.read()
+        lines.append(
+            "requirements_file=$(mktemp /tmp/streamparse_requirements-XXXXXXXXX.txt)"
+        )
+        lines.append('requirements_files="$requirements_files $requirements_file"')
+        lines.append(f"cat > \"$requirements_file\" <<'{delimiter}'")
+        lines.append(requirements.rstrip("\n"))
+        lines.append(delimiter)
+    for message, cmd in _get_virtualenv_steps(
+        virtualenv_root,
+        virtualenv_name,
+        "$(printf -- ' -r %s' $requirements_files)",
+        virtualenv_flags=virtualenv_flags,
+        overwrite_virtualenv=overwrite_virtualenv,
+        manifest=manifest,
+    ):
+        if message is not None:
+            lines.append(f"echo {shlex.quote(message)}")
+        if cmd is not None:
+            lines.append(cmd)
+    lines.extend(["}", "main < /dev/null", ""])
+    return "\n".join(lines)
+
+
+def _create_or_update(
+    hosts,
+    virtualenv_root,
+    virtualenv_name,
+    requirements_paths,
+    virtualenv_flags=None,
+    overwrite_virtualenv=False,
+    user=None,
+    manifest=None,
+):
+    """Create or update the virtualenv on every one of `hosts` at once."""
+    executor = get_executor()
+    if executor is None:
+        execute(
+            _create_or_update_virtualenv,
+            virtualenv_root,
+            virtualenv_name,
+            requirements_paths,
+            virtualenv_flags=virtualenv_flags,
+            hosts=hosts,
+            overwrite_virtualenv=overwrite_virtualenv,
+            user=user,
+            manifest=manifest,
+        )
+        return
+    script = get_virtualenv_script(
+        virtualenv_root,
+        virtualenv_name,
+        requirements_paths,
+        virtualenv_flags=virtualenv_flags,
+        overwrite_virtualenv=overwrite_virtualenv,
+        manifest=manifest,
+    )
+    results = executor.run(
+        hosts, as_user("bash -s", user, env.user), input=script.encode("utf-8")
+    )
+    check_results(results, f"update virtualenv {virtualenv_name}")
+
+
+@parallel
+def _get_platform():
+    """Get the output of ``PLATFORM_CMD`` on a host."""
+    with hide("everything"), settings(warn_only=True):
+        return str(run(PLATFORM_CMD))
+
+
+def get_platforms(hosts):
+    """Get what identifies the platform of each of `hosts`, and the Python
+    virtualenvs are built with there, so virtualenvs built on other hosts can
+    be told apart.
+
+    :returns: a `dict` mapping each host to its platform.
+    """
+    executor = get_executor()
+    if executor is None:
+        return execute(_get_platform, hosts=hosts)
+    results = executor.run(hosts, PLATFORM_CMD, stream=False)
+    check_results(results, "get platform")
+    return {host: result.output for host, result in results.items()}
+
+
+def _pack_virtualenv(virtualenv_path, local_path, user=None):
+    """Download a virtualenv as a tarball to `local_path`."""
+    remote_tarball = run("mktemp /tmp/streamparse_virtualenv-XXXXXXXXX.tar.gz")
+    run(f"chmod 0666 {remote_tarball}")
+    puts(f"Packing {virtualenv_path} into {remote_tarball}.")
+    run_cmd(f"tar -czf {remote_tarball} -C {virtualenv_path} .", user)
+    get(remote_tarball, local_path)
+    run(f"rm -f {remote_tarball}")
+
+
+@parallel
+def _unpack_virtualenv(local_path, virtualenv_path, user=None):
+    """Replace the virtualenv at `virtualenv_path` with the tarball at
+    `local_path`.
+
+    Virtualenvs are not relocatable, so it must have been built at the same
+    path.
+    """
+    with show("output"):
+        remote_tarball = run("mktemp /tmp/streamparse_virtualenv-XXXXXXXXX.tar.gz")
+        puts(f"Uploading {local_path} to {remote_tarball}.")
+        put(local_path, remote_tarball, mode="0666")
+        new_path = f"{virtualenv_path}.new"
+        old_path = f"{virtualenv_path}.old"
         run_cmd(
-            (
-                "{} install -r {} --exists-action w --upgrade "
-                "--upgrade-strategy only-if-needed --progress-bar off"
-            ).format(pip_path, " -r ".join(temp_req_paths)),
+            f"rm -rf {new_path} {old_path} && mkdir -p {new_path} && "
+            f"tar -xzf {remote_tarball} -C {new_path}",
             user,
         )
+        # Swap the whole virtualenv at once, so new workers never see half of it
+        run_cmd(
+            f"if [ -e {virtualenv_path} ]; then mv {virtualenv_path} {old_path}; fi "
+            f"&& mv {new_path} {virtualenv_path} && rm -rf {old_path}",
+            user,
+        )
+        run(f"rm -f {remote_tarball}")
+
+
+def _distribute_prebuilt_virtualenv(
+    virtualenv_root,
+    virtualenv_name,
+    requirements_paths,
+    hosts,
+    manifest,
+    virtualenv_flags=None,
+    overwrite_virtualenv=False,
+    user=None,
+    rebuild=False,
+):
+    """Build a virtualenv on one of `hosts` per platform, and copy it to the
+    others with the same platform.
+
+    The tarball is kept in ``_cache/virtualenvs``, so workers that need it
+    later, or other environments with the same ``virtualenv_root`` and
+    platform, do not need a new build.  Virtualenvs are not relocatable, and
+    have compiled extensions in them, so tarballs are kept by the path and
+    platform they were built for, as well as by `manifest`.
+
+    :param rebuild: build a new tarball even if one is cached, like when
+                    requirements are not pinned.
+    """
+    platforms = get_platforms(list(hosts))
+    hosts_by_platform = {}
+    for host in hosts:
+        hosts_by_platform.setdefault(platforms[host], []).append(host)
+    if len(hosts_by_platform) > 1:
+        print(
+            f"Building virtualenv {virtualenv_name} for each of "
+            f"{len(hosts_by_platform)} platforms."
+        )
+    for platform, platform_hosts in hosts_by_platform.items():
+        _distribute_prebuilt_virtualenv_for_platform(
+            virtualenv_root,
+            virtualenv_name,
+            requirements_paths,
+            platform_hosts,
+            platform,
+            manifest,
+            virtualenv_flags=virtualenv_flags,
+            overwrite_virtualenv=overwrite_virtualenv,
+            user=user,
+            rebuild=rebuild,
+        )
 
-        run(f"rm -f {' '.join(temp_req_paths)}")
+
+def _distribute_prebuilt_virtualenv_for_platform(
+    virtualenv_root,
+    virtualenv_name,
+    requirements_paths,
+    hosts,
+    platform,
+    manifest,
+    virtualenv_flags=None,
+    overwrite_virtualenv=False,
+    user=None,
+    rebuild=False,
+):
+    """Build a virtualenv on one of `hosts`, which all have the same
+    `platform`, and copy it to the others.
+    """
+    virtualenv_path = "/".join((virtualenv_root, virtualenv_name))
+    hosts = list(hosts)
+    cache_dir = os.path.join(cache.CACHE_DIR, VIRTUALENV_CACHE_DIR, virtualenv_name)
+    target_hash = hashlib.sha256(
+        json.dumps([virtualenv_path, platform]).encode("utf-8")
+    ).hexdigest()
+    manifest_hash = hashlib.sha256(
+        json.dumps(manifest, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    local_path = os.path.join(
+        cache_dir, f"{target_hash[:16]}-{manifest_hash[:16]}.tar.gz"
+    )
+    if overwrite_virtualenv or rebuild or not os.path.exists(local_path):
+        builder = hosts.pop(0)
+        _create_or_update(
+            [builder],
+            virtualenv_root,
+            virtualenv_name,
+            requirements_paths,
+            virtualenv_flags=virtualenv_flags,
+            overwrite_virtualenv=overwrite_virtualenv,
+            user=user,
+            manifest=manifest,
+        )
+        os.makedirs(cache_dir, exist_ok=True)
+        executor = get_executor()
+        if executor is None:
+            execute(
+                _pack_virtualenv,
+                virtualenv_path,
+                f"{local_path}.tmp",
+                user=user,
+                hosts=[builder],
+            )
+        else:
+            print(f"Downloading virtualenv {virtualenv_name} from {builder}...")
+            result = executor.fetch(
+                builder,
+                as_user(f"tar -czf - -C {virtualenv_path} .", user, env.user),
+                f"{local_path}.tmp",
+            )
+            check_results({builder: result}, f"pack virtualenv {virtualenv_name}")
+        os.replace(f"{local_path}.tmp", local_path)
+        # Only keep the latest tarball for each path and platform
+        for file_name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, file_name)
+            if file_name.startswith(f"{target_hash[:16]}-") and path != local_path:
+                os.remove(path)
+    if not hosts:
+        return
+    executor = get_executor()
+    if executor is None:
+        execute(
+            _unpack_virtualenv,
+            local_path,
+            virtualenv_path,
+            user=user,
+            hosts=hosts,
+        )
+        return
+    new_path = f"{virtualenv_path}.new"
+    old_path = f"{virtualenv_path}.old"
+    # Swap the whole virtualenv at once, so new workers never see half of it
+    unpack_cmd = (
+        f"rm -rf {new_path} {old_path} && mkdir -p {new_path} && "
+        f"tar -xzf - -C {new_path} && "
+        f"if [ -e {virtualenv_path} ]; then mv {virtualenv_path} {old_path}; fi "
+        f"&& mv {new_path} {virtualenv_path} && rm -rf {old_path}"
+    )
+    results = executor.run(
+        hosts, as_user(unpack_cmd, user, env.user), input_path=local_path
+    )
+    check_results(results, f"unpack virtualenv {virtualenv_name}")
+
+
+def update_virtualenvs(
+    virtualenv_root,
+    virtualenv_name,
+    requirements_paths,
+    hosts,
+    virtualenv_flags=None,
+    overwrite_virtualenv=False,
+    user=None,
+    prebuilt=False,
+):
+    """Create or update the virtualenv on each of `hosts` that was not built
+    from the same requirements by the same version of streamparse.
+
+    Unless every requirement is pinned to one version, a newer release of one
+    may be out, so every host is updated.
+
+    :param prebuilt: build the virtualenv on one host and copy it to the
+                     others, instead of building it on every host.
+    :returns: the hosts that were updated.
+    """
+    virtualenv_path = "/".join((virtualenv_root, virtualenv_name))
+    manifest = get_virtualenv_manifest(requirements_paths, virtualenv_flags)
+    hosts = list(hosts)
+    unpinned = get_unpinned_requirements(requirements_paths)
+    if overwrite_virtualenv:
+        stale_hosts = hosts
+    elif unpinned:
+        warn(
+            f"Updating virtualenv {virtualenv_name} on every host, because "
+            "these requirements are not pinned to one version with ==: "
+            f"{', '.join(unpinned)}"
+        )
+        stale_hosts = hosts
+    else:
+        stale_hosts = get_stale_hosts(virtualenv_path, manifest, hosts)
+    if not stale_hosts:
+        print(f"virtualenv {virtualenv_name} is up to date on all {len(hosts)} hosts.")
+        return []
+    if len(stale_hosts) < len(hosts):
+        print(
+            f"Updating virtualenv {virtualenv_name} on {len(stale_hosts)} of "
+            f"{len(hosts)} hosts."
+        )
+    if prebuilt:
+        _distribute_prebuilt_virtualenv(
+            virtualenv_root,
+            virtualenv_name,
+            requirements_paths,
+            stale_hosts,
+            manifest,
+            virtualenv_flags=virtualenv_flags,
+            overwrite_virtualenv=overwrite_virtualenv,
+            user=user,
+            rebuild=bool(unpinned),
+        )
+    else:
+        _create_or_update(
+            stale_hosts,
+            virtualenv_root,
+            virtualenv_name,
+            requirements_paths,
+            virtualenv_flags=virtualenv_flags,
+            overwrite_virtualenv=overwrite_virtualenv,
+            user=user,
+            manifest=manifest,
+        )
+    return stale_hosts
 
 
 def create_or_update_virtualenvs(
@@ -142,15 +673,15 @@ def create_or_update_virtualenvs(
     activate_env(env_name, storm_options, config_file=config_file)
 
     # Actually create or update virtualenv on worker nodes
-    execute(
-        _create_or_update_virtualenv,
+    update_virtualenvs(
         env.virtualenv_root,
         virtualenv_name,
         requirements_paths,
+        env.storm_workers,
         virtualenv_flags=storm_options.get("virtualenv_flags"),
-        hosts=env.storm_workers,
         overwrite_virtualenv=overwrite_virtualenv,
         user=user or storm_options["sudo_user"],
+        prebuilt=storm_options.get("prebuilt_virtualenv", False),
     )
 
 
@@ -0,0 +1,388 @@
+"""
+OpenMetrics (Prometheus) export of component metrics.
+
+With ``streamparse.metrics.export.enabled`` set, every task periodically
+writes its :class:`~streamparse.metrics.MetricsRegistry`, along with how many
+Tuples it is holding on to and its memory use, to a file in a directory shared
+by every task on the host.  One exporter process per host serves all of those
+files as a single OpenMetrics page, labelled with the topology, component, and
+task ID they came from.
+
+``streamparse.metrics.export.enabled``
+    Set to ``true`` to write metrics files and start the exporter.  This does
+    not need ``streamparse.metrics.enabled``, and so does not need any
+    metrics to be registered with Storm.
+``streamparse.metrics.export.dir``
+    The directory to write metrics files to.  Defaults to
+    ``streamparse_metrics`` in the system temporary directory.
+``streamparse.metrics.export.interval_secs``
+    How often each task rewrites its file.  Default is ``10``.
+``streamparse.metrics.export.port``
+    The port the exporter listens on.  The first task on a host that finds
+    nothing listening on it starts an exporter in the background, which
+    exits after ``EXPORTER_IDLE_TIMEOUT`` seconds without any metrics files.
+    Set this to ``0`` to only write the files, for example to be picked up by
+    the textfile collector of the Prometheus node exporter instead.  Default
+    is ``9731``.
+"""
+
+import argparse
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .metrics import Counter
+
+DEFAULT_EXPORT_INTERVAL_SECS = 10
+DEFAULT_EXPORT_PORT = 9731
+EXPORTER_IDLE_TIMEOUT = 600
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+# Histogram bucket boundaries, in microseconds for metrics ending in "_us"
+HISTOGRAM_BUCKETS = (
+    100,
+    250,
+    500,
+    1_000,
+    2_500,
+    5_000,
+    10_000,
+    25_000,
+    50_000,
+    100_000,
+    250_000,
+    500_000,
+    1_000_000,
+    2_500_000,
+    5_000_000,
+    10_000_000,
+)
+_FILE_PREFIX = "streamparse_metrics_"
+_FILE_SUFFIX = ".prom"
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def read_rss_bytes():
+    """The resident set size of this process, or ``0`` if it is unknown."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _family_name(name):
+    return "streamparse_" + _INVALID_NAME_CHARS.sub("_", name)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    formatted = ",".join(
+        '{}="{}"'.format(
+            key,
+            str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"),
+        )
+        for key, value in items
+    )
+    return f"{{{formatted}}}" if formatted else ""
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render_metrics(metrics, labels, gauges=None):
+    """Render metrics in the OpenMetrics text format, without the ``# EOF``.
+
+    Histograms with names ending in ``_us`` are converted to seconds, the
+    base unit Prometheus expects.
+
+    :param metrics: an iterable of ``(name, metric)`` pairs, where each
+                    metric is a :class:`~streamparse.metrics.Counter` or
+                    :class:`~streamparse.metrics.Histogram`.
+    :param labels: a `dict` of the labels to give every sample.
+    :param gauges: a `dict` mapping gauge names to their current values.
+    :returns: a `list` of lines.
+    """
+    lines = []
+    for name, value in sorted((gauges or {}).items()):
+        family = _family_name(name)
+        lines.append(f"# TYPE {family} gauge")
+        lines.append(f"{family}{_format_labels(labels)} {_format_value(value)}")
+    for name, metric in sorted(metrics, key=lambda item: item[0]):
+        if isinstance(metric, Counter):
+            family = _family_name(name)
+            lines.append(f"# TYPE {family} counter")
+            lines.append(f"{family}_total{_format_labels(labels)} {metric.value}")
+            continue
+        scale = 1
+        if name.endswith("_us"):
+            name = name[:-3] + "_seconds"
+            scale = 1e6
+        family = _family_name(name)
+        lines.append(f"# TYPE {family} histogram")
+        buckets = metric.buckets()
+        seen = 0
+        index = 0
+        for boundary in HISTOGRAM_BUCKETS:
+            while index < len(buckets) and buckets[index][0] <= boundary:
+                seen += buckets[index][1]
+                index += 1
+            le = _format_value(boundary / scale if scale != 1 else boundary)
+            lines.append(f"{family}_bucket{_format_labels(labels, {'le': le})} {seen}")
+        lines.append(
+            f"{family}_bucket{_format_labels(labels, {'le': '+Inf'})} {metric.count}"
+        )
+        lines.append(f"{family}_count{_format_labels(labels)} {metric.count}")
+        total = metric.total / scale if scale != 1 else metric.total
+        lines.append(f"{family}_sum{_format_labels(labels)} {_format_value(total)}")
+    return lines
+
+
+class MetricsFileWriter:
+    """Writes a component's metrics to an OpenMetrics file.
+
+    Storm reporting resets metrics, while Prometheus expects them to only go
+    up, so the values from before every reset are kept here with ``fold``.
+
+    :param path: the path of the file to write.
+    :param labels: a `dict` of the labels to give every sample.
+    :param interval_secs: how often the file should be rewritten.
+    """
+
+    def __init__(self, path, labels, interval_secs=DEFAULT_EXPORT_INTERVAL_SECS):
+        self.path = path
+        self.labels = labels
+        self.interval_secs = interval_secs
+        self.last_write = None
+        self._totals = {}
+
+    def fold(self, registry):
+        """Keep the current values of the metrics in `registry`, which is
+        about to be reset.
+        """
+        for name, metric in registry:
+            total = self._totals.get(name)
+            if total is None:
+                total = self._totals[name] = metric.__class__()
+            total.merge(metric)
+
+    def due(self):
+        """Whether it is time to rewrite the file."""
+        return (
+            self.last_write is None
+            or time.monotonic() - self.last_write >= self.interval_secs
+        )
+
+    def write(self, registry, gauges=None):
+        """Write every metric in `registry` and `gauges` to the file.
+
+        The file is replaced atomically, so the exporter never sees half of
+        it.
+        """
+        metrics = []
+        for name, metric in registry:
+            total = self._totals.get(name)
+            if total is not None:
+                metric = metric.__class__().merge(total).merge(metric)
+            metrics.append((name, metric))
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as metrics_file:
+            for line in render_metrics(metrics, self.labels, gauges):
+                metrics_file.write(line)
+                metrics_file.write("\n")
+        os.replace(tmp_path, self.path)
+        self.last_write = time.monotonic()
+
+    def close(self):
+        """Remove the file, because this task is going away."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def get_export_dir(storm_conf):
+    return storm_conf.get("streamparse.metrics.export.dir") or os.path.join(
+        tempfile.gettempdir(), "streamparse_metrics"
+    )
+
+
+def open_metrics_file(component, storm_conf):
+    """Start exporting metrics for `component` if its config asks for it,
+    starting the exporter for this host if it is not running.
+
+    :returns: a :class:`MetricsFileWriter`, or ``None`` if exporting is
+              disabled.
+    """
+    if not storm_conf.get("streamparse.metrics.export.enabled", False):
+        return None
+    export_dir = get_export_dir(storm_conf)
+    os.makedirs(export_dir, exist_ok=True)
+    file_name = (
+        f"{_FILE_PREFIX}{component.topology_name}_{component.component_name}"
+        f"_{component.task_id}_{component.pid}{_FILE_SUFFIX}"
+    )
+    labels = {
+        "topology": component.topology_name,
+        "component": component.component_name,
+        "task": component.task_id,
+    }
+    port = storm_conf.get("streamparse.metrics.export.port", DEFAULT_EXPORT_PORT)
+    if port:
+        ensure_exporter(export_dir, port)
+    return MetricsFileWriter(
+        os.path.join(export_dir, file_name),
+        labels,
+        interval_secs=storm_conf.get(
+            "streamparse.metrics.export.interval_secs", DEFAULT_EXPORT_INTERVAL_SECS
+        ),
+    )
+
+
+def ensure_exporter(export_dir, port):
+    """Start an exporter in the background unless something is already
+    listening on `port`.
+    """
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=1):
+            return
+    except OSError:
+        pass
+    with open(os.devnull, "r+b") as devnull:
+        # If another task beats us to it, this one fails to bind and exits
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "streamparse.exporter",
+                "--dir",
+                export_dir,
+                "--port",
+                str(port),
+            ],
+            stdin=devnull,
+            stdout=devnull,
+            stderr=devnull,
+            close_fds=True,
+            start_new_session=True,
+        )
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect_metrics(export_dir):
+    """Merge the metrics files in `export_dir` into one OpenMetrics page.
+
+    Files left behind by tasks that are no longer running are removed.
+
+    :returns: a `tuple` of the page, and the number of files in it.
+    """
+    families = {}
+    num_files = 0
+    for file_name in sorted(os.listdir(export_dir)):
+        if not (
+            file_name.startswith(_FILE_PREFIX) and file_name.endswith(_FILE_SUFFIX)
+        ):
+            continue
+        path = os.path.join(export_dir, file_name)
+        pid = file_name[: -len(_FILE_SUFFIX)].rpartition("_")[2]
+        if pid.isdigit() and not _pid_alive(int(pid)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(path, encoding="utf-8") as metrics_file:
+                lines = metrics_file.read().splitlines()
+        except FileNotFoundError:
+            continue
+        num_files += 1
+        family = None
+        for line in lines:
+            if line.startswith("# TYPE "):
+                family = families.setdefault(line.split()[2], [line])
+            elif family is not None and line and not line.startswith("#"):
+                family.append(line)
+    page = [line for family in families.values() for line in family]
+    page.append("# EOF")
+    return "\n".join(page) + "\n", num_files
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        page, num_files = collect_metrics(self.server.export_dir)
+        if num_files:
+            self.server.last_seen_files = time.monotonic()
+        body = page.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(export_dir, port, idle_timeout=EXPORTER_IDLE_TIMEOUT, host=""):
+    """Serve the metrics in `export_dir` until there have been none for
+    `idle_timeout` seconds.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.export_dir = export_dir
+    server.last_seen_files = time.monotonic()
+    server.timeout = 1
+    with server:
+        while time.monotonic() - server.last_seen_files < idle_timeout:
+            server.handle_request()
+            if collect_metrics(export_dir)[1]:
+                server.last_seen_files = time.monotonic()
+
+
+def main():
+    """main entry point for the per-host metrics exporter"""
+    parser = argparse.ArgumentParser(
+        description="Serve the metrics files of every streamparse task on this "
+        "host as one OpenMetrics page.",
+        epilog="This is started automatically by tasks with "
+        "streamparse.metrics.export.enabled set.",
+    )
+    parser.add_argument("--dir", required=True, help="The metrics file directory.")
+    parser.add_argument(
+        "--port",
+        default=DEFAULT_EXPORT_PORT,
+        type=int,
+        help="The port to listen on. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--idle_timeout",
+        default=EXPORTER_IDLE_TIMEOUT,
+        type=int,
+        help="Exit after this many seconds without metrics files. "
+        "(default: %(default)s)",
+    )
+    args = parser.parse_args()
+    serve(args.dir, args.port, idle_timeout=args.idle_timeout)
+
+
+if __name__ == "__main__":
+    main()
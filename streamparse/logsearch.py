@@ -0,0 +1,173 @@
+"""
+Search the pystorm log files of a topology on one Storm worker.
+
+``sparse logs search`` sends the source of this module to every worker and
+runs it there, so only matching log entries are sent back over SSH.  That is
+why it only uses the standard library.
+
+Files rotated by pystorm's ``RotatingFileHandler`` (``.log.1``, ...) are
+searched along with the current ones, as are rotated files that have been
+gzipped.  Lines that do not start with a timestamp, like the rest of a
+traceback, are searched and returned as part of the entry before them.
+Matches are printed as JSON lines, oldest first.
+"""
+
+import base64
+import fnmatch
+import gzip
+import heapq
+import itertools
+import json
+import os
+import re
+import sys
+import time
+
+TIMESTAMP_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2}:\d{2})(?:[.,](\d+))?")
+# How deep to look for log files below the log path, like get_logfiles_cmd
+MAX_DEPTH = 4
+
+
+def normalize_timestamp(value):
+    """Get the timestamp `value` starts with as ``YYYY-MM-DD HH:MM:SS.fff``,
+    so timestamps can be compared as strings.
+
+    :returns: the timestamp, or ``None`` if `value` does not start with one.
+    """
+    match = TIMESTAMP_RE.match(value)
+    if match is None:
+        return None
+    date, clock, fraction = match.groups()
+    return f"{date} {clock}.{(fraction or '').ljust(3, '0')[:3]}"
+
+
+def find_log_files(log_path, name_pattern, file_regex=None):
+    """Find the files below `log_path` whose paths match `name_pattern`.
+
+    :param name_pattern: a glob the path, starting with ``./``, must match.
+    :param file_regex: a regular expression the path must also contain.
+    """
+    root_depth = log_path.rstrip(os.sep).count(os.sep)
+    for dir_path, dir_names, file_names in os.walk(log_path):
+        if dir_path.rstrip(os.sep).count(os.sep) - root_depth >= MAX_DEPTH - 1:
+            dir_names[:] = []
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            relative_path = "./" + os.path.relpath(path, log_path)
+            if not fnmatch.fnmatch(relative_path, name_pattern):
+                continue
+            if file_regex and not re.search(file_regex, relative_path):
+                continue
+            yield path
+
+
+def get_component_name(path, topology_name):
+    """Get the component that wrote the log file at `path`, from pystorm's
+    default ``pystorm_<topology>_<component>_<task>_<pid>.log`` file name.
+
+    :returns: the component, or the file name if it is not in that format.
+    """
+    file_name = os.path.basename(path).split(".log", 1)[0]
+    prefix = f"pystorm_{topology_name}_"
+    if file_name.startswith(prefix):
+        parts = file_name[len(prefix) :].rsplit("_", 2)
+        if len(parts) == 3:
+            return parts[0]
+    return file_name
+
+
+def read_entries(path):
+    """Read the entries of a log file, which may be gzipped.
+
+    Lines before the first timestamp are skipped, because the entry they
+    belong to started in an older file.
+
+    :returns: a generator of ``(timestamp, text)`` pairs.
+    """
+    if path.endswith(".gz"):
+        log_file = gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    else:
+        log_file = open(path, encoding="utf-8", errors="replace")
+    with log_file:
+        timestamp = None
+        lines = []
+        for line in log_file:
+            line_timestamp = normalize_timestamp(line)
+            if line_timestamp is not None:
+                if timestamp is not None:
+                    yield timestamp, "".join(lines)
+                timestamp = line_timestamp
+                lines = [line]
+            elif timestamp is not None:
+                lines.append(line)
+        if timestamp is not None:
+            yield timestamp, "".join(lines)
+
+
+def search(
+    log_path,
+    topology_name,
+    regex=None,
+    ignore_case=False,
+    start=None,
+    end=None,
+    max_results=None,
+    file_regex=None,
+):
+    """Search the log files of `topology_name` below `log_path`.
+
+    :param regex: a regular expression entries must contain.
+    :param ignore_case: whether `regex` is case insensitive.
+    :param start: the normalized timestamp of the oldest entry to return.
+    :param end: the normalized timestamp entries must be older than.
+    :param max_results: the most entries to return.  Only the newest ones are
+                        kept.
+    :param file_regex: a regular expression the paths of log files must
+                       contain.
+    :returns: a `list` of matches, oldest first, as `dict` objects with the
+              ``timestamp``, ``component``, ``file``, and ``text`` of each.
+    """
+    compiled = re.compile(regex, re.IGNORECASE if ignore_case else 0) if regex else None
+    start_secs = None
+    if start:
+        start_secs = time.mktime(time.strptime(start[:19], "%Y-%m-%d %H:%M:%S"))
+    # The newest matches, as a heap of (timestamp, order found, match)
+    matches = []
+    order = itertools.count()
+    for path in find_log_files(log_path, f"*{topology_name}*.log*", file_regex):
+        try:
+            # Nothing in a file can be newer than when it was last written
+            if start_secs is not None and os.path.getmtime(path) < start_secs:
+                continue
+            component = get_component_name(path, topology_name)
+            for timestamp, text in read_entries(path):
+                if (start and timestamp < start) or (end and timestamp >= end):
+                    continue
+                if compiled is not None and not compiled.search(text):
+                    continue
+                match = {
+                    "timestamp": timestamp,
+                    "component": component,
+                    "file": os.path.relpath(path, log_path),
+                    "text": text.rstrip("\n"),
+                }
+                item = (timestamp, next(order), match)
+                if max_results is None or len(matches) < max_results:
+                    heapq.heappush(matches, item)
+                elif item > matches[0]:
+                    heapq.heapreplace(matches, item)
+        except (OSError, EOFError):
+            # Rotated away while we were looking, or a truncated gzip file
+            continue
+    return [match for _, _, match in sorted(matches)]
+
+
+def main(options):
+    """Print the matches for `options`, the arguments to :func:`search`."""
+    for match in search(**options):
+        sys.stdout.write(json.dumps(match))
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main(json.loads(base64.b64decode(sys.argv[-1]).decode("utf-8")))
@@ -0,0 +1,416 @@
+"""
+Counters and histograms for timing the Python side of a topology.
+
+Every component has a :class:`MetricsRegistry` as ``self.metrics``, which you
+can record your own metrics in.  They, and the metrics streamparse records
+itself, are only reported when these Storm options are set for the topology or
+component:
+
+``streamparse.metrics.enabled``
+    Set to ``true`` to record the built-in metrics below, and report the
+    ``registered`` ones to Storm on each tick Tuple, or every
+    ``interval_secs`` for components that do not get ticks.
+``streamparse.metrics.registered``
+    The names of the metrics to report to Storm, like ``["acked",
+    "process_latency_us"]``.  Nothing is reported to Storm by default, so
+    metrics are only exported (see :mod:`streamparse.exporter`).
+``streamparse.metrics.interval_secs``
+    The longest time between reports.  Default is ``60``.
+``streamparse.metrics.prefix``
+    What to start the name of every reported metric with.  Default is
+    ``"streamparse."``.
+
+The built-in metrics are:
+
+``process_latency_us``
+    How long the main thread spent on each Tuple, or spout command, before
+    asking for the next one.
+``input_wait_us``
+    How long the main thread waited for and decoded each message from Storm.
+    This is mostly time spent idle waiting for input, not time messages
+    spent queued.
+``serialize_us``
+    How long each message to Storm took to serialize.
+``gc_pause_us``
+    How long each garbage collection took.
+``received``, ``emitted.<stream>``, ``acked``, ``failed``
+    How many Tuples were received, emitted to each stream, and acked or
+    failed.
+
+Counters are reported as numbers, and histograms as a dictionary of their
+``count``, ``min``, ``mean``, ``max``, ``p50``, ``p90``, ``p99``, and ``p999``.
+Both are reset after every report, like Storm's own metrics.
+
+.. warning::
+    Out of the box, these metrics can only be seen through the OpenMetrics
+    exporter (see :mod:`streamparse.exporter`), not in Storm's own metrics or
+    the Storm UI.  Storm's ``ShellBolt`` and ``ShellSpout`` kill a worker that
+    reports a metric they do not know about, and streamparse cannot register
+    metrics for them without Java code.  Only list a metric in
+    ``streamparse.metrics.registered`` once the task registers an
+    ``IShellMetric`` under its prefixed name, for example from a ``ShellBolt``
+    subclass that calls ``context.registerMetric`` in ``prepare``.
+
+Metrics can be recorded from any thread.
+"""
+
+import gc
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_INTERVAL_SECS = 60
+DEFAULT_PREFIX = "streamparse."
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Counter:
+    """A number that only goes up, until it is reset."""
+
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+    def merge(self, other):
+        """Add the value of `other` to this one."""
+        self.inc(other.value)
+        return self
+
+    def summary(self, reset=False):
+        """The value, optionally resetting it at the same time."""
+        with self._lock:
+            value = self.value
+            if reset:
+                self.value = 0
+        return value
+
+
+class Histogram:
+    """Records the distribution of non-negative integer values.
+
+    Values are counted in log-linear buckets, like an HdrHistogram: values
+    below ``2 ** precision_bits`` are exact, and larger ones are rounded to
+    within ``2 ** (1 - precision_bits)`` of their value (about 3% with the
+    default precision).  Recording a value is a few integer operations and a
+    dictionary update, no matter how many values have been recorded.
+
+    :param precision_bits: the number of significant bits to keep per value.
+    """
+
+    __slots__ = (
+        "count",
+        "max",
+        "min",
+        "precision_bits",
+        "total",
+        "_buckets",
+        "_lock",
+    )
+
+    def __init__(self, precision_bits=5):
+        if precision_bits < 1:
+            raise ValueError(
+                f"precision_bits must be positive.  Given: {precision_bits!r}"
+            )
+        self.precision_bits = precision_bits
+        self._lock = threading.Lock()
+        self._reset()
+
+    def reset(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self._buckets = {}
+
+    def _bucket(self, value):
+        shift = value.bit_length() - self.precision_bits
+        if shift <= 0:
+            return value
+        # The top precision_bits bits, of which the first is always set
+        half = 1 << (self.precision_bits - 1)
+        return (shift + 1) * half + (value >> shift) - half
+
+    def _bucket_max(self, bucket):
+        """The highest value that is counted in `bucket`."""
+        half = 1 << (self.precision_bits - 1)
+        if bucket < 2 * half:
+            return bucket
+        shift, top = divmod(bucket, half)
+        shift -= 1
+        return ((top + half + 1) << shift) - 1
+
+    def record(self, value):
+        """Record a value, which is rounded down to an `int`."""
+        value = int(value)
+        if value < 0:
+            value = 0
+        bucket = self._bucket(value)
+        with self._lock:
+            self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+            self.count += 1
+            self.total += value
+            if self.max is None or value > self.max:
+                self.max = value
+            if self.min is None or value < self.min:
+                self.min = value
+
+    def merge(self, other):
+        """Add the values recorded in `other` to this one."""
+        if other.precision_bits != self.precision_bits:
+            raise ValueError("Cannot merge histograms of different precisions.")
+        # Copy other first, so the two locks are never held at once
+        with other._lock:
+            buckets = list(other._buckets.items())
+            count, total = other.count, other.total
+            other_max, other_min = other.max, other.min
+        with self._lock:
+            for bucket, bucket_count in buckets:
+                self._buckets[bucket] = self._buckets.get(bucket, 0) + bucket_count
+            self.count += count
+            self.total += total
+            if other_max is not None and (self.max is None or other_max > self.max):
+                self.max = other_max
+            if other_min is not None and (self.min is None or other_min < self.min):
+                self.min = other_min
+        return self
+
+    def buckets(self):
+        """The highest value in, and the count of, each non-empty bucket.
+
+        :returns: a `list` of ``(max_value, count)`` pairs, lowest first.
+        """
+        with self._lock:
+            buckets = sorted(self._buckets.items())
+        return [(self._bucket_max(bucket), count) for bucket, count in buckets]
+
+    @contextmanager
+    def time(self):
+        """Record how many microseconds the ``with`` block took."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record((time.perf_counter() - start) * 1e6)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """The value `percent` percent of recorded values are at or below.
+
+        This is the highest value in the bucket the percentile falls in, so it
+        is never an underestimate.
+        """
+        with self._lock:
+            return self._percentile(percent)
+
+    def _percentile(self, percent):
+        if not self.count:
+            return 0
+        rank = max(1, math.ceil(round(self.count * percent / 100, 9)))
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                return min(self._bucket_max(bucket), self.max)
+        return self.max
+
+    def summary(self, reset=False):
+        """Summarize the recorded values, optionally resetting them at the
+        same time, so no value recorded in between is lost.
+        """
+        with self._lock:
+            summary = {
+                "count": self.count,
+                "min": self.min or 0,
+                "mean": self.mean,
+                "max": self.max or 0,
+            }
+            for percent in PERCENTILES:
+                summary[f"p{str(percent).replace('.', '')}"] = self._percentile(percent)
+            if reset:
+                self._reset()
+        return summary
+
+
+class MetricsRegistry:
+    """The named counters and histograms of one component.
+
+    Metrics are created the first time they are asked for::
+
+        self.metrics.counter("cache_misses").inc()
+        with self.metrics.histogram("db_query_us").time():
+            ...
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _get(self, name, cls):
+        metric = self._metrics.get(name)
+        if metric is None:
+            # setdefault, so two threads can't create the same metric twice
+            metric = self._metrics.setdefault(name, cls())
+        if not isinstance(metric, cls):
+            raise TypeError(f"{name} is a {metric.__class__.__name__}.")
+        return metric
+
+    def counter(self, name):
+        """Get the :class:`Counter` called `name`."""
+        return self._get(name, Counter)
+
+    def histogram(self, name):
+        """Get the :class:`Histogram` called `name`."""
+        return self._get(name, Histogram)
+
+    def __contains__(self, name):
+        return name in self._metrics
+
+    def __iter__(self):
+        # A copy, because other threads may add metrics while iterating
+        return iter(list(self._metrics.items()))
+
+    def snapshot(self, reset=False):
+        """Summarize every metric.
+
+        :param reset: reset every metric after summarizing it.
+        :returns: a `dict` mapping metric names to their summaries.
+        """
+        return {
+            name: metric.summary(reset=reset)
+            for name, metric in sorted(self._metrics.items())
+        }
+
+
+class ComponentMetrics:
+    """Records the built-in metrics of a component in its registry.
+
+    This is what ``streamparse.metrics.enabled`` (or exporting) turns on.
+
+    :param registry: the :class:`MetricsRegistry` to record metrics in.
+    :param serializer: the component's serializer, whose ``serialize_dict``
+                       is timed.
+    :param interval_secs: the longest time between reports.
+    """
+
+    def __init__(self, registry, serializer, interval_secs=DEFAULT_INTERVAL_SECS):
+        self.registry = registry
+        self.interval_secs = interval_secs
+        self.last_report = time.monotonic()
+        self._process_latency = registry.histogram("process_latency_us")
+        self._input_wait = registry.histogram("input_wait_us")
+        self._serialize = registry.histogram("serialize_us")
+        self._gc_pause = registry.histogram("gc_pause_us")
+        self._acked = registry.counter("acked")
+        self._failed = registry.counter("failed")
+        self._received = registry.counter("received")
+        self._emitted = {}
+        self._busy_since = None
+        self._gc_start = None
+        self._time_serializer(serializer)
+        gc.callbacks.append(self._on_gc)
+
+    def _time_serializer(self, serializer):
+        serialize_dict = serializer.serialize_dict
+        histogram = self._serialize
+        perf_counter = time.perf_counter
+
+        def timed_serialize_dict(msg_dict):
+            start = perf_counter()
+            try:
+                return serialize_dict(msg_dict)
+            finally:
+                histogram.record((perf_counter() - start) * 1e6)
+
+        serializer.serialize_dict = timed_serialize_dict
+
+    def _on_gc(self, phase, info):
+        if phase == "start":
+            self._gc_start = time.perf_counter()
+        elif self._gc_start is not None:
+            self._gc_pause.record((time.perf_counter() - self._gc_start) * 1e6)
+            self._gc_start = None
+
+    def close(self):
+        """Stop timing garbage collections."""
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+
+    def message_read(self, msg, start, end):
+        """Record reading `msg` from Storm, which took from `start` to `end`.
+
+        Lists of task IDs are read in the middle of processing a Tuple, so
+        they should not be passed here.
+        """
+        if self._busy_since is not None:
+            self._process_latency.record((start - self._busy_since) * 1e6)
+        self._input_wait.record((end - start) * 1e6)
+        stream = msg.get("stream")
+        if stream == "__heartbeat" or stream == "__tick":
+            # Don't count the time spent on these as processing
+            self._busy_since = None
+            return
+        self._busy_since = end
+        if "tuple" in msg:
+            self._received.inc()
+        command = msg.get("command")
+        if command == "ack":
+            self._acked.inc()
+        elif command == "fail":
+            self._failed.inc()
+
+    def count_sent(self, messages):
+        """Count the emits, acks, and fails in `messages`."""
+        for msg in messages:
+            if not isinstance(msg, dict):
+                continue
+            command = msg.get("command")
+            if command == "emit":
+                stream = msg.get("stream") or "default"
+                counter = self._emitted.get(stream)
+                if counter is None:
+                    counter = self._emitted[stream] = self.registry.counter(
+                        f"emitted.{stream}"
+                    )
+                counter.inc()
+            elif command == "ack":
+                self._acked.inc()
+            elif command == "fail":
+                self._failed.inc()
+
+    def report_due(self, msg):
+        """Whether it is time to report metrics, having just read `msg`."""
+        return (
+            isinstance(msg, dict) and msg.get("stream") == "__tick"
+        ) or time.monotonic() - self.last_report >= self.interval_secs
+
+
+def make_metric_messages(registry, prefix=DEFAULT_PREFIX, names=None):
+    """Build ``metrics`` commands for the metrics in `registry`, and reset
+    every one of them.
+
+    :param names: the names of the metrics to build commands for, which
+                  Storm must know about.  Defaults to every metric.
+    """
+    return [
+        {"command": "metrics", "name": f"{prefix}{name}", "params": summary}
+        for name, summary in registry.snapshot(reset=True).items()
+        if names is None or name in names
+    ]
@@ -0,0 +1,185 @@
+"""
+A low-overhead sampling profiler for Python components.
+
+Profiling is enabled per topology or component with these Storm options:
+
+``streamparse.profile.enabled``
+    Set to ``true`` to sample the stack of each task's main thread.
+``streamparse.profile.hz``
+    How many times per second of CPU time to sample.  Default is ``100``.
+``streamparse.profile.interval``
+    How often, in seconds, to write the samples so far to disk.  Default is
+    ``60``.
+``streamparse.profile.path``
+    The directory to write profiles to.  Defaults to ``pystorm.log.path``, or
+    the system temporary directory.
+
+Samples are taken from a ``SIGPROF`` handler, so a task that is waiting for
+Tuples costs nothing to profile, and one that is busy pays for a stack walk
+``hz`` times a second.  The handler only counts stacks; profiles are written
+from a background thread, and when profiling stops.  Profiles are written as
+collapsed stacks (one ``frame;frame;frame count`` line per unique stack), the
+input format of `FlameGraph <https://github.com/brendangregg/FlameGraph>`_ and
+most of the tools that came after it.  Use ``sparse profile`` to fetch and
+merge them from every worker.
+"""
+
+import logging
+import os
+import signal
+import tempfile
+import threading
+from collections import Counter
+
+DEFAULT_HZ = 100
+DEFAULT_INTERVAL = 60
+
+log = logging.getLogger(__name__)
+
+
+def format_frame(frame):
+    """Describe `frame` as ``function (file:line)``, with its first line."""
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples the main thread's stack on a CPU-time interval timer.
+
+    :param path: the path of the collapsed stack file to write, if any.
+    :param hz: how many times per second of CPU time to sample.
+    :param interval: how often, in seconds, to write `path`.
+
+    :ivar samples: a :class:`collections.Counter` of collapsed stacks.
+    """
+
+    def __init__(self, path=None, hz=DEFAULT_HZ, interval=DEFAULT_INTERVAL):
+        if hz <= 0:
+            raise ValueError(f"hz must be positive.  Given: {hz!r}")
+        self.path = path
+        self.hz = hz
+        self.interval = interval
+        self.samples = Counter()
+        self._old_handler = None
+        self._stop_writing = threading.Event()
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self.running = False
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(format_frame(frame))
+            frame = frame.f_back
+        if stack:
+            self.samples[";".join(reversed(stack))] += 1
+
+    def _write_periodically(self):
+        while not self._stop_writing.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                log.exception("Failed to write profile to %s", self.path)
+
+    def start(self):
+        """Start sampling.  Must be called from the main thread."""
+        if self.running:
+            return
+        self._old_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, 1 / self.hz, 1 / self.hz)
+        self.running = True
+        if self.path is not None:
+            self._stop_writing.clear()
+            self._writer = threading.Thread(
+                target=self._write_periodically, name="profile-writer", daemon=True
+            )
+            self._writer.start()
+
+    def stop(self):
+        """Stop sampling and write out the samples taken."""
+        if not self.running:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._old_handler or signal.SIG_DFL)
+        self.running = False
+        if self._writer is not None:
+            self._stop_writing.set()
+            self._writer.join()
+            self._writer = None
+        if self.path is not None:
+            self.write()
+
+    def write(self, path=None):
+        """Write every sample taken so far as collapsed stacks.
+
+        The file is replaced atomically, so readers never see half of it.
+        This must not be called from the signal handler, which can interrupt
+        a write in progress.
+        """
+        path = path or self.path
+        # Copying a dict can't be interrupted by the signal handler, unlike
+        # iterating over it
+        samples = dict(self.samples)
+        with self._write_lock:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as profile_file:
+                write_collapsed(profile_file, samples)
+            os.replace(tmp_path, path)
+
+
+def write_collapsed(profile_file, samples):
+    """Write a `Counter` of collapsed stacks to `profile_file`."""
+    for stack, count in sorted(samples.items()):
+        profile_file.write(f"{stack} {count}\n")
+
+
+def read_collapsed(lines, samples=None):
+    """Add the collapsed stacks in `lines` to `samples`.
+
+    :param lines: an iterable of ``stack count`` lines.
+    :param samples: the :class:`collections.Counter` to add to.  A new one is
+                    created if not given.
+    :returns: `samples`
+    """
+    if samples is None:
+        samples = Counter()
+    for line in lines:
+        stack, _, count = line.strip().rpartition(" ")
+        if not stack or not count.isdigit():
+            continue
+        samples[stack] += int(count)
+    return samples
+
+
+def start_profiler(component, storm_conf):
+    """Start profiling `component` if its config asks for it.
+
+    :returns: a running :class:`SamplingProfiler`, or ``None`` if profiling is
+              disabled or not possible in this thread.
+    """
+    if not storm_conf.get("streamparse.profile.enabled", False):
+        return None
+    if threading.current_thread() is not threading.main_thread():
+        log.warning(
+            "Not profiling %s, because signal handlers can only be set in the "
+            "main thread.",
+            component.component_name,
+        )
+        return None
+    profile_dir = (
+        storm_conf.get("streamparse.profile.path")
+        or storm_conf.get("pystorm.log.path")
+        or tempfile.gettempdir()
+    )
+    os.makedirs(profile_dir, exist_ok=True)
+    file_name = (
+        f"streamparse_profile_{component.topology_name}_{component.component_name}"
+        f"_{component.task_id}_{component.pid}.folded"
+    )
+    profiler = SamplingProfiler(
+        os.path.join(profile_dir, file_name),
+        hz=storm_conf.get("streamparse.profile.hz", DEFAULT_HZ),
+        interval=storm_conf.get("streamparse.profile.interval", DEFAULT_INTERVAL),
+    )
+    profiler.start()
+    return profiler
@@ -0,0 +1,352 @@
+"""
+Run shell commands on many Storm workers at once.
+
+Commands are run over the system ``ssh`` client from a single asyncio event
+loop, rather than by forking a Fabric process for each host.  Connections to
+each host are shared with SSH's ``ControlMaster``, so only the first command
+sent to a host in a while pays for the SSH handshake.  Output is streamed as
+it arrives, a line at a time, prefixed with the host it came from.
+
+Fabric is still used when the environment has an ``ssh_password``, which the
+``ssh`` client cannot be given, when Fabric has a ``sudo_password`` to give
+``sudo``, or when ``remote_executor`` is set to ``"fabric"`` for it.
+"""
+
+import asyncio
+import os
+import shlex
+import sys
+
+from fabric.api import env
+
+from .util import SSH_CONTROL_PERSIST, get_ssh_control_dir, warn
+
+DEFAULT_CONCURRENCY = 10
+# What sudo -n says when it would have to ask for a password
+SUDO_PASSWORD_REQUIRED = "a password is required"
+# How many bytes to read or write at a time when copying files
+COPY_CHUNK_SIZE = 1 << 16
+# The longest line of output to read at once
+_LINE_LIMIT = 1 << 20
+
+
+class RemoteResult:
+    """The outcome of running a command on one host.
+
+    :ivar host: the host the command ran on.
+    :ivar output: everything the command wrote to stdout and stderr.
+    :ivar return_code: the exit status of the command, or ``None`` if it
+                       timed out.
+    :ivar timed_out: whether the command was killed for taking too long.
+    """
+
+    def __init__(self, host, output, return_code, timed_out=False):
+        self.host = host
+        self.output = output
+        self.return_code = return_code
+        self.timed_out = timed_out
+
+    @property
+    def succeeded(self):
+        return self.return_code == 0
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(host={self.host!r}, "
+            f"return_code={self.return_code!r}, timed_out={self.timed_out!r})"
+        )
+
+
+class SSHTransport:
+    """Starts commands on remote hosts with the system ``ssh`` client.
+
+    Host keys are not checked, and the SSH agent is forwarded, the same as
+    with Fabric.
+
+    :param user: who to log in as, or ``None`` to leave it to ``ssh``.
+    :param control_persist: how long, in seconds, to keep each connection
+                            open after its last command.
+    :param connect_timeout: how long, in seconds, to wait to connect.
+    """
+
+    def __init__(
+        self, user=None, control_persist=SSH_CONTROL_PERSIST, connect_timeout=10
+    ):
+        self.user = user
+        self.control_persist = control_persist
+        self.connect_timeout = connect_timeout
+
+    def get_command(self, host, command):
+        """Get the arguments to run `command` on `host` with ``ssh``."""
+        user_at_host = f"{self.user}@{host}" if self.user else host
+        return [
+            "ssh",
+            "-A",
+            "-o",
+            "BatchMode=yes",
+            "-o",
+            f"ConnectTimeout={self.connect_timeout}",
+            "-o",
+            "StrictHostKeyChecking=no",
+            "-o",
+            "UserKnownHostsFile=/dev/null",
+            "-o",
+            "LogLevel=ERROR",
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={os.path.join(get_ssh_control_dir(), '%C')}",
+            "-o",
+            f"ControlPersist={self.control_persist}",
+            user_at_host,
+            command,
+        ]
+
+    async def start(self, host, command, merge_stderr=True):
+        """Start running `command` on `host`.
+
+        :param merge_stderr: whether to read stderr along with stdout, or
+                             leave it going to our stderr.
+        :returns: an :class:`asyncio.subprocess.Process`.
+        """
+        return await asyncio.create_subprocess_exec(
+            *self.get_command(host, command),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT if merge_stderr else None,
+            limit=_LINE_LIMIT,
+        )
+
+
+class LocalTransport:
+    """Runs commands on this machine in place of each host, with the host in
+    the ``STREAMPARSE_HOST`` environment variable.
+
+    This is for testing, and for clusters whose workers all run here.
+    """
+
+    async def start(self, host, command, merge_stderr=True):
+        return await asyncio.create_subprocess_shell(
+            command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT if merge_stderr else None,
+            env=dict(os.environ, STREAMPARSE_HOST=host),
+            limit=_LINE_LIMIT,
+        )
+
+
+def as_user(command, user, login_user=None):
+    """Wrap `command` to run as `user`, like :func:`streamparse.util.run_cmd`.
+
+    Commands are run directly if `user` is who we log in as, and with
+    ``sudo`` (as root if `user` is ``None``) otherwise.  ``sudo`` must not
+    need a password, since there is no terminal to type it into, so it fails
+    instead of asking for one.
+    """
+    if user == login_user:
+        return command
+    user_flag = f"-u {shlex.quote(user)} " if user else ""
+    return f"sudo -n -H {user_flag}bash -c {shlex.quote(command)}"
+
+
+class RemoteExecutor:
+    """Runs a command on many hosts at once.
+
+    :param transport: what to start commands with.  Defaults to an
+                      :class:`SSHTransport`.
+    :param concurrency: the most hosts to run a command on at once.
+    :param timeout: how long, in seconds, to let a command run on each host
+                    before killing it, or ``None`` to wait forever.
+    :param output: where to stream output to.  Defaults to ``sys.stdout``.
+    """
+
+    def __init__(
+        self, transport=None, concurrency=DEFAULT_CONCURRENCY, timeout=None, output=None
+    ):
+        self.transport = transport or SSHTransport()
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.output = output
+
+    def _print(self, host, line):
+        output = self.output or sys.stdout
+        if not line.endswith("\n"):
+            line += "\n"
+        output.write(f"[{host}] {line}")
+        output.flush()
+
+    def run(self, hosts, command, input=None, input_path=None, stream=True):
+        """Run `command` on every one of `hosts`, and wait for them all.
+
+        :param command: a shell command, or a function that takes a host and
+                        returns the command for it.
+        :param input: `bytes` to send to each command's stdin.
+        :param input_path: the path of a file to send to each command's stdin.
+        :param stream: whether to print output as it arrives.
+        :returns: a `dict` mapping each host to its :class:`RemoteResult`.
+        """
+        return asyncio.run(
+            self.run_async(
+                hosts, command, input=input, input_path=input_path, stream=stream
+            )
+        )
+
+    async def run_async(self, hosts, command, input=None, input_path=None, stream=True):
+        """The coroutine behind :meth:`run`."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        hosts = list(hosts)
+        results = await asyncio.gather(
+            *(
+                self._run_host(semaphore, host, command, input, input_path, stream)
+                for host in hosts
+            )
+        )
+        return dict(zip(hosts, results))
+
+    async def _write_input(self, process, input, input_path):
+        try:
+            if input is not None:
+                process.stdin.write(input)
+                await process.stdin.drain()
+            elif input_path is not None:
+                with open(input_path, "rb") as input_file:
+                    for chunk in iter(lambda: input_file.read(COPY_CHUNK_SIZE), b""):
+                        process.stdin.write(chunk)
+                        await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # The command exited without reading everything, which its
+            # return code will say more about
+            pass
+        finally:
+            process.stdin.close()
+
+    async def _run_host(self, semaphore, host, command, input, input_path, stream):
+        if callable(command):
+            command = command(host)
+        async with semaphore:
+            process = await self.transport.start(host, command)
+            lines = []
+
+            async def communicate():
+                writer = asyncio.ensure_future(
+                    self._write_input(process, input, input_path)
+                )
+                try:
+                    while True:
+                        try:
+                            line = await process.stdout.readline()
+                        except ValueError:
+                            # Longer than _LINE_LIMIT, so take what there is
+                            line = await process.stdout.read(_LINE_LIMIT)
+                        if not line:
+                            break
+                        line = line.decode("utf-8", "replace")
+                        lines.append(line)
+                        if stream:
+                            self._print(host, line)
+                    await writer
+                finally:
+                    writer.cancel()
+                return await process.wait()
+
+            timed_out = False
+            try:
+                return_code = await asyncio.wait_for(communicate(), self.timeout)
+            except asyncio.TimeoutError:
+                return_code = None
+                timed_out = True
+                if stream:
+                    self._print(host, f"Timed out after {self.timeout} seconds.")
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+            return RemoteResult(host, "".join(lines), return_code, timed_out=timed_out)
+
+    def fetch(self, host, command, local_path):
+        """Run `command` on `host`, and write its stdout to `local_path`.
+
+        stderr is not captured, so the output can be binary, like a tarball.
+
+        :returns: the :class:`RemoteResult`, without any output.
+        """
+        return asyncio.run(self.fetch_async(host, command, local_path))
+
+    async def fetch_async(self, host, command, local_path):
+        """The coroutine behind :meth:`fetch`."""
+        process = await self.transport.start(host, command, merge_stderr=False)
+        process.stdin.close()
+
+        async def copy():
+            with open(local_path, "wb") as local_file:
+                while True:
+                    chunk = await process.stdout.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    local_file.write(chunk)
+            return await process.wait()
+
+        try:
+            return_code = await asyncio.wait_for(copy(), self.timeout)
+        except asyncio.TimeoutError:
+            return RemoteResult(host, "", None, timed_out=True)
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        return RemoteResult(host, "", return_code)
+
+
+def get_executor():
+    """Get a :class:`RemoteExecutor` for the hosts of the environment set up
+    by :func:`streamparse.util.activate_env`.
+
+    :returns: the executor, or ``None`` if Fabric should be used instead.
+    """
+    if (
+        env.get("remote_executor", "asyncio") == "fabric"
+        or env.get("password")
+        or env.get("sudo_password")
+    ):
+        return None
+    return RemoteExecutor(
+        SSHTransport(
+            user=env.get("user"),
+            control_persist=env.get("ssh_control_persist", SSH_CONTROL_PERSIST),
+        ),
+        concurrency=env.get("pool_size") or DEFAULT_CONCURRENCY,
+        timeout=env.get("remote_timeout"),
+    )
+
+
+def _describe_failures(results, action):
+    """Describe the hosts where `action` failed, or return ``None`` if it
+    succeeded everywhere.
+    """
+    failed = sorted(host for host, result in results.items() if not result.succeeded)
+    if not failed:
+        return None
+    message = f"Failed to {action} on: " + ", ".join(
+        f"{host} (timed out)" if results[host].timed_out else host for host in failed
+    )
+    if any(SUDO_PASSWORD_REQUIRED in results[host].output for host in failed):
+        message += (
+            ".  sudo needs a password there, which can only be typed in with "
+            'Fabric, so set "remote_executor" to "fabric" for this environment.'
+        )
+    return message
+
+
+def check_results(results, action):
+    """Raise a `RuntimeError` naming the hosts where `action` failed."""
+    message = _describe_failures(results, action)
+    if message is not None:
+        raise RuntimeError(message)
+
+
+def warn_about_results(results, action):
+    """Print a warning naming the hosts where `action` failed."""
+    message = _describe_failures(results, action)
+    if message is not None:
+        warn(message)
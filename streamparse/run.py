@@ -7,11 +7,42 @@ import importlib
 import os
 import sys
 
-from pystorm.component import _SERIALIZERS
+from .storm.serializers import _SERIALIZERS
 
 RESOURCES_PATH = "resources"
 
 
+def get_import_path(mod_name):
+    """Find the directory we need to add to ``sys.path`` to import `mod_name`.
+
+    Storm <= 1.0.2 runs components from the directory containing our code,
+    while Storm >= 1.0.3 runs them from its parent, so we check for a
+    ``resources`` directory containing the module first.
+    """
+    import_path = os.getcwd()  # Storm <= 1.0.2
+    if RESOURCES_PATH in next(os.walk(import_path))[1] and os.path.isfile(
+        os.path.join(
+            import_path, RESOURCES_PATH, mod_name.replace(".", os.path.sep) + ".py"
+        )
+    ):
+        import_path = os.path.join(import_path, RESOURCES_PATH)  # Storm >= 1.0.3
+    return import_path
+
+
+def load_component_class(target_class, import_path=None):
+    """Import and return the bolt/spout class given by its dotted path."""
+    mod_name, cls_name = target_class.rsplit(".", 1)
+    if import_path is None:
+        import_path = get_import_path(mod_name)
+    # Add current directory to sys.path so imports will work
+    if import_path not in sys.path:
+        sys.path.append(import_path)
+    # Import module
+    mod = importlib.import_module(mod_name)
+    # Get class from module
+    return getattr(mod, cls_name)
+
+
 def main():
     """main entry point for Python bolts and spouts"""
     parser = argparse.ArgumentParser(
@@ -29,24 +60,27 @@ def main():
         choices=_SERIALIZERS.keys(),
         default="json",
     )
+    parser.add_argument(
+        "-z",
+        "--zygote",
+        action="store_true",
+        help="Fork the component from a warm per-host worker process that "
+        "has already imported streamparse and the topology code, starting "
+        "one in the background if none is running yet.",
+    )
     # Storm sends everything as one string, which is not great
     if len(sys.argv) == 2:
         sys.argv = [sys.argv[0]] + sys.argv[1].split()
     args = parser.parse_args()
-    mod_name, cls_name = args.target_class.rsplit(".", 1)
-    # Add current directory to sys.path so imports will work
-    import_path = os.getcwd()  # Storm <= 1.0.2
-    if RESOURCES_PATH in next(os.walk(import_path))[1] and os.path.isfile(
-        os.path.join(
-            import_path, RESOURCES_PATH, mod_name.replace(".", os.path.sep) + ".py"
-        )
-    ):
-        import_path = os.path.join(import_path, RESOURCES_PATH)  # Storm >= 1.0.3
-    sys.path.append(import_path)
-    # Import module
-    mod = importlib.import_module(mod_name)
+    if args.zygote:
+        from .zygote import run_in_zygote
+
+        exit_code = run_in_zygote(args.target_class, args.serializer)
+        # None means no zygote was available, so fall back to a cold start
+        if exit_code is not None:
+            sys.exit(exit_code)
     # Get class from module and run it
-    cls = getattr(mod, cls_name)
+    cls = load_component_class(args.target_class)
     cls(serializer=args.serializer).run()
 
 
@@ -0,0 +1,749 @@
+"""
+Run a topology's Python components in-process, without Storm.
+
+:class:`TopologySimulator` plays the part of Storm for the Python spouts and
+bolts in a :class:`~streamparse.Topology`.  It speaks the JSON multi-lang
+protocol to each task, routes emitted Tuples according to each input's
+:class:`~streamparse.Grouping`, tracks the Tuple tree of every reliable spout
+Tuple so spouts get ``ack`` and ``fail`` just like on a cluster, and sends
+heartbeat and tick Tuples to bolts.
+
+Tasks run either as threads in the current process (``mode="thread"``, the
+default, which starts in milliseconds), or as ``streamparse_run`` subprocesses
+(``mode="process"``), which is closer to how Storm runs them.
+
+Only topologies made up entirely of Python components can be simulated, since
+there is no JVM to run the others.
+"""
+
+import io
+import itertools
+import logging
+import os
+import queue
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import defaultdict
+
+import simplejson as json
+from pystorm.exceptions import StormWentAwayError
+from pystorm.serializers.serializer import Serializer
+
+SIMULATOR_MODES = ("thread", "process")
+HEARTBEAT_SECS = 1
+# How long to wait before asking a spout for more Tuples when it emitted none
+SPOUT_WAIT_SECS = 0.001
+
+# Maps from the levels pystorm sends in "log" commands to Python levels
+_LOG_LEVELS = {
+    0: logging.DEBUG,
+    1: logging.DEBUG,
+    2: logging.INFO,
+    3: logging.WARNING,
+    4: logging.ERROR,
+}
+_GROUPING_KINDS = ("shuffle", "all", "direct", "none", "local_or_shuffle")
+# Put in a thread task's inbox to raise an exception from another of its threads
+_INTERRUPT = object()
+
+log = logging.getLogger(__name__)
+
+
+def _dumps(msg):
+    return json.dumps(msg, namedtuple_as_object=False)
+
+
+class _FrameParser:
+    """File-like object that splits multi-lang frames written to it into
+    messages and passes them to `callback`.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._buffer = ""
+
+    def write(self, data):
+        self._buffer += data
+        while True:
+            frame, sep, rest = self._buffer.partition("\nend\n")
+            if not sep:
+                break
+            self._buffer = rest
+            self.callback(json.loads(frame))
+
+    def flush(self):
+        pass
+
+
+class _SimulatedSerializer(Serializer):
+    """JSON serializer that reads from a queue instead of a stream.
+
+    :ivar interrupt_handler: the SIGUSR1 handler of the component, called
+                             when the queue has ``_INTERRUPT`` in it.
+    """
+
+    interrupt_handler = None
+
+    def read_message(self):
+        while True:
+            msg = self.input_stream.get()
+            if msg is None:
+                raise StormWentAwayError()
+            if msg is not _INTERRUPT:
+                return json.loads(msg)
+            # Raises the exception another thread of the component hit
+            self.interrupt_handler(signal.SIGUSR1, None)
+
+    def serialize_dict(self, msg_dict):
+        return f"{_dumps(msg_dict)}\nend\n"
+
+
+class _Root:
+    """A reliable spout Tuple, and the IDs of the Tuples in its tree that have
+    not been acked yet.
+    """
+
+    __slots__ = ("task", "msg_id", "start_time", "pending", "done")
+
+    def __init__(self, task, msg_id, start_time):
+        self.task = task
+        self.msg_id = msg_id
+        self.start_time = start_time
+        self.pending = set()
+        self.done = False
+
+
+class _Subscription:
+    """A bolt's subscription to one stream, and how Tuples are grouped."""
+
+    def __init__(self, kind, task_ids, field_indices=None):
+        self.kind = kind
+        self.task_ids = sorted(task_ids)
+        self.field_indices = field_indices
+        start = random.randrange(len(self.task_ids))
+        self._cycle = itertools.cycle(self.task_ids[start:] + self.task_ids[:start])
+
+    def choose(self, values):
+        """Return the IDs of the tasks a Tuple with `values` goes to."""
+        kind = self.kind
+        if kind == "fields":
+            key = _dumps([values[i] for i in self.field_indices])
+            index = zlib.crc32(key.encode("utf-8")) % len(self.task_ids)
+            return [self.task_ids[index]]
+        elif kind == "global":
+            return self.task_ids[:1]
+        elif kind == "all":
+            return self.task_ids
+        # shuffle, none, and local_or_shuffle all act like shuffle
+        return [next(self._cycle)]
+
+
+class _Task:
+    """One simulated task of a spout or bolt."""
+
+    def __init__(self, simulator, task_id, spec, conf, context):
+        self.simulator = simulator
+        self.task_id = task_id
+        self.spec = spec
+        self.component = spec.name
+        self.conf = conf
+        self.context = context
+        self.is_spout = not spec.inputs
+        self.ready = False
+        self.dead = False
+        # Spout commands that have not been answered with "sync" yet
+        self.outstanding = 0
+        # Reliable Tuples emitted by this spout that are not done yet
+        self.pending_roots = 0
+        self.emitted_since_next = 0
+        self.next_time = 0
+        self.next_tick_time = None
+
+    def on_message(self, msg):
+        self.simulator._events.put((self, msg))
+
+    def start(self, pid_dir):
+        raise NotImplementedError()
+
+    def send(self, msg):
+        raise NotImplementedError()
+
+    def stop(self):
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return f"{self.component}:{self.task_id}"
+
+
+class _ThreadTask(_Task):
+    """Task that runs its component in a thread of this process."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._inbox = queue.Queue()
+        # Components are created here, on the main thread, because some of
+        # them install signal handlers.  Those that hear about exceptions on
+        # their other threads with SIGUSR1 would replace each other's
+        # handler, so it is put back, and the simulator passes each SIGUSR1
+        # on to the task it was meant for through its inbox.
+        sigusr1_handler = signal.getsignal(signal.SIGUSR1)
+        self.instance = self.spec.component_cls(
+            input_stream=io.BytesIO(), output_stream=io.BytesIO(), rdb_signal=None
+        )
+        self.instance.serializer = _SimulatedSerializer(
+            self._inbox,
+            _FrameParser(self.on_message),
+            self.instance._reader_lock,
+            self.instance._writer_lock,
+        )
+        if signal.getsignal(signal.SIGUSR1) != sigusr1_handler:
+            self.instance.serializer.interrupt_handler = signal.getsignal(
+                signal.SIGUSR1
+            )
+            signal.signal(signal.SIGUSR1, sigusr1_handler or signal.SIG_DFL)
+        # The exception we last interrupted the component for
+        self._interrupted_for = None
+        self._thread = threading.Thread(
+            target=self._run, name=f"streamparse-simulator-{self!r}", daemon=True
+        )
+
+    def start(self, pid_dir):
+        self.send({"pidDir": pid_dir, "conf": self.conf, "context": self.context})
+        self._thread.start()
+
+    def send(self, msg):
+        self._inbox.put(_dumps(msg))
+
+    def stop(self):
+        self._inbox.put(None)
+        self._thread.join(timeout=5)
+
+    def interrupt(self):
+        """Raise the exception another thread of the component hit, if it has
+        one we have not raised yet, like its SIGUSR1 handler would.
+        """
+        if self.instance.serializer.interrupt_handler is None:
+            return
+        exc_info = getattr(self.instance, "exc_info", None)
+        if exc_info is not None and exc_info is not self._interrupted_for:
+            self._interrupted_for = exc_info
+            self._inbox.put(_INTERRUPT)
+
+    def _run(self):
+        """Does what ``Component.run`` does, but without exiting the process."""
+        component = self.instance
+        try:
+            storm_conf, context = component.read_handshake()
+            # Logging goes wherever it is configured to in this process, rather
+            # than through Storm or to pystorm log files, which would otherwise
+            # get a handler on the root logger for every task.
+            root_log = logging.getLogger()
+            handlers = list(root_log.handlers)
+            component._setup_component(storm_conf, context)
+            for handler in list(root_log.handlers):
+                if handler not in handlers:
+                    root_log.removeHandler(handler)
+            component.initialize(storm_conf, context)
+            while True:
+                try:
+                    component._run()
+                except StormWentAwayError:
+                    return
+                except Exception as e:
+                    component.logger.error(
+                        "Exception in %s.run()",
+                        component.__class__.__name__,
+                        exc_info=True,
+                    )
+                    try:
+                        component._handle_run_exception(e)
+                    except StormWentAwayError:
+                        return
+                    except Exception:
+                        log.exception("While trying to handle previous exception...")
+                    if component.exit_on_exception:
+                        self.on_message({"command": "__died", "msg": repr(e)})
+                        return
+        except StormWentAwayError:
+            pass
+        except Exception as e:
+            log.exception("%r failed to start", self)
+            self.on_message({"command": "__died", "msg": repr(e)})
+
+
+class _ProcessTask(_Task):
+    """Task that runs its component in a ``streamparse_run`` subprocess."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.process = None
+        self._stopping = False
+        self._writer_lock = threading.Lock()
+
+    def start(self, pid_dir):
+        cls = self.spec.component_cls
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(path or os.getcwd() for path in sys.path)
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "streamparse.run",
+                f"{cls.__module__}.{cls.__name__}",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env,
+            universal_newlines=True,
+            encoding="utf-8",
+        )
+        threading.Thread(
+            target=self._read_output,
+            name=f"streamparse-simulator-{self!r}",
+            daemon=True,
+        ).start()
+        self.send({"pidDir": pid_dir, "conf": self.conf, "context": self.context})
+
+    def send(self, msg):
+        with self._writer_lock:
+            try:
+                self.process.stdin.write(f"{_dumps(msg)}\nend\n")
+                self.process.stdin.flush()
+            except OSError:
+                # The reader notices the process is gone and reports it
+                pass
+
+    def stop(self):
+        self._stopping = True
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def _read_output(self):
+        parser = _FrameParser(self.on_message)
+        for line in self.process.stdout:
+            parser.write(line)
+        exit_code = self.process.wait()
+        if not self._stopping:
+            self.on_message(
+                {"command": "__died", "msg": f"Process exited with code {exit_code}"}
+            )
+
+
+class TopologySimulator:
+    """Runs the Python components of a topology without Storm.
+
+    :param topology_class: the :class:`~streamparse.Topology` subclass to run.
+    :param name: the name of the topology.  Defaults to the class name.
+    :param options: Storm options to use, which override the topology's
+                    ``config``.  ``topology.acker.executors`` (set it to 0 to
+                    disable acking), ``topology.message.timeout.secs``,
+                    ``topology.max.spout.pending``, and
+                    ``topology.tick.tuple.freq.secs`` are honored.
+    :param mode: ``"thread"`` to run every task in a thread of this process,
+                 or ``"process"`` to run each one in a ``streamparse_run``
+                 subprocess.
+    :param env_name: the environment to use for parallelism hints that are
+                     dicts.
+    :param record_emits: whether or not to keep every emitted Tuple's values in
+                         ``emitted``, for tests.
+
+    :ivar acked: the number of spout Tuples that were fully processed.
+    :ivar failed: the number of spout Tuples that failed or timed out.
+    :ivar errors: the messages of every error reported by a task.
+    :ivar metrics: a `dict` mapping from ``(component, metric name)`` pairs to
+                   lists of the values reported with ``report_metric``.
+    :ivar emitted: a `dict` mapping from ``(component, stream)`` pairs to
+                   lists of emitted values, if `record_emits` is set.
+    """
+
+    def __init__(
+        self,
+        topology_class,
+        name=None,
+        options=None,
+        mode="thread",
+        env_name=None,
+        record_emits=False,
+    ):
+        if mode not in SIMULATOR_MODES:
+            raise ValueError(
+                f"mode must be one of {SIMULATOR_MODES!r}.  Given: {mode!r}"
+            )
+        self.topology_class = topology_class
+        self.name = name or topology_class.__name__
+        self.mode = mode
+        self.record_emits = record_emits
+        self.conf = dict(topology_class.config)
+        self.conf.update(options or {})
+        self.conf["topology.name"] = self.name
+        self.acking = self.conf.get("topology.acker.executors") != 0
+        self.message_timeout = self.conf.get("topology.message.timeout.secs", 30)
+        self.max_spout_pending = self.conf.get("topology.max.spout.pending")
+
+        self.acked = 0
+        self.failed = 0
+        self.errors = []
+        self.metrics = defaultdict(list)
+        self.emitted = defaultdict(list)
+
+        self.tasks = {}
+        self._events = queue.Queue()
+        # (component, stream) -> list of _Subscription
+        self._subscriptions = defaultdict(list)
+        # (spout task ID, message ID) -> _Root, oldest first
+        self._roots = {}
+        # Tuple ID -> the _Roots whose trees it is in
+        self._tuple_roots = {}
+        self._tuple_ids = itertools.count(1)
+        self._running = False
+        self._died = None
+        self._pid_dir = None
+        self._previous_sigusr1_handler = None
+        self._build_tasks(env_name)
+
+    def _build_tasks(self, env_name):
+        specs = sorted(self.topology_class.specs, key=lambda spec: spec.name)
+        task_ids = {}
+        next_task_id = 1
+        for spec in specs:
+            shell = spec.component_object.shell
+            if shell is None or shell.execution_command != "streamparse_run":
+                raise ValueError(
+                    f"Only Python components can be simulated, but {spec.name!r} "
+                    f"is a {spec.component_cls.__name__}."
+                )
+            par = spec.par
+            if isinstance(par, dict):
+                par = par.get(env_name)
+                if par is None:
+                    raise ValueError(
+                        f"No parallelism hint for {spec.name!r} in environment "
+                        f"{env_name!r}."
+                    )
+            task_ids[spec.name] = list(range(next_task_id, next_task_id + par))
+            next_task_id += par
+
+        task_to_component = {
+            str(task_id): component
+            for component, ids in task_ids.items()
+            for task_id in ids
+        }
+        specs_by_name = {spec.name: spec for spec in specs}
+        task_cls = _ThreadTask if self.mode == "thread" else _ProcessTask
+        for spec in specs:
+            source_stream_fields = defaultdict(dict)
+            for stream_id, grouping in spec.inputs.items():
+                source, stream = stream_id.componentId, stream_id.streamId
+                fields = specs_by_name[source].outputs[stream].output_fields
+                source_stream_fields[source][stream] = fields
+                self._subscriptions[(source, stream)].append(
+                    self._make_subscription(grouping, task_ids[spec.name], fields)
+                )
+            conf = dict(self.conf)
+            conf.update(json.loads(spec.config))
+            for task_id in task_ids[spec.name]:
+                context = {
+                    "taskid": task_id,
+                    "componentid": spec.name,
+                    "task->component": task_to_component,
+                    "source->stream->fields": source_stream_fields,
+                }
+                self.tasks[task_id] = task_cls(self, task_id, spec, conf, context)
+
+    @staticmethod
+    def _make_subscription(grouping, task_ids, fields):
+        if grouping.fields is not None:
+            if not grouping.fields:
+                return _Subscription("global", task_ids)
+            return _Subscription(
+                "fields",
+                task_ids,
+                field_indices=[fields.index(field) for field in grouping.fields],
+            )
+        for kind in _GROUPING_KINDS:
+            if getattr(grouping, kind) is not None:
+                return _Subscription(kind, task_ids)
+        raise ValueError(f"Custom groupings cannot be simulated.  Given: {grouping!r}")
+
+    def start(self):
+        """Start every task.  ``run`` calls this for you."""
+        self._pid_dir = tempfile.mkdtemp(prefix="streamparse_simulator_")
+        self._running = True
+        if any(
+            isinstance(task, _ThreadTask)
+            and task.instance.serializer.interrupt_handler is not None
+            for task in self.tasks.values()
+        ):
+            # Those tasks send SIGUSR1 to this process when their other
+            # threads hit an exception
+            self._previous_sigusr1_handler = signal.signal(
+                signal.SIGUSR1, self._interrupt_tasks
+            )
+        now = time.monotonic()
+        for task in self.tasks.values():
+            freq = task.conf.get("topology.tick.tuple.freq.secs")
+            if freq and not task.is_spout:
+                task.next_tick_time = now + freq
+            task.start(self._pid_dir)
+        self._next_heartbeat_time = now + HEARTBEAT_SECS
+
+    def stop(self):
+        """Stop every task."""
+        self._running = False
+        for task in self.tasks.values():
+            task.stop()
+        if self._previous_sigusr1_handler is not None:
+            signal.signal(signal.SIGUSR1, self._previous_sigusr1_handler)
+            self._previous_sigusr1_handler = None
+        if self._pid_dir is not None:
+            shutil.rmtree(self._pid_dir, ignore_errors=True)
+            self._pid_dir = None
+
+    def _interrupt_tasks(self, signum, frame):
+        """Pass a SIGUSR1 on to every task with an exception to raise, since
+        signals do not say who sent them.
+        """
+        for task in self.tasks.values():
+            task.interrupt()
+
+    def run(self, secs=None, until=None):
+        """Run the topology until `secs` seconds pass, `until` returns
+        ``True``, or a task dies.
+
+        :param secs: how long to run for.  ``None`` means forever.
+        :param until: a callable that is passed this simulator after every
+                      message, and returns ``True`` when it should stop.
+
+        :raises RuntimeError: if a task died while running.
+        """
+        deadline = None if secs is None else time.monotonic() + secs
+        self.start()
+        try:
+            while self._running:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    break
+                self._handle_timers(now)
+                try:
+                    task, msg = self._events.get(timeout=self._wait_secs(now))
+                except queue.Empty:
+                    continue
+                self._handle_message(task, msg)
+                if until is not None and until(self):
+                    break
+        finally:
+            self.stop()
+        if self._died is not None:
+            raise RuntimeError(self._died)
+
+    def _wait_secs(self, now):
+        """How long to wait for a message before timers need handling."""
+        wait = self._next_heartbeat_time - now
+        for task in self.tasks.values():
+            if task.is_spout and self._wants_next(task):
+                wait = min(wait, task.next_time - now)
+            elif task.next_tick_time is not None:
+                wait = min(wait, task.next_tick_time - now)
+        return max(wait, 0)
+
+    def _wants_next(self, task):
+        """Whether or not spout `task` should be asked for more Tuples."""
+        return (
+            task.ready
+            and not task.outstanding
+            and (
+                self.max_spout_pending is None
+                or task.pending_roots < self.max_spout_pending
+            )
+        )
+
+    def _handle_timers(self, now):
+        heartbeat = now >= self._next_heartbeat_time
+        if heartbeat:
+            self._next_heartbeat_time = now + HEARTBEAT_SECS
+            self._time_out_roots(now)
+        for task in self.tasks.values():
+            if not task.ready:
+                continue
+            if task.is_spout:
+                if self._wants_next(task) and now >= task.next_time:
+                    task.emitted_since_next = 0
+                    self._send_spout_command(task, {"command": "next"})
+                continue
+            if heartbeat:
+                task.send(
+                    {
+                        "id": "-1",
+                        "comp": None,
+                        "stream": "__heartbeat",
+                        "task": -1,
+                        "tuple": [],
+                    }
+                )
+            if task.next_tick_time is not None and now >= task.next_tick_time:
+                freq = task.conf["topology.tick.tuple.freq.secs"]
+                task.next_tick_time = now + freq
+                task.send(
+                    {
+                        "id": str(next(self._tuple_ids)),
+                        "comp": "__system",
+                        "stream": "__tick",
+                        "task": -1,
+                        "tuple": [freq],
+                    }
+                )
+
+    def _send_spout_command(self, task, msg):
+        task.outstanding += 1
+        task.send(msg)
+
+    def _handle_message(self, task, msg):
+        if "pid" in msg:
+            task.ready = True
+            return
+        command = msg.get("command")
+        if command == "emit":
+            self._handle_emit(task, msg)
+        elif command == "ack":
+            self._handle_ack(msg["id"])
+        elif command == "fail":
+            self._handle_fail(msg["id"])
+        elif command == "sync":
+            if task.is_spout and task.outstanding:
+                task.outstanding -= 1
+                if not task.emitted_since_next:
+                    task.next_time = time.monotonic() + SPOUT_WAIT_SECS
+        elif command == "log":
+            logging.getLogger(f"{__name__}.{task.component}").log(
+                _LOG_LEVELS.get(msg.get("level"), logging.INFO), msg["msg"]
+            )
+        elif command == "error":
+            log.error("%r reported an error: %s", task, msg["msg"])
+            self.errors.append(msg["msg"])
+        elif command == "metrics":
+            self.metrics[(task.component, msg["name"])].append(msg["params"])
+        elif command == "__died":
+            task.dead = True
+            self._died = f"{task!r} died: {msg['msg']}"
+            self.errors.append(self._died)
+            self._running = False
+        else:
+            log.error("%r sent an unknown message: %r", task, msg)
+
+    def _route(self, task, stream, values, direct_task):
+        """Return the IDs of the tasks an emitted Tuple goes to."""
+        targets = []
+        for subscription in self._subscriptions.get((task.component, stream), ()):
+            if direct_task is not None:
+                if (
+                    subscription.kind == "direct"
+                    and direct_task in subscription.task_ids
+                ):
+                    targets.append(direct_task)
+            elif subscription.kind != "direct":
+                targets.extend(subscription.choose(values))
+        return targets
+
+    def _handle_emit(self, task, msg):
+        stream = msg.get("stream", "default")
+        values = msg["tuple"]
+        direct_task = msg.get("task")
+        targets = self._route(task, stream, values, direct_task)
+        if direct_task is None and msg.get("need_task_ids", True):
+            task.send(targets)
+        if self.record_emits:
+            self.emitted[(task.component, stream)].append(values)
+
+        roots = ()
+        spout_root = None
+        if task.is_spout:
+            task.emitted_since_next += 1
+            msg_id = msg.get("id")
+            if msg_id is not None:
+                if self.acking:
+                    spout_root = _Root(task, msg_id, time.monotonic())
+                    roots = (spout_root,)
+                else:
+                    self.acked += 1
+                    self._send_spout_command(task, {"command": "ack", "id": msg_id})
+        else:
+            anchored = set()
+            for anchor in msg.get("anchors", ()):
+                anchored.update(self._tuple_roots.get(anchor, ()))
+            roots = tuple(root for root in anchored if not root.done)
+
+        for target in targets:
+            tup_id = str(next(self._tuple_ids))
+            if roots:
+                self._tuple_roots[tup_id] = roots
+                for root in roots:
+                    root.pending.add(tup_id)
+            self.tasks[target].send(
+                {
+                    "id": tup_id,
+                    "comp": task.component,
+                    "stream": stream,
+                    "task": task.task_id,
+                    "tuple": values,
+                }
+            )
+
+        if spout_root is not None:
+            if spout_root.pending:
+                self._roots[(task.task_id, spout_root.msg_id)] = spout_root
+                task.pending_roots += 1
+            else:
+                # Nothing subscribes to this stream, so it is done already
+                self.acked += 1
+                self._send_spout_command(task, {"command": "ack", "id": msg_id})
+
+    def _finish_root(self, root, command):
+        root.done = True
+        del self._roots[(root.task.task_id, root.msg_id)]
+        root.task.pending_roots -= 1
+        if command == "ack":
+            self.acked += 1
+        else:
+            self.failed += 1
+        for tup_id in root.pending:
+            roots = self._tuple_roots.pop(tup_id, ())
+            roots = tuple(other for other in roots if other is not root)
+            if roots:
+                self._tuple_roots[tup_id] = roots
+        self._send_spout_command(root.task, {"command": command, "id": root.msg_id})
+
+    def _handle_ack(self, tup_id):
+        for root in self._tuple_roots.pop(tup_id, ()):
+            if not root.done:
+                root.pending.discard(tup_id)
+                if not root.pending:
+                    self._finish_root(root, "ack")
+
+    def _handle_fail(self, tup_id):
+        for root in self._tuple_roots.pop(tup_id, ()):
+            if not root.done:
+                self._finish_root(root, "fail")
+
+    def _time_out_roots(self, now):
+        expired = []
+        for root in self._roots.values():
+            if now - root.start_time < self.message_timeout:
+                # Roots are in the order they were emitted
+                break
+            expired.append(root)
+        for root in expired:
+            self._finish_root(root, "fail")
@@ -4,6 +4,16 @@ Package that adds streamparse-specific addition to pystorm classes
 
 from pystorm import Tuple
 
-from .bolt import BatchingBolt, Bolt, JavaBolt, ShellBolt, TicklessBatchingBolt
+from .bolt import (
+    AdaptiveBatchController,
+    AsyncBolt,
+    BatchingBolt,
+    Bolt,
+    JavaBolt,
+    ShellBolt,
+    TicklessBatchingBolt,
+)
 from .component import Component, StormHandler
+from .serializers import FramedMsgpackSerializer
 from .spout import JavaSpout, ShellSpout, ReliableSpout, Spout
+from .windowed import WindowedBolt
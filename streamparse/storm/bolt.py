@@ -1,11 +1,117 @@
 """
 Module to add streamparse-specific extensions to pystorm Bolt classes
 """
+import asyncio
+import mmap
+import multiprocessing
+import os
+import pickle
+import signal
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import defaultdict, deque
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import ContextVar
 
 import pystorm
+from pystorm.component import Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from ..dsl.bolt import JavaBoltSpec, ShellBoltSpec
 from .component import Component
+from .state import open_state_store
+
+POOL_KINDS = ("thread", "process")
+
+# The _PoolTask a Bolt.process call on a thread or process pool is handling
+_current_pool_task = ContextVar("streamparse_current_pool_task", default=None)
+# The Bolt a process pool was forked from, which its workers call process on
+_pool_bolt = None
+
+
+class _PoolTask:
+    """A Tuple being processed on a pool, and the messages it sent."""
+
+    __slots__ = ("tup", "messages")
+
+    def __init__(self, tup):
+        self.tup = tup
+        self.messages = []
+
+
+def _tuple_to_record(tup):
+    """Convert a Tuple into a plain `tuple` that can be pickled.
+
+    Tuple values are instances of namedtuple classes created at runtime, so
+    they cannot be pickled themselves.  Use ``_restore_tuple`` to convert them
+    back.
+    """
+    return (tup.id, tup.component, tup.stream, tup.task, tuple(tup.values))
+
+
+def _restore_tuple(bolt, record):
+    """Convert a record made by ``_tuple_to_record`` back into a Tuple."""
+    tup_id, source, stream, task, values = record
+    val_type = bolt._source_tuple_types[source].get(stream)
+    return Tuple(
+        tup_id, source, stream, task, values if val_type is None else val_type(*values)
+    )
+
+
+def _run_pool_task(bolt, tup):
+    """Call ``bolt.process`` and return the messages it tried to send."""
+    pool_task = _PoolTask(tup)
+    token = _current_pool_task.set(pool_task)
+    try:
+        bolt.process(tup)
+    finally:
+        _current_pool_task.reset(token)
+    return pool_task.messages
+
+
+def _run_process_pool_task(record):
+    return _run_pool_task(_pool_bolt, _restore_tuple(_pool_bolt, record))
+
+
+def _send_pool_worker_message(msg_dict):
+    """Replacement for ``Serializer.send_message`` in process pool workers.
+
+    Only the parent process may talk to Storm, so messages like logs are
+    passed back to it along with the result of ``process``.
+    """
+    pool_task = _current_pool_task.get()
+    if pool_task is not None:
+        pool_task.messages.append(msg_dict)
+
+
+def _buffer_pool_messages(send_message):
+    """Wrap ``Serializer.send_message`` for Bolts with a thread pool.
+
+    Messages sent from ``process`` on the pool, like logs, are passed back to
+    the main thread along with the result of ``process``, so they reach Storm
+    in order with its emits and acks.
+    """
+
+    def _send_message(msg_dict):
+        pool_task = _current_pool_task.get()
+        if pool_task is None:
+            send_message(msg_dict)
+        else:
+            pool_task.messages.append(msg_dict)
+
+    return _send_message
+
+
+def _init_process_pool_worker():
+    _pool_bolt.serializer.send_message = _send_pool_worker_message
 
 
 class JavaBolt(Component):
@@ -146,10 +252,64 @@ class ShellBolt(Component):
 
 
 class Bolt(pystorm.bolt.Bolt, ShellBolt):
-    """pystorm Bolt with streamparse-specific additions"""
+    """pystorm Bolt with streamparse-specific additions
+
+    :ivar pool: Set to ``"thread"`` or ``"process"`` to call ``process`` on a
+                pool of threads or processes inside this one Python process,
+                so a CPU-heavy Bolt can use several cores without raising
+                ``par``.  Emits, acks, fails, and logs made inside
+                ``process`` are sent to Storm from the main thread, in the
+                order the Tuples were received, once ``process`` returns.  Processes are forked from the Bolt
+                after ``initialize``, so they get a copy of its state but
+                changes they make to it are not seen by the Bolt.  Default is
+                ``None``, which calls ``process`` on the main thread.
+
+                .. note::
+                    Finished Tuples are sent to Storm the next time the Bolt
+                    hears from it, which Storm heartbeats ensure is at least
+                    once a second.
+
+    :ivar pool_size: The number of threads or processes in the pool. Defaults
+                     to the number of CPUs.
+    :ivar state_backend: Set to ``"memory"``, ``"sqlite"``, or ``"lmdb"`` to
+                         get a :class:`~streamparse.storm.state.StateStore` as
+                         ``self.state``, for keyed state that outlives
+                         restarts of this task (on the same machine).  State
+                         is snapshotted to the backend every
+                         ``state_snapshot_ticks`` tick Tuples, so you should
+                         set ``topology.tick.tuple.freq.secs`` too. Default is
+                         ``None``, which leaves ``self.state`` as ``None``.
+    :ivar state_dir: The directory to keep state in. Defaults to
+                     ``streamparse_state/<topology name>`` in Storm's
+                     ``storm.local.dir``.
+    :ivar state_cache_size: The maximum number of keys of state to keep in
+                            memory. Default is ``10000``.
+    :ivar state_snapshot_ticks: The number of tick Tuples between state
+                                snapshots. Default is ``1``.
+
+    Each of the ``pool`` and ``state`` attributes can also be set in the
+    component's config as ``streamparse.bolt.<attribute>``.
+    """
+
+    pool = None
+    pool_size = None
+    state_backend = None
+    state_dir = None
+    state_cache_size = 10000
+    state_snapshot_ticks = 1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+        # (Tuple, Future) pairs, in the order the Tuples were received
+        self._pool_pending = deque()
+        self.state = None
+        self._ticks_since_snapshot = 0
 
     @classmethod
-    def spec(cls, name=None, inputs=None, par=None, config=None):
+    def spec(
+        cls, name=None, inputs=None, par=None, config=None, pool=None, pool_size=None
+    ):
         """Create a :class:`~ShellBoltSpec` for a Python Bolt.
 
         This spec represents this Bolt in a :class:`~streamparse.Topology`.
@@ -184,11 +344,41 @@ class Bolt(pystorm.bolt.Bolt, ShellBolt):
                            :class:`~Bolt` subclass.
 
         :type config:  `dict`
+        :param pool:   ``"thread"`` or ``"process"`` to call ``process`` on a
+                       pool.  Stored in ``config`` as
+                       ``streamparse.bolt.pool``.
+
+                       .. note::
+                           This can also be specified as an attribute of your
+                           :class:`~Bolt` subclass.
+
+        :type pool:    `str`
+        :param pool_size: The number of threads or processes in the pool.
+                          Stored in ``config`` as
+                          ``streamparse.bolt.pool_size``.
+
+                          .. note::
+                              This can also be specified as an attribute of
+                              your :class:`~Bolt` subclass.
+
+        :type pool_size: `int`
 
         .. note::
             This method does not take a ``outputs`` argument because
             ``outputs`` should be an attribute of your :class:`~Bolt` subclass.
         """
+        if pool is not None or pool_size is not None:
+            if pool is not None and pool not in POOL_KINDS:
+                raise ValueError(
+                    f"pool must be one of {POOL_KINDS!r} or None.  Given: {pool!r}"
+                )
+            if config is None:
+                config = cls.config
+            config = dict(config or {})
+            if pool is not None:
+                config["streamparse.bolt.pool"] = pool
+            if pool_size is not None:
+                config["streamparse.bolt.pool_size"] = pool_size
         return ShellBoltSpec(
             cls,
             command="streamparse_run",
@@ -200,14 +390,976 @@ class Bolt(pystorm.bolt.Bolt, ShellBolt):
             outputs=cls.outputs,
         )
 
+    def emit_many(self, tups, stream=None, anchors=None, direct_task=None):
+        """Emit several new Tuples to a stream with a single write.
+
+        :param tups: the Tuple payloads to send to Storm.
+        :type tups: `list` of `list` or `tuple`
+        :param stream: the ID of the stream to emit these Tuples to. Specify
+                       ``None`` to emit to default stream.
+        :type stream: str
+        :param anchors: IDs the Tuples (or :class:`streamparse.Tuple`
+                        instances) which the emitted Tuples should be anchored
+                        to. If ``auto_anchor`` is set to ``True`` and
+                        you have not specified ``anchors``, ``anchors`` will be
+                        set to the incoming/most recent Tuple ID(s).
+        :type anchors: list
+        :param direct_task: the task to send the Tuples to.
+        :type direct_task: int
+        """
+        pool_task = _current_pool_task.get()
+        if anchors is None:
+            if not self.auto_anchor:
+                anchors = []
+            elif pool_task is not None:
+                anchors = [pool_task.tup]
+            else:
+                anchors = self._current_tups
+        anchors = [a.id if isinstance(a, Tuple) else a for a in anchors]
+        if pool_task is not None:
+            pool_task.messages.extend(
+                self._make_emit_messages(
+                    tups, stream=stream, anchors=anchors, direct_task=direct_task
+                )
+            )
+        else:
+            super().emit_many(
+                tups, stream=stream, anchors=anchors, direct_task=direct_task
+            )
+
+    def emit(
+        self, tup, stream=None, anchors=None, direct_task=None, need_task_ids=False
+    ):
+        """Emit a new Tuple to a stream.
+
+        See :meth:`pystorm.bolt.Bolt.emit` for details.  When called from
+        ``process`` running on a ``pool``, the emit is sent once ``process``
+        returns, and task IDs are never returned.
+        """
+        if _current_pool_task.get() is not None:
+            return self.emit_many(
+                [tup], stream=stream, anchors=anchors, direct_task=direct_task
+            )
+        return super().emit(
+            tup,
+            stream=stream,
+            anchors=anchors,
+            direct_task=direct_task,
+            need_task_ids=need_task_ids,
+        )
+
+    def send_message(self, message):
+        """Send a message to Storm via stdout.
+
+        When called from ``process`` running on a ``pool``, the message is
+        sent once ``process`` returns, after the emits made before it.
+        """
+        pool_task = _current_pool_task.get()
+        if pool_task is not None:
+            pool_task.messages.append(message)
+        else:
+            super().send_message(message)
+
+    def _setup_component(self, storm_conf, context):
+        super()._setup_component(storm_conf, context)
+        for attr in (
+            "pool",
+            "pool_size",
+            "state_backend",
+            "state_dir",
+            "state_cache_size",
+            "state_snapshot_ticks",
+        ):
+            setattr(
+                self,
+                attr,
+                storm_conf.get(f"streamparse.bolt.{attr}", getattr(self, attr)),
+            )
+        if self.state_backend is not None:
+            self.state = self._open_state(storm_conf)
+
+    def _open_state(self, storm_conf):
+        """Open the state store for this task."""
+        state_dir = self.state_dir
+        if state_dir is None:
+            state_dir = os.path.join(
+                storm_conf.get("storm.local.dir") or tempfile.gettempdir(),
+                "streamparse_state",
+                self.topology_name or "",
+            )
+        path = None
+        if self.state_backend != "memory":
+            path = os.path.join(
+                state_dir,
+                f"{self.component_name}-{self.task_id}.{self.state_backend}",
+            )
+        return open_state_store(
+            self.state_backend, path=path, cache_size=self.state_cache_size
+        )
+
+    def read_tuple(self):
+        """Read a tuple from the pipe to Storm, snapshotting state on ticks."""
+        tup = super().read_tuple()
+        if self.state is not None and self.is_tick(tup):
+            self._ticks_since_snapshot += 1
+            if self._ticks_since_snapshot >= self.state_snapshot_ticks:
+                self.state.snapshot()
+                self._ticks_since_snapshot = 0
+        return tup
+
+    @property
+    def pending_tuples(self):
+        """The number of Tuples being processed on the pool."""
+        return len(self._pool_pending)
+
+    def _get_pool(self):
+        """Create the pool to run ``process`` on, if we have not already."""
+        if self._pool is None:
+            if self.pool not in POOL_KINDS:
+                raise ValueError(
+                    f"pool must be one of {POOL_KINDS!r} or None.  "
+                    f"Given: {self.pool!r}"
+                )
+            pool_size = self.pool_size or os.cpu_count() or 1
+            if self.pool == "thread":
+                self._pool = ThreadPoolExecutor(
+                    max_workers=pool_size,
+                    thread_name_prefix=f"{self.__class__.__name__}:pool",
+                )
+                # Loggers send straight through the serializer
+                self.serializer.send_message = _buffer_pool_messages(
+                    self.serializer.send_message
+                )
+            else:
+                global _pool_bolt
+                _pool_bolt = self
+                # Workers must be forked so they inherit this Bolt
+                self._pool = ProcessPoolExecutor(
+                    max_workers=pool_size,
+                    mp_context=multiprocessing.get_context("fork"),
+                    initializer=_init_process_pool_worker,
+                )
+            self._pool_max_pending = 2 * pool_size
+        return self._pool
+
+    def _submit_to_pool(self, tup):
+        """Start processing `tup` on the pool."""
+        pool = self._get_pool()
+        if self.pool == "thread":
+            future = pool.submit(_run_pool_task, self, tup)
+        else:
+            future = pool.submit(_run_process_pool_task, _tuple_to_record(tup))
+        self._pool_pending.append((tup, future))
+        # Wait only once tup is pending, so that if an earlier Tuple's
+        # exception is raised here, tup is still acked or failed later
+        if len(self._pool_pending) > self._pool_max_pending:
+            self._drain_pool(block=True)
+
+    def _drain_pool(self, block=False):
+        """Send emits and acks for Tuples the pool has finished, in order.
+
+        :param block: Wait for the oldest pending Tuple to finish first.
+        """
+        pending = self._pool_pending
+        while pending and (block or pending[0][1].done()):
+            block = False
+            tup, future = pending.popleft()
+            # Set so that an exception from process fails the right Tuple
+            self._current_tups = [tup]
+            messages = future.result()
+            if self.auto_ack:
+                messages.append({"command": "ack", "id": tup.id})
+            self.send_messages(messages)
+            self._current_tups = []
+
+    def _run(self):
+        """The inside of ``run``'s infinite loop.
+
+        Separated out so it can be properly unit tested.
+        """
+        if self.pool is None:
+            return super()._run()
+        tup = self.read_tuple()
+        self._current_tups = [tup]
+        if self.is_heartbeat(tup):
+            self.send_message({"command": "sync"})
+        elif self.is_tick(tup):
+            self.process_tick(tup)
+            if self.auto_ack:
+                self.ack(tup)
+        else:
+            self._submit_to_pool(tup)
+        self._current_tups = []
+        self._drain_pool()
+
+    def _handle_run_exception(self, exc):
+        """Process an exception encountered while running the ``run()`` loop.
+
+        Called right before program exits.
+        """
+        super()._handle_run_exception(exc)
+        if self.auto_fail and self.exit_on_exception:
+            # Fail Tuples still on the pool so Storm can replay them right away
+            while self._pool_pending:
+                tup, _ = self._pool_pending.popleft()
+                self.fail(tup)
+
+
+def _to_column(values):
+    """Convert a sequence of field values into the best available array type.
+
+    Uses NumPy when it is installed.  Otherwise, all-``int`` and all-``float``
+    columns become :class:`array.array` instances, and anything else is left as
+    a `list`.
+    """
+    if np is not None:
+        try:
+            column = np.asarray(values)
+        except (OverflowError, ValueError):
+            column = None
+        # NumPy will happily turn [1, "a"] into an array of strings
+        if column is None or (
+            column.dtype.kind in "SU"
+            and not all(value.__class__ is str for value in values)
+        ):
+            column = np.empty(len(values), dtype=object)
+            column[:] = values
+        return column
+    value_types = set(map(type, values))
+    if value_types == {int}:
+        try:
+            return array("q", values)
+        except OverflowError:
+            pass
+    elif value_types == {float}:
+        return array("d", values)
+    return list(values)
+
+
+def _estimate_tuple_size(tup):
+    """Roughly estimate how many bytes of memory a Tuple's values use."""
+    values = tup.values
+    return sys.getsizeof(values) + sum(map(sys.getsizeof, values))
+
 
 class BatchingBolt(pystorm.bolt.BatchingBolt, Bolt):
-    """pystorm BatchingBolt with streamparse-specific additions"""
+    """pystorm BatchingBolt with streamparse-specific additions
 
-    pass
+    Instead of implementing ``process_batch``, you can implement
+    ``process_columns`` to receive each batch as one array per field.
+
+    :ivar max_batch_memory: The approximate number of bytes of Tuple values
+                            to keep in memory across all pending batches.
+                            Once this is exceeded, the largest batches are
+                            appended to a temporary spill file until half of
+                            this is used, and are read back (via ``mmap``)
+                            when they are processed. Default is ``None``,
+                            which never spills.
+    :ivar spill_dir: The directory to create the spill file in. Defaults to
+                     the system temporary directory.
+    :ivar spilled_bytes: The total number of bytes written to the spill file.
+    :ivar spilled_tuples: The total number of Tuples written to the spill file.
+    :ivar spill_count: The number of times batches have been spilled.  These
+                       three are also counted in :attr:`metrics` under the
+                       same names.
+
+    **Example**:
+
+    .. code-block:: python
+
+        from collections import Counter
+
+        from streamparse import BatchingBolt
+
+        class WordCounterBolt(BatchingBolt):
+
+            def process_columns(self, key, columns):
+                for word, count in Counter(columns["word"]).items():
+                    self.emit([word, count])
+    """
+
+    max_batch_memory = None
+    spill_dir = None
+
+    def __init__(self, *args, **kwargs):
+        # Approximate bytes used by each in-memory batch, by group key
+        self._batch_memory = defaultdict(int)
+        self._total_batch_memory = 0
+        self._spill_file = None
+        # (offset, length) of each chunk of each spilled batch, by group key
+        self._spilled = defaultdict(list)
+        self._spilled_pending = 0
+        self.spilled_bytes = 0
+        self.spilled_tuples = 0
+        self.spill_count = 0
+        super().__init__(*args, **kwargs)
+        self._spilled_bytes_counter = self.metrics.counter("spilled_bytes")
+        self._spilled_tuples_counter = self.metrics.counter("spilled_tuples")
+        self._spill_count_counter = self.metrics.counter("spill_count")
+
+    def process(self, tup):
+        """Group non-tick Tuples into batches by ``group_key``.
+
+        .. warning::
+            This method should **not** be overriden.  If you want to tweak
+            how Tuples are grouped into batches, override ``group_key``.
+        """
+        group_key = self.group_key(tup)
+        self._batches[group_key].append(tup)
+        if self.max_batch_memory is not None:
+            size = _estimate_tuple_size(tup)
+            self._batch_memory[group_key] += size
+            self._total_batch_memory += size
+            if self._total_batch_memory > self.max_batch_memory:
+                self._spill_batches()
+
+    @property
+    def pending_tuples(self):
+        """The number of Tuples in batches, including spilled ones."""
+        in_memory = sum(len(batch) for batch in self._batches.values())
+        return in_memory + self._spilled_pending
+
+    def _spill_batches(self):
+        """Spill the largest batches until we are using half our memory."""
+        target = self.max_batch_memory // 2
+        largest_first = sorted(
+            self._batch_memory, key=self._batch_memory.__getitem__, reverse=True
+        )
+        spilled = False
+        for key in largest_first:
+            if self._total_batch_memory <= target:
+                break
+            spilled |= self._spill_batch(key)
+        if spilled:
+            self.spill_count += 1
+            self._spill_count_counter.inc()
+
+    def _spill_batch(self, key):
+        """Append the in-memory part of the batch for `key` to the spill file.
+
+        :returns: whether anything was written.
+        """
+        batch = self._batches.pop(key, [])
+        self._total_batch_memory -= self._batch_memory.pop(key, 0)
+        if not batch:
+            return False
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(
+                prefix="streamparse_spill_", dir=self.spill_dir
+            )
+        data = pickle.dumps(
+            [_tuple_to_record(tup) for tup in batch], protocol=pickle.HIGHEST_PROTOCOL
+        )
+        offset = self._spill_file.seek(0, os.SEEK_END)
+        self._spill_file.write(data)
+        self._spilled[key].append((offset, len(data)))
+        self.spilled_bytes += len(data)
+        self.spilled_tuples += len(batch)
+        self._spilled_bytes_counter.inc(len(data))
+        self._spilled_tuples_counter.inc(len(batch))
+        self._spilled_pending += len(batch)
+        return True
+
+    def _read_spilled(self, key, spill_map):
+        """Remove the spilled part of the batch for `key` and return it."""
+        tups = []
+        for offset, length in self._spilled.pop(key, ()):
+            records = pickle.loads(spill_map[offset : offset + length])
+            tups.extend(_restore_tuple(self, record) for record in records)
+        self._spilled_pending -= len(tups)
+        return tups
+
+    def _map_spill_file(self):
+        self._spill_file.flush()
+        return mmap.mmap(self._spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def process_batches(self):
+        """Iterate through all batches, call process_batch on them, and ack.
+
+        Spilled batches are read back from disk one at a time, right before
+        they are processed.
+        """
+        try:
+            if not self._spilled:
+                super().process_batches()
+            else:
+                self._process_spilled_batches()
+        finally:
+            self._forget_batch_memory()
+
+    def _process_spilled_batches(self):
+        with self._map_spill_file() as spill_map:
+            for key in dict.fromkeys(chain(self._spilled, self._batches)):
+                batch = self._read_spilled(key, spill_map)
+                batch.extend(self._batches.get(key, ()))
+                if not batch:
+                    continue
+                # Put spilled Tuples back so they get failed on exceptions
+                self._batches[key] = batch
+                self._current_tups = batch
+                self._current_key = key
+                self.process_batch(key, batch)
+                if self.auto_ack:
+                    for tup in batch:
+                        self.ack(tup)
+                self._current_key = None
+                self._batches[key] = []
+        self._batches = defaultdict(list)
+        self._spill_file.truncate(0)
+
+    def _forget_batch_memory(self):
+        """Drop the memory estimates of batches that are no longer pending.
+
+        If ``process_batch`` raised, the current batch is about to be failed,
+        and the batches after it are still waiting for the next tick.
+        """
+        for key in list(self._batch_memory):
+            if key == self._current_key or not self._batches.get(key):
+                del self._batch_memory[key]
+        self._total_batch_memory = sum(self._batch_memory.values())
+
+    def _handle_run_exception(self, exc):
+        """Process an exception encountered while running the ``run()`` loop.
+
+        Called right before program exits.
+        """
+        super()._handle_run_exception(exc)
+        if self.auto_fail and self.exit_on_exception and self._spilled:
+            with self._map_spill_file() as spill_map:
+                for key in list(self._spilled):
+                    for tup in self._read_spilled(key, spill_map):
+                        self.fail(tup)
+
+    def process_batch(self, key, tups):
+        """Process a batch of Tuples.
+
+        Subclasses should override either this or ``process_columns``.  By
+        default, this converts `tups` to columns with ``batch_to_columns`` and
+        passes them to ``process_columns``.
+
+        :param key: the group key for the list of batches.
+        :type key: hashable
+        :param tups: a `list` of :class:`streamparse.Tuple` s for the group.
+        :type tups: list
+        """
+        self.process_columns(key, self.batch_to_columns(tups))
+
+    def process_columns(self, key, columns):
+        """Process a batch of Tuples that has been converted to columns.
+
+        Should be overridden by subclasses that do not override
+        ``process_batch``.
+
+        :param key: the group key for the list of batches.
+        :type key: hashable
+        :param columns: a `dict` mapping from field names to arrays of the
+                        values for that field, in the same order as the Tuples
+                        in the batch.  See ``batch_to_columns`` for details.
+        :type columns: dict
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def batch_to_columns(tups):
+        """Convert a batch of Tuples into a `dict` of columns.
+
+        Columns are keyed by the field names of the stream the Tuples came
+        from (as declared in that component's ``outputs``), or by position if
+        Storm did not tell us the field names.  Columns are NumPy arrays if
+        NumPy is installed, and :class:`array.array` instances or lists
+        otherwise.
+
+        :param tups: a `list` of :class:`streamparse.Tuple` s that all come from
+                     streams with the same fields.
+        :type tups: list
+
+        :returns: a `dict` mapping from field names to columns.
+        """
+        if not tups:
+            return {}
+        # pystorm makes a namedtuple class per (component, stream), so Tuples
+        # from different sources with the same fields have different classes
+        field_names = getattr(tups[0].values, "_fields", None)
+        for tup in tups:
+            if getattr(tup.values, "_fields", None) != field_names:
+                raise ValueError(
+                    "Cannot convert a batch of Tuples with different fields to "
+                    "columns.  Override group_key to put Tuples from different "
+                    "streams in different batches.  Given: {!r} and {!r}".format(
+                        tups[0], tup
+                    )
+                )
+        if field_names is None:
+            num_fields = len(tups[0].values)
+            if any(len(tup.values) != num_fields for tup in tups):
+                raise ValueError(
+                    "Cannot convert a batch of Tuples with different numbers "
+                    "of values to columns."
+                )
+            field_names = range(num_fields)
+        if not field_names:
+            return {}
+        return {
+            field_name: _to_column(values)
+            for field_name, values in zip(
+                field_names, zip(*(tup.values for tup in tups))
+            )
+        }
+
+
+class AdaptiveBatchController:
+    """Picks batch windows and sizes that keep batch latency near a target.
+
+    After every batch, call ``update`` with how many Tuples it had, how long
+    they took to arrive, and how long the batch took to process.  The
+    controller keeps moving averages of the Tuple arrival rate and of the
+    processing time per Tuple, and uses them to pick:
+
+    * ``secs_between_batches``, the longest window for which the expected time
+      to collect and then process a batch is within ``target_latency``, so
+      quiet periods get big, efficient batches.
+    * ``max_batch_size``, the largest batch that can be processed within
+      ``target_latency``, so bursts are flushed before they get too slow to
+      process.
+
+    :param target_latency: The target time (in seconds) between a Tuple
+                           arriving and the batch it is in being processed.
+    :param secs_between_batches: The initial batch window, in seconds.
+    :param min_secs_between_batches: The shortest allowed batch window.
+    :param max_secs_between_batches: The longest allowed batch window.
+    :param max_batch_size: The largest allowed batch size.
+    :param smoothing: The weight of each new measurement in the moving
+                      averages, between 0 and 1.
+    """
+
+    def __init__(
+        self,
+        target_latency,
+        secs_between_batches,
+        min_secs_between_batches,
+        max_secs_between_batches,
+        max_batch_size,
+        smoothing=0.3,
+    ):
+        if target_latency <= 0:
+            raise ValueError(
+                f"target_latency must be positive.  Given: {target_latency!r}"
+            )
+        if not 0 < min_secs_between_batches <= max_secs_between_batches:
+            raise ValueError(
+                "Batch windows must satisfy 0 < min_secs_between_batches <= "
+                f"max_secs_between_batches.  Given: {min_secs_between_batches!r} "
+                f"and {max_secs_between_batches!r}"
+            )
+        self.target_latency = target_latency
+        self.min_secs_between_batches = min_secs_between_batches
+        self.max_secs_between_batches = max_secs_between_batches
+        self.max_batch_size_limit = max_batch_size
+        self.smoothing = smoothing
+        self.secs_between_batches = self._clamp(
+            secs_between_batches, min_secs_between_batches, max_secs_between_batches
+        )
+        self.max_batch_size = max_batch_size
+        self.arrival_rate = None
+        self.secs_per_tuple = None
+
+    @staticmethod
+    def _clamp(value, low, high):
+        return max(low, min(value, high))
+
+    def _average(self, average, value):
+        if average is None:
+            return value
+        return average + self.smoothing * (value - average)
+
+    def update(self, batch_size, collect_secs, process_secs):
+        """Adjust the batch window and size after processing a batch.
+
+        :param batch_size: The number of Tuples in the batch.
+        :param collect_secs: The time (in seconds) spent collecting the batch.
+        :param process_secs: The time (in seconds) spent processing the batch.
+        """
+        if batch_size <= 0:
+            return
+        self.arrival_rate = self._average(
+            self.arrival_rate, batch_size / max(collect_secs, 1e-6)
+        )
+        self.secs_per_tuple = self._average(
+            self.secs_per_tuple, process_secs / batch_size
+        )
+        # Collecting for w seconds and then processing arrival_rate * w Tuples
+        # should take about target_latency
+        self.secs_between_batches = self._clamp(
+            self.target_latency / (1 + self.secs_per_tuple * self.arrival_rate),
+            self.min_secs_between_batches,
+            self.max_secs_between_batches,
+        )
+        self.max_batch_size = int(
+            self._clamp(
+                self.target_latency / max(self.secs_per_tuple, 1e-9),
+                1,
+                self.max_batch_size_limit,
+            )
+        )
 
 
 class TicklessBatchingBolt(pystorm.bolt.TicklessBatchingBolt, BatchingBolt):
-    """pystorm TicklessBatchingBolt with streamparse-specific additions"""
+    """pystorm TicklessBatchingBolt with streamparse-specific additions
+
+    :ivar adaptive: A ``bool`` indicating whether or not to adjust the batch
+                    window and maximum batch size based on how quickly Tuples
+                    arrive and how long ``process_batch`` takes, using an
+                    :class:`AdaptiveBatchController`.  When ``True``,
+                    ``secs_between_batches`` is only the initial window, and
+                    batches are also processed as soon as they reach the
+                    current maximum size. Default is ``False``.
+    :ivar target_latency_secs: The time (in seconds) adaptive batching aims to
+                               keep between a Tuple arriving and its batch
+                               being processed. Default is ``1``.
+    :ivar max_batch_size: The largest batch adaptive batching will collect
+                          before processing it. Default is ``10000``.
+    :ivar min_secs_between_batches: The shortest window adaptive batching will
+                                    use. Default is ``0.01``.
+    :ivar max_secs_between_batches: The longest window adaptive batching will
+                                    use. Default is ``10``.
+    """
+
+    adaptive = False
+    target_latency_secs = 1
+    max_batch_size = 10000
+    min_secs_between_batches = 0.01
+    max_secs_between_batches = 10
+
+    def __init__(self, *args, **kwargs):
+        # These must exist before the batcher thread is started by
+        # pystorm.bolt.TicklessBatchingBolt.__init__
+        self._batch_ready = threading.Event()
+        self._num_pending = 0
+        self._last_batch_time = time.monotonic()
+        self.batch_controller = None
+        if self.adaptive:
+            self.batch_controller = AdaptiveBatchController(
+                self.target_latency_secs,
+                self.secs_between_batches,
+                self.min_secs_between_batches,
+                self.max_secs_between_batches,
+                self.max_batch_size,
+            )
+        super().__init__(*args, **kwargs)
+
+    def process(self, tup):
+        """Group non-tick Tuples into batches by ``group_key``.
+
+        .. warning::
+            This method should **not** be overriden.  If you want to tweak
+            how Tuples are grouped into batches, override ``group_key``.
+        """
+        super().process(tup)
+        if self.batch_controller is not None:
+            self._num_pending += 1
+            if self._num_pending >= self.batch_controller.max_batch_size:
+                self._batch_ready.set()
+
+    def _batch_entry_run(self):
+        """The inside of ``_batch_entry``'s infinite loop.
+
+        Separated out so it can be properly unit tested.
+        """
+        controller = self.batch_controller
+        if controller is None:
+            return super()._batch_entry_run()
+        self._batch_ready.wait(controller.secs_between_batches)
+        with self._batch_lock:
+            self._batch_ready.clear()
+            batch_size = self._num_pending
+            if not batch_size:
+                return
+            start = time.monotonic()
+            collect_secs = start - self._last_batch_time
+            self.process_batches()
+            self._num_pending = 0
+            self._last_batch_time = time.monotonic()
+            controller.update(batch_size, collect_secs, self._last_batch_time - start)
+
+
+# The in-flight Tuple that the current asyncio task is processing
+_current_in_flight = ContextVar("streamparse_current_in_flight", default=None)
 
-    pass
+
+class _InFlightTuple:
+    """Bookkeeping for a Tuple being processed by an :class:`AsyncBolt`."""
+
+    __slots__ = ("tup", "messages", "done", "exc_info")
+
+    def __init__(self, tup):
+        self.tup = tup
+        # Buffered emit messages, only used when AsyncBolt.ordered is set
+        self.messages = []
+        self.done = False
+        self.exc_info = None
+
+
+class AsyncBolt(Bolt):
+    """A Bolt whose ``process`` method is a coroutine.
+
+    Tuples are read on the main thread and processed concurrently on an
+    asyncio event loop running in a background thread, so bolts that spend
+    most of their time waiting on the network can work on many Tuples at
+    once.  Once ``max_in_flight`` Tuples are being processed, the bolt stops
+    reading new Tuples until one finishes, which lets Storm's own backpressure
+    take over.
+
+    ``process_tick`` is still a regular method, and is called on the main
+    thread.  The event loop is available as ``self.loop`` if you need to run
+    coroutines from ``initialize``.
+
+    :ivar auto_anchor: A ``bool`` indicating whether or not emits within
+                       ``process`` should automatically be anchored to the
+                       Tuple being processed. Default is ``True``.
+    :ivar auto_ack: A ``bool`` indicating whether or not the bolt should
+                    automatically acknowledge Tuples after ``process()``
+                    finishes. Default is ``True``.
+    :ivar auto_fail: A ``bool`` indicating whether or not the bolt should
+                     automatically fail Tuples when ``process()`` raises an
+                     exception. Default is ``True``.
+    :ivar max_in_flight: The maximum number of Tuples to process concurrently.
+                         Default is ``100``.
+    :ivar ordered: A ``bool`` indicating whether or not emits and acks should
+                   be sent to Storm in the order the Tuples were received.  If
+                   ``True``, emits, acks, and fails made in ``process`` are
+                   buffered until the Tuple and every Tuple received before
+                   it have finished processing.  If
+                   ``False``, emits are sent immediately and Tuples are acked
+                   as soon as they finish.  Default is ``False``.
+
+    **Example**:
+
+    .. code-block:: python
+
+        import aiohttp
+
+        from streamparse import AsyncBolt
+
+        class URLStatusBolt(AsyncBolt):
+            outputs = ["url", "status"]
+            max_in_flight = 50
+
+            async def process(self, tup):
+                url = tup.values[0]
+                async with aiohttp.ClientSession() as session:
+                    async with session.head(url) as response:
+                        self.emit([url, response.status])
+    """
+
+    max_in_flight = 100
+    ordered = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not asyncio.iscoroutinefunction(self.process):
+            raise TypeError(
+                f"{self.__class__.__name__}.process must be a coroutine "
+                "function (defined with async def)."
+            )
+        self.exc_info = None
+        self._exc_tup = None
+        signal.signal(signal.SIGUSR1, self._handle_worker_exception)
+
+        iname = self.__class__.__name__
+        threading.current_thread().name = f"{iname}:main-thread"
+        self._in_flight_slots = threading.BoundedSemaphore(self.max_in_flight)
+        # Used as an ordered set, so we can find the oldest Tuple quickly
+        self._in_flight = {}
+        self._in_flight_lock = threading.RLock()
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop_entry)
+        self._loop_thread.name = f"{iname}:event-loop-thread"
+        self._loop_thread.daemon = True
+        self._loop_thread.start()
+
+    async def process(self, tup):
+        """Process a single Tuple :class:`streamparse.Tuple` of input.
+
+        This should be overridden by subclasses, and must be a coroutine.
+
+        :param tup: the Tuple to be processed.
+        :type tup: :class:`streamparse.Tuple`
+        """
+        raise NotImplementedError()
+
+    @property
+    def num_in_flight(self):
+        """The number of Tuples currently being processed."""
+        return len(self._in_flight)
+
+    @property
+    def pending_tuples(self):
+        """The number of Tuples currently being processed."""
+        return self.num_in_flight
+
+    def emit(
+        self, tup, stream=None, anchors=None, direct_task=None, need_task_ids=False
+    ):
+        """Emit a new Tuple to a stream.
+
+        Within ``process``, emits are anchored to the Tuple being processed if
+        ``auto_anchor`` is set, and are buffered until that Tuple is done if
+        ``ordered`` is set.  Task IDs are never returned, because the main
+        thread is busy reading Tuples.
+
+        See :meth:`streamparse.Bolt.emit` for more information.
+
+        :returns: ``None``.
+        """
+        self.emit_many([tup], stream=stream, anchors=anchors, direct_task=direct_task)
+
+    def emit_many(self, tups, stream=None, anchors=None, direct_task=None):
+        """Emit several new Tuples to a stream with a single write.
+
+        See :meth:`emit` and :meth:`streamparse.Bolt.emit_many` for more
+        information.
+        """
+        in_flight = _current_in_flight.get()
+        if in_flight is None:
+            # Outside of process, like in process_tick
+            return super().emit_many(
+                tups, stream=stream, anchors=anchors, direct_task=direct_task
+            )
+        if anchors is None:
+            anchors = [in_flight.tup] if self.auto_anchor else []
+        anchors = [a.id if isinstance(a, Tuple) else a for a in anchors]
+        if self.ordered:
+            in_flight.messages.extend(
+                self._make_emit_messages(
+                    tups, stream=stream, anchors=anchors, direct_task=direct_task
+                )
+            )
+        else:
+            super().emit_many(
+                tups, stream=stream, anchors=anchors, direct_task=direct_task
+            )
+
+    def send_message(self, message):
+        """Send a message to Storm via stdout.
+
+        Within ``process``, messages like acks and fails are buffered with
+        the emits for the Tuple being processed if ``ordered`` is set.
+        """
+        in_flight = _current_in_flight.get()
+        if in_flight is not None and self.ordered:
+            in_flight.messages.append(message)
+        else:
+            super().send_message(message)
+
+    def _loop_entry(self):
+        """Entry point for the event loop thread."""
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _handle_worker_exception(self, signum, frame):
+        """Handle an exception raised in ``process`` on the event loop.
+
+        The event loop thread sends a SIGUSR1 to the main thread, which we
+        catch here, and then raise in the main thread.
+        """
+        exc_info = self.exc_info
+        if exc_info is not None:
+            raise exc_info[1].with_traceback(exc_info[2])
+
+    def _run(self):
+        """The inside of ``run``'s infinite loop.
+
+        Separated out so it can be properly unit tested.
+        """
+        tup = self.read_tuple()
+        self._current_tups = [tup]
+        if self.is_heartbeat(tup):
+            self.send_message({"command": "sync"})
+        elif self.is_tick(tup):
+            self.process_tick(tup)
+            if self.auto_ack:
+                self.ack(tup)
+        else:
+            # Block until a slot frees up, so we stop reading from Storm
+            self._in_flight_slots.acquire()
+            in_flight = _InFlightTuple(tup)
+            with self._in_flight_lock:
+                self._in_flight[in_flight] = None
+            asyncio.run_coroutine_threadsafe(
+                self._process_in_flight(in_flight), self.loop
+            )
+        self._current_tups = []
+
+    async def _process_in_flight(self, in_flight):
+        """Run ``process`` for a Tuple, and finish it up when it is done."""
+        # Each task has its own context, so this is only visible to this Tuple
+        _current_in_flight.set(in_flight)
+        try:
+            await self.process(in_flight.tup)
+        except Exception:
+            in_flight.exc_info = sys.exc_info()
+        in_flight.done = True
+        # Finishing may send messages for other Tuples, which must not be
+        # buffered with this one's
+        _current_in_flight.set(None)
+
+        with self._in_flight_lock:
+            if self.ordered:
+                finished = []
+                for oldest in self._in_flight:
+                    if not oldest.done:
+                        break
+                    finished.append(oldest)
+            elif in_flight in self._in_flight:
+                finished = [in_flight]
+            else:
+                # Already failed by _handle_run_exception
+                finished = []
+            for done in finished:
+                self._in_flight.pop(done, None)
+            for done in finished:
+                try:
+                    self._finish_in_flight(done)
+                finally:
+                    self._in_flight_slots.release()
+
+    def _finish_in_flight(self, in_flight):
+        """Send buffered emits and ack (or fail) a Tuple that is done."""
+        if in_flight.exc_info is not None:
+            if self.auto_fail:
+                self.fail(in_flight.tup)
+            exc = in_flight.exc_info[1]
+            if self.exit_on_exception:
+                if self.exc_info is None:
+                    self.exc_info = in_flight.exc_info
+                    self._exc_tup = in_flight.tup
+                    os.kill(self.pid, signal.SIGUSR1)  # interrupt stdin waiting
+            else:
+                self.logger.error(
+                    "Exception in %s.process()",
+                    self.__class__.__name__,
+                    exc_info=in_flight.exc_info,
+                )
+                self.raise_exception(exc, in_flight.tup)
+            return
+        messages = in_flight.messages
+        if self.auto_ack:
+            messages.append({"command": "ack", "id": in_flight.tup.id})
+        self.send_messages(messages)
+
+    def _handle_run_exception(self, exc):
+        """Process an exception encountered while running the ``run()`` loop.
+
+        Called right before program exits.
+        """
+        if self.exc_info is not None and exc is self.exc_info[1]:
+            # Raised by process on the event loop, which already failed it
+            self.raise_exception(exc, self._exc_tup)
+        else:
+            super()._handle_run_exception(exc)
+        if self.auto_fail and self.exit_on_exception:
+            # Fail everything else so Storm can replay it without a timeout
+            with self._in_flight_lock:
+                for in_flight in self._in_flight:
+                    self.fail(in_flight.tup)
+                self._in_flight.clear()
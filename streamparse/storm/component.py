@@ -1,8 +1,25 @@
 """
 Module to add streamparse-specific extensions to pystorm Component classes
 """
+import logging
+import time
+
 import pystorm
 from pystorm.component import StormHandler  # This is used by other code
+from pystorm.exceptions import StormWentAwayError
+
+from ..capture import open_capture
+from ..exporter import open_metrics_file, read_rss_bytes
+from ..metrics import (
+    DEFAULT_INTERVAL_SECS,
+    DEFAULT_PREFIX,
+    ComponentMetrics,
+    MetricsRegistry,
+    make_metric_messages,
+)
+from ..profiler import start_profiler
+
+log = logging.getLogger(__name__)
 
 
 class Component(pystorm.component.Component):
@@ -10,11 +27,41 @@ class Component(pystorm.component.Component):
 
     :ivar outputs: The outputs
     :ivar config: Component-specific config settings to pass to Storm.
+    :ivar messages_sent: The number of messages sent to Storm through
+                         ``send_message`` and ``send_messages``.
+    :ivar message_writes: The number of writes to the output stream those
+                          messages took.  ``emit_many`` sends many messages
+                          per write.
+    :ivar capture: The :class:`~streamparse.capture.CaptureWriter` recording
+                   messages from Storm, if ``streamparse.capture.enabled`` is
+                   set.
+    :ivar profiler: The :class:`~streamparse.profiler.SamplingProfiler`
+                    sampling this component, if ``streamparse.profile.enabled``
+                    is set.
+    :ivar metrics: The :class:`~streamparse.metrics.MetricsRegistry` to record
+                   this component's metrics in.  The ones named in
+                   ``streamparse.metrics.registered`` are reported to Storm
+                   if ``streamparse.metrics.enabled`` is set, and all of them
+                   are exported for Prometheus if
+                   ``streamparse.metrics.export.enabled`` is.
     """
 
     outputs = None
     par = 1
     config = None
+    capture = None
+    profiler = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.messages_sent = 0
+        self.message_writes = 0
+        self.metrics = MetricsRegistry()
+        self._component_metrics = None
+        self._metrics_prefix = DEFAULT_PREFIX
+        self._registered_metrics = frozenset()
+        self._report_metrics = False
+        self._metrics_file = None
 
     @classmethod
     def spec(cls, *args, **kwargs):
@@ -22,3 +69,218 @@ class Component(pystorm.component.Component):
         raise TypeError(
             f"Specifications should either be bolts or spouts. Given: {cls!r}"
         )
+
+    def _setup_component(self, storm_conf, context):
+        super()._setup_component(storm_conf, context)
+        self.capture = open_capture(self, storm_conf, context)
+        self.profiler = start_profiler(self, storm_conf)
+        metrics_enabled = storm_conf.get("streamparse.metrics.enabled", False)
+        # Storm kills the worker for metrics it doesn't know, so only report
+        # the ones it has been told about
+        self._registered_metrics = frozenset(
+            storm_conf.get("streamparse.metrics.registered") or ()
+        )
+        self._report_metrics = metrics_enabled and bool(self._registered_metrics)
+        if metrics_enabled and not self._registered_metrics:
+            log.info(
+                "Not reporting metrics for %s to Storm, because "
+                "streamparse.metrics.registered is empty.",
+                self.component_name,
+            )
+        self._metrics_file = open_metrics_file(self, storm_conf)
+        if metrics_enabled or self._metrics_file is not None:
+            self._component_metrics = ComponentMetrics(
+                self.metrics,
+                self.serializer,
+                interval_secs=storm_conf.get(
+                    "streamparse.metrics.interval_secs", DEFAULT_INTERVAL_SECS
+                ),
+            )
+            self._metrics_prefix = storm_conf.get(
+                "streamparse.metrics.prefix", DEFAULT_PREFIX
+            )
+
+    def _exit(self, status_code):
+        """Write out any capture or profile before exiting."""
+        if self._component_metrics is not None:
+            self._component_metrics.close()
+        if self._metrics_file is not None:
+            self._metrics_file.close()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.capture is not None:
+            self.capture.close()
+        super()._exit(status_code)
+
+    def read_message(self):
+        """Read a message from Storm via serializer, recording it if capturing.
+
+        Metrics are reported here too, when they are due.
+        """
+        component_metrics = self._component_metrics
+        if component_metrics is None:
+            msg = super().read_message()
+        else:
+            start = time.perf_counter()
+            msg = super().read_message()
+            # Task IDs are read in the middle of an emit, so leave them out
+            if not isinstance(msg, list):
+                component_metrics.message_read(msg, start, time.perf_counter())
+                if self._report_metrics and component_metrics.report_due(msg):
+                    self.report_metrics()
+                if self._metrics_file is not None and self._metrics_file.due():
+                    self._metrics_file.write(
+                        self.metrics,
+                        {
+                            "pending_tuples": self.pending_tuples,
+                            "rss_bytes": read_rss_bytes(),
+                        },
+                    )
+        if self.capture is not None:
+            self.capture.record(msg)
+        return msg
+
+    def read_command(self):
+        """Read a command or Tuple from Storm, noting which one we are working
+        on if capturing.
+        """
+        msg = super().read_command()
+        if self.capture is not None:
+            self.capture.command_taken()
+        return msg
+
+    def report_metrics(self):
+        """Report the metrics in ``metrics`` named in
+        ``streamparse.metrics.registered`` to Storm with one write, and reset
+        every metric.
+
+        This is done automatically on every tick Tuple when
+        ``streamparse.metrics.enabled`` is set.
+        """
+        if self._metrics_file is not None:
+            self._metrics_file.fold(self.metrics)
+        self.send_messages(
+            make_metric_messages(
+                self.metrics, self._metrics_prefix, names=self._registered_metrics
+            )
+        )
+        if self._component_metrics is not None:
+            self._component_metrics.last_report = time.monotonic()
+
+    @property
+    def pending_tuples(self):
+        """The number of Tuples this component is holding on to, without
+        having acked or failed them yet.
+        """
+        return 0
+
+    @property
+    def messages_per_write(self):
+        """The average number of messages sent to Storm per write."""
+        if not self.message_writes:
+            return 0.0
+        return self.messages_sent / self.message_writes
+
+    def send_message(self, message):
+        """Send a message to Storm via stdout."""
+        with self._writer_lock:
+            super().send_message(message)
+            self.messages_sent += 1
+            self.message_writes += 1
+            if self._component_metrics is not None:
+                self._component_metrics.count_sent((message,))
+
+    def send_messages(self, messages):
+        """Send several messages to Storm with a single write and flush.
+
+        :param messages: the message dictionaries to send.
+        :type messages: `list` of `dict`
+        """
+        if not messages:
+            return
+        serializer = self.serializer
+        with self._writer_lock:
+            try:
+                frames = [serializer.serialize_dict(msg) for msg in messages]
+                serializer.output_stream.flush()
+                # frames are either all str or all bytes, depending on serializer
+                serializer.output_stream.write(frames[0][:0].join(frames))
+                serializer.output_stream.flush()
+            except OSError:
+                raise StormWentAwayError()
+            except Exception:
+                log.exception("Failed to send messages: %r", messages)
+                return
+            self.messages_sent += len(messages)
+            self.message_writes += 1
+            if self._component_metrics is not None:
+                self._component_metrics.count_sent(messages)
+
+    def emit_many(
+        self, tups, tup_ids=None, stream=None, anchors=None, direct_task=None
+    ):
+        """Emit several new Tuples to a stream with a single write.
+
+        This is much cheaper than calling ``emit`` in a loop when emitting
+        many Tuples at once, because every ``emit`` is a separate write and
+        flush.  Task IDs are never returned.
+
+        :param tups: the Tuple payloads to send to Storm.
+        :type tups: `list` of `list` or `tuple`
+        :param tup_ids: the IDs for the Tuples, in the same order as `tups`.
+        :type tup_ids: `list` of `str`
+        :param stream: the ID of the stream to emit these Tuples to. Specify
+                       ``None`` to emit to default stream.
+        :type stream: str
+        :param anchors: IDs the Tuples which the emitted Tuples should be
+                        anchored to. This is only passed by
+                        :class:`streamparse.Bolt`.
+        :type anchors: list
+        :param direct_task: the task to send the Tuples to.
+        :type direct_task: int
+        """
+        self.send_messages(
+            self._make_emit_messages(
+                tups,
+                tup_ids=tup_ids,
+                stream=stream,
+                anchors=anchors,
+                direct_task=direct_task,
+            )
+        )
+
+    @staticmethod
+    def _make_emit_messages(
+        tups, tup_ids=None, stream=None, anchors=None, direct_task=None
+    ):
+        """Build the emit messages for ``emit_many`` without sending them."""
+        tups = list(tups)
+        if tup_ids is None:
+            tup_ids = [None] * len(tups)
+        else:
+            tup_ids = list(tup_ids)
+            if len(tup_ids) != len(tups):
+                raise ValueError(
+                    f"Received {len(tup_ids)} tuple IDs for {len(tups)} Tuples."
+                )
+
+        base_msg = {"command": "emit", "need_task_ids": False}
+        if anchors is not None:
+            base_msg["anchors"] = anchors
+        if stream is not None:
+            base_msg["stream"] = stream
+        if direct_task is not None:
+            base_msg["task"] = direct_task
+
+        messages = []
+        for tup, tup_id in zip(tups, tup_ids):
+            if not isinstance(tup, (list, tuple)):
+                raise TypeError(
+                    "All Tuples must be either lists or tuples, "
+                    f"received {type(tup)!r} instead."
+                )
+            msg = dict(base_msg, tuple=tup)
+            if tup_id is not None:
+                msg["id"] = tup_id
+            messages.append(msg)
+        return messages
@@ -1,7 +1,6 @@
 """
 Module to add streamparse-specific extensions to pystorm Spout class
 """
-
 import pystorm
 
 from ..dsl.spout import JavaSpoutSpec, ShellSpoutSpec
@@ -157,8 +156,47 @@ class Spout(pystorm.spout.Spout, ShellSpout):
             outputs=cls.outputs,
         )
 
+    def emit_many(self, tups, tup_ids=None, stream=None, direct_task=None):
+        """Emit several spout Tuples with a single write.
+
+        :param tups: the Tuple payloads to send to Storm.
+        :type tups: `list` of `list` or `tuple`
+        :param tup_ids: the IDs for the Tuples, in the same order as `tups`.
+                        Leave this blank for unreliable emits.
+        :type tup_ids: `list` of `str`
+        :param stream: ID of the stream these Tuples should be emitted to.
+                       Leave empty to emit to the default stream.
+        :type stream: str
+        :param direct_task: the task to send the Tuples to if performing a
+                            direct emit.
+        :type direct_task: int
+        """
+        super().emit_many(tups, tup_ids=tup_ids, stream=stream, direct_task=direct_task)
+
 
 class ReliableSpout(pystorm.spout.ReliableSpout, Spout):
     """pystorm ReliableSpout with streamparse-specific additions"""
 
-    pass
+    @property
+    def pending_tuples(self):
+        """The number of Tuples emitted that have not been acked or failed."""
+        return len(self.unacked_tuples)
+
+    def emit_many(self, tups, tup_ids=None, stream=None, direct_task=None):
+        """Emit several spout Tuples & add metadata about them to
+        `unacked_tuples`.
+
+        In order for this to work, `tup_ids` is a required parameter.
+
+        See :meth:`Spout.emit_many`.
+        """
+        if tup_ids is None:
+            raise ValueError(
+                "You must provide tuple IDs when emitting with a "
+                "ReliableSpout in order for the tuples to be tracked."
+            )
+        tups = list(tups)
+        tup_ids = list(tup_ids)
+        for tup, tup_id in zip(tups, tup_ids):
+            self.unacked_tuples[tup_id] = (tup, stream, direct_task, False)
+        super().emit_many(tups, tup_ids=tup_ids, stream=stream, direct_task=direct_task)
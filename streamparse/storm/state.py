@@ -0,0 +1,298 @@
+"""
+Keyed state for Bolts, with an LRU cache in front of an embedded database
+"""
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import simplejson as json
+
+try:
+    import lmdb
+
+    HAVE_LMDB = True
+except ImportError:
+    HAVE_LMDB = False
+
+
+def _encode(obj):
+    return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def _decode(data):
+    return json.loads(bytes(data).decode("utf-8"))
+
+
+class StateBackend:
+    """Base class for places a :class:`StateStore` can keep its data.
+
+    Keys must be hashable and JSON serializable, like strings or tuples of
+    strings.  Values must be JSON serializable, and come back as the types
+    JSON decodes them to.
+    """
+
+    def get(self, key):
+        """Return the value for `key`, or raise `KeyError` if there is none."""
+        raise NotImplementedError()
+
+    def put_many(self, items):
+        """Store each ``(key, value)`` pair in `items`."""
+        raise NotImplementedError()
+
+    def delete_many(self, keys):
+        """Remove `keys`, ignoring any that do not exist."""
+        raise NotImplementedError()
+
+    def commit(self):
+        """Make everything written so far durable."""
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """Backend that keeps everything in a `dict`, and is lost on restart."""
+
+    def __init__(self, path=None):
+        self.data = {}
+
+    def get(self, key):
+        return self.data[key]
+
+    def put_many(self, items):
+        self.data.update(items)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+class SQLiteBackend(StateBackend):
+    """Backend that stores state in a SQLite database at `path`.
+
+    Writes are only committed by ``commit``, so after a restart the database
+    has the state as of the last snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS state (key BLOB PRIMARY KEY, value BLOB)"
+        )
+        self.conn.commit()
+
+    def get(self, key):
+        row = self.conn.execute(
+            "SELECT value FROM state WHERE key = ?", (_encode(key),)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return _decode(row[0])
+
+    def put_many(self, items):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+            [(_encode(key), _encode(value)) for key, value in items],
+        )
+
+    def delete_many(self, keys):
+        self.conn.executemany(
+            "DELETE FROM state WHERE key = ?", [(_encode(key),) for key in keys]
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class LMDBBackend(StateBackend):
+    """Backend that stores state in an LMDB environment at `path`.
+
+    Requires the ``lmdb`` package.  Every write is committed immediately, so
+    after a restart the database has the state as of the last snapshot or
+    later.
+    """
+
+    map_size = 2**30
+
+    def __init__(self, path):
+        if not HAVE_LMDB:
+            raise ImportError("lmdb is required to use the lmdb state backend.")
+        self.path = path
+        self.env = lmdb.open(path, map_size=self.map_size, subdir=True)
+
+    def get(self, key):
+        with self.env.begin() as txn:
+            data = txn.get(_encode(key))
+        if data is None:
+            raise KeyError(key)
+        return _decode(data)
+
+    def put_many(self, items):
+        with self.env.begin(write=True) as txn:
+            for key, value in items:
+                txn.put(_encode(key), _encode(value))
+
+    def delete_many(self, keys):
+        with self.env.begin(write=True) as txn:
+            for key in keys:
+                txn.delete(_encode(key))
+
+    def commit(self):
+        self.env.sync()
+
+    def close(self):
+        self.env.close()
+
+
+STATE_BACKENDS = {
+    "memory": MemoryBackend,
+    "sqlite": SQLiteBackend,
+    "lmdb": LMDBBackend,
+}
+
+# Marks cache entries for keys that were deleted or are not in the backend
+_MISSING = object()
+
+
+class StateStore:
+    """Keyed state with an LRU cache of hot keys in front of a backend.
+
+    Changes are kept in the cache until they are evicted or ``snapshot`` is
+    called, at which point they are written to the backend.  All methods are
+    thread-safe.
+
+    :param backend: the :class:`StateBackend` to store state in.
+    :param cache_size: the maximum number of keys to keep in the cache.
+    """
+
+    def __init__(self, backend, cache_size=10000):
+        self.backend = backend
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._dirty = set()
+        self._lock = threading.RLock()
+
+    def _lookup(self, key):
+        cache = self._cache
+        try:
+            value = cache[key]
+        except KeyError:
+            try:
+                value = self.backend.get(key)
+            except KeyError:
+                value = _MISSING
+            self._store(key, value, dirty=False)
+        else:
+            cache.move_to_end(key)
+        return value
+
+    def _store(self, key, value, dirty=True):
+        cache = self._cache
+        cache[key] = value
+        cache.move_to_end(key)
+        if dirty:
+            self._dirty.add(key)
+        while len(cache) > self.cache_size:
+            old_key, old_value = cache.popitem(last=False)
+            if old_key in self._dirty:
+                self._dirty.discard(old_key)
+                if old_value is _MISSING:
+                    self.backend.delete_many([old_key])
+                else:
+                    self.backend.put_many([(old_key, old_value)])
+
+    def get(self, key, default=None):
+        """Return the value for `key`, or `default` if there is none."""
+        with self._lock:
+            value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not _MISSING
+
+    def put(self, key, value):
+        """Set the value for `key`."""
+        with self._lock:
+            self._store(key, value)
+
+    __setitem__ = put
+
+    def incr(self, key, amount=1):
+        """Add `amount` to the value for `key`, and return the new value.
+
+        Keys without a value start at 0.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            value = amount if value is _MISSING else value + amount
+            self._store(key, value)
+        return value
+
+    def delete(self, key):
+        """Remove `key`, if it exists."""
+        with self._lock:
+            self._store(key, _MISSING)
+
+    __delitem__ = delete
+
+    def snapshot(self):
+        """Write every change to the backend and commit it."""
+        with self._lock:
+            cache = self._cache
+            puts = []
+            deletes = []
+            for key in self._dirty:
+                value = cache[key]
+                if value is _MISSING:
+                    deletes.append(key)
+                else:
+                    puts.append((key, value))
+            if puts:
+                self.backend.put_many(puts)
+            if deletes:
+                self.backend.delete_many(deletes)
+            self.backend.commit()
+            self._dirty.clear()
+
+    def close(self):
+        """Snapshot and close the backend."""
+        with self._lock:
+            self.snapshot()
+            self.backend.close()
+
+
+def open_state_store(backend, path=None, cache_size=10000):
+    """Create a :class:`StateStore` using the backend with the given name.
+
+    :param backend: one of the names in ``STATE_BACKENDS``.
+    :param path: where the backend should keep its data.  Parent directories
+                 are created if necessary.
+    :param cache_size: the maximum number of keys to keep in memory.
+    """
+    try:
+        backend_cls = STATE_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(
+            f"Unknown state backend: {backend!r}.  Must be one of "
+            f"{sorted(STATE_BACKENDS)!r}"
+        )
+    if path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return StateStore(backend_cls(path), cache_size=cache_size)
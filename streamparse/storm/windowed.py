@@ -0,0 +1,601 @@
+"""
+Bolts that aggregate Tuples over windows of event time
+"""
+
+import heapq
+import itertools
+import math
+import time
+from collections import defaultdict, namedtuple
+
+from pystorm.component import Tuple
+
+from .bolt import Bolt
+
+Window = namedtuple("Window", ["start", "end"])
+Window.__doc__ = """The ``[start, end)`` range of event times in a window."""
+
+
+class Aggregator:
+    """Incrementally combines the Tuples in a window into a result.
+
+    Subclasses must implement ``add`` and ``merge``.  Neither may modify an
+    accumulator that is passed to ``merge``, because the accumulators for
+    parts of a sliding window are shared between windows.
+    """
+
+    def create(self):
+        """Return a new, empty accumulator."""
+        return None
+
+    def add(self, acc, tup):
+        """Add `tup` to `acc`, and return the updated accumulator."""
+        raise NotImplementedError()
+
+    def merge(self, acc1, acc2):
+        """Return a new accumulator that combines `acc1` and `acc2`."""
+        raise NotImplementedError()
+
+    def result(self, acc):
+        """Return the result to pass to ``process_window`` for `acc`."""
+        return acc
+
+
+class ListAggregator(Aggregator):
+    """Collects every Tuple in the window into a `list`."""
+
+    def create(self):
+        return []
+
+    def add(self, acc, tup):
+        acc.append(tup)
+        return acc
+
+    def merge(self, acc1, acc2):
+        return acc1 + acc2
+
+
+class CountAggregator(Aggregator):
+    """Counts the Tuples in the window."""
+
+    def create(self):
+        return 0
+
+    def add(self, acc, tup):
+        return acc + 1
+
+    def merge(self, acc1, acc2):
+        return acc1 + acc2
+
+
+class SumAggregator(Aggregator):
+    """Sums one field of the Tuples in the window.
+
+    :param field: the name or position of the field to sum.
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def create(self):
+        return 0
+
+    def add(self, acc, tup):
+        if isinstance(self.field, str):
+            return acc + getattr(tup.values, self.field)
+        return acc + tup.values[self.field]
+
+    def merge(self, acc1, acc2):
+        return acc1 + acc2
+
+
+class SlidingWindows:
+    """Windows of `size` seconds, starting every `slide` seconds.
+
+    Each Tuple is added to one pane of `slide` seconds, and each window merges
+    the ``size / slide`` panes it covers, so Tuples are never re-aggregated
+    as the window slides.  Panes are numbered from the epoch, and their
+    bounds are always computed from their number, so they do not drift when
+    `slide` is not exactly representable as a float.
+
+    :param size: the length of each window, in seconds.
+    :param slide: the time between the starts of windows, in seconds.
+                  `size` must be a multiple of it.
+    """
+
+    def __init__(self, size, slide):
+        if size <= 0 or slide <= 0:
+            raise ValueError(
+                f"Window size and slide must be positive.  Given: {size!r} and "
+                f"{slide!r}"
+            )
+        panes = round(size / slide)
+        if abs(panes * slide - size) > 1e-9 * size:
+            raise ValueError(
+                f"Window size must be a multiple of its slide.  Given: {size!r} "
+                f"and {slide!r}"
+            )
+        self.size = size
+        self.slide = slide
+        #: The number of panes in each window
+        self.panes = panes
+
+    def pane_index(self, event_time):
+        """Return the number of the pane `event_time` falls in."""
+        return math.floor(event_time / self.slide)
+
+    def pane_start(self, event_time):
+        """Return the start of the pane `event_time` falls in."""
+        return self.pane_index(event_time) * self.slide
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(size={self.size!r}, slide={self.slide!r})"
+
+
+class TumblingWindows(SlidingWindows):
+    """Back-to-back windows of `size` seconds.
+
+    :param size: the length of each window, in seconds.
+    """
+
+    def __init__(self, size):
+        super().__init__(size, size)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(size={self.size!r})"
+
+
+class SessionWindows:
+    """Windows that last until no Tuples have arrived for `gap` seconds.
+
+    :param gap: the length of inactivity, in seconds, that ends a session.
+    """
+
+    def __init__(self, gap):
+        if gap <= 0:
+            raise ValueError(f"Session gap must be positive.  Given: {gap!r}")
+        self.gap = gap
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(gap={self.gap!r})"
+
+
+class _Pane:
+    """Accumulator and Tuple IDs for one slide of a sliding window."""
+
+    __slots__ = ("acc", "tup_ids")
+
+    def __init__(self, acc):
+        self.acc = acc
+        self.tup_ids = []
+
+
+class _Session:
+    """Accumulator and Tuple IDs for one session window."""
+
+    __slots__ = ("start", "end", "acc", "tup_ids", "fired", "discarded")
+
+    def __init__(self, start, end, acc):
+        self.start = start
+        self.end = end
+        self.acc = acc
+        self.tup_ids = []
+        self.fired = False
+        # Set once merged into another session or discarded
+        self.discarded = False
+
+
+class WindowedBolt(Bolt):
+    """A Bolt that aggregates Tuples over tumbling, sliding, or session
+    windows of event time.
+
+    Each Tuple's event time comes from ``event_time``.  The bolt tracks a
+    *watermark*, which is the largest event time seen so far minus
+    ``watermark_delay``, and assumes no more Tuples will arrive with event
+    times before it.  When the watermark passes the end of a window,
+    ``process_window`` is called with the window's aggregated result, and
+    emits from it are anchored to every Tuple in the window.
+
+    Windows are kept for ``allowed_lateness`` seconds after they close.  Tuples
+    that arrive for a closed window during that time update it, and
+    ``process_window`` is called again with the new result.  Tuples that
+    arrive even later are passed to ``process_late_tuple`` instead.
+
+    Tuples are acked once every window they are in has been kept for
+    ``allowed_lateness``, so a crash replays everything needed to rebuild the
+    open windows.  Make sure ``topology.message.timeout.secs`` is longer than
+    your windows (plus ``watermark_delay`` and ``allowed_lateness``).
+
+    .. note::
+        Results are at-least-once, not exactly-once.  A window that fired
+        before a crash, but whose Tuples were not acked yet, fires again when
+        they are replayed, and a window that is updated by late Tuples fires
+        once more each time.  Make whatever consumes the results idempotent,
+        for example by writing them keyed by ``(key, window)``.
+
+    :ivar window: A :class:`TumblingWindows`, :class:`SlidingWindows`, or
+                  :class:`SessionWindows` describing the windows to use.
+                  Required.
+    :ivar aggregator: The :class:`Aggregator` used to combine each window's
+                      Tuples.  Default is a :class:`ListAggregator`, which
+                      passes ``process_window`` a `list` of the Tuples.
+    :ivar timestamp_field: The name or position of the field holding each
+                           Tuple's event time, in seconds since the epoch.
+                           If ``None``, the time the Tuple was received is
+                           used. Override ``event_time`` for anything fancier.
+    :ivar watermark_delay: How far (in seconds) behind the latest event time
+                           Tuples may arrive without being late. Default is
+                           ``0``.
+    :ivar allowed_lateness: How long (in seconds) windows are kept after they
+                            close, to be updated by late Tuples. Default is
+                            ``0``.
+    :ivar tick_advances_watermark: A ``bool`` indicating whether or not tick
+                                   Tuples should advance the watermark to the
+                                   current time minus ``watermark_delay``, so
+                                   windows close even when no Tuples arrive.
+                                   Only use this when event times are close to
+                                   the current time. Default is ``False``.
+    :ivar auto_ack: A ``bool`` indicating whether or not the bolt should
+                    automatically ack Tuples once all their windows are
+                    discarded, late Tuples after ``process_late_tuple``, and
+                    tick Tuples.  If ``False``, you must ack them yourself,
+                    for example from ``process_window`` with a
+                    :class:`ListAggregator`.  Default is ``True``.
+    :ivar late_tuples: The number of Tuples passed to ``process_late_tuple``.
+
+    **Example**:
+
+    .. code-block:: python
+
+        from streamparse import WindowedBolt
+        from streamparse.storm.windowed import CountAggregator, SlidingWindows
+
+        class PageViewCountBolt(WindowedBolt):
+            outputs = ["url", "window_end", "count"]
+            window = SlidingWindows(size=60, slide=10)
+            aggregator = CountAggregator()
+            timestamp_field = "timestamp"
+            watermark_delay = 5
+
+            def group_key(self, tup):
+                return tup.values.url
+
+            def process_window(self, key, window, count):
+                self.emit([key, window.end, count])
+    """
+
+    window = None
+    aggregator = ListAggregator()
+    timestamp_field = None
+    watermark_delay = 0
+    allowed_lateness = 0
+    tick_advances_watermark = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not isinstance(self.window, (SlidingWindows, SessionWindows)):
+            raise TypeError(
+                f"{self.__class__.__name__}.window must be a TumblingWindows, "
+                f"SlidingWindows, or SessionWindows.  Given: {self.window!r}"
+            )
+        self.watermark = float("-inf")
+        self.late_tuples = 0
+        # group key -> pane index -> _Pane, for sliding and tumbling windows
+        self._panes = defaultdict(dict)
+        # Heap of (window end pane index, order, group key) of windows that
+        # still have to fire, and set of their (group key, end pane index)
+        self._window_ends = []
+        self._scheduled_windows = set()
+        # Heap of (pane index, order, group key) of panes to discard
+        self._pane_expirations = []
+        self._order = itertools.count()
+        # group key -> list of _Session in order of start, for session windows
+        self._sessions = defaultdict(list)
+        # Heaps of (session end, order, group key, _Session) of sessions to
+        # fire and to discard.  Entries for sessions that have since been
+        # merged or extended are skipped.
+        self._session_ends = []
+        self._session_expirations = []
+
+    def group_key(self, tup):
+        """Return the key to group `tup` by.
+
+        Each key gets its own set of windows.  By default, all Tuples are in
+        one group with the key ``None``.
+        """
+        return None
+
+    def event_time(self, tup):
+        """Return the event time of `tup`, in seconds since the epoch."""
+        field = self.timestamp_field
+        if field is None:
+            return time.time()
+        if isinstance(field, str):
+            return getattr(tup.values, field)
+        return tup.values[field]
+
+    def process_window(self, key, window, result):
+        """Process the result of a window that has closed.
+
+        Should be overridden by subclasses.
+
+        :param key: the group key for the window.
+        :param window: the :class:`Window` that closed.
+        :param result: the result of the window's ``aggregator``.
+        """
+        raise NotImplementedError()
+
+    def process_late_tuple(self, tup):
+        """Handle a Tuple that arrived after all its windows were discarded.
+
+        By default, late Tuples are dropped.  They are acked either way.
+        """
+        pass
+
+    def process(self, tup):
+        """Add a Tuple to its windows, and close any windows that are done.
+
+        .. warning::
+            This method should **not** be overriden.  Override
+            ``process_window`` instead.
+        """
+        event_time = self.event_time(tup)
+        key = self.group_key(tup)
+        if isinstance(self.window, SessionWindows):
+            added = self._add_to_session(key, tup, event_time)
+        else:
+            added = self._add_to_pane(key, tup, event_time)
+        if not added:
+            self.late_tuples += 1
+            self.process_late_tuple(tup)
+            if self.auto_ack:
+                self.ack(tup)
+        self.advance_watermark(event_time - self.watermark_delay)
+
+    def process_tick(self, tup):
+        """Advance the watermark if ``tick_advances_watermark`` is set."""
+        if self.tick_advances_watermark:
+            self.advance_watermark(time.time() - self.watermark_delay)
+
+    def advance_watermark(self, watermark):
+        """Move the watermark to `watermark`, closing and discarding windows.
+
+        Does nothing if `watermark` is not after the current one.
+        """
+        old_watermark = self.watermark
+        if watermark <= old_watermark:
+            return
+        self.watermark = watermark
+        if isinstance(self.window, SessionWindows):
+            self._advance_sessions(watermark)
+        else:
+            self._advance_panes(watermark)
+
+    def _fire(self, key, window, acc, tup_ids):
+        """Call ``process_window``, anchoring its emits to the window."""
+        self._current_tups = tup_ids
+        self.process_window(key, window, self.aggregator.result(acc))
+        self._current_tups = []
+
+    # Sliding and tumbling windows
+
+    def _add_to_pane(self, key, tup, event_time):
+        window = self.window
+        index = window.pane_index(event_time)
+        # The last window this pane is in ends window.panes panes later
+        last_end = (index + window.panes) * window.slide
+        if last_end + self.allowed_lateness <= self.watermark:
+            return False
+        panes = self._panes[key]
+        pane = panes.get(index)
+        if pane is None:
+            pane = panes[index] = _Pane(self.aggregator.create())
+            self._schedule_pane(key, index)
+        pane.acc = self.aggregator.add(pane.acc, tup)
+        pane.tup_ids.append(tup.id)
+        # Update windows with this pane that already closed
+        for end in range(index + 1, index + window.panes + 1):
+            if end * window.slide > self.watermark:
+                break
+            self._fire_window_ending(key, end)
+        return True
+
+    def _schedule_pane(self, key, index):
+        """Schedule the windows a new pane is in to fire, and the pane to be
+        discarded, so advancing the watermark only looks at what is due.
+        """
+        window = self.window
+        order = next(self._order)
+        heapq.heappush(self._pane_expirations, (index, order, key))
+        for end in range(index + 1, index + window.panes + 1):
+            # Windows that already closed are fired by _add_to_pane
+            if end * window.slide <= self.watermark:
+                continue
+            if (key, end) not in self._scheduled_windows:
+                self._scheduled_windows.add((key, end))
+                heapq.heappush(self._window_ends, (end, order, key))
+
+    def _fire_window_ending(self, key, end):
+        """Merge the panes of the window ending where pane `end` starts, and
+        fire it.
+        """
+        window = self.window
+        panes = self._panes.get(key, {})
+        aggregator = self.aggregator
+        acc = aggregator.create()
+        tup_ids = []
+        start = end - window.panes
+        for index in range(start, end):
+            pane = panes.get(index)
+            if pane is not None:
+                acc = aggregator.merge(acc, pane.acc)
+                tup_ids.extend(pane.tup_ids)
+        if tup_ids:
+            self._fire(
+                key, Window(start * window.slide, end * window.slide), acc, tup_ids
+            )
+
+    def _advance_panes(self, watermark):
+        window = self.window
+        window_ends = self._window_ends
+        while window_ends and window_ends[0][0] * window.slide <= watermark:
+            end, _, key = heapq.heappop(window_ends)
+            self._scheduled_windows.discard((key, end))
+            self._fire_window_ending(key, end)
+
+        expirations = self._pane_expirations
+        while (
+            expirations
+            and (expirations[0][0] + window.panes) * window.slide
+            + self.allowed_lateness
+            <= watermark
+        ):
+            index, _, key = heapq.heappop(expirations)
+            panes = self._panes[key]
+            pane = panes.pop(index)
+            if self.auto_ack:
+                for tup_id in pane.tup_ids:
+                    self.ack(tup_id)
+            if not panes:
+                del self._panes[key]
+
+    # Session windows
+
+    def _add_to_session(self, key, tup, event_time):
+        gap = self.window.gap
+        if event_time + gap + self.allowed_lateness <= self.watermark:
+            return False
+        aggregator = self.aggregator
+        new_session = _Session(event_time, event_time + gap, aggregator.create())
+        new_session.acc = aggregator.add(new_session.acc, tup)
+        new_session.tup_ids.append(tup.id)
+        # Sessions never overlap, so the ones this one overlaps are next to
+        # each other in order of start
+        sessions = self._sessions[key]
+        first = 0
+        while first < len(sessions) and sessions[first].end < new_session.start:
+            first += 1
+        last = first
+        while last < len(sessions) and sessions[last].start <= new_session.end:
+            last += 1
+        overlapping = sessions[first:last]
+        position = 0
+        while (
+            position < len(overlapping)
+            and overlapping[position].start < new_session.start
+        ):
+            position += 1
+        overlapping.insert(position, new_session)
+        # Merge them in order of start
+        session = overlapping[0]
+        old_end = session.end
+        for other in overlapping[1:]:
+            session.end = max(session.end, other.end)
+            session.acc = aggregator.merge(session.acc, other.acc)
+            session.tup_ids.extend(other.tup_ids)
+            session.fired = session.fired or other.fired
+            other.discarded = True
+        sessions[first:last] = [session]
+        if session is new_session or session.end != old_end:
+            order = next(self._order)
+            heapq.heappush(self._session_ends, (session.end, order, key, session))
+            heapq.heappush(
+                self._session_expirations, (session.end, order, key, session)
+            )
+        # Update sessions that already closed
+        if session.fired and session.end <= self.watermark:
+            self._fire(
+                key,
+                Window(session.start, session.end),
+                session.acc,
+                session.tup_ids,
+            )
+        elif session.end > self.watermark:
+            session.fired = False
+        return True
+
+    def _advance_sessions(self, watermark):
+        session_ends = self._session_ends
+        while session_ends and session_ends[0][0] <= watermark:
+            end, _, key, session = heapq.heappop(session_ends)
+            if session.discarded or session.fired or session.end != end:
+                continue
+            session.fired = True
+            self._fire(
+                key, Window(session.start, session.end), session.acc, session.tup_ids
+            )
+
+        expirations = self._session_expirations
+        while expirations and expirations[0][0] + self.allowed_lateness <= watermark:
+            end, _, key, session = heapq.heappop(expirations)
+            if session.discarded or session.end != end:
+                continue
+            session.discarded = True
+            sessions = self._sessions[key]
+            sessions.remove(session)
+            if not sessions:
+                del self._sessions[key]
+            if self.auto_ack:
+                for tup_id in session.tup_ids:
+                    self.ack(tup_id)
+
+    def _held_tup_ids(self):
+        """Yield the IDs of every Tuple waiting for its windows to close."""
+        for panes in self._panes.values():
+            for pane in panes.values():
+                yield from pane.tup_ids
+        for sessions in self._sessions.values():
+            for session in sessions:
+                yield from session.tup_ids
+
+    @property
+    def pending_tuples(self):
+        """The number of Tuples waiting for their windows to close."""
+        return sum(1 for _ in self._held_tup_ids())
+
+    def _run(self):
+        """The inside of ``run``'s infinite loop.
+
+        Separated out so it can be properly unit tested.
+        """
+        tup = self.read_tuple()
+        self._current_tups = [tup]
+        if self.is_heartbeat(tup):
+            self.send_message({"command": "sync"})
+        elif self.is_tick(tup):
+            self.process_tick(tup)
+            if self.auto_ack:
+                self.ack(tup)
+        else:
+            # Acked when its windows are discarded
+            self.process(tup)
+        self._current_tups = []
+
+    def _handle_run_exception(self, exc):
+        """Process an exception encountered while running the ``run()`` loop.
+
+        Called right before program exits.
+        """
+        current_tups = self._current_tups
+        self.raise_exception(exc, current_tups[0] if len(current_tups) == 1 else None)
+        if self.auto_fail:
+            if self.exit_on_exception:
+                # Replay every window we were holding onto right away
+                failed = set()
+                for tup_id in self._held_tup_ids():
+                    if tup_id not in failed:
+                        failed.add(tup_id)
+                        self.fail(tup_id)
+                for tup in current_tups:
+                    tup_id = tup.id if isinstance(tup, Tuple) else tup
+                    if tup_id not in failed:
+                        self.fail(tup_id)
+                self._panes.clear()
+                self._window_ends.clear()
+                self._scheduled_windows.clear()
+                self._pane_expirations.clear()
+                self._sessions.clear()
+                self._session_ends.clear()
+                self._session_expirations.clear()
+            elif len(current_tups) == 1 and isinstance(current_tups[0], Tuple):
+                self.fail(current_tups[0])
@@ -1,15 +1,21 @@
+import hashlib
 import importlib
 import os
 import re
 import shutil
+import socket
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+import warnings
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from glob import glob
+from itertools import chain
 from os.path import join
-from random import shuffle
 from socket import error as SocketError
 from socketserver import UDPServer, TCPServer
 
@@ -18,14 +24,32 @@ import simplejson as json
 from fabric.api import env, hide, local, settings, show, run, sudo
 from fabric.colors import red, yellow
 from pkg_resources import parse_version
+from requests.adapters import HTTPAdapter
 from texttable import Texttable
 from thriftpy2.protocol import TBinaryProtocolFactory
 from thriftpy2.rpc import make_client
 from thriftpy2.transport import TFramedTransportFactory
+from urllib3.util.retry import Retry
 
+from . import cache
 from .dsl.topology import Topology, TopologyType
+from .storm.serializers import PYTHON_ONLY_SERIALIZERS
 from .thrift import Nimbus
 
+try:
+    import fcntl
+
+    HAVE_FCNTL = True
+except ImportError:
+    HAVE_FCNTL = False
+
+# Defaults for requests to the Storm UI REST API
+UI_MAX_WORKERS = 16
+UI_TIMEOUT_SECS = 30
+UI_RETRIES = 3
+# How long an idle shared SSH connection to Nimbus stays open, in seconds
+SSH_CONTROL_PERSIST = 600
+
 
 def _port_in_use(port, server_type="tcp"):
     """Check to see whether a given port is already in use on localhost."""
@@ -45,18 +69,194 @@ def _port_in_use(port, server_type="tcp"):
 
 
 _active_tunnels = defaultdict(int)
+# Tunnels forwarded through a shared SSH connection, keyed by control socket
+# and remote port, with their local ports and how many contexts are using them
+_shared_tunnels = {}
+_shared_tunnels_lock = threading.Lock()
+
+
+def _get_ssh_command(env_config, host):
+    """Get the start of an ``ssh`` command for `host`, and who to connect as."""
+    user = env_config.get("user")
+    port = env_config.get("ssh_port")
+    if user:
+        user_at_host = f"{user}@{host}"
+    else:
+        user_at_host = host  # Rely on SSH default or config to connect.
+    ssh_cmd = ["ssh"]
+    # Specify port if in config
+    if port:
+        ssh_cmd.extend(["-p", str(port)])
+    return ssh_cmd, user_at_host
+
+
+def use_ssh_control_master(env_config):
+    """Check if tunnels to Nimbus should share one SSH connection."""
+    return HAVE_FCNTL and env_config.get("ssh_control_master", True)
+
+
+def get_ssh_control_dir():
+    """Get the directory for the control sockets of shared SSH connections."""
+    control_dir = os.path.join(tempfile.gettempdir(), f"streamparse_ssh_{os.getuid()}")
+    os.makedirs(control_dir, mode=0o700, exist_ok=True)
+    return control_dir
+
+
+def _get_ssh_control_path(user_at_host, port):
+    """Get the path of the control socket for the shared SSH connection to
+    `user_at_host`.
+
+    The socket is named after a hash, because socket paths have to be short.
+    """
+    control_dir = get_ssh_control_dir()
+    digest = hashlib.sha1(f"{user_at_host}:{port}".encode("utf-8")).hexdigest()
+    return os.path.join(control_dir, digest[:16])
+
+
+def _ssh_control(ssh_cmd, user_at_host, control_path, *args):
+    """Send a command to the SSH connection listening on `control_path`.
+
+    :returns: whether the command succeeded.
+    """
+    result = subprocess.run(
+        ssh_cmd + ["-S", control_path, *args, user_at_host],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return result.returncode == 0
+
+
+def _ensure_ssh_master(ssh_cmd, user_at_host, control_path, persist):
+    """Start a shared SSH connection listening on `control_path`, unless one
+    is already running.
+
+    A lock file keeps concurrent ``sparse`` commands from both starting one.
+
+    :returns: whether a new connection was started.
+    """
+    if _ssh_control(ssh_cmd, user_at_host, control_path, "-O", "check"):
+        return False
+    with open(f"{control_path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if _ssh_control(ssh_cmd, user_at_host, control_path, "-O", "check"):
+            return False
+        master_cmd = ssh_cmd + [
+            "-fNM",
+            "-S",
+            control_path,
+            "-o",
+            f"ControlPersist={persist}",
+            user_at_host,
+        ]
+        # ssh goes to the background once it is connected and authenticated
+        result = subprocess.run(
+            master_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL
+        )
+        if result.returncode != 0:
+            raise OSError(
+                f"Unable to open ssh connection via: \"{' '.join(master_cmd)}\""
+            )
+    return True
+
+
+def _get_free_port():
+    """Get a local TCP port that nothing is listening on right now."""
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def _shared_ssh_tunnel(env_config, host, remote_port, quiet=False):
+    """Forward a local port to `remote_port` on `host` through a shared SSH
+    connection, which stays open for ``ssh_control_persist`` seconds after
+    the last tunnel through it closes.
+
+    Tunnels opened while another to the same port is open reuse its local
+    port.
+
+    :returns: the local port.
+    """
+    ssh_cmd, user_at_host = _get_ssh_command(env_config, host)
+    control_path = _get_ssh_control_path(user_at_host, env_config.get("ssh_port"))
+    key = (control_path, remote_port)
+    with _shared_tunnels_lock:
+        tunnel = _shared_tunnels.get(key)
+        if tunnel is not None:
+            tunnel[1] += 1
+    if tunnel is None:
+        # Connecting can take seconds, so tunnels that already exist are not
+        # held up by it.  The lock file keeps us from connecting twice.
+        persist = env_config.get("ssh_control_persist", SSH_CONTROL_PERSIST)
+        if _ensure_ssh_master(ssh_cmd, user_at_host, control_path, persist):
+            if not quiet:
+                print(f"ssh connection to {user_at_host} established.")
+        with _shared_tunnels_lock:
+            tunnel = _shared_tunnels.get(key)
+            if tunnel is None:
+                for _ in range(3):
+                    forward = f"{_get_free_port()}:localhost:{remote_port}"
+                    if _ssh_control(
+                        ssh_cmd,
+                        user_at_host,
+                        control_path,
+                        "-O",
+                        "forward",
+                        "-L",
+                        forward,
+                    ):
+                        break
+                else:
+                    raise OSError(
+                        f"Unable to forward port {remote_port} on {host} through "
+                        f"the ssh connection at {control_path}"
+                    )
+                if not quiet:
+                    print(f"ssh tunnel to Nimbus {host}:{remote_port} established.")
+                tunnel = _shared_tunnels[key] = [forward, 0]
+            tunnel[1] += 1
+    try:
+        yield int(tunnel[0].split(":", 1)[0])
+    finally:
+        with _shared_tunnels_lock:
+            tunnel[1] -= 1
+            if not tunnel[1]:
+                del _shared_tunnels[key]
+                _ssh_control(
+                    ssh_cmd, user_at_host, control_path, "-O", "cancel", "-L", tunnel[0]
+                )
 
 
 @contextmanager
-def ssh_tunnel(env_config, local_port=6627, remote_port=None, quiet=False):
+def ssh_tunnel(env_config, local_port=None, remote_port=None, quiet=False):
     """Setup an optional ssh_tunnel to Nimbus.
 
-    If use_ssh_for_nimbus is False, no tunnel will be created.
+    If use_ssh_for_nimbus is False, no tunnel will be created.  Unless
+    ssh_control_master is False, every tunnel goes through one SSH connection
+    that is shared by every ``sparse`` command, on a free local port.
+
+    :param local_port: the first local port to try when ssh_control_master is
+                       False.  Defaults to 6627.  Deprecated, since the
+                       local port is picked for you otherwise.
+    :returns: the host and port to connect to.
     """
     host, nimbus_port = get_nimbus_host_port(env_config)
     if remote_port is None:
         remote_port = nimbus_port
-    if is_ssh_for_nimbus(env_config):
+    if is_ssh_for_nimbus(env_config) and use_ssh_control_master(env_config):
+        if local_port is not None:
+            warnings.warn(
+                "The 'local_port' argument to 'ssh_tunnel' is ignored when the "
+                "ssh connection is shared, and will be removed in the next "
+                "major release of streamparse.",
+                DeprecationWarning,
+            )
+        with _shared_ssh_tunnel(env_config, host, remote_port, quiet=quiet) as port:
+            yield "localhost", port
+    elif is_ssh_for_nimbus(env_config):
+        if local_port is None:
+            local_port = 6627
         need_setup = True
         while _port_in_use(local_port):
             if local_port in _active_tunnels:
@@ -67,23 +267,9 @@ def ssh_tunnel(env_config, local_port=6627, remote_port=None, quiet=False):
             local_port += 1
 
         if need_setup:
-            user = env_config.get("user")
-            port = env_config.get("ssh_port")
-            if user:
-                user_at_host = f"{user}@{host}"
-            else:
-                user_at_host = host  # Rely on SSH default or config to connect.
-
-            ssh_cmd = [
-                "ssh",
-                "-NL",
-                f"{local_port}:localhost:{remote_port}",
-                user_at_host,
-            ]
-            # Specify port if in config
-            if port:
-                ssh_cmd.insert(-1, "-p")
-                ssh_cmd.insert(-1, str(port))
+            ssh_cmd, user_at_host = _get_ssh_command(env_config, host)
+            ssh_cmd[1:1] = ["-NL", f"{local_port}:localhost:{remote_port}"]
+            ssh_cmd.append(user_at_host)
 
             ssh_proc = subprocess.Popen(ssh_cmd, shell=False)
             # Validate that the tunnel is actually running before yielding
@@ -139,6 +325,9 @@ def activate_env(env_name=None, options=None, config_file=None):
     env.disable_known_hosts = True
     env.forward_agent = True
     env.use_ssh_config = True
+    env.remote_executor = env_config.get("remote_executor", "asyncio")
+    env.remote_timeout = env_config.get("remote_timeout")
+    env.ssh_control_persist = env_config.get("ssh_control_persist", SSH_CONTROL_PERSIST)
     # fix for config file load issue
     if env_config.get("ssh_password"):
         env.password = env_config.get("ssh_password")
@@ -325,10 +514,19 @@ def get_storm_workers(env_config):
 
     worker_list = env_config.get("workers")
     if not worker_list:
-        with ssh_tunnel(env_config) as (host, port):
-            nimbus_client = get_nimbus_client(env_config, host=host, port=port)
-            cluster_info = nimbus_client.getClusterInfo()
-            worker_list = [supervisor.host for supervisor in cluster_info.supervisors]
+
+        def fetch_workers():
+            with ssh_tunnel(env_config) as (host, port):
+                nimbus_client = get_nimbus_client(env_config, host=host, port=port)
+                cluster_info = nimbus_client.getClusterInfo()
+                return [supervisor.host for supervisor in cluster_info.supervisors]
+
+        worker_list = cache.cached(
+            "storm_workers",
+            nimbus_info,
+            env_config.get("cache_ttl", cache.DEFAULT_CACHE_TTL),
+            fetch_workers,
+        )
 
     _storm_workers[nimbus_info] = worker_list
     return worker_list
@@ -347,11 +545,18 @@ def get_nimbus_config(env_config):
     """
     nimbus_info = get_nimbus_host_port(env_config)
     if nimbus_info not in _nimbus_configs:
-        with ssh_tunnel(env_config) as (host, port):
-            nimbus_client = get_nimbus_client(env_config, host=host, port=port)
-            nimbus_json = nimbus_client.getNimbusConf()
-            nimbus_conf = json.loads(nimbus_json)
-        _nimbus_configs[nimbus_info] = nimbus_conf
+
+        def fetch_nimbus_config():
+            with ssh_tunnel(env_config) as (host, port):
+                nimbus_client = get_nimbus_client(env_config, host=host, port=port)
+                return json.loads(nimbus_client.getNimbusConf())
+
+        _nimbus_configs[nimbus_info] = cache.cached(
+            "nimbus_config",
+            nimbus_info,
+            env_config.get("cache_ttl", cache.DEFAULT_CACHE_TTL),
+            fetch_nimbus_config,
+        )
     return _nimbus_configs[nimbus_info]
 
 
@@ -420,39 +625,98 @@ def storm_lib_version():
         return parse_version(versions.pop())
 
 
-def get_ui_jsons(env_name, api_paths, config_file=None):
+def _make_ui_session(pool_size, retries):
+    """Make a `requests.Session` that keeps up to `pool_size` connections to
+    the Storm UI open, and retries failed requests with backoff.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=Retry(
+            total=retries,
+            backoff_factor=0.2,
+            status_forcelist=(500, 502, 503, 504),
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _fetch_ui_json(session, url, timeout):
+    response = session.get(url, timeout=timeout)
+    data = response.json()
+    error = data.get("error")
+    if error:
+        error_msg = data.get("errorMessage")
+        raise RuntimeError(f"Received bad response from {url}: {error}\n{error_msg}")
+    return data
+
+
+def get_ui_jsons(
+    env_name,
+    api_paths,
+    config_file=None,
+    max_workers=UI_MAX_WORKERS,
+    timeout=UI_TIMEOUT_SECS,
+    retries=UI_RETRIES,
+):
     """Take env_name as a string and api_paths that should
     be a list of strings like '/api/v1/topology/summary'
+
+    The paths are requested concurrently, over one pool of connections.
+    Responses are cached on disk for the ``ui_cache_ttl`` of the environment.
+
+    :param max_workers: the most requests to have in flight at once.
+    :param timeout: the number of seconds to wait for each response.
+    :param retries: how many times to retry each failed request.
     """
-    _, env_config = get_env_config(env_name, config_file=config_file)
-    host, _ = get_nimbus_host_port(env_config)
+    env_name, env_config = get_env_config(env_name, config_file=config_file)
+    nimbus_host, _ = get_nimbus_host_port(env_config)
     # TODO: Get remote_ui_port from storm?
     remote_ui_port = env_config.get("ui.port", 8080)
-    # SSH tunnel can take a while to close. Check multiples if necessary.
-    local_ports = list(range(8081, 8090))
-    shuffle(local_ports)
-    for local_port in local_ports:
-        try:
-            data = {}
-            with ssh_tunnel(
-                env_config, local_port=local_port, remote_port=remote_ui_port
-            ) as (host, local_port):
-                for api_path in api_paths:
-                    url = f"http://{host}:{local_port}{api_path}"
-                    r = requests.get(url)
-                    data[api_path] = r.json()
-                    error = data[api_path].get("error")
-                    if error:
-                        error_msg = data[api_path].get("errorMessage")
-                        raise RuntimeError(
-                            f"Received bad response from {url}: {error}\n{error_msg}"
-                        )
-            return data
-        except Exception as e:
-            if "already in use" in str(e):
-                continue
-            raise
-    raise RuntimeError("Cannot find local port for SSH tunnel to Storm Head.")
+    api_paths = list(dict.fromkeys(api_paths))
+    ttl = env_config.get("ui_cache_ttl", cache.DEFAULT_UI_CACHE_TTL)
+    data = {}
+    for api_path in api_paths:
+        cached_json = cache.load(
+            "ui", (env_name, nimbus_host, remote_ui_port, api_path), ttl
+        )
+        if cached_json is not None:
+            data[api_path] = cached_json
+    missing_paths = [api_path for api_path in api_paths if api_path not in data]
+    if not missing_paths:
+        return data
+    # The tunnel finds a free local port itself
+    with ssh_tunnel(env_config, remote_port=remote_ui_port) as (host, local_port):
+        num_workers = max(1, min(max_workers, len(missing_paths)))
+        with _make_ui_session(num_workers, retries) as session:
+            with ThreadPoolExecutor(max_workers=num_workers) as pool:
+                futures = {
+                    api_path: pool.submit(
+                        _fetch_ui_json,
+                        session,
+                        f"http://{host}:{local_port}{api_path}",
+                        timeout,
+                    )
+                    for api_path in missing_paths
+                }
+                try:
+                    for api_path, future in futures.items():
+                        data[api_path] = future.result()
+                except Exception:
+                    for future in futures.values():
+                        future.cancel()
+                    raise
+    if ttl and ttl > 0:
+        for api_path in missing_paths:
+            cache.store(
+                "ui",
+                (env_name, nimbus_host, remote_ui_port, api_path),
+                data[api_path],
+            )
+    return {api_path: data[api_path] for api_path in api_paths}
 
 
 def get_ui_json(env_name, api_path, config_file=None):
@@ -575,8 +839,16 @@ def set_topology_serializer(env_config, config, topology_class):
     This is necessary because the `Topology` class has no information about the
     user-specified serializer, but it needs to be passed as an argument to
     ``streamparse_run``.
+
+    :raises ValueError: if the serializer has no Java counterpart for Storm to
+                        talk to it with.
     """
     serializer = env_config.get("serializer", config.get("serializer", None))
+    if serializer in PYTHON_ONLY_SERIALIZERS:
+        raise ValueError(
+            f"The {serializer} serializer has no Java counterpart in Storm, so "
+            "it can only be used with sparse bench and sparse run --simulate."
+        )
     if serializer is not None:
         # Set serializer arg in bolts
         for thrift_bolt in topology_class.thrift_bolts.values():
@@ -590,6 +862,27 @@ def set_topology_serializer(env_config, config, topology_class):
                 inner_shell.script = f"-s {serializer} {inner_shell.script}"
 
 
+def set_topology_zygote(options, topology_class):
+    """Go through the Python components in a `Topology` and enable zygotes.
+
+    Like the serializer, whether ``streamparse_run`` should use a zygote has to
+    be known before Storm sends us the topology config, so it is passed as an
+    argument to ``streamparse_run`` when ``streamparse.run.zygote`` is set.
+    """
+    if not options.get("streamparse.run.zygote", False):
+        return
+    for thrift_component in chain(
+        (bolt.bolt_object for bolt in topology_class.thrift_bolts.values()),
+        (spout.spout_object for spout in topology_class.thrift_spouts.values()),
+    ):
+        inner_shell = thrift_component.shell
+        if (
+            inner_shell is not None
+            and "streamparse_run" in inner_shell.execution_command
+        ):
+            inner_shell.script = f"--zygote {inner_shell.script}"
+
+
 def run_cmd(cmd, user, **kwargs):
     with show("everything"):
         with settings(warn_only=True):
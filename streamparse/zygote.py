@@ -0,0 +1,450 @@
+"""
+Warm-worker ("zygote") support for ``streamparse_run``.
+
+Starting a Python executor normally means starting a fresh interpreter and
+importing streamparse, pystorm, and the topology code from scratch.  With
+``streamparse.run.zygote`` enabled, ``streamparse_run`` instead connects to a
+long-lived process on the same host that has already done those imports, hands
+it the pipes Storm gave us, and waits while the zygote forks a child that runs
+the component on those pipes.
+
+The first ``streamparse_run`` on a host finds no zygote, starts one in the
+background for the executors that follow, and falls back to a cold start
+itself.  Zygotes exit after ``ZYGOTE_IDLE_TIMEOUT`` seconds without any running
+children, so the ones left behind by old deployments clean themselves up.
+
+.. note::
+    Topology modules are imported inside the zygote before it forks, so they
+    should not start threads or open connections at import time.  Do that in
+    ``initialize`` instead.
+"""
+
+import argparse
+import array
+import errno
+import fcntl
+import hashlib
+import os
+import select
+import signal
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+import simplejson as json
+
+from . import run
+
+ZYGOTE_IDLE_TIMEOUT = 600
+_HEADER = struct.Struct(">I")
+_MAX_FDS = 3
+
+
+def get_zygote_dir():
+    """Get the directory for the sockets and locks of this user's zygotes.
+
+    Clients hand zygotes their pipes to Storm and their environment, so the
+    directory must be private to us.
+
+    :raises PermissionError: if the directory is a symlink, is owned by
+                             another user, or is accessible by other users.
+    """
+    zygote_dir = os.path.join(
+        tempfile.gettempdir(), f"streamparse_zygote_{os.getuid()}"
+    )
+    os.makedirs(zygote_dir, mode=0o700, exist_ok=True)
+    dir_stat = os.lstat(zygote_dir)
+    if (
+        not stat.S_ISDIR(dir_stat.st_mode)
+        or dir_stat.st_uid != os.getuid()
+        or dir_stat.st_mode & 0o077
+    ):
+        raise PermissionError(
+            f"{zygote_dir} must be a directory only accessible by user "
+            f"{os.getuid()}."
+        )
+    return zygote_dir
+
+
+def get_socket_path(import_path):
+    """Get the path of the Unix socket the zygote for `import_path` uses.
+
+    Zygotes are keyed by interpreter and code directory, so every topology
+    deployment (and every virtualenv) gets its own.
+    """
+    key = f"{sys.executable}:{os.path.realpath(import_path)}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(get_zygote_dir(), f"{digest}.sock")
+
+
+def _get_peer_uid(sock):
+    """Get the user ID of the process on the other end of Unix socket `sock`.
+
+    :returns: the user ID, or ``None`` if this platform cannot tell us.
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = struct.Struct("3i")
+    _, uid, _ = creds.unpack(
+        sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, creds.size)
+    )
+    return uid
+
+
+def _owned_by_us(sock):
+    """Check that the process on the other end of `sock` is run by our user."""
+    peer_uid = _get_peer_uid(sock)
+    return peer_uid is None or peer_uid == os.getuid()
+
+
+def _send_msg(sock, msg, fds=None):
+    """Send a length-prefixed JSON message, optionally with file descriptors."""
+    payload = json.dumps(msg).encode("utf-8")
+    data = _HEADER.pack(len(payload)) + payload
+    if fds:
+        ancillary = [
+            (socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds).tobytes())
+        ]
+        sent = sock.sendmsg([data], ancillary)
+        data = data[sent:]
+    if data:
+        sock.sendall(data)
+
+
+def _recv_exactly(sock, num_bytes):
+    chunks = []
+    while num_bytes:
+        chunk = sock.recv(num_bytes)
+        if not chunk:
+            raise EOFError("Connection closed while reading message.")
+        chunks.append(chunk)
+        num_bytes -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_msg(sock):
+    """Receive a message sent by `_send_msg`.
+
+    :returns: a `tuple` of the decoded message and a `list` of any file
+              descriptors that came with it.
+    """
+    fd_array = array.array("i")
+    data, ancdata, _, _ = sock.recvmsg(
+        _HEADER.size, socket.CMSG_LEN(_MAX_FDS * fd_array.itemsize)
+    )
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            usable = len(cmsg_data) - (len(cmsg_data) % fd_array.itemsize)
+            fd_array.frombytes(cmsg_data[:usable])
+    if not data:
+        raise EOFError("Connection closed while reading message.")
+    data += _recv_exactly(sock, _HEADER.size - len(data))
+    (length,) = _HEADER.unpack(data)
+    return json.loads(_recv_exactly(sock, length).decode("utf-8")), list(fd_array)
+
+
+def _exit_code_from_status(status):
+    """Convert a status from `os.waitpid` into a shell-style exit code."""
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def start_zygote(import_path, socket_path=None):
+    """Start a zygote for `import_path` in the background.
+
+    The zygote takes a lock on startup, so calling this while another zygote
+    is running or starting up is harmless.
+    """
+    if socket_path is None:
+        socket_path = get_socket_path(import_path)
+    with open(os.devnull, "r+b") as devnull:
+        subprocess.Popen(
+            [sys.executable, "-m", "streamparse.zygote", import_path, socket_path],
+            stdin=devnull,
+            stdout=devnull,
+            stderr=devnull,
+            close_fds=True,
+            start_new_session=True,
+        )
+
+
+def run_in_zygote(target_class, serializer, socket_path=None):
+    """Run `target_class` in a child of the zygote for the current directory.
+
+    :returns: The exit code of the child process, or ``None`` if there was no
+              zygote available to run it, in which case the caller should
+              start the component itself.
+    """
+    mod_name = target_class.rsplit(".", 1)[0]
+    import_path = run.get_import_path(mod_name)
+    try:
+        if socket_path is None:
+            socket_path = get_socket_path(import_path)
+        socket_uid = os.lstat(socket_path).st_uid
+    except FileNotFoundError:
+        start_zygote(import_path, socket_path)
+        return None
+    except OSError as e:
+        sys.stderr.write(f"Not using streamparse zygote: {e}\n")
+        return None
+    if socket_uid != os.getuid():
+        sys.stderr.write(
+            f"Not using streamparse zygote: {socket_path} is owned by user "
+            f"{socket_uid}.\n"
+        )
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        start_zygote(import_path, socket_path)
+        return None
+
+    with sock:
+        # Never hand our pipes and environment to another user's process
+        if not _owned_by_us(sock):
+            sys.stderr.write(
+                f"Not using streamparse zygote: {socket_path} is served by "
+                "another user.\n"
+            )
+            return None
+        request = {
+            "target_class": target_class,
+            "serializer": serializer,
+            "import_path": import_path,
+            "cwd": os.getcwd(),
+            "environ": dict(os.environ),
+            "argv": sys.argv,
+        }
+        try:
+            _send_msg(sock, request, fds=[0, 1, 2])
+            reply, _ = _recv_msg(sock)
+        except (OSError, EOFError):
+            return None
+        if "error" in reply:
+            sys.stderr.write(f"streamparse zygote failed: {reply['error']}\n")
+            return None
+        child_pid = reply["pid"]
+
+        # Storm stops components by signalling the process it started, so make
+        # sure those signals reach the process actually running the component.
+        def forward_signal(signum, frame):
+            try:
+                os.kill(child_pid, signum)
+            except OSError:
+                pass
+
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, forward_signal)
+
+        try:
+            reply, _ = _recv_msg(sock)
+            return reply["exit_code"]
+        except (OSError, EOFError):
+            pass
+
+    # The zygote went away, but our child may not have, so keep waiting on it
+    while True:
+        try:
+            os.kill(child_pid, 0)
+        except OSError as e:
+            if e.errno != errno.EPERM:
+                return 1
+        time.sleep(1)
+
+
+class Zygote:
+    """Server that forks pre-warmed component processes on request."""
+
+    def __init__(self, import_path, socket_path, idle_timeout=ZYGOTE_IDLE_TIMEOUT):
+        self.import_path = import_path
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.children = {}
+        self.listener = None
+        self._lock_file = None
+        self._last_active = time.time()
+
+    def acquire_lock(self):
+        """Make sure we are the only zygote for our socket path."""
+        # Don't follow symlinks, so nobody can get us to truncate their file
+        fd = os.open(
+            f"{self.socket_path}.lock",
+            os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW,
+            0o600,
+        )
+        self._lock_file = os.fdopen(fd, "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+        return True
+
+    def preload(self):
+        """Import everything that every component needs before forking."""
+        # These are imported here so only the zygote pays for them up front
+        import pystorm  # noqa: F401
+        import streamparse  # noqa: F401
+
+        if self.import_path not in sys.path:
+            sys.path.append(self.import_path)
+
+    def listen(self):
+        tmp_path = f"{self.socket_path}.{os.getpid()}"
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(tmp_path)
+        os.chmod(tmp_path, 0o600)
+        self.listener.listen(128)
+        # Rename so clients never see a socket nobody is listening on yet
+        os.rename(tmp_path, self.socket_path)
+
+    def serve_forever(self):
+        """Accept requests until we have been idle for `idle_timeout`."""
+        if not self.acquire_lock():
+            return
+        self.preload()
+        self.listen()
+        try:
+            while True:
+                readable, _, _ = select.select([self.listener], [], [], 1.0)
+                if readable:
+                    conn, _ = self.listener.accept()
+                    self._last_active = time.time()
+                    self.handle_request(conn)
+                self.reap_children()
+                if (
+                    not self.children
+                    and time.time() - self._last_active > self.idle_timeout
+                ):
+                    break
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        try:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        finally:
+            if self.listener is not None:
+                self.listener.close()
+            if self._lock_file is not None:
+                self._lock_file.close()
+
+    def handle_request(self, conn):
+        if not _owned_by_us(conn):
+            conn.close()
+            return
+        try:
+            request, fds = _recv_msg(conn)
+        except (OSError, EOFError, ValueError):
+            conn.close()
+            return
+        try:
+            if len(fds) != 3:
+                raise ValueError(f"Expected 3 file descriptors, got {len(fds)}.")
+            # Importing in the zygote means only the first executor of each
+            # component class on this host pays for the import.
+            cls = run.load_component_class(
+                request["target_class"], import_path=request["import_path"]
+            )
+        except Exception:
+            _send_msg(conn, {"error": traceback.format_exc()})
+            conn.close()
+            for fd in fds:
+                os.close(fd)
+            return
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self._run_child(conn, cls, request, fds)
+        for fd in fds:
+            os.close(fd)
+        self.children[pid] = conn
+        try:
+            _send_msg(conn, {"pid": pid})
+        except OSError:
+            pass
+
+    def _run_child(self, conn, cls, request, fds):
+        """Set up the forked child to look like Storm started it, and run."""
+        exit_code = 1
+        try:
+            self.listener.close()
+            conn.close()
+            for other_conn in self.children.values():
+                other_conn.close()
+            if self._lock_file is not None:
+                self._lock_file.close()
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            for target_fd, fd in enumerate(fds):
+                os.dup2(fd, target_fd)
+                os.close(fd)
+            os.chdir(request["cwd"])
+            os.environ.clear()
+            os.environ.update(request["environ"])
+            sys.argv = request["argv"]
+            cls(serializer=request["serializer"]).run()
+            exit_code = 0
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(exit_code)
+
+    def reap_children(self):
+        """Tell clients about children that have exited."""
+        for pid in list(self.children):
+            try:
+                finished_pid, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                finished_pid, status = pid, 0
+            if finished_pid == 0:
+                continue
+            conn = self.children.pop(pid)
+            self._last_active = time.time()
+            try:
+                _send_msg(conn, {"exit_code": _exit_code_from_status(status)})
+            except OSError:
+                pass
+            conn.close()
+
+
+def main():
+    """Entry point for the background zygote process."""
+    parser = argparse.ArgumentParser(
+        description="Run a streamparse zygote.",
+        epilog="This is internal to streamparse and is started automatically "
+        "by streamparse_run when the streamparse.run.zygote option is set.",
+    )
+    parser.add_argument("import_path", help="Directory containing topology code.")
+    parser.add_argument("socket_path", help="Unix socket to listen on.")
+    parser.add_argument(
+        "--idle_timeout",
+        type=float,
+        default=ZYGOTE_IDLE_TIMEOUT,
+        help="Seconds to stay alive without running children. "
+        "(default: %(default)s)",
+    )
+    args = parser.parse_args()
+    Zygote(args.import_path, args.socket_path, args.idle_timeout).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import io
+import itertools
+from unittest.mock import patch
+
+import simplejson as json
+
+from streamparse.cli.bench import (
+    ComponentProcess,
+    _percentile,
+    get_bolt_spec,
+    get_input_fields,
+    main,
+    make_handshake,
+    recorded_tuples,
+    run_benchmark,
+    serializer_cost_us,
+    subparser_hook,
+    synthetic_tuples,
+)
+from streamparse.dsl import Topology
+from streamparse.storm import Bolt, Spout
+
+
+class WordSpout(Spout):
+    outputs = ["word", "weight"]
+
+
+class UpperBolt(Bolt):
+    outputs = ["word"]
+
+    def process(self, tup):
+        if tup.values.word == "fail":
+            raise ValueError("fail")
+        self.emit([tup.values.word.upper()])
+
+
+class BenchTopology(Topology):
+    word_spout = WordSpout.spec()
+    upper_bolt = UpperBolt.spec(inputs=[word_spout])
+
+
+def _parse(arg_str):
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+    subparser_hook(subparsers)
+    return parser.parse_args(arg_str.split())
+
+
+def test_subparser_hook():
+    args = _parse("bench upper_bolt -t 50 --json")
+    assert args.component == "upper_bolt"
+    assert args.tuples == 50
+    assert args.json
+
+
+def test_percentile():
+    values = list(range(1, 1001))
+    assert _percentile(values, 50) == 500
+    assert _percentile(values, 99) == 990
+    assert _percentile(values, 99.9) == 999
+    assert _percentile([], 50) is None
+
+
+def test_get_bolt_spec():
+    assert get_bolt_spec(BenchTopology, "upper_bolt").component_cls is UpperBolt
+    for name in ("word_spout", "nope"):
+        try:
+            get_bolt_spec(BenchTopology, name)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{name} should not be benchmarkable")
+
+
+def test_synthetic_and_recorded_tuples():
+    spec = get_bolt_spec(BenchTopology, "upper_bolt")
+    input_fields = get_input_fields(BenchTopology, spec)
+    assert input_fields == {("word_spout", "default"): ["word", "weight"]}
+    component, stream, values = next(synthetic_tuples(input_fields, value_size=4))
+    assert (component, stream) == ("word_spout", "default")
+    assert [len(value) for value in values] == [4, 4]
+
+    lines = ['["dog", 1]', "", '{"stream": "default", "tuple": ["cat", 2]}']
+    tuples = list(itertools.islice(recorded_tuples(lines, input_fields), 3))
+    assert tuples == [
+        ("word_spout", "default", ["dog", 1]),
+        ("word_spout", "default", ["cat", 2]),
+        ("word_spout", "default", ["dog", 1]),
+    ]
+
+
+def test_serializer_cost():
+    tuples = itertools.repeat(("word_spout", "default", ["dog", 1]))
+    assert serializer_cost_us("json", tuples, num_samples=10) > 0
+
+
+def test_run_benchmark():
+    spec = get_bolt_spec(BenchTopology, "upper_bolt")
+    conf, context = make_handshake(BenchTopology, spec, "bench")
+    assert context["source->stream->fields"] == {
+        "word_spout": {"default": ["word", "weight"]}
+    }
+    component = ComponentProcess(spec, conf, context)
+    try:
+        results = run_benchmark(
+            component,
+            itertools.repeat(("word_spout", "default", ["dog", 1])),
+            num_tuples=200,
+            warmup=20,
+            max_pending=10,
+            timeout=30,
+        )
+    finally:
+        component.close()
+    assert results["tuples"] == 200
+    assert results["acked"] == 200
+    assert results["emitted"] >= 200
+    assert not results["timed_out"]
+    assert results["tuples_per_sec"] > 0
+    assert 0 < results["latency_p50_ms"] <= results["latency_p999_ms"]
+
+
+def test_run_benchmark_without_warmup():
+    spec = get_bolt_spec(BenchTopology, "upper_bolt")
+    conf, context = make_handshake(BenchTopology, spec, "bench")
+    component = ComponentProcess(spec, conf, context)
+    try:
+        results = run_benchmark(
+            component,
+            itertools.repeat(("word_spout", "default", ["dog", 1])),
+            num_tuples=50,
+            warmup=0,
+            max_pending=10,
+            timeout=30,
+        )
+    finally:
+        component.close()
+    assert results["tuples"] == 50
+    # Timed from the start, not from the last Tuple
+    assert results["elapsed_secs"] > 0
+    assert results["tuples_per_sec"] > 0
+    assert results["rss_start_kb"] is not None
+    assert results["rss_growth_kb"] is not None
+
+
+@patch("streamparse.cli.bench.bench_component", autospec=True)
+def test_main_json(bench_mock, capsys):
+    bench_mock.return_value = {"tuples": 10, "tuples_per_sec": 5.0}
+    main(_parse("bench upper_bolt -n topo --json"))
+    assert json.loads(capsys.readouterr().out) == {"tuples": 10, "tuples_per_sec": 5.0}
+    assert bench_mock.call_args[1]["name"] == "topo"
@@ -1,6 +1,12 @@
 import argparse
 import unittest
+import zipfile
+from unittest import mock
 
+import pytest
+
+from streamparse import cache
+from streamparse.cli import jar
 from streamparse.cli.jar import subparser_hook
 
 
@@ -11,3 +17,89 @@ def test_subparser_hook():
 
     subcommands = parser._optionals._actions[1].choices.keys()
     assert "jar" in subcommands
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cache, "_refresh", False)
+    (tmp_path / "project.clj").write_text("(defproject wordcount)")
+    (tmp_path / "src" / "bolts").mkdir(parents=True)
+    (tmp_path / "src" / "bolts" / "wordcount.py").write_text("COUNT = 1\n")
+    (tmp_path / "src" / "spouts.py").write_text("WORDS = []\n")
+    (tmp_path / "src" / "util.clj").write_text("(ns util)")
+
+    def build_jar(simple_jar=False):
+        # Like Leiningen, put src at the top level and under resources/
+        jar = tmp_path / "_build" / "wordcount.jar"
+        jar.parent.mkdir(exist_ok=True)
+        with zipfile.ZipFile(jar, "w", zipfile.ZIP_DEFLATED) as built:
+            built.writestr("META-INF/MANIFEST.MF", "Manifest-Version: 1.0\n")
+            for path in sorted((tmp_path / "src").rglob("*.*")):
+                rel_path = path.relative_to(tmp_path / "src").as_posix()
+                built.write(path, rel_path)
+                built.write(path, f"resources/{rel_path}")
+            built.writestr("org/example/Dependency.class", b"\xca\xfe" * 1000)
+        return str(jar)
+
+    mock_build = mock.Mock(side_effect=build_jar)
+    monkeypatch.setattr(jar, "_build_jar", mock_build)
+    return tmp_path, mock_build
+
+
+def read_jar(path):
+    with zipfile.ZipFile(path) as jar_file:
+        assert jar_file.testzip() is None
+        return {name: jar_file.read(name) for name in jar_file.namelist()}
+
+
+def test_jar_for_deploy_reuses_jar(project):
+    _, mock_build = project
+    first = jar.jar_for_deploy()
+    assert jar.jar_for_deploy() == first
+    assert mock_build.call_count == 1
+    assert read_jar(first)["resources/spouts.py"] == b"WORDS = []\n"
+
+
+def test_jar_for_deploy_patches_python(project):
+    tmp_path, mock_build = project
+    first = jar.jar_for_deploy()
+    before = read_jar(first)
+    for count in (2, 3):
+        (tmp_path / "src" / "bolts" / "wordcount.py").write_text(f"COUNT = {count}\n")
+        assert jar.jar_for_deploy() == first
+    assert mock_build.call_count == 1
+    after = read_jar(first)
+    assert sorted(after) == sorted(before)
+    assert after["resources/bolts/wordcount.py"] == b"COUNT = 3\n"
+    assert after["bolts/wordcount.py"] == b"COUNT = 3\n"
+    for name in before:
+        if not name.endswith("wordcount.py"):
+            assert after[name] == before[name]
+
+
+def test_jar_for_deploy_rebuilds(project):
+    tmp_path, mock_build = project
+    first = jar.jar_for_deploy()
+    (tmp_path / "src" / "util.clj").write_text("(ns util2)")
+    second = jar.jar_for_deploy()
+    assert second != first
+    (tmp_path / "src" / "new_bolt.py").write_text("")
+    third = jar.jar_for_deploy()
+    assert third != second
+    assert "resources/new_bolt.py" in read_jar(third)
+    assert jar.jar_for_deploy(simple_jar=True) != third
+    cache.set_refresh()
+    assert jar.jar_for_deploy(simple_jar=True)
+    assert mock_build.call_count == 5
+    assert len(list((tmp_path / "_cache" / "jars").glob("*.jar"))) == 3
+
+
+def test_jar_for_deploy_rebuilds_broken_jar(project):
+    tmp_path, mock_build = project
+    first = jar.jar_for_deploy()
+    with open(first, "wb") as jar_file:
+        jar_file.write(b"not a jar")
+    (tmp_path / "src" / "spouts.py").write_text("WORDS = ['dog']\n")
+    assert read_jar(jar.jar_for_deploy())["spouts.py"] == b"WORDS = ['dog']\n"
+    assert mock_build.call_count == 2
@@ -0,0 +1,154 @@
+import argparse
+import io
+import sys
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from fabric.api import env
+
+from streamparse.cli import logs
+from streamparse.cli.logs import (
+    get_search_cmd,
+    merge_matches,
+    parse_time,
+    search_logs,
+    subparser_hook,
+)
+from streamparse.remote import LocalTransport, RemoteExecutor
+
+
+def test_subparser_hook():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+    subparser_hook(subparsers)
+
+    subcommands = parser._optionals._actions[1].choices.keys()
+    assert "logs" in subcommands
+    args = parser.parse_args(["logs", "search", "-i", "--since", "2h", "error"])
+    assert args.func is logs.main_search
+    assert args.regex == "error"
+    assert args.ignore_case
+
+
+def test_parse_time():
+    now = datetime(2024, 3, 1, 12, 30, 0)
+    assert parse_time("30m", now=now) == "2024-03-01 12:00:00.000"
+    assert parse_time("1d", now=now) == "2024-02-29 12:30:00.000"
+    assert parse_time("2024-03-01") == "2024-03-01 00:00:00.000"
+    assert parse_time("2024-03-01T08:15:00") == "2024-03-01 08:15:00.000"
+    with pytest.raises(ValueError):
+        parse_time("yesterday")
+
+
+def test_merge_matches():
+    outputs = {
+        "worker1": '{"timestamp": "2024-03-01 12:00:00.000", "text": "a"}\n'
+        '{"timestamp": "2024-03-01 12:00:02.000", "text": "c"}\n',
+        "worker2": 'Welcome to worker2\n{"timestamp": "2024-03-01 12:00:01.000", '
+        '"text": "b"}\n',
+    }
+    matches, truncated = merge_matches(outputs, max_results=10)
+    assert [(match["host"], match["text"]) for match in matches] == [
+        ("worker1", "a"),
+        ("worker2", "b"),
+        ("worker1", "c"),
+    ]
+    assert not truncated
+    matches, truncated = merge_matches(outputs, max_results=2)
+    assert [match["text"] for match in matches] == ["b", "c"]
+    assert truncated
+
+
+class WorkerDirTransport(LocalTransport):
+    """Runs commands for each host in its own directory."""
+
+    def __init__(self, root):
+        self.root = root
+
+    async def start(self, host, command, merge_stderr=True):
+        return await super().start(
+            host, f"cd {self.root}/{host} && {command}", merge_stderr=merge_stderr
+        )
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Give each of two workers a log file in its own directory, and get an
+    executor for them.
+    """
+    for host, second in (("worker1", 0), ("worker2", 1)):
+        log_dir = tmp_path / host
+        log_dir.mkdir()
+        (log_dir / "pystorm_wordcount_split_3_100.log").write_text(
+            f"2024-03-01 12:00:0{second},000 - split - ERROR - failed on {host}\n"
+            f"2024-03-01 12:00:0{second + 2},000 - split - INFO - fine\n"
+        )
+    with patch.dict(env, storm_workers=["worker1", "worker2"], log_path="."):
+        yield RemoteExecutor(WorkerDirTransport(tmp_path), output=io.StringIO())
+
+
+@patch.dict(env, log_path="/var/log/storm")
+def test_get_search_cmd():
+    cmd = get_search_cmd("wordcount", regex="it's \\d+ $HOME")
+    assert cmd.startswith("python3 -c 'import base64, sys; ")
+    # Nothing the shell would touch
+    assert "$" not in cmd.split("'")[-1]
+    assert "\\" not in cmd
+
+
+@patch("streamparse.cli.logs.activate_env")
+@patch("streamparse.cli.logs.get_env_config", return_value=("prod", {}))
+def test_search_logs(get_env_config_mock, activate_mock, workers, capsys):
+    with patch.object(logs, "SEARCH_PYTHON", sys.executable), patch.object(
+        logs, "get_executor", return_value=workers
+    ):
+        matches = search_logs(override_name="wordcount", regex="ERROR")
+    assert [(match["host"], match["component"]) for match in matches] == [
+        ("worker1", "split"),
+        ("worker2", "split"),
+    ]
+    out = capsys.readouterr().out
+    assert out.splitlines() == [
+        "[worker1] [split] 2024-03-01 12:00:00,000 - split - ERROR - failed on worker1",
+        "[worker2] [split] 2024-03-01 12:00:01,000 - split - ERROR - failed on worker2",
+    ]
+
+
+@patch("streamparse.cli.logs.activate_env")
+@patch("streamparse.cli.logs.get_env_config", return_value=("prod", {}))
+def test_search_logs_max_results(get_env_config_mock, activate_mock, workers, capsys):
+    with patch.object(logs, "SEARCH_PYTHON", sys.executable), patch.object(
+        logs, "get_executor", return_value=workers
+    ):
+        matches = search_logs(
+            override_name="wordcount", since="2024-03-01 12:00:01.000", max_results=2
+        )
+    assert [match["timestamp"] for match in matches] == [
+        "2024-03-01 12:00:02.000",
+        "2024-03-01 12:00:03.000",
+    ]
+    assert "Showing the 2 newest matches." in capsys.readouterr().err
+
+
+@patch.dict(env, storm_workers=["worker1"], log_path="/var/log/storm")
+@patch("streamparse.cli.logs.activate_env")
+@patch("streamparse.cli.logs.get_env_config", return_value=("prod", {}))
+@patch("streamparse.cli.logs.get_executor", return_value=None)
+@patch("streamparse.cli.logs.execute")
+def test_search_logs_with_fabric(
+    execute_mock, get_executor_mock, get_env_config_mock, activate_mock
+):
+    execute_mock.return_value = {
+        "worker1": '{"timestamp": "2024-03-01 12:00:00.000", "component": "split", '
+        '"text": "a"}'
+    }
+    matches = search_logs(override_name="wordcount")
+    assert execute_mock.call_args[0][0] is logs._search_logs
+    assert execute_mock.call_args[1]["hosts"] == ["worker1"]
+    assert [match["text"] for match in matches] == ["a"]
+
+
+def test_search_logs_invalid_regex():
+    with pytest.raises(SystemExit):
+        search_logs(override_name="wordcount", regex="(")
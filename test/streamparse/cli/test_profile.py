@@ -0,0 +1,56 @@
+import argparse
+import os
+from collections import Counter
+from unittest.mock import patch
+
+import pytest
+from fabric.api import env
+
+from streamparse.cli.profile import (
+    get_profiles_cmd,
+    profile_topology,
+    subparser_hook,
+)
+from streamparse.profiler import read_collapsed
+
+
+def test_subparser_hook():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+    subparser_hook(subparsers)
+
+    subcommands = parser._optionals._actions[1].choices.keys()
+    assert "profile" in subcommands
+
+
+@patch.dict(env, log_path="/var/log/storm")
+def test_get_profiles_cmd():
+    cmd = get_profiles_cmd("wordcount", pattern="count_bolt")
+    assert cmd.startswith("cd /var/log/storm && find")
+    assert "*streamparse_profile_wordcount_*.folded" in cmd
+    assert cmd.endswith(" | egrep 'count_bolt' | xargs -r cat")
+
+
+@patch.dict(env, storm_workers=["worker1", "worker2"])
+@patch("streamparse.cli.profile.activate_env")
+@patch("streamparse.cli.profile.get_env_config", return_value=("prod", {}))
+@patch("streamparse.cli.profile.execute")
+def test_profile_topology(execute_mock, get_env_config_mock, activate_mock, tmp_path):
+    execute_mock.return_value = {
+        "worker1": "main (a.py:1);work (a.py:5) 3\nmain (a.py:1) 1",
+        "worker2": "main (a.py:1);work (a.py:5) 2",
+    }
+    output = str(tmp_path / "wordcount.folded")
+    samples = profile_topology(override_name="wordcount", output=output)
+    assert samples == Counter({"main (a.py:1);work (a.py:5)": 5, "main (a.py:1)": 1})
+    with open(output, encoding="utf-8") as profile_file:
+        assert read_collapsed(profile_file) == samples
+
+
+@patch.dict(env, storm_workers=["worker1", "worker2"])
+@patch("streamparse.cli.profile.activate_env")
+@patch("streamparse.cli.profile.get_env_config", return_value=("prod", {}))
+@patch("streamparse.cli.profile.execute", return_value={"worker1": ""})
+def test_profile_topology_no_profiles(execute_mock, get_env_config_mock, activate_mock):
+    with pytest.raises(SystemExit):
+        profile_topology(override_name="wordcount")
@@ -0,0 +1,81 @@
+import argparse
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from streamparse.capture import CaptureWriter
+from streamparse.cli.replay import replay_capture, subparser_hook
+from streamparse.storm import Bolt
+
+
+class CountingBolt(Bolt):
+    processed = []
+
+    def process(self, tup):
+        CountingBolt.processed.append(tup.values.word)
+
+
+@pytest.fixture
+def capture_path():
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "bolt.spcap")
+    handshake = {
+        "class": f"{__name__}.CountingBolt",
+        "conf": {"streamparse.capture.enabled": True, "pystorm.log.path": "/nope"},
+        "context": {
+            "taskid": 1,
+            "componentid": "counting_bolt",
+            "source->stream->fields": {"spout": {"default": ["word"]}},
+        },
+    }
+    writer = CaptureWriter(path, handshake)
+    for word in ("dog", "cat"):
+        writer.record(
+            {
+                "id": word,
+                "comp": "spout",
+                "stream": "default",
+                "task": 2,
+                "tuple": [word],
+            }
+        )
+    writer.close()
+    yield path
+    shutil.rmtree(tmp_dir)
+
+
+def test_subparser_hook():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+    subparser_hook(subparsers)
+
+    args = parser.parse_args("replay bolt.spcap -r 3 -p none".split())
+    assert args.capture == "bolt.spcap"
+    assert args.repeat == 3
+    assert args.profiler == "none"
+
+
+def test_replay_capture(capture_path, capsys, tmp_path):
+    CountingBolt.processed = []
+    output = str(tmp_path / "replay.prof")
+    replay_capture(capture_path, repeat=2, import_path=os.getcwd(), output=output)
+    assert CountingBolt.processed == ["dog", "cat", "dog", "cat"]
+    out = capsys.readouterr().out
+    assert "Replayed 4 messages" in out
+    assert "function calls" in out
+    assert os.path.exists(output)
+
+
+def test_invalid_profiler(capture_path):
+    with pytest.raises(ValueError):
+        replay_capture(capture_path, profiler="nope")
+
+
+def test_replay_capture_sampled(capture_path, capsys):
+    CountingBolt.processed = []
+    replay_capture(capture_path, profiler="sample", import_path=os.getcwd())
+    assert CountingBolt.processed == ["dog", "cat"]
+    assert f"samples to {capture_path}.folded" in capsys.readouterr().out
+    assert os.path.exists(f"{capture_path}.folded")
@@ -29,4 +29,17 @@ def test_main_args_passed(run_local_mock):
         env_name="my_env",
         time=0,
         config_file=None,
+        simulate=None,
     )
+
+
+@patch("streamparse.cli.run.run_local_topology", autospec=True)
+def test_simulate_defaults_to_threads(run_local_mock):
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+    subparser_hook(subparsers)
+
+    args = parser.parse_args("run -n my_topo --simulate".split())
+    assert args.simulate == "thread"
+    args = parser.parse_args("run -n my_topo --simulate process".split())
+    assert args.simulate == "process"
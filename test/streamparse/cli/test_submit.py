@@ -1,7 +1,26 @@
 import argparse
+import itertools
+import time
 import unittest
+from contextlib import contextmanager
+from unittest import mock
 
+import pytest
+from thriftpy2.thrift import TApplicationException
+from thriftpy2.transport import TTransportException
+
+from streamparse.cli import submit
 from streamparse.cli.submit import subparser_hook
+from streamparse.thrift import (
+    AccessControl,
+    AccessControlType,
+    AuthorizationException,
+    KeyAlreadyExistsException,
+    KeyNotFoundException,
+    ListBlobsResult,
+    ReadableBlobMeta,
+    SettableBlobMeta,
+)
 
 
 def test_subparser_hook():
@@ -11,3 +30,270 @@ def test_subparser_hook():
 
     subcommands = parser._optionals._actions[1].choices.keys()
     assert "submit" in subcommands
+
+
+class BlobStore(dict):
+    """Blob contents by key, with their ACLs."""
+
+    def __init__(self):
+        super().__init__()
+        self.acls = {}
+
+
+class FakeNimbus:
+    """Enough of Nimbus to upload JARs and blobs to.
+
+    Blob ACLs are normalized like Storm does, for the authenticated `user`,
+    or for nobody on an unsecured cluster if `user` is ``None``.
+    """
+
+    upload_ids = itertools.count()
+
+    def __init__(self, blobs=None, fail_after=None, leader="nimbus:6627", user=None):
+        self.uploads = {}
+        self.blobs = BlobStore() if blobs is None else blobs
+        self.sessions = {}
+        self.in_flight = self.max_in_flight = 0
+        self.fail_after = fail_after
+        self.leader = leader
+        self.user = user
+
+    def beginFileUpload(self):
+        location = f"/storm/nimbus/inbox/stormjar-{next(self.upload_ids)}.jar"
+        self.uploads[location] = b""
+        return location
+
+    def _send(self, api, location, chunk):
+        assert api == "uploadChunk"
+        if (
+            self.fail_after is not None
+            and len(self.uploads[location]) >= self.fail_after
+        ):
+            raise TTransportException(message="Connection reset")
+        self.uploads[location] += chunk
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _recv(self, api):
+        self.in_flight -= 1
+
+    def finishFileUpload(self, location):
+        pass
+
+    def getLeader(self):
+        if self.leader is None:
+            raise TApplicationException(TApplicationException.UNKNOWN_METHOD)
+        host, port = self.leader.split(":")
+        return mock.Mock(host=host, port=int(port))
+
+    def beginBlobDownload(self, key):
+        if key not in self.blobs:
+            raise KeyNotFoundException(msg=key)
+        self.sessions[key] = [self.blobs[key], b""]
+        return mock.Mock(session=key)
+
+    def downloadBlobChunk(self, session):
+        return self.sessions[session].pop(0)
+
+    def _check_writable(self, key):
+        if key not in self.blobs:
+            raise KeyNotFoundException(msg=key)
+        for entry in self.blobs.acls[key]:
+            if entry.access & 0x2 and (
+                entry.type == AccessControlType.OTHER or entry.name == self.user
+            ):
+                return
+        raise AuthorizationException(msg=key)
+
+    def beginCreateBlob(self, key, meta):
+        if key in self.blobs:
+            raise KeyAlreadyExistsException(msg=key)
+        if self.user is None:
+            owner = AccessControl(type=AccessControlType.OTHER, access=0x7)
+        else:
+            owner = AccessControl(
+                type=AccessControlType.USER, name=self.user, access=0x7
+            )
+        self.blobs.acls[key] = list(meta.acl) + [owner]
+        return key
+
+    def beginUpdateBlob(self, key):
+        self._check_writable(key)
+        return key
+
+    def getBlobMeta(self, key):
+        if key not in self.blobs:
+            raise KeyNotFoundException(msg=key)
+        return ReadableBlobMeta(
+            settable=SettableBlobMeta(acl=self.blobs.acls[key]), version=1
+        )
+
+    def listBlobs(self, session):
+        # Two keys at a time, to page through them
+        start = int(session or 0)
+        keys = sorted(self.blobs)[start : start + 2]
+        return ListBlobsResult(keys=keys, session=str(start + 2))
+
+    def deleteBlob(self, key):
+        self._check_writable(key)
+        del self.blobs[key]
+        del self.blobs.acls[key]
+
+    def uploadBlobChunk(self, session, chunk):
+        self.sessions[session] = chunk
+
+    def finishBlobUpload(self, session):
+        self.blobs[session] = self.sessions.pop(session)
+
+
+@pytest.fixture
+def local_jar(tmp_path):
+    path = tmp_path / "topology.jar"
+    path.write_bytes(bytes(range(256)) * 1000)
+    return str(path)
+
+
+@pytest.fixture
+def nimbus(monkeypatch):
+    clients = []
+    tunnels = []
+    blobs = BlobStore()
+
+    @contextmanager
+    def fake_tunnel(env_config):
+        tunnels.append(env_config)
+        yield "localhost", 6627
+
+    def fake_client(env_config, host=None, port=None, timeout=None):
+        return clients.pop(0)
+
+    monkeypatch.setattr(submit, "ssh_tunnel", fake_tunnel)
+    monkeypatch.setattr(submit, "get_nimbus_client", fake_client)
+    monkeypatch.setattr(
+        submit,
+        "get_nimbus_config",
+        lambda env_config: {"nimbus.thrift.max_buffer_size": 16384 + 10000},
+    )
+    monkeypatch.setattr(submit.time, "sleep", lambda secs: None)
+    return clients, tunnels, blobs
+
+
+def test_upload_jar_pipelined(local_jar):
+    client = FakeNimbus()
+    location = submit._upload_jar(client, local_jar, chunk_size=1000, pipeline_depth=3)
+    with open(local_jar, "rb") as jar_file:
+        assert client.uploads[location] == jar_file.read()
+    assert client.max_in_flight == 3
+
+
+def test_upload_jar_reuses_upload(local_jar, nimbus):
+    clients, _, blobs = nimbus
+    first = FakeNimbus(blobs)
+    second = FakeNimbus(blobs)
+    clients.extend([first, second])
+    location = submit.upload_jar({}, local_jar)
+    assert len(first.uploads[location]) == 256000
+    assert first.max_in_flight == submit.UPLOAD_PIPELINE_DEPTH
+    assert list(blobs) == [f"{submit.JAR_BLOB_PREFIX}{submit._hash_jar(local_jar)}"]
+    assert submit.upload_jar({}, local_jar) == location
+    assert second.uploads == {}
+
+
+def test_upload_jar_expired_upload(local_jar, nimbus):
+    clients, _, blobs = nimbus
+    clients.append(FakeNimbus(blobs))
+    submit.upload_jar({}, local_jar)
+    with mock.patch.object(submit.time, "time", return_value=time.time() + 3400):
+        clients.append(FakeNimbus(blobs))
+        location = submit.upload_jar({}, local_jar)
+    clients.append(FakeNimbus(blobs))
+    assert submit.upload_jar({}, local_jar) == location
+    new_leader = FakeNimbus(blobs, leader="nimbus2:6627")
+    clients.append(new_leader)
+    assert submit.upload_jar({}, local_jar) != location
+    assert new_leader.uploads
+
+
+def test_upload_jar_secured_reuse(local_jar, nimbus, monkeypatch):
+    clients, _, blobs = nimbus
+    monkeypatch.setattr(
+        submit,
+        "get_nimbus_config",
+        lambda env_config: {"blobstore.acl.validation.enabled": True},
+    )
+    key = f"{submit.JAR_BLOB_PREFIX}{submit._hash_jar(local_jar)}"
+    env_config = {"storm_user": "alice"}
+    clients.append(FakeNimbus(blobs, user="alice"))
+    location = submit.upload_jar(env_config, local_jar)
+    # Others can only read the record
+    assert [(entry.type, entry.name, entry.access) for entry in blobs.acls[key]] == [
+        (AccessControlType.OTHER, None, 0x1),
+        (AccessControlType.USER, "alice", 0x7),
+    ]
+    clients.append(FakeNimbus(blobs, user="alice"))
+    assert submit.upload_jar(env_config, local_jar) == location
+
+    # Someone else pointed the record at their own upload
+    blobs.clear()
+    mallory = FakeNimbus(blobs, user="mallory")
+    submit._record_uploaded_jar(
+        mallory, submit._hash_jar(local_jar), "nimbus:6627", "/tmp/evil.jar"
+    )
+    alice = FakeNimbus(blobs, user="alice")
+    clients.append(alice)
+    assert submit.upload_jar(env_config, local_jar) not in (location, "/tmp/evil.jar")
+    assert alice.uploads
+
+
+def test_upload_jar_checks_hash(local_jar, nimbus):
+    clients, _, blobs = nimbus
+    clients.append(FakeNimbus(blobs))
+    location = submit.upload_jar({}, local_jar)
+    key = f"{submit.JAR_BLOB_PREFIX}{submit._hash_jar(local_jar)}"
+    blobs[key] = blobs[key].replace(b'"hash": "', b'"hash": "0')
+    clients.append(FakeNimbus(blobs))
+    assert submit.upload_jar({}, local_jar) != location
+
+
+def test_upload_jar_deletes_expired_records(local_jar, nimbus):
+    clients, _, blobs = nimbus
+    alice = FakeNimbus(blobs, user="alice")
+    now = time.time()
+    with mock.patch.object(submit.time, "time", return_value=now - 7200):
+        submit._record_uploaded_jar(alice, "old", "nimbus:6627", "/old.jar")
+        submit._record_uploaded_jar(
+            FakeNimbus(blobs, user="bob"), "bobs", "nimbus:6627", "/bobs.jar"
+        )
+    submit._record_uploaded_jar(alice, "new", "nimbus:6627", "/new.jar")
+    blobs["unrelated"] = b""
+    blobs.acls["unrelated"] = []
+    clients.append(FakeNimbus(blobs, user="alice"))
+    submit.upload_jar({}, local_jar)
+    assert sorted(blobs) == [
+        f"{submit.JAR_BLOB_PREFIX}{key}"
+        for key in sorted([submit._hash_jar(local_jar), "bobs", "new"])
+    ] + ["unrelated"]
+
+
+def test_upload_jar_without_reuse(local_jar, nimbus):
+    clients, _, blobs = nimbus
+    old_storm = FakeNimbus(blobs, leader=None)
+    clients.extend([old_storm, FakeNimbus(blobs)])
+    submit.upload_jar({}, local_jar)
+    assert old_storm.uploads and not blobs
+    submit.upload_jar({"reuse_jar_uploads": False}, local_jar)
+    assert not blobs
+
+
+def test_upload_jar_retries(local_jar, nimbus):
+    clients, tunnels, blobs = nimbus
+    last = FakeNimbus(blobs)
+    clients.extend(
+        [FakeNimbus(blobs, fail_after=50000), FakeNimbus(blobs, fail_after=0), last]
+    )
+    location = submit.upload_jar({}, local_jar)
+    assert len(last.uploads[location]) == 256000
+    assert len(tunnels) == 3
+    clients.extend(FakeNimbus(fail_after=0) for _ in range(submit.UPLOAD_RETRIES + 1))
+    with pytest.raises(TTransportException):
+        submit.upload_jar({"reuse_jar_uploads": False}, local_jar)
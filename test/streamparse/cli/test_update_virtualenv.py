@@ -1,7 +1,25 @@
 import argparse
+import io
+import json
+import os
+import stat
 import unittest
+from unittest import mock
 
-from streamparse.cli.update_virtualenv import subparser_hook
+import pytest
+from fabric.api import env
+
+from streamparse import cache
+from streamparse.cli import update_virtualenv
+from streamparse.remote import LocalTransport, RemoteExecutor
+from streamparse.cli.update_virtualenv import (
+    get_requirements_hash,
+    get_unpinned_requirements,
+    get_virtualenv_manifest,
+    get_virtualenv_script,
+    subparser_hook,
+)
+from streamparse.version import __version__
 
 
 def test_subparser_hook():
@@ -11,3 +29,325 @@ def test_subparser_hook():
 
     subcommands = parser._optionals._actions[1].choices.keys()
     assert "update_virtualenv" in subcommands
+
+
+@pytest.fixture
+def cluster(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "_cache"))
+    requirements = tmp_path / "wordcount.txt"
+    requirements.write_text("streamparse==4.0.0\n")
+    manifests = {"worker1": None, "worker2": None, "worker3": None}
+    calls = []
+
+    def fake_execute(task, *args, hosts=None, **kwargs):
+        calls.append((task.__name__, hosts))
+        if task is update_virtualenv._get_virtualenv_manifest:
+            return {host: manifests[host] for host in hosts}
+        if task is update_virtualenv._get_platform:
+            return {host: "Linux x86_64" for host in hosts}
+        if task is update_virtualenv._pack_virtualenv:
+            with open(args[1], "w") as tarball:
+                tarball.write("virtualenv")
+        return {host: None for host in hosts}
+
+    monkeypatch.setattr(update_virtualenv, "execute", fake_execute)
+    monkeypatch.setattr(update_virtualenv, "get_executor", lambda: None)
+    return str(requirements), manifests, calls
+
+
+def update(requirements_path, virtualenv_root="/data/virtualenvs", **kwargs):
+    return update_virtualenv.update_virtualenvs(
+        virtualenv_root,
+        "wordcount",
+        [requirements_path],
+        ["worker1", "worker2", "worker3"],
+        **kwargs,
+    )
+
+
+def test_get_requirements_hash(cluster):
+    requirements_path, _, _ = cluster
+    requirements_hash = get_requirements_hash([requirements_path])
+    assert get_requirements_hash([requirements_path]) == requirements_hash
+    assert get_requirements_hash([requirements_path], "-p python3") != (
+        requirements_hash
+    )
+    with open(requirements_path, "a") as requirements_file:
+        requirements_file.write("requests\n")
+    assert get_requirements_hash([requirements_path]) != requirements_hash
+
+
+def test_get_unpinned_requirements(tmp_path):
+    requirements_path = tmp_path / "wordcount.txt"
+    requirements_path.write_text(
+        "# Comments and options are fine\n"
+        "--index-url https://pypi.example.com/simple\n"
+        "streamparse==4.0.0  # pinned\n"
+        "requests[socks] == 2.31.0 ; python_version >= '3.8'\n"
+        "simplejson==3.19.1 \\\n"
+        "    --hash=sha256:0123456789abcdef\n"
+        "ujson>=5\n"
+        "msgpack==1.*\n"
+        "-r other.txt\n"
+        "-e git+https://example.com/repo.git#egg=repo\n"
+    )
+    assert get_unpinned_requirements([str(requirements_path)]) == [
+        "ujson>=5",
+        "msgpack==1.*",
+        "-r other.txt",
+        "-e git+https://example.com/repo.git#egg=repo",
+    ]
+
+
+def test_update_unpinned_requirements(cluster, capsys):
+    requirements_path, manifests, calls = cluster
+    with open(requirements_path, "a") as requirements_file:
+        requirements_file.write("requests\n")
+    manifest = get_virtualenv_manifest([requirements_path])
+    manifests.update(worker1=manifest, worker2=manifest, worker3=manifest)
+    # A newer release of requests may be out
+    assert update(requirements_path) == ["worker1", "worker2", "worker3"]
+    assert "_get_virtualenv_manifest" not in [name for name, _ in calls]
+    assert "not pinned to one version with ==: requests" in capsys.readouterr().out
+    # And so cached prebuilt virtualenvs are not reused
+    calls.clear()
+    update(requirements_path, prebuilt=True)
+    update(requirements_path, prebuilt=True)
+    assert [name for name, _ in calls].count("_create_or_update_virtualenv") == 2
+
+
+def test_update_skips_unchanged_hosts(cluster):
+    requirements_path, manifests, calls = cluster
+    manifest = get_virtualenv_manifest([requirements_path])
+    assert manifest["streamparse_version"] == __version__
+    manifests["worker1"] = manifest
+    manifests["worker2"] = dict(manifest, streamparse_version="3.0.0")
+    assert update(requirements_path) == ["worker2", "worker3"]
+    assert calls == [
+        ("_get_virtualenv_manifest", ["worker1", "worker2", "worker3"]),
+        ("_create_or_update_virtualenv", ["worker2", "worker3"]),
+    ]
+
+    calls.clear()
+    manifests.update(worker2=manifest, worker3=manifest)
+    assert update(requirements_path) == []
+    assert calls == [("_get_virtualenv_manifest", ["worker1", "worker2", "worker3"])]
+
+    calls.clear()
+    assert update(requirements_path, overwrite_virtualenv=True) == [
+        "worker1",
+        "worker2",
+        "worker3",
+    ]
+    assert calls == [
+        ("_create_or_update_virtualenv", ["worker1", "worker2", "worker3"])
+    ]
+
+
+def test_prebuilt_virtualenv(cluster):
+    requirements_path, manifests, calls = cluster
+    manifests["worker1"] = get_virtualenv_manifest([requirements_path])
+    update(requirements_path, prebuilt=True)
+    assert calls == [
+        ("_get_virtualenv_manifest", ["worker1", "worker2", "worker3"]),
+        ("_get_platform", ["worker2", "worker3"]),
+        ("_create_or_update_virtualenv", ["worker2"]),
+        ("_pack_virtualenv", ["worker2"]),
+        ("_unpack_virtualenv", ["worker3"]),
+    ]
+
+    # The tarball is reused for hosts that need it later
+    calls.clear()
+    manifests["worker2"] = manifests["worker1"]
+    update(requirements_path, prebuilt=True)
+    assert calls == [
+        ("_get_virtualenv_manifest", ["worker1", "worker2", "worker3"]),
+        ("_get_platform", ["worker3"]),
+        ("_unpack_virtualenv", ["worker3"]),
+    ]
+
+
+def test_prebuilt_virtualenv_cached_by_path_and_platform(cluster, monkeypatch):
+    requirements_path, _, calls = cluster
+    update(requirements_path, prebuilt=True)
+    # Virtualenvs are not relocatable
+    calls.clear()
+    update(requirements_path, virtualenv_root="/opt/virtualenvs", prebuilt=True)
+    assert ("_create_or_update_virtualenv", ["worker1"]) in calls
+    # The tarball for each path is kept
+    calls.clear()
+    update(requirements_path, prebuilt=True)
+    assert "_create_or_update_virtualenv" not in [name for name, _ in calls]
+    # Nor can virtualenvs be copied to other platforms
+    calls.clear()
+    monkeypatch.setattr(
+        update_virtualenv,
+        "get_platforms",
+        lambda hosts: {host: "Darwin" for host in hosts},
+    )
+    update(requirements_path, prebuilt=True)
+    assert ("_create_or_update_virtualenv", ["worker1"]) in calls
+    cache_dir = os.path.join(cache.CACHE_DIR, "virtualenvs", "wordcount")
+    assert len(os.listdir(cache_dir)) == 3
+
+
+def test_prebuilt_virtualenv_per_platform(cluster, monkeypatch):
+    requirements_path, _, calls = cluster
+    platforms = {
+        "worker1": "Linux x86_64",
+        "worker2": "Linux aarch64",
+        "worker3": "Linux x86_64",
+    }
+    monkeypatch.setattr(
+        update_virtualenv,
+        "get_platforms",
+        lambda hosts: {host: platforms[host] for host in hosts},
+    )
+    update(requirements_path, prebuilt=True)
+    # Hosts only get virtualenvs built on their own platform
+    assert calls == [
+        ("_get_virtualenv_manifest", ["worker1", "worker2", "worker3"]),
+        ("_create_or_update_virtualenv", ["worker1"]),
+        ("_pack_virtualenv", ["worker1"]),
+        ("_unpack_virtualenv", ["worker3"]),
+        ("_create_or_update_virtualenv", ["worker2"]),
+        ("_pack_virtualenv", ["worker2"]),
+    ]
+    cache_dir = os.path.join(cache.CACHE_DIR, "virtualenvs", "wordcount")
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_prebuilt_virtualenv_overwrite(cluster):
+    requirements_path, _, calls = cluster
+    for _ in range(2):
+        update(requirements_path, prebuilt=True, overwrite_virtualenv=True)
+    assert [name for name, _ in calls].count("_create_or_update_virtualenv") == 2
+    assert "_get_virtualenv_manifest" not in [name for name, _ in calls]
+    assert calls[-1] == ("_unpack_virtualenv", ["worker2", "worker3"])
+    cache_dir = os.path.join(cache.CACHE_DIR, "virtualenvs", "wordcount")
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_fabric_and_script_run_same_steps(tmp_path, monkeypatch):
+    requirements_path = tmp_path / "wordcount.txt"
+    requirements_path.write_text("streamparse\n")
+    commands = []
+    monkeypatch.setattr(update_virtualenv, "run", lambda cmd: "/tmp/requirements")
+    monkeypatch.setattr(update_virtualenv, "put", lambda *args, **kwargs: None)
+    monkeypatch.setattr(
+        update_virtualenv, "run_cmd", lambda cmd, user: commands.append(cmd)
+    )
+    kwargs = dict(
+        virtualenv_flags="-p python3",
+        overwrite_virtualenv=True,
+        manifest={"streamparse_version": __version__},
+    )
+    update_virtualenv._create_or_update_virtualenv(
+        "/data/virtualenvs", "wordcount", [str(requirements_path)], **kwargs
+    )
+    script = get_virtualenv_script(
+        "/data/virtualenvs", "wordcount", [str(requirements_path)], **kwargs
+    )
+    script_commands = [
+        cmd.replace("-r /tmp/requirements", "$(printf -- ' -r %s' $requirements_files)")
+        for cmd in commands
+    ]
+    assert len(commands) == 5
+    assert [line for line in script.splitlines() if line in script_commands] == (
+        script_commands
+    )
+
+
+FAKE_VIRTUALENV = """#!/bin/sh
+if [ "$1" = --version ]; then echo "virtualenv 20.0.0"; exit 0; fi
+mkdir -p "$2/bin"
+cp "$(dirname "$0")/pip" "$2/bin/pip"
+"""
+
+FAKE_PIP = """#!/bin/sh
+# Log what would be installed, and fail for requirements that cannot be
+echo "$@" >> "$(dirname "$0")/../pip.log"
+for arg in "$@"; do
+    if [ -f "$arg" ]; then
+        cat "$arg" >> "$(dirname "$0")/../pip.log"
+        if grep -q missing "$arg"; then exit 1; fi
+    fi
+done
+"""
+
+
+@pytest.fixture
+def local_cluster(tmp_path, monkeypatch):
+    """Run virtualenv updates on this machine, with each worker's virtualenvs
+    in their own directory.
+    """
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "_cache"))
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, script in (("virtualenv", FAKE_VIRTUALENV), ("pip", FAKE_PIP)):
+        path = bin_dir / name
+        path.write_text(script)
+        path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(
+        update_virtualenv,
+        "get_executor",
+        lambda: RemoteExecutor(LocalTransport(), output=io.StringIO()),
+    )
+    requirements = tmp_path / "wordcount.txt"
+    requirements.write_text("streamparse==4.0.0\nsimplejson==3.19.1\n")
+    with mock.patch.dict(env, user=None):
+        yield tmp_path, str(requirements)
+
+
+def update_local(tmp_path, requirements_path, **kwargs):
+    return update_virtualenv.update_virtualenvs(
+        str(tmp_path / "$STREAMPARSE_HOST"),
+        "wordcount",
+        [requirements_path],
+        ["worker1", "worker2", "worker3"],
+        **kwargs,
+    )
+
+
+def test_update_with_executor(local_cluster):
+    tmp_path, requirements_path = local_cluster
+    assert update_local(tmp_path, requirements_path) == [
+        "worker1",
+        "worker2",
+        "worker3",
+    ]
+    manifest = get_virtualenv_manifest([requirements_path])
+    for host in ("worker1", "worker2", "worker3"):
+        virtualenv_path = tmp_path / host / "wordcount"
+        pip_log = (virtualenv_path / "pip.log").read_text()
+        assert "streamparse==4.0.0\nsimplejson==3.19.1\n" in pip_log
+        assert "--upgrade-strategy only-if-needed" in pip_log
+        with open(virtualenv_path / update_virtualenv.VIRTUALENV_MANIFEST_FILE) as f:
+            assert json.load(f) == manifest
+    # Temporary requirements files are cleaned up
+    assert update_local(tmp_path, requirements_path) == []
+
+
+def test_update_with_executor_fails(local_cluster):
+    tmp_path, requirements_path = local_cluster
+    with open(requirements_path, "a") as requirements_file:
+        requirements_file.write("missing==1.0\n")
+    with pytest.raises(RuntimeError, match="worker1, worker2, worker3"):
+        update_local(tmp_path, requirements_path)
+    # Nothing is recorded as installed
+    assert not (
+        tmp_path / "worker1" / "wordcount" / update_virtualenv.VIRTUALENV_MANIFEST_FILE
+    ).exists()
+
+
+def test_prebuilt_virtualenv_with_executor(local_cluster):
+    tmp_path, requirements_path = local_cluster
+    update_local(tmp_path, requirements_path, prebuilt=True)
+    # Only the first worker built it, and the rest got a copy
+    for host in ("worker1", "worker2", "worker3"):
+        virtualenv_path = tmp_path / host / "wordcount"
+        assert (virtualenv_path / "bin" / "pip").exists()
+        assert (virtualenv_path / "pip.log").read_text().count("install -r") == 1
+        assert not (tmp_path / host / "wordcount.new").exists()
+        assert not (tmp_path / host / "wordcount.old").exists()
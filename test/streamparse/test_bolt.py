@@ -0,0 +1,739 @@
+"""
+Tests for streamparse-specific Bolt extensions
+"""
+import asyncio
+import io
+import logging
+import signal
+import time
+import unittest
+from array import array
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest import mock
+
+import simplejson as json
+from pystorm.component import Tuple
+
+from streamparse.storm import (
+    AdaptiveBatchController,
+    AsyncBolt,
+    BatchingBolt,
+    Bolt,
+    StormHandler,
+    TicklessBatchingBolt,
+)
+from streamparse.storm import bolt as bolt_module
+
+WordCount = namedtuple("WordCount", ["word", "count", "weight"])
+Other = namedtuple("Other", ["word"])
+
+
+def _make_tup(values, tup_id="1"):
+    return Tuple(tup_id, "word_spout", "default", 1, values)
+
+
+class ColumnsBolt(BatchingBolt):
+    def initialize(self, conf, ctx):
+        self.batches = []
+
+    def process_columns(self, key, columns):
+        self.batches.append((key, columns))
+
+
+class BatchToColumnsTests(unittest.TestCase):
+    def test_named_fields(self):
+        tups = [
+            _make_tup(WordCount("dog", 1, 0.5)),
+            _make_tup(WordCount("cat", 2, 1.5)),
+        ]
+        columns = BatchingBolt.batch_to_columns(tups)
+        self.assertEqual(list(columns), ["word", "count", "weight"])
+        self.assertEqual(list(columns["word"]), ["dog", "cat"])
+        self.assertEqual(list(columns["count"]), [1, 2])
+        self.assertEqual(list(columns["weight"]), [0.5, 1.5])
+
+    def test_positional_fields(self):
+        tups = [_make_tup(["dog", 1]), _make_tup(["cat", 2])]
+        columns = BatchingBolt.batch_to_columns(tups)
+        self.assertEqual(list(columns), [0, 1])
+        self.assertEqual(list(columns[1]), [1, 2])
+
+    def test_empty(self):
+        self.assertEqual(BatchingBolt.batch_to_columns([]), {})
+
+    def test_same_fields_from_two_sources(self):
+        # pystorm makes a namedtuple class for each source component and stream
+        SpoutWordCount = namedtuple("WordCount", ["word", "count", "weight"])
+        tups = [
+            _make_tup(WordCount("dog", 1, 0.5)),
+            Tuple("2", "other_spout", "default", 2, SpoutWordCount("cat", 2, 1.5)),
+        ]
+        columns = BatchingBolt.batch_to_columns(tups)
+        self.assertEqual(list(columns["word"]), ["dog", "cat"])
+        self.assertEqual(list(columns["count"]), [1, 2])
+
+    def test_mixed_fields(self):
+        tups = [_make_tup(WordCount("dog", 1, 0.5)), _make_tup(Other("cat"))]
+        with self.assertRaises(ValueError):
+            BatchingBolt.batch_to_columns(tups)
+
+    def test_mixed_lengths(self):
+        with self.assertRaises(ValueError):
+            BatchingBolt.batch_to_columns([_make_tup(["dog", 1]), _make_tup(["cat"])])
+
+
+class ToColumnTests(unittest.TestCase):
+    def setUp(self):
+        self._np = bolt_module.np
+        bolt_module.np = None
+
+    def tearDown(self):
+        bolt_module.np = self._np
+
+    def test_fallback_types(self):
+        self.assertEqual(bolt_module._to_column([1, 2]), array("q", [1, 2]))
+        self.assertEqual(bolt_module._to_column([0.5, 1.5]), array("d", [0.5, 1.5]))
+        self.assertEqual(bolt_module._to_column(["a", 1]), ["a", 1])
+        self.assertEqual(bolt_module._to_column([2**70, 1]), [2**70, 1])
+
+    def test_numpy(self):
+        if self._np is None:
+            self.skipTest("NumPy is not installed")
+        bolt_module.np = self._np
+        self.assertEqual(bolt_module._to_column([1, 2]).dtype.kind, "i")
+        self.assertEqual(bolt_module._to_column(["a", "b"]).dtype.kind, "U")
+        mixed = bolt_module._to_column(["a", 1])
+        self.assertEqual(mixed.dtype, object)
+        self.assertEqual(list(mixed), ["a", 1])
+
+
+class ProcessColumnsTests(unittest.TestCase):
+    def _make_bolt(self, cls):
+        self.output = io.BytesIO()
+        bolt = cls(input_stream=io.BytesIO(), output_stream=self.output)
+        bolt.initialize({}, {})
+        return bolt
+
+    def test_process_batches(self):
+        bolt = self._make_bolt(ColumnsBolt)
+        bolt.process(_make_tup(WordCount("dog", 1, 0.5), tup_id="1"))
+        bolt.process(_make_tup(WordCount("cat", 2, 1.5), tup_id="2"))
+        bolt.process_batches()
+        self.assertEqual(len(bolt.batches), 1)
+        key, columns = bolt.batches[0]
+        self.assertIsNone(key)
+        self.assertEqual(list(columns["word"]), ["dog", "cat"])
+        # Tuples should still be acked after process_columns
+        bolt.serializer.output_stream.flush()
+        self.assertEqual(self.output.getvalue().count(b'"ack"'), 2)
+
+    def test_tickless_uses_process_columns(self):
+        self.assertIs(TicklessBatchingBolt.process_batch, BatchingBolt.process_batch)
+
+    def test_not_implemented(self):
+        bolt = self._make_bolt(BatchingBolt)
+        with self.assertRaises(NotImplementedError):
+            bolt.process_batch(None, [_make_tup(["dog"])])
+
+
+class EmitManyTests(unittest.TestCase):
+    def setUp(self):
+        self.output = io.BytesIO()
+        self.bolt = Bolt(input_stream=io.BytesIO(), output_stream=self.output)
+        self.bolt._current_tups = [_make_tup(["the dog"], tup_id="7")]
+
+    def _sent_messages(self):
+        self.bolt.serializer.output_stream.flush()
+        chunks = self.output.getvalue().decode("utf-8").split("\nend\n")
+        return [json.loads(chunk) for chunk in chunks if chunk]
+
+    def test_emit_many(self):
+        self.bolt.emit_many([["the"], ["dog"]], stream="words")
+        self.assertEqual(
+            self._sent_messages(),
+            [
+                {
+                    "command": "emit",
+                    "tuple": [word],
+                    "anchors": ["7"],
+                    "stream": "words",
+                    "need_task_ids": False,
+                }
+                for word in ("the", "dog")
+            ],
+        )
+        self.assertEqual(self.bolt.messages_sent, 2)
+        self.assertEqual(self.bolt.message_writes, 1)
+        self.assertEqual(self.bolt.messages_per_write, 2.0)
+
+    def test_emit_many_single_write(self):
+        with mock.patch.object(
+            self.bolt.serializer.output_stream, "write"
+        ) as write_mock:
+            self.bolt.emit_many([["the"], ["dog"], ["barked"]])
+        write_mock.assert_called_once()
+
+    def test_emit_many_explicit_anchors(self):
+        self.bolt.emit_many([["dog"]], anchors=[_make_tup(["dog"], tup_id="9")])
+        self.assertEqual(self._sent_messages()[0]["anchors"], ["9"])
+
+    def test_emit_many_empty(self):
+        self.bolt.emit_many([])
+        self.assertEqual(self._sent_messages(), [])
+        self.assertEqual(self.bolt.message_writes, 0)
+
+    def test_emit_many_type_error(self):
+        with self.assertRaises(TypeError):
+            self.bolt.emit_many([["dog"], "cat"])
+        self.assertEqual(self._sent_messages(), [])
+
+    def test_emit_counts_messages(self):
+        self.bolt.emit(["dog"])
+        self.assertEqual(self.bolt.messages_sent, 1)
+        self.assertEqual(self.bolt.message_writes, 1)
+
+
+def _tuple_message(tup_id, values):
+    msg = {"id": tup_id, "comp": "word_spout", "stream": "default", "task": 1}
+    msg["tuple"] = values
+    return json.dumps(msg) + "\nend\n"
+
+
+class WaitingAsyncBolt(AsyncBolt):
+    """Emits each word once the test tells it to."""
+
+    def initialize(self, conf, ctx):
+        self.events = {}
+
+    async def process(self, tup):
+        word = tup.values[0]
+        if word == "boom":
+            raise ValueError(word)
+        event = self.events.setdefault(word, asyncio.Event())
+        await event.wait()
+        self.emit([word.upper()])
+
+    def release(self, word):
+        def _set():
+            self.events.setdefault(word, asyncio.Event()).set()
+
+        self.loop.call_soon_threadsafe(_set)
+
+
+class AsyncBoltTests(unittest.TestCase):
+    def setUp(self):
+        self._old_handler = signal.getsignal(signal.SIGUSR1)
+        self.bolts = []
+
+    def tearDown(self):
+        for bolt in self.bolts:
+            asyncio.run_coroutine_threadsafe(self._cancel_tasks(), bolt.loop).result(5)
+            bolt.loop.call_soon_threadsafe(bolt.loop.stop)
+            bolt._loop_thread.join(5)
+            bolt.loop.close()
+        signal.signal(signal.SIGUSR1, self._old_handler)
+
+    @staticmethod
+    async def _cancel_tasks():
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _make_bolt(self, words, **attrs):
+        input_stream = io.BytesIO(
+            "".join(
+                _tuple_message(str(i), [word]) for i, word in enumerate(words)
+            ).encode("utf-8")
+        )
+        self.output = io.BytesIO()
+        cls = type("TestAsyncBolt", (WaitingAsyncBolt,), attrs)
+        bolt = cls(input_stream=input_stream, output_stream=self.output)
+        bolt.logger = mock.Mock()
+        bolt.initialize({}, {})
+        self.bolts.append(bolt)
+        for _ in words:
+            bolt._run()
+        # Wait for every Tuple to start waiting on its event
+        deadline = time.time() + 5
+        while len(bolt.events) < len(set(words) - {"boom"}):
+            if time.time() > deadline:
+                self.fail("Tuples were never processed.")
+            time.sleep(0.01)
+        return bolt
+
+    def _sent_messages(self, bolt, count):
+        deadline = time.time() + 5
+        while True:
+            with bolt._writer_lock:
+                bolt.serializer.output_stream.flush()
+                chunks = self.output.getvalue().decode("utf-8").split("\nend\n")
+            messages = [json.loads(chunk) for chunk in chunks if chunk]
+            if len(messages) >= count or time.time() > deadline:
+                return messages
+            time.sleep(0.01)
+
+    def test_sync_process(self):
+        class SyncProcessBolt(AsyncBolt):
+            def process(self, tup):
+                pass
+
+        with self.assertRaises(TypeError):
+            SyncProcessBolt(input_stream=io.BytesIO(), output_stream=io.BytesIO())
+
+    def test_unordered(self):
+        bolt = self._make_bolt(["the", "dog"])
+        self.assertEqual(bolt.num_in_flight, 2)
+        bolt.release("dog")
+        bolt.release("the")
+        messages = self._sent_messages(bolt, 4)
+        self.assertEqual(
+            messages,
+            [
+                {
+                    "command": "emit",
+                    "tuple": ["DOG"],
+                    "anchors": ["1"],
+                    "need_task_ids": False,
+                },
+                {"command": "ack", "id": "1"},
+                {
+                    "command": "emit",
+                    "tuple": ["THE"],
+                    "anchors": ["0"],
+                    "need_task_ids": False,
+                },
+                {"command": "ack", "id": "0"},
+            ],
+        )
+        self.assertEqual(bolt.num_in_flight, 0)
+
+    def test_ordered(self):
+        bolt = self._make_bolt(["the", "dog"], ordered=True)
+        bolt.release("dog")
+        time.sleep(0.05)
+        self.assertEqual(self._sent_messages(bolt, 0), [])
+        bolt.release("the")
+        messages = self._sent_messages(bolt, 4)
+        self.assertEqual(
+            [(msg["command"], msg.get("tuple")) for msg in messages],
+            [("emit", ["THE"]), ("ack", None), ("emit", ["DOG"]), ("ack", None)],
+        )
+        # Each Tuple's emits and ack go out in one write
+        self.assertEqual(bolt.message_writes, 2)
+
+    def test_ordered_manual_ack(self):
+        async def process(bolt, tup):
+            await WaitingAsyncBolt.process(bolt, tup)
+            bolt.ack(tup)
+
+        bolt = self._make_bolt(
+            ["the", "dog"], ordered=True, auto_ack=False, process=process
+        )
+        bolt.release("dog")
+        time.sleep(0.05)
+        self.assertEqual(self._sent_messages(bolt, 0), [])
+        bolt.release("the")
+        messages = self._sent_messages(bolt, 4)
+        self.assertEqual(
+            [(msg["command"], msg.get("id")) for msg in messages],
+            [("emit", None), ("ack", "0"), ("emit", None), ("ack", "1")],
+        )
+
+    def test_backpressure(self):
+        bolt = self._make_bolt(["the", "dog"], max_in_flight=2)
+        self.assertFalse(bolt._in_flight_slots.acquire(blocking=False))
+        bolt.release("the")
+        self._sent_messages(bolt, 2)
+        self.assertTrue(bolt._in_flight_slots.acquire(timeout=5))
+
+    def test_exception_without_exit(self):
+        bolt = self._make_bolt(["boom", "dog"], exit_on_exception=False)
+        bolt.release("dog")
+        messages = self._sent_messages(bolt, 4)
+        self.assertIn({"command": "fail", "id": "0"}, messages)
+        self.assertIn({"command": "ack", "id": "1"}, messages)
+        self.assertIsNone(bolt.exc_info)
+
+    @mock.patch("os.kill")
+    def test_exception_with_exit(self, kill_mock):
+        bolt = self._make_bolt(["dog", "boom"])
+        messages = self._sent_messages(bolt, 1)
+        self.assertEqual(messages, [{"command": "fail", "id": "1"}])
+        kill_mock.assert_called_once_with(bolt.pid, signal.SIGUSR1)
+        with self.assertRaises(ValueError) as raised:
+            bolt._handle_worker_exception(signal.SIGUSR1, None)
+        with mock.patch.object(bolt, "raise_exception") as raise_mock:
+            bolt._handle_run_exception(raised.exception)
+        raise_mock.assert_called_once_with(raised.exception, mock.ANY)
+        # Everything else in flight gets failed before we exit
+        self.assertIn({"command": "fail", "id": "0"}, self._sent_messages(bolt, 2))
+        self.assertEqual(bolt.num_in_flight, 0)
+
+
+class UpperBolt(Bolt):
+    outputs = ["word"]
+
+    def process(self, tup):
+        word = tup.values[0]
+        if word == "boom":
+            raise ValueError(word)
+        self.logger.info("processing %s", word)
+        self.emit([word.upper()])
+        self.emit([word.lower()], stream="lower")
+
+
+class PoolTests(unittest.TestCase):
+    def _make_bolt(self, words, **attrs):
+        input_stream = io.BytesIO(
+            "".join(
+                _tuple_message(str(i), [word]) for i, word in enumerate(words)
+            ).encode("utf-8")
+        )
+        self.output = io.BytesIO()
+        cls = type("TestPoolBolt", (UpperBolt,), attrs)
+        bolt = cls(input_stream=input_stream, output_stream=self.output)
+        bolt.logger = mock.Mock()
+        self.addCleanup(lambda: bolt._pool and bolt._pool.shutdown())
+        return bolt
+
+    def _sent_messages(self, bolt):
+        bolt.serializer.output_stream.flush()
+        chunks = self.output.getvalue().decode("utf-8").split("\nend\n")
+        return [json.loads(chunk) for chunk in chunks if chunk]
+
+    def _run_all(self, bolt, num_tuples):
+        for _ in range(num_tuples):
+            bolt._run()
+        while bolt._pool_pending:
+            bolt._drain_pool(block=True)
+
+    def _check_output(self, bolt, words):
+        messages = self._sent_messages(bolt)
+        expected = []
+        for i, word in enumerate(words):
+            expected += [
+                {
+                    "command": "emit",
+                    "tuple": [word.upper()],
+                    "anchors": [str(i)],
+                    "need_task_ids": False,
+                },
+                {
+                    "command": "emit",
+                    "tuple": [word.lower()],
+                    "anchors": [str(i)],
+                    "stream": "lower",
+                    "need_task_ids": False,
+                },
+                {"command": "ack", "id": str(i)},
+            ]
+        self.assertEqual([msg for msg in messages if msg["command"] != "log"], expected)
+        return messages
+
+    def test_thread_pool(self):
+        words = ["the", "Dog", "barked", "at", "a", "cat"]
+        bolt = self._make_bolt(words, pool="thread", pool_size=3)
+        self._run_all(bolt, len(words))
+        self._check_output(bolt, words)
+        self.assertIsInstance(bolt._pool, ThreadPoolExecutor)
+        # One write per Tuple
+        self.assertEqual(bolt.message_writes, len(words))
+
+    def test_process_pool(self):
+        words = ["the", "Dog", "barked"]
+        bolt = self._make_bolt(words, pool="process", pool_size=2)
+        # Log to Storm in the workers, so we can check it comes back through
+        # the parent
+        bolt.logger = logging.getLogger("test_process_pool")
+        bolt.logger.addHandler(StormHandler(bolt.serializer))
+        bolt.logger.setLevel(logging.INFO)
+        self._run_all(bolt, len(words))
+        messages = self._check_output(bolt, words)
+        self.assertEqual(sum(msg["command"] == "log" for msg in messages), len(words))
+
+    def test_thread_pool_manual_ack(self):
+        words = ["the", "Dog", "barked"]
+
+        def process(bolt, tup):
+            UpperBolt.process(bolt, tup)
+            bolt.ack(tup)
+
+        bolt = self._make_bolt(
+            words, pool="thread", pool_size=3, auto_ack=False, process=process
+        )
+        bolt.logger = logging.getLogger("test_thread_pool_manual_ack")
+        bolt.logger.addHandler(StormHandler(bolt.serializer))
+        bolt.logger.setLevel(logging.INFO)
+        self._run_all(bolt, len(words))
+        # Acks come after the emits anchored to their Tuples
+        messages = self._check_output(bolt, words)
+        self.assertEqual(
+            [msg["command"] for msg in messages[:4]], ["log", "emit", "emit", "ack"]
+        )
+
+    def test_exception(self):
+        bolt = self._make_bolt(["the", "boom"], pool="thread")
+        bolt._run()
+        with self.assertRaises(ValueError):
+            self._run_all(bolt, 1)
+        self.assertEqual(bolt._current_tups[0].id, "1")
+
+    def test_exception_while_full_keeps_new_tuple(self):
+        bolt = self._make_bolt([], pool="thread", pool_size=1)
+        bolt._get_pool()
+        bolt._pool_max_pending = 1
+        failed = Future()
+        failed.set_exception(ValueError("boom"))
+        bolt._pool_pending.append((_make_tup(["boom"], tup_id="4"), failed))
+        with self.assertRaises(ValueError):
+            bolt._submit_to_pool(_make_tup(["dog"], tup_id="5"))
+        self.assertEqual(bolt._current_tups[0].id, "4")
+        self.assertEqual([tup.id for tup, _ in bolt._pool_pending], ["5"])
+        bolt._current_tups = []
+        self._run_all(bolt, 0)
+        self.assertIn({"command": "ack", "id": "5"}, self._sent_messages(bolt))
+
+    def test_exception_fails_pending(self):
+        bolt = self._make_bolt([], pool="thread")
+        bolt._pool_pending.append((_make_tup(["dog"], tup_id="5"), mock.Mock()))
+        bolt._current_tups = [_make_tup(["boom"], tup_id="4")]
+        with mock.patch.object(bolt, "raise_exception"):
+            bolt._handle_run_exception(ValueError("boom"))
+        self.assertEqual(
+            self._sent_messages(bolt),
+            [{"command": "fail", "id": "4"}, {"command": "fail", "id": "5"}],
+        )
+
+    def test_setup_component_reads_config(self):
+        bolt = self._make_bolt([])
+        bolt._setup_component(
+            {"streamparse.bolt.pool": "process", "streamparse.bolt.pool_size": 3},
+            {"taskid": 1, "task->component": {"1": "upper"}},
+        )
+        self.assertEqual(bolt.pool, "process")
+        self.assertEqual(bolt.pool_size, 3)
+
+    def test_spec(self):
+        spec = UpperBolt.spec(config={"foo": 1}, pool="thread", pool_size=4)
+        self.assertEqual(
+            json.loads(spec.config),
+            {
+                "foo": 1,
+                "streamparse.bolt.pool": "thread",
+                "streamparse.bolt.pool_size": 4,
+            },
+        )
+        with self.assertRaises(ValueError):
+            UpperBolt.spec(pool="greenlet")
+
+
+class AdaptiveBatchControllerTests(unittest.TestCase):
+    def _make_controller(self, **kwargs):
+        params = dict(
+            target_latency=1.0,
+            secs_between_batches=2.0,
+            min_secs_between_batches=0.01,
+            max_secs_between_batches=10.0,
+            max_batch_size=10000,
+            smoothing=1.0,
+        )
+        params.update(kwargs)
+        return AdaptiveBatchController(**params)
+
+    def test_initial_window_clamped(self):
+        controller = self._make_controller(secs_between_batches=20)
+        self.assertEqual(controller.secs_between_batches, 10.0)
+
+    def test_invalid_params(self):
+        with self.assertRaises(ValueError):
+            self._make_controller(target_latency=0)
+        with self.assertRaises(ValueError):
+            self._make_controller(
+                min_secs_between_batches=5, max_secs_between_batches=1
+            )
+
+    def test_quiet(self):
+        controller = self._make_controller()
+        # 10 Tuples/sec that are cheap to process
+        controller.update(20, 2.0, 0.002)
+        self.assertAlmostEqual(controller.secs_between_batches, 1 / 1.001)
+        self.assertEqual(controller.max_batch_size, 10000)
+
+    def test_busy(self):
+        controller = self._make_controller()
+        # 10,000 Tuples/sec at 0.5ms each
+        controller.update(20000, 2.0, 10.0)
+        self.assertAlmostEqual(controller.secs_between_batches, 1 / 6)
+        self.assertEqual(controller.max_batch_size, 2000)
+
+    def test_min_window(self):
+        controller = self._make_controller(min_secs_between_batches=0.5)
+        controller.update(20000, 2.0, 10.0)
+        self.assertEqual(controller.secs_between_batches, 0.5)
+
+    def test_smoothing(self):
+        controller = self._make_controller(smoothing=0.5)
+        controller.update(10, 1.0, 0.1)
+        controller.update(30, 1.0, 0.1)
+        self.assertAlmostEqual(controller.arrival_rate, 20.0)
+        self.assertAlmostEqual(controller.secs_per_tuple, (0.01 + 0.1 / 30) / 2)
+
+    def test_empty_batch(self):
+        controller = self._make_controller()
+        controller.update(0, 1.0, 0.0)
+        self.assertIsNone(controller.arrival_rate)
+        self.assertEqual(controller.secs_between_batches, 2.0)
+
+
+class AdaptiveTicklessBatchingBoltTests(unittest.TestCase):
+    def setUp(self):
+        self._old_handler = signal.getsignal(signal.SIGUSR1)
+        self.addCleanup(signal.signal, signal.SIGUSR1, self._old_handler)
+
+    def test_flushes_full_batches(self):
+        class AdaptiveBolt(TicklessBatchingBolt):
+            adaptive = True
+            secs_between_batches = 10
+            max_batch_size = 3
+
+            def initialize(self, conf, ctx):
+                self.batches = []
+
+            def process_batch(self, key, tups):
+                self.batches.append([tup.id for tup in tups])
+
+        output = io.BytesIO()
+        bolt = AdaptiveBolt(input_stream=io.BytesIO(), output_stream=output)
+        bolt.initialize({}, {})
+        with bolt._batch_lock:
+            for i in range(3):
+                bolt.process(_make_tup(["dog"], tup_id=str(i)))
+        self.assertTrue(bolt._batch_ready.wait(5))
+        deadline = time.time() + 5
+        while not bolt.batches and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(bolt.batches, [["0", "1", "2"]])
+        self.assertIsNotNone(bolt.batch_controller.arrival_rate)
+        self.assertLess(bolt.batch_controller.secs_between_batches, 10)
+
+    def test_not_adaptive(self):
+        bolt = TicklessBatchingBolt(
+            input_stream=io.BytesIO(), output_stream=io.BytesIO()
+        )
+        self.assertIsNone(bolt.batch_controller)
+
+
+class SpillingBolt(BatchingBolt):
+    max_batch_memory = 2000
+
+    def initialize(self, conf, ctx):
+        self.batches = {}
+
+    def group_key(self, tup):
+        return tup.values.word
+
+    def process_batch(self, key, tups):
+        if key == "boom":
+            raise ValueError(key)
+        self.batches[key] = tups
+
+
+class SpillTests(unittest.TestCase):
+    def setUp(self):
+        self.output = io.BytesIO()
+        self.bolt = SpillingBolt(input_stream=io.BytesIO(), output_stream=self.output)
+        self.bolt._source_tuple_types["word_spout"]["default"] = WordCount
+        self.bolt.initialize({}, {})
+        self.addCleanup(lambda: self.bolt._spill_file and self.bolt._spill_file.close())
+
+    def _process(self, words):
+        tups = []
+        for i, word in enumerate(words):
+            tup = _make_tup(WordCount(word, i, "x" * 200), tup_id=str(i))
+            self.bolt.process(tup)
+            tups.append(tup)
+        return tups
+
+    def _sent_messages(self):
+        self.bolt.serializer.output_stream.flush()
+        chunks = self.output.getvalue().decode("utf-8").split("\nend\n")
+        return [json.loads(chunk) for chunk in chunks if chunk]
+
+    def test_no_spill_under_limit(self):
+        self._process(["dog", "cat"])
+        self.assertEqual(self.bolt.spilled_tuples, 0)
+        self.assertIsNone(self.bolt._spill_file)
+
+    def test_spill_and_replay(self):
+        words = ["dog", "cat", "dog", "dog", "cat", "dog", "cat", "dog"]
+        tups = self._process(words)
+        self.assertGreater(self.bolt.spill_count, 0)
+        self.assertGreater(self.bolt.spilled_tuples, 0)
+        self.assertGreater(self.bolt.spilled_bytes, 0)
+        self.assertLessEqual(self.bolt._total_batch_memory, self.bolt.max_batch_memory)
+        in_memory = sum(len(batch) for batch in self.bolt._batches.values())
+        self.assertEqual(in_memory + self.bolt.spilled_tuples, len(words))
+
+        self.bolt.process_batches()
+        for word in ("dog", "cat"):
+            self.assertEqual(
+                self.bolt.batches[word],
+                [tup for tup in tups if tup.values.word == word],
+            )
+        # Values come back as the stream's namedtuple
+        self.assertIsInstance(self.bolt.batches["dog"][0].values, WordCount)
+        acked = [msg["id"] for msg in self._sent_messages() if msg["command"] == "ack"]
+        self.assertEqual(sorted(acked, key=int), [str(i) for i in range(len(words))])
+        self.assertEqual(self.bolt._spill_file.seek(0, io.SEEK_END), 0)
+        self.assertEqual(self.bolt._total_batch_memory, 0)
+
+    def test_exception_fails_spilled(self):
+        self._process(["boom", "boom", "cat", "boom", "cat", "boom", "cat"])
+        self.assertTrue(self.bolt._spilled)
+        with self.assertRaises(ValueError) as raised:
+            self.bolt.process_batches()
+        with mock.patch.object(self.bolt, "raise_exception"):
+            self.bolt._handle_run_exception(raised.exception)
+        messages = self._sent_messages()
+        failed = {msg["id"] for msg in messages if msg["command"] == "fail"}
+        acked = {msg["id"] for msg in messages if msg["command"] == "ack"}
+        self.assertEqual(failed | acked, {str(i) for i in range(7)})
+        self.assertEqual(failed & acked, set())
+        self.assertFalse(self.bolt._spilled)
+
+    def test_spill_count_only_counts_writes(self):
+        # An estimate left over for a batch that is no longer in memory
+        self.bolt._batch_memory["dog"] = 5000
+        self.bolt._total_batch_memory = 5000
+        self.bolt._spill_batches()
+        self.assertEqual(self.bolt.spill_count, 0)
+        self.assertEqual(self.bolt._total_batch_memory, 0)
+        self.assertIsNone(self.bolt._spill_file)
+
+    def test_spill_metrics(self):
+        self._process(["dog", "cat", "dog", "dog", "cat", "dog", "cat", "dog"])
+        snapshot = self.bolt.metrics.snapshot()
+        self.assertGreater(self.bolt.spill_count, 0)
+        self.assertEqual(snapshot["spill_count"], self.bolt.spill_count)
+        self.assertEqual(snapshot["spilled_tuples"], self.bolt.spilled_tuples)
+        self.assertEqual(snapshot["spilled_bytes"], self.bolt.spilled_bytes)
+
+    def test_exception_resets_memory_estimate(self):
+        self._process(["boom", "cat"])
+        self.assertFalse(self.bolt._spilled)
+        cat_memory = self.bolt._batch_memory["cat"]
+        with self.assertRaises(ValueError):
+            self.bolt.process_batches()
+        # The failed batch is forgotten, and the one after it is still pending
+        self.assertEqual(dict(self.bolt._batch_memory), {"cat": cat_memory})
+        self.assertEqual(self.bolt._total_batch_memory, cat_memory)
+
+    def test_exception_resets_spilled_memory_estimate(self):
+        self._process(["cat", "boom", "cat", "boom", "cat", "boom", "boom"])
+        self.assertTrue(self.bolt._spilled)
+        with self.assertRaises(ValueError):
+            self.bolt.process_batches()
+        self.assertEqual(dict(self.bolt._batch_memory), {})
+        self.assertEqual(self.bolt._total_batch_memory, 0)
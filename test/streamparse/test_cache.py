@@ -0,0 +1,76 @@
+"""
+Tests for streamparse.cache
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from streamparse import cache
+
+
+class CacheTests(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        for patcher in (
+            mock.patch.object(cache, "CACHE_DIR", cache_dir),
+            mock.patch.object(cache, "_refresh", False),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_store_and_load(self):
+        cache.store("workers", ("nimbus", 6627), ["a", "b"])
+        self.assertEqual(cache.load("workers", ("nimbus", 6627), 60), ["a", "b"])
+        self.assertIsNone(cache.load("workers", ("nimbus", 6628), 60))
+        self.assertIsNone(cache.load("config", ("nimbus", 6627), 60))
+
+    def test_expired(self):
+        cache.store("workers", ("nimbus", 6627), ["a"])
+        path = cache._cache_path("workers", ("nimbus", 6627))
+        old = time.time() - 120
+        os.utime(path, (old, old))
+        self.assertIsNone(cache.load("workers", ("nimbus", 6627), 60))
+        self.assertEqual(cache.load("workers", ("nimbus", 6627), 300), ["a"])
+
+    def test_no_ttl(self):
+        cache.store("workers", ("nimbus", 6627), ["a"])
+        self.assertIsNone(cache.load("workers", ("nimbus", 6627), 0))
+        self.assertIsNone(cache.load("workers", ("nimbus", 6627), None))
+
+    def test_corrupt(self):
+        path = cache._cache_path("workers", ("nimbus", 6627))
+        os.makedirs(os.path.dirname(path))
+        with open(path, "w") as cache_file:
+            cache_file.write("{not json")
+        self.assertIsNone(cache.load("workers", ("nimbus", 6627), 60))
+
+    def test_cached(self):
+        fetch = mock.Mock(return_value={"nimbus.seeds": ["nimbus"]})
+        for _ in range(3):
+            value = cache.cached("config", ("nimbus", 6627), 60, fetch)
+        self.assertEqual(value, {"nimbus.seeds": ["nimbus"]})
+        fetch.assert_called_once_with()
+
+    def test_refresh(self):
+        fetch = mock.Mock(side_effect=[["a"], ["b"]])
+        cache.cached("workers", ("nimbus", 6627), 60, fetch)
+        cache.set_refresh()
+        self.assertEqual(cache.cached("workers", ("nimbus", 6627), 60, fetch), ["b"])
+        cache.set_refresh(False)
+        self.assertEqual(cache.load("workers", ("nimbus", 6627), 60), ["b"])
+
+    def test_unwritable(self):
+        with open(os.path.join(cache.CACHE_DIR, "ui"), "w"):
+            pass
+        fetch = mock.Mock(return_value=["a"])
+        self.assertEqual(cache.cached("ui", ("/a",), 60, fetch), ["a"])
+        self.assertEqual(cache.cached("ui", ("/a",), 60, fetch), ["a"])
+        self.assertEqual(fetch.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+"""
+Tests for recording the messages Storm sends to components
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import simplejson as json
+
+from streamparse.capture import CAPTURE_MAGIC, CaptureWriter, read_capture
+from streamparse.cli.replay import replay_capture
+from streamparse.storm import Bolt
+
+HANDSHAKE = {"class": "bolts.WordBolt", "conf": {}, "context": {}}
+
+
+def _tuple_msg(tup_id, stream="default"):
+    return {"id": tup_id, "comp": "spout", "stream": stream, "task": 1, "tuple": [1]}
+
+
+class CaptureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, "bolt.spcap")
+
+    def read(self, path=None):
+        with open(path or self.path, "rb") as capture_file:
+            handshake, records = read_capture(capture_file)
+            return handshake, [msg for _, msg in records]
+
+
+class CaptureWriterTests(CaptureTestCase):
+    def test_round_trip(self):
+        writer = CaptureWriter(self.path, HANDSHAKE)
+        writer.record(_tuple_msg("1"))
+        writer.record(_tuple_msg("2", stream="__heartbeat"))
+        writer.record([1, 2])
+        writer.record(_tuple_msg("3", stream="__tick"))
+        writer.close()
+        handshake, messages = self.read()
+        self.assertEqual(handshake, HANDSHAKE)
+        self.assertEqual(messages, [_tuple_msg("1"), [1, 2], _tuple_msg("3", "__tick")])
+        self.assertEqual(writer.records, 3)
+
+    def test_sampling_keeps_ticks(self):
+        writer = CaptureWriter(self.path, HANDSHAKE, sample_rate=0)
+        writer.record(_tuple_msg("1"))
+        writer.record(_tuple_msg("2", stream="__tick"))
+        writer.close()
+        self.assertEqual([msg["id"] for msg in self.read()[1]], ["2"])
+
+    @mock.patch("random.random", side_effect=[0.1, 0.9])
+    def test_sampling_keeps_task_ids_of_sampled_tuples(self, random_mock):
+        writer = CaptureWriter(self.path, HANDSHAKE, sample_rate=0.5)
+        # The second Tuple is read ahead while waiting for the first's task IDs
+        writer.record(_tuple_msg("1"))
+        writer.command_taken()
+        writer.record(_tuple_msg("2"))
+        writer.record([1])
+        writer.command_taken()
+        writer.record([2])
+        writer.close()
+        self.assertEqual(self.read()[1], [_tuple_msg("1"), [1]])
+
+    def test_flush(self):
+        writer = CaptureWriter(self.path, HANDSHAKE, flush_secs=60, flush_bytes=200)
+        self.addCleanup(writer.close)
+        writer.record(_tuple_msg("1"))
+        self.assertEqual(self.read()[1], [])
+        for i in range(2, 5):
+            writer.record(_tuple_msg(str(i)))
+        self.assertEqual(len(self.read()[1]), 3)
+        writer.flush_secs = 0
+        writer.record(_tuple_msg("5", stream="__heartbeat"))
+        self.assertEqual(len(self.read()[1]), 4)
+
+    def test_rotation(self):
+        writer = CaptureWriter(self.path, HANDSHAKE, max_bytes=200, backup_count=2)
+        for i in range(30):
+            writer.record(_tuple_msg(str(i)))
+        writer.close()
+        self.assertTrue(os.path.exists(f"{self.path}.1"))
+        self.assertTrue(os.path.exists(f"{self.path}.2"))
+        self.assertFalse(os.path.exists(f"{self.path}.3"))
+        # Every file starts with the handshake, and the newest has the last
+        for path in (self.path, f"{self.path}.1", f"{self.path}.2"):
+            self.assertEqual(self.read(path)[0], HANDSHAKE)
+        self.assertEqual(self.read()[1][-1]["id"], "29")
+
+    def test_truncated_record_ignored(self):
+        writer = CaptureWriter(self.path, HANDSHAKE)
+        writer.record(_tuple_msg("1"))
+        writer.record(_tuple_msg("2"))
+        writer.close()
+        with open(self.path, "r+b") as capture_file:
+            capture_file.truncate(os.path.getsize(self.path) - 3)
+        self.assertEqual([msg["id"] for msg in self.read()[1]], ["1"])
+
+    def test_not_a_capture(self):
+        with self.assertRaises(ValueError):
+            read_capture(io.BytesIO(b"nope"))
+        with self.assertRaises(ValueError):
+            read_capture(io.BytesIO(CAPTURE_MAGIC))
+
+
+class ComponentCaptureTests(CaptureTestCase):
+    def test_bolt_records_input(self):
+        messages = [
+            {
+                "pidDir": self.tmp_dir,
+                "conf": {
+                    "streamparse.capture.enabled": True,
+                    "streamparse.capture.path": self.tmp_dir,
+                    "topology.name": "topo",
+                },
+                "context": {"taskid": 3, "componentid": "word_bolt"},
+            },
+            _tuple_msg("1"),
+            _tuple_msg("2", stream="__heartbeat"),
+        ]
+        input_stream = io.BytesIO(
+            "".join(f"{json.dumps(msg)}\nend\n" for msg in messages).encode("utf-8")
+        )
+        bolt = Bolt(input_stream=input_stream, output_stream=io.BytesIO())
+        self.addCleanup(bolt.serializer.output_stream.flush)
+        with mock.patch("logging.Logger.addHandler"):
+            storm_conf, context = bolt.read_handshake()
+            bolt._setup_component(storm_conf, context)
+        bolt.read_tuple()
+        bolt.read_tuple()
+        bolt.capture.close()
+        path = os.path.join(
+            self.tmp_dir, f"streamparse_capture_topo_word_bolt_3_{bolt.pid}.spcap"
+        )
+        handshake, recorded = self.read(path)
+        self.assertEqual(handshake["class"], "streamparse.storm.bolt.Bolt")
+        self.assertEqual(handshake["context"]["componentid"], "word_bolt")
+        self.assertEqual(recorded, [_tuple_msg("1")])
+
+    def test_task_ids_replayed(self):
+        handshake = {
+            "pidDir": self.tmp_dir,
+            "conf": {
+                "streamparse.capture.enabled": True,
+                "streamparse.capture.path": self.tmp_dir,
+                "topology.name": "topo",
+            },
+            "context": {"taskid": 3, "componentid": "task_id_bolt"},
+        }
+        messages = [handshake, _tuple_msg("1"), _tuple_msg("2"), [4], [5]]
+        input_stream = io.BytesIO(
+            "".join(f"{json.dumps(msg)}\nend\n" for msg in messages).encode("utf-8")
+        )
+        bolt = TaskIdBolt(input_stream=input_stream, output_stream=io.BytesIO())
+        with mock.patch("logging.Logger.addHandler"):
+            storm_conf, context = bolt.read_handshake()
+            bolt._setup_component(storm_conf, context)
+        TaskIdBolt.task_ids = []
+        bolt._run()
+        bolt._run()
+        bolt.capture.close()
+        self.assertEqual(TaskIdBolt.task_ids, [[4], [5]])
+
+        TaskIdBolt.task_ids = []
+        replay_capture(bolt.capture.path, profiler="none", import_path=os.getcwd())
+        self.assertEqual(TaskIdBolt.task_ids, [[4], [5]])
+
+
+class TaskIdBolt(Bolt):
+    task_ids = []
+
+    def process(self, tup):
+        TaskIdBolt.task_ids.append(self.emit([1], need_task_ids=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+"""
+Tests for OpenMetrics export of component metrics
+"""
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.request
+from http.server import ThreadingHTTPServer
+from unittest import mock
+
+import simplejson as json
+
+from streamparse.exporter import (
+    CONTENT_TYPE,
+    MetricsFileWriter,
+    _MetricsHandler,
+    collect_metrics,
+    render_metrics,
+)
+from streamparse.metrics import MetricsRegistry
+from streamparse.storm import Bolt
+
+LABELS = {"topology": "topo", "component": "bolt", "task": 3}
+
+
+def _dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+class RenderMetricsTests(unittest.TestCase):
+    def test_render(self):
+        registry = MetricsRegistry()
+        registry.counter("emitted.words").inc(4)
+        latency = registry.histogram("process_latency_us")
+        for value in (50, 200, 3000):
+            latency.record(value)
+        lines = render_metrics(registry, LABELS, {"rss_bytes": 1024})
+        labels = 'topology="topo",component="bolt",task="3"'
+        self.assertIn("# TYPE streamparse_rss_bytes gauge", lines)
+        self.assertIn(f"streamparse_rss_bytes{{{labels}}} 1024", lines)
+        self.assertIn("# TYPE streamparse_emitted_words counter", lines)
+        self.assertIn(f"streamparse_emitted_words_total{{{labels}}} 4", lines)
+        self.assertIn("# TYPE streamparse_process_latency_seconds histogram", lines)
+        self.assertIn(
+            f'streamparse_process_latency_seconds_bucket{{{labels},le="0.0001"}} 1',
+            lines,
+        )
+        self.assertIn(
+            f'streamparse_process_latency_seconds_bucket{{{labels},le="0.005"}} 3',
+            lines,
+        )
+        self.assertIn(
+            f'streamparse_process_latency_seconds_bucket{{{labels},le="+Inf"}} 3',
+            lines,
+        )
+        self.assertIn(
+            f"streamparse_process_latency_seconds_sum{{{labels}}} 0.00325", lines
+        )
+
+    def test_label_escaping(self):
+        registry = MetricsRegistry()
+        registry.counter("acked")
+        (_, line) = render_metrics(registry, {"component": 'a"b\\c'})
+        self.assertEqual(line, 'streamparse_acked_total{component="a\\"b\\\\c"} 0')
+
+
+class MetricsFileTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_totals_survive_reset(self):
+        path = os.path.join(
+            self.tmp_dir, f"streamparse_metrics_topo_bolt_3_{os.getpid()}.prom"
+        )
+        writer = MetricsFileWriter(path, LABELS)
+        registry = MetricsRegistry()
+        registry.counter("acked").inc(2)
+        writer.fold(registry)
+        registry.snapshot(reset=True)
+        registry.counter("acked").inc(1)
+        self.assertTrue(writer.due())
+        writer.write(registry)
+        self.assertFalse(writer.due())
+        with open(path) as metrics_file:
+            self.assertIn(
+                'streamparse_acked_total{topology="topo",component="bolt",task="3"} 3',
+                metrics_file.read(),
+            )
+        writer.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_collect_merges_families(self):
+        registry = MetricsRegistry()
+        registry.counter("acked").inc()
+        pid = os.getpid()
+        for task in (1, 2):
+            MetricsFileWriter(
+                os.path.join(
+                    self.tmp_dir, f"streamparse_metrics_topo_bolt_{task}_{pid}.prom"
+                ),
+                dict(LABELS, task=task),
+            ).write(registry)
+        stale_path = os.path.join(
+            self.tmp_dir, f"streamparse_metrics_topo_bolt_4_{_dead_pid()}.prom"
+        )
+        MetricsFileWriter(stale_path, LABELS).write(registry)
+        page, num_files = collect_metrics(self.tmp_dir)
+        self.assertEqual(num_files, 2)
+        lines = page.splitlines()
+        self.assertEqual(lines.count("# TYPE streamparse_acked counter"), 1)
+        self.assertEqual(
+            len([line for line in lines if line.startswith("streamparse_acked_total")]),
+            2,
+        )
+        self.assertEqual(lines[-1], "# EOF")
+        self.assertFalse(os.path.exists(stale_path))
+
+    def test_http(self):
+        registry = MetricsRegistry()
+        registry.counter("acked").inc()
+        MetricsFileWriter(
+            os.path.join(
+                self.tmp_dir, f"streamparse_metrics_topo_bolt_1_{os.getpid()}.prom"
+            ),
+            LABELS,
+        ).write(registry)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _MetricsHandler)
+        server.export_dir = self.tmp_dir
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            self.assertEqual(response.headers["Content-Type"], CONTENT_TYPE)
+            self.assertIn("streamparse_acked_total", response.read().decode("utf-8"))
+
+
+class ComponentExportTests(unittest.TestCase):
+    def test_bolt_writes_metrics_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        messages = [
+            {
+                "pidDir": tmp_dir,
+                "conf": {
+                    "streamparse.metrics.export.enabled": True,
+                    "streamparse.metrics.export.dir": tmp_dir,
+                    "streamparse.metrics.export.port": 0,
+                    "topology.name": "topo",
+                },
+                "context": {"taskid": 3, "componentid": "bolt"},
+            },
+            {"id": "1", "comp": "spout", "stream": "default", "task": 1, "tuple": [1]},
+        ]
+        input_stream = io.BytesIO(
+            "".join(f"{json.dumps(msg)}\nend\n" for msg in messages).encode("utf-8")
+        )
+        output_stream = io.BytesIO()
+        bolt = Bolt(input_stream=input_stream, output_stream=output_stream)
+        bolt.process = lambda tup: None
+        with mock.patch("logging.Logger.addHandler"):
+            bolt._setup_component(*bolt.read_handshake())
+        self.addCleanup(bolt._component_metrics.close)
+        bolt._run()
+        with open(bolt._metrics_file.path) as metrics_file:
+            contents = metrics_file.read()
+        self.assertIn(
+            'streamparse_received_total{topology="topo",component="bolt",task="3"} 1',
+            contents,
+        )
+        self.assertIn("streamparse_pending_tuples{", contents)
+        self.assertIn("streamparse_rss_bytes{", contents)
+        # Nothing is reported to Storm
+        self.assertNotIn(b'"metrics"', output_stream.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
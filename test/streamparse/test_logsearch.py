@@ -0,0 +1,135 @@
+"""
+Tests for streamparse.logsearch
+"""
+import gzip
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from streamparse.logsearch import (
+    get_component_name,
+    normalize_timestamp,
+    search,
+)
+
+SPLITTER_LOG = """\
+2024-03-01 12:00:00,100 - pystorm.component.split - INFO - starting
+2024-03-01 12:00:01,200 - pystorm.component.split - ERROR - failed
+Traceback (most recent call last):
+  File "split.py", line 10, in process
+KeyError: 'word'
+2024-03-01 12:00:02,300 - pystorm.component.split - INFO - done
+"""
+
+ROTATED_LOG = """\
+  File "split.py", line 3, in process
+2024-03-01 11:00:00,000 - pystorm.component.split - INFO - rotated
+"""
+
+GZIPPED_LOG = """\
+2024-03-01 10:00:00,000 - pystorm.component.count - ERROR - gzipped failure
+"""
+
+
+class LogSearchTests(unittest.TestCase):
+    def setUp(self):
+        self.log_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_path)
+        artifacts = os.path.join(self.log_path, "workers-artifacts", "wc-1", "6700")
+        os.makedirs(artifacts)
+        self.write(
+            os.path.join(artifacts, "pystorm_wordcount_split_3_100.log"), SPLITTER_LOG
+        )
+        self.write(
+            os.path.join(artifacts, "pystorm_wordcount_split_3_100.log.1"),
+            ROTATED_LOG,
+        )
+        with gzip.open(
+            os.path.join(self.log_path, "pystorm_wordcount_count_4_101.log.2.gz"),
+            "wt",
+        ) as log_file:
+            log_file.write(GZIPPED_LOG)
+        self.write(
+            os.path.join(self.log_path, "pystorm_other_split_1_5.log"), SPLITTER_LOG
+        )
+
+    def write(self, path, contents):
+        with open(path, "w") as log_file:
+            log_file.write(contents)
+
+    def test_normalize_timestamp(self):
+        self.assertEqual(
+            normalize_timestamp("2024-03-01 12:00:00,1 - x"), "2024-03-01 12:00:00.100"
+        )
+        self.assertEqual(
+            normalize_timestamp("2024-03-01T12:00:00.123456"), "2024-03-01 12:00:00.123"
+        )
+        self.assertEqual(
+            normalize_timestamp("2024-03-01 12:00:00"), "2024-03-01 12:00:00.000"
+        )
+        self.assertIsNone(normalize_timestamp("  File 'split.py'"))
+
+    def test_get_component_name(self):
+        self.assertEqual(
+            get_component_name(
+                "./a/pystorm_wordcount_word_split_3_100.log.1", "wordcount"
+            ),
+            "word_split",
+        )
+        self.assertEqual(get_component_name("./custom.log", "wordcount"), "custom")
+
+    def test_search_everything(self):
+        matches = search(self.log_path, "wordcount")
+        self.assertEqual(
+            [match["timestamp"] for match in matches],
+            [
+                "2024-03-01 10:00:00.000",
+                "2024-03-01 11:00:00.000",
+                "2024-03-01 12:00:00.100",
+                "2024-03-01 12:00:01.200",
+                "2024-03-01 12:00:02.300",
+            ],
+        )
+        self.assertEqual(matches[0]["component"], "count")
+        self.assertEqual(matches[0]["file"], "pystorm_wordcount_count_4_101.log.2.gz")
+        self.assertEqual(matches[1]["component"], "split")
+
+    def test_search_regex_includes_continuation_lines(self):
+        matches = search(self.log_path, "wordcount", regex="keyerror", ignore_case=True)
+        self.assertEqual(len(matches), 1)
+        self.assertTrue(matches[0]["text"].startswith("2024-03-01 12:00:01,200"))
+        self.assertTrue(matches[0]["text"].endswith("KeyError: 'word'"))
+
+    def test_search_time_range(self):
+        matches = search(
+            self.log_path,
+            "wordcount",
+            start="2024-03-01 11:00:00.000",
+            end="2024-03-01 12:00:01.200",
+        )
+        self.assertEqual(
+            [match["timestamp"] for match in matches],
+            ["2024-03-01 11:00:00.000", "2024-03-01 12:00:00.100"],
+        )
+
+    def test_search_skips_files_older_than_start(self):
+        old = time.mktime((2024, 2, 1, 0, 0, 0, 0, 0, -1))
+        for dir_path, _, file_names in os.walk(self.log_path):
+            for file_name in file_names:
+                os.utime(os.path.join(dir_path, file_name), (old, old))
+        self.assertEqual(
+            search(self.log_path, "wordcount", start="2024-03-01 00:00:00.000"), []
+        )
+
+    def test_search_max_results_keeps_newest(self):
+        matches = search(self.log_path, "wordcount", regex="pystorm", max_results=2)
+        self.assertEqual(
+            [match["timestamp"] for match in matches],
+            ["2024-03-01 12:00:01.200", "2024-03-01 12:00:02.300"],
+        )
+
+    def test_search_file_regex(self):
+        matches = search(self.log_path, "wordcount", file_regex="_count_")
+        self.assertEqual([match["component"] for match in matches], ["count"])
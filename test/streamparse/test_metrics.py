@@ -0,0 +1,248 @@
+"""
+Tests for component metrics
+"""
+import gc
+import io
+import math
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import simplejson as json
+
+from streamparse.metrics import (
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    make_metric_messages,
+)
+from streamparse.storm import Bolt
+
+
+class HistogramTests(unittest.TestCase):
+    def test_small_values_exact(self):
+        histogram = Histogram()
+        for value in range(1, 11):
+            histogram.record(value)
+        self.assertEqual(histogram.percentile(50), 5)
+        self.assertEqual(histogram.percentile(100), 10)
+        self.assertEqual(histogram.summary()["p90"], 9)
+        self.assertEqual(histogram.mean, 5.5)
+        self.assertEqual((histogram.min, histogram.max), (1, 10))
+
+    def test_large_values_within_precision(self):
+        histogram = Histogram()
+        values = [random.randint(0, 10**7) for _ in range(5000)]
+        for value in values:
+            histogram.record(value)
+        values.sort()
+        for percent in (50, 90, 99, 99.9):
+            exact = values[math.ceil(round(len(values) * percent / 100, 9)) - 1]
+            estimate = histogram.percentile(percent)
+            self.assertGreaterEqual(estimate, exact)
+            self.assertLessEqual(estimate, exact * 1.07 + 1)
+
+    def test_buckets_are_contiguous(self):
+        histogram = Histogram(precision_bits=3)
+        previous_bucket = -1
+        for value in range(2000):
+            bucket = histogram._bucket(value)
+            self.assertIn(bucket, (previous_bucket, previous_bucket + 1))
+            self.assertLessEqual(value, histogram._bucket_max(bucket))
+            previous_bucket = bucket
+
+    def test_empty_and_reset(self):
+        histogram = Histogram()
+        histogram.record(-5)
+        self.assertEqual(histogram.max, 0)
+        histogram.reset()
+        self.assertEqual(histogram.percentile(99), 0)
+        self.assertEqual(histogram.summary()["count"], 0)
+
+    def test_record_from_threads(self):
+        histogram = Histogram()
+        counter = Counter()
+
+        def record():
+            for value in range(10000):
+                histogram.record(value)
+                counter.inc()
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(histogram.count, 40000)
+        self.assertEqual(sum(count for _, count in histogram.buckets()), 40000)
+        self.assertEqual(counter.value, 40000)
+
+    def test_summary_reset(self):
+        histogram = Histogram()
+        histogram.record(5)
+        self.assertEqual(histogram.summary(reset=True)["count"], 1)
+        self.assertEqual(histogram.count, 0)
+
+    def test_time(self):
+        histogram = Histogram()
+        with histogram.time():
+            pass
+        self.assertEqual(histogram.count, 1)
+
+
+class MetricsRegistryTests(unittest.TestCase):
+    def test_snapshot_and_reset(self):
+        registry = MetricsRegistry()
+        registry.counter("misses").inc(3)
+        registry.histogram("query_us").record(40)
+        messages = make_metric_messages(registry, prefix="app.")
+        self.assertEqual(
+            [(msg["name"], msg["command"]) for msg in messages],
+            [("app.misses", "metrics"), ("app.query_us", "metrics")],
+        )
+        self.assertEqual(messages[0]["params"], 3)
+        self.assertEqual(messages[1]["params"]["max"], 40)
+        self.assertEqual(registry.snapshot()["misses"], 0)
+
+    def test_only_named_messages(self):
+        registry = MetricsRegistry()
+        registry.counter("misses").inc(3)
+        registry.counter("hits").inc(3)
+        messages = make_metric_messages(registry, names={"hits"})
+        self.assertEqual([msg["name"] for msg in messages], ["streamparse.hits"])
+        # Everything is reset, reported or not
+        self.assertEqual(registry.snapshot(), {"hits": 0, "misses": 0})
+
+    def test_type_clash(self):
+        registry = MetricsRegistry()
+        registry.counter("misses")
+        with self.assertRaises(TypeError):
+            registry.histogram("misses")
+
+
+class CountingBolt(Bolt):
+    def process(self, tup):
+        self.emit([tup.values[0]], stream="words")
+
+
+class ComponentMetricsTests(unittest.TestCase):
+    def make_bolt(self, conf, messages):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        handshake = {
+            "pidDir": tmp_dir,
+            "conf": conf,
+            "context": {"taskid": 1, "componentid": "counting_bolt"},
+        }
+        input_stream = io.BytesIO(
+            "".join(
+                f"{json.dumps(msg)}\nend\n" for msg in [handshake] + messages
+            ).encode("utf-8")
+        )
+        output_stream = io.BytesIO()
+        bolt = CountingBolt(input_stream=input_stream, output_stream=output_stream)
+        with mock.patch("logging.Logger.addHandler"):
+            bolt._setup_component(*bolt.read_handshake())
+        if bolt._component_metrics is not None:
+            self.addCleanup(bolt._component_metrics.close)
+        return bolt, output_stream
+
+    @staticmethod
+    def sent(output_stream):
+        frames = output_stream.getvalue().decode("utf-8").split("\nend\n")
+        return [json.loads(frame) for frame in frames if frame]
+
+    def test_disabled(self):
+        bolt, output_stream = self.make_bolt(
+            {},
+            [
+                {
+                    "id": "1",
+                    "comp": "spout",
+                    "stream": "__tick",
+                    "task": -1,
+                    "tuple": [1],
+                }
+            ],
+        )
+        bolt._run()
+        self.assertNotIn(
+            "metrics", [msg.get("command") for msg in self.sent(output_stream)]
+        )
+
+    def test_not_reported_unless_registered(self):
+        bolt, output_stream = self.make_bolt(
+            {"streamparse.metrics.enabled": True},
+            [
+                {
+                    "id": "1",
+                    "comp": "__system",
+                    "stream": "__tick",
+                    "task": -1,
+                    "tuple": [1],
+                }
+            ],
+        )
+        bolt._run()
+        self.assertNotIn(
+            "metrics", [msg.get("command") for msg in self.sent(output_stream)]
+        )
+        # Metrics are still recorded, for exporting
+        self.assertEqual(bolt.metrics.snapshot()["input_wait_us"]["count"], 1)
+
+    def test_reported_on_tick(self):
+        tup = {"comp": "spout", "stream": "default", "task": 2, "tuple": ["dog"]}
+        registered = [
+            "acked",
+            "custom",
+            "emitted.words",
+            "failed",
+            "gc_pause_us",
+            "process_latency_us",
+            "input_wait_us",
+            "serialize_us",
+        ]
+        bolt, output_stream = self.make_bolt(
+            {
+                "streamparse.metrics.enabled": True,
+                "streamparse.metrics.registered": registered,
+            },
+            [
+                dict(tup, id="1"),
+                dict(tup, id="2"),
+                {
+                    "id": "3",
+                    "comp": "__system",
+                    "stream": "__tick",
+                    "task": -1,
+                    "tuple": [1],
+                },
+            ],
+        )
+        bolt.metrics.counter("custom").inc()
+        gc.collect()
+        for _ in range(3):
+            bolt._run()
+        metrics = {
+            msg["name"]: msg["params"]
+            for msg in self.sent(output_stream)
+            if msg.get("command") == "metrics"
+        }
+        self.assertEqual(metrics["streamparse.emitted.words"], 2)
+        self.assertEqual(metrics["streamparse.acked"], 2)
+        self.assertEqual(metrics["streamparse.failed"], 0)
+        self.assertEqual(metrics["streamparse.custom"], 1)
+        self.assertEqual(metrics["streamparse.process_latency_us"]["count"], 2)
+        self.assertEqual(metrics["streamparse.input_wait_us"]["count"], 3)
+        self.assertGreaterEqual(metrics["streamparse.serialize_us"]["count"], 4)
+        self.assertGreaterEqual(metrics["streamparse.gc_pause_us"]["count"], 1)
+        self.assertNotIn("streamparse.received", metrics)
+        # Everything is reset after a report
+        self.assertEqual(bolt.metrics.snapshot()["acked"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
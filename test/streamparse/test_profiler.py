@@ -0,0 +1,115 @@
+"""
+Tests for the sampling profiler
+"""
+import io
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import unittest
+from collections import Counter
+from unittest import mock
+
+from streamparse.profiler import (
+    SamplingProfiler,
+    read_collapsed,
+    start_profiler,
+    write_collapsed,
+)
+
+
+def busy_loop(secs):
+    end = time.process_time() + secs
+    total = 0
+    while time.process_time() < end:
+        total += sum(range(100))
+    return total
+
+
+class SamplingProfilerTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_samples_busy_function(self):
+        path = os.path.join(self.tmp_dir, "bolt.folded")
+        profiler = SamplingProfiler(path, hz=1000)
+        profiler.start()
+        try:
+            busy_loop(0.2)
+        finally:
+            profiler.stop()
+        self.assertFalse(profiler.running)
+        self.assertTrue(profiler.samples)
+        self.assertTrue(any("busy_loop (" in stack for stack in profiler.samples))
+        with open(path, encoding="utf-8") as profile_file:
+            self.assertEqual(read_collapsed(profile_file), profiler.samples)
+
+    def test_writes_on_interval(self):
+        path = os.path.join(self.tmp_dir, "bolt.folded")
+        profiler = SamplingProfiler(path, hz=1000, interval=0.05)
+        profiler.start()
+        try:
+            deadline = time.monotonic() + 5
+            while not os.path.exists(path) and time.monotonic() < deadline:
+                busy_loop(0.01)
+            self.assertTrue(os.path.exists(path))
+        finally:
+            profiler.stop()
+
+    def test_handler_never_writes(self):
+        profiler = SamplingProfiler(
+            os.path.join(self.tmp_dir, "bolt.folded"), interval=0
+        )
+        with mock.patch.object(profiler, "write") as write_mock:
+            for _ in range(3):
+                profiler._sample(signal.SIGPROF, sys._getframe())
+        write_mock.assert_not_called()
+        self.assertEqual(sum(profiler.samples.values()), 3)
+
+    def test_invalid_hz(self):
+        with self.assertRaises(ValueError):
+            SamplingProfiler(hz=0)
+
+
+class CollapsedStackTests(unittest.TestCase):
+    def test_round_trip_and_merge(self):
+        samples = Counter({"main (a.py:1);work (a.py:5)": 3, "main (a.py:1)": 1})
+        profile_file = io.StringIO()
+        write_collapsed(profile_file, samples)
+        lines = profile_file.getvalue().splitlines() + ["", "garbage"]
+        merged = read_collapsed(lines, read_collapsed(lines))
+        self.assertEqual(merged, samples + samples)
+
+
+class StartProfilerTests(unittest.TestCase):
+    def setUp(self):
+        self.component = mock.Mock(
+            topology_name="topo", component_name="bolt", task_id=2, pid=123
+        )
+
+    def test_disabled(self):
+        self.assertIsNone(start_profiler(self.component, {}))
+
+    def test_enabled(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        profiler = start_profiler(
+            self.component,
+            {"streamparse.profile.enabled": True, "pystorm.log.path": tmp_dir},
+        )
+        try:
+            self.assertTrue(profiler.running)
+            self.assertEqual(
+                profiler.path,
+                os.path.join(tmp_dir, "streamparse_profile_topo_bolt_2_123.folded"),
+            )
+        finally:
+            profiler.stop()
+        self.assertTrue(os.path.exists(profiler.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
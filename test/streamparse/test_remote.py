@@ -0,0 +1,168 @@
+"""
+Tests for streamparse.remote
+"""
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from fabric.api import env
+
+from streamparse import remote
+from streamparse.remote import (
+    LocalTransport,
+    RemoteExecutor,
+    SSHTransport,
+    as_user,
+    check_results,
+    get_executor,
+    warn_about_results,
+)
+
+HOSTS = ["worker1", "worker2", "worker3"]
+
+
+class RemoteExecutorTests(unittest.TestCase):
+    def setUp(self):
+        self.output = io.StringIO()
+        self.executor = RemoteExecutor(LocalTransport(), output=self.output)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_run_streams_output_with_host_prefixes(self):
+        results = self.executor.run(HOSTS, 'echo "one $STREAMPARSE_HOST"; echo two')
+        self.assertEqual(list(results), HOSTS)
+        for host in HOSTS:
+            self.assertTrue(results[host].succeeded)
+            self.assertEqual(results[host].output, f"one {host}\ntwo\n")
+            self.assertIn(f"[{host}] one {host}\n", self.output.getvalue())
+            self.assertIn(f"[{host}] two\n", self.output.getvalue())
+
+    def test_run_without_streaming(self):
+        results = self.executor.run(HOSTS, "echo hi", stream=False)
+        self.assertEqual(results["worker1"].output, "hi\n")
+        self.assertEqual(self.output.getvalue(), "")
+
+    def test_run_captures_stderr_and_failures(self):
+        results = self.executor.run(
+            HOSTS, 'echo oops >&2; [ "$STREAMPARSE_HOST" != worker2 ]'
+        )
+        self.assertEqual(results["worker2"].output, "oops\n")
+        self.assertFalse(results["worker2"].succeeded)
+        self.assertTrue(results["worker1"].succeeded)
+        with self.assertRaisesRegex(RuntimeError, "Failed to check on: worker2$"):
+            check_results(results, "check")
+
+    def test_warn_about_failures(self):
+        results = self.executor.run(
+            HOSTS, '[ "$STREAMPARSE_HOST" != worker2 ]', stream=False
+        )
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            warn_about_results(results, "check")
+            warn_about_results({"worker1": results["worker1"]}, "check")
+        self.assertEqual(stdout.getvalue().count("\n"), 1)
+        self.assertIn("Failed to check on: worker2\n", stdout.getvalue())
+
+    def test_sudo_needs_password(self):
+        results = self.executor.run(
+            HOSTS, 'echo "sudo: a password is required" >&2; exit 1', stream=False
+        )
+        with self.assertRaisesRegex(RuntimeError, '"remote_executor" to "fabric"'):
+            check_results(results, "check")
+
+    def test_run_command_per_host(self):
+        results = self.executor.run(HOSTS, lambda host: f"echo {host.upper()}")
+        self.assertEqual(results["worker3"].output, "WORKER3\n")
+
+    def test_run_concurrently(self):
+        start = time.monotonic()
+        self.executor.run(HOSTS * 3, "sleep 0.5", stream=False)
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_run_limits_concurrency(self):
+        self.executor.concurrency = 1
+        start = time.monotonic()
+        self.executor.run(HOSTS, "sleep 0.2", stream=False)
+        self.assertGreaterEqual(time.monotonic() - start, 0.6)
+
+    def test_run_timeout(self):
+        self.executor.timeout = 0.5
+        start = time.monotonic()
+        results = self.executor.run(
+            HOSTS, '[ "$STREAMPARSE_HOST" = worker1 ] || exec sleep 10'
+        )
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertTrue(results["worker1"].succeeded)
+        self.assertTrue(results["worker2"].timed_out)
+        self.assertIsNone(results["worker2"].return_code)
+        self.assertIn("[worker2] Timed out after 0.5 seconds.", self.output.getvalue())
+        with self.assertRaisesRegex(RuntimeError, r"worker2 \(timed out\)"):
+            check_results(results, "check")
+
+    def test_run_with_input(self):
+        results = self.executor.run(HOSTS, "cat", input=b"hello\n")
+        self.assertEqual(results["worker1"].output, "hello\n")
+
+    def test_run_with_input_path(self):
+        input_path = os.path.join(self.tmp_dir, "input")
+        with open(input_path, "wb") as input_file:
+            input_file.write(b"x" * (remote.COPY_CHUNK_SIZE * 3 + 1))
+        results = self.executor.run(HOSTS, "wc -c", input_path=input_path)
+        self.assertEqual(
+            results["worker2"].output.strip(), str(remote.COPY_CHUNK_SIZE * 3 + 1)
+        )
+
+    def test_run_ignores_unread_input(self):
+        results = self.executor.run(["worker1"], "true", input=b"x" * (1 << 22))
+        self.assertTrue(results["worker1"].succeeded)
+
+    def test_fetch(self):
+        local_path = os.path.join(self.tmp_dir, "fetched")
+        result = self.executor.fetch(
+            "worker1", "printf '\\000\\001'; echo ignored >&2", local_path
+        )
+        self.assertTrue(result.succeeded)
+        with open(local_path, "rb") as fetched:
+            self.assertEqual(fetched.read(), b"\x00\x01")
+
+
+class AsUserTests(unittest.TestCase):
+    def test_same_user(self):
+        self.assertEqual(as_user("ls", "storm", "storm"), "ls")
+        self.assertEqual(as_user("ls", None, None), "ls")
+
+    def test_sudo(self):
+        self.assertEqual(
+            as_user("ls 'a b'", "storm", "ubuntu"),
+            "sudo -n -H -u storm bash -c 'ls '\"'\"'a b'\"'\"''",
+        )
+        self.assertEqual(as_user("ls", None, "ubuntu"), "sudo -n -H bash -c ls")
+
+
+class GetExecutorTests(unittest.TestCase):
+    def test_get_executor(self):
+        with mock.patch.dict(
+            env, user="storm", pool_size=4, remote_timeout=30, password=None
+        ):
+            executor = get_executor()
+        self.assertEqual(executor.concurrency, 4)
+        self.assertEqual(executor.timeout, 30)
+        self.assertEqual(executor.transport.user, "storm")
+
+    def test_fabric_fallback(self):
+        with mock.patch.dict(env, remote_executor="fabric", password=None):
+            self.assertIsNone(get_executor())
+        with mock.patch.dict(env, remote_executor="asyncio", password="secret"):
+            self.assertIsNone(get_executor())
+        with mock.patch.dict(env, password=None, sudo_password="secret"):
+            self.assertIsNone(get_executor())
+
+    def test_ssh_command(self):
+        command = SSHTransport(user="storm").get_command("worker1", "ls")
+        self.assertEqual(command[0], "ssh")
+        self.assertEqual(command[-2:], ["storm@worker1", "ls"])
+        self.assertIn("ControlMaster=auto", command)
+        self.assertIn("BatchMode=yes", command)
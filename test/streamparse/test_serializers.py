@@ -0,0 +1,89 @@
+"""
+Tests for streamparse-specific serializers
+"""
+import io
+import threading
+import unittest
+
+import pytest
+from pystorm.component import _SERIALIZERS
+from pystorm.exceptions import StormWentAwayError
+
+from streamparse import util
+from streamparse.dsl import Topology
+from streamparse.storm import Bolt, JavaSpout
+
+msgpack = pytest.importorskip("msgpack")
+
+from streamparse.storm.serializers import FramedMsgpackSerializer
+
+
+def _make_serializer(input_bytes=b""):
+    return FramedMsgpackSerializer(
+        io.BytesIO(input_bytes), io.BytesIO(), threading.RLock(), threading.RLock()
+    )
+
+
+class FramedMsgpackSerializerTests(unittest.TestCase):
+    def test_registered(self):
+        self.assertIs(_SERIALIZERS["msgpack_framed"], FramedMsgpackSerializer)
+
+    def test_frame_is_length_prefixed(self):
+        serializer = _make_serializer()
+        msg = {"command": "emit", "tuple": ["word", 1]}
+        frame = serializer.serialize_dict(msg)
+        self.assertEqual(frame[0], 0xCE)
+        self.assertEqual(int.from_bytes(frame[1:5], "big"), len(frame) - 5)
+        self.assertEqual(msgpack.unpackb(frame[5:], raw=False), msg)
+
+    def test_round_trip(self):
+        writer = _make_serializer()
+        messages = [
+            {"command": "next"},
+            [1, 2, 3],
+            {"id": "1", "comp": "spout", "stream": "default", "tuple": ["é", b"x"]},
+        ]
+        data = b"".join(writer.serialize_dict(msg) for msg in messages)
+        reader = _make_serializer(data)
+        self.assertEqual([reader.read_message() for _ in messages], messages)
+        with self.assertRaises(StormWentAwayError):
+            reader.read_message()
+
+    def test_send_message(self):
+        output = io.BytesIO()
+        serializer = FramedMsgpackSerializer(
+            io.BytesIO(), output, threading.RLock(), threading.RLock()
+        )
+        serializer.send_message({"command": "sync"})
+        self.assertEqual(
+            output.getvalue(), serializer.serialize_dict({"command": "sync"})
+        )
+
+    def test_bolt_reads_tuple(self):
+        writer = _make_serializer()
+        data = writer.serialize_dict(
+            {"id": "1", "comp": "spout", "stream": "default", "task": 3, "tuple": ["a"]}
+        )
+        bolt = Bolt(
+            input_stream=io.BytesIO(data),
+            output_stream=io.BytesIO(),
+            serializer="msgpack_framed",
+        )
+        tup = bolt.read_tuple()
+        self.assertEqual(tup.values, ("a",))
+        self.assertEqual(tup.task, 3)
+
+    def test_not_used_with_storm(self):
+        class WordCount(Topology):
+            word_spout = JavaSpout.spec(
+                full_class_name="com.example.Spout", args_list=[], outputs=["word"]
+            )
+            word_bolt = Bolt.spec(inputs=[word_spout])
+
+        with self.assertRaises(ValueError):
+            util.set_topology_serializer(
+                {"serializer": "msgpack_framed"}, {}, WordCount
+            )
+        util.set_topology_serializer({"serializer": "msgpack"}, {}, WordCount)
+        bolt_shell = WordCount.thrift_bolts["word_bolt"].bolt_object.shell
+        self.assertTrue(bolt_shell.script.startswith("-s msgpack "))
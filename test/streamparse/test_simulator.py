@@ -0,0 +1,194 @@
+"""
+Tests for running topologies without Storm
+"""
+import unittest
+
+from streamparse.dsl import Grouping, Stream, Topology
+from streamparse.simulator import TopologySimulator
+from streamparse.storm import AsyncBolt, Bolt, JavaBolt, Spout
+
+WORDS = ["dog", "cat", "zebra", "elephant", "dog", "cat", "dog"]
+
+
+class WordSpout(Spout):
+    outputs = ["word"]
+
+    def initialize(self, conf, ctx):
+        self.words = iter(WORDS)
+        self.next_id = 0
+
+    def next_tuple(self):
+        word = next(self.words, None)
+        if word is not None:
+            self.next_id += 1
+            self.emit([word], tup_id=self.next_id)
+
+
+class WordCountBolt(Bolt):
+    outputs = [
+        Stream(fields=["word", "count"]),
+        Stream(fields=["task"], name="tasks"),
+    ]
+
+    def initialize(self, conf, ctx):
+        self.counts = {}
+
+    def process(self, tup):
+        word = tup.values.word
+        self.counts[word] = self.counts.get(word, 0) + 1
+        self.emit([word, self.counts[word]])
+        self.emit([self.task_id], stream="tasks")
+
+
+class TaskBolt(Bolt):
+    outputs = ["task"]
+
+    def process(self, tup):
+        self.emit([tup.values.task])
+
+
+class FailingBolt(Bolt):
+    outputs = ["word"]
+    auto_ack = False
+
+    def process(self, tup):
+        if tup.values.word == "cat":
+            self.fail(tup)
+        else:
+            self.ack(tup)
+
+
+class UnackingBolt(Bolt):
+    auto_ack = False
+
+    def process(self, tup):
+        pass
+
+
+class TickBolt(Bolt):
+    outputs = ["freq"]
+
+    def process(self, tup):
+        pass
+
+    def process_tick(self, tup):
+        self.emit([tup.values[0]])
+
+
+class WordCountTopology(Topology):
+    word_spout = WordSpout.spec()
+    count_bolt = WordCountBolt.spec(inputs={word_spout: Grouping.fields("word")}, par=3)
+    all_bolt = TaskBolt.spec(inputs={count_bolt["tasks"]: Grouping.ALL}, par=2)
+
+
+class FailTopology(Topology):
+    word_spout = WordSpout.spec()
+    fail_bolt = FailingBolt.spec(inputs=[word_spout])
+
+
+class TimeoutTopology(Topology):
+    config = {"topology.message.timeout.secs": 0.1}
+    word_spout = WordSpout.spec()
+    unacking_bolt = UnackingBolt.spec(inputs=[word_spout])
+
+
+class TickTopology(Topology):
+    word_spout = WordSpout.spec()
+    tick_bolt = TickBolt.spec(
+        inputs=[word_spout], config={"topology.tick.tuple.freq.secs": 0.05}
+    )
+
+
+class AsyncCatBolt(AsyncBolt):
+    async def process(self, tup):
+        if tup.values.word == "cat":
+            raise ValueError("No cats")
+
+
+class AsyncDogBolt(AsyncBolt):
+    async def process(self, tup):
+        pass
+
+
+class AsyncTopology(Topology):
+    word_spout = WordSpout.spec()
+    # Created first, so its SIGUSR1 handler would be replaced
+    a_cat_bolt = AsyncCatBolt.spec(inputs=[word_spout])
+    b_dog_bolt = AsyncDogBolt.spec(inputs=[word_spout])
+
+
+def _all_done(simulator):
+    return simulator.acked + simulator.failed == len(WORDS)
+
+
+class TopologySimulatorTests(unittest.TestCase):
+    def test_fields_grouping_and_acks(self):
+        simulator = TopologySimulator(WordCountTopology, record_emits=True)
+        simulator.run(secs=10, until=_all_done)
+        self.assertEqual(simulator.acked, len(WORDS))
+        self.assertEqual(simulator.failed, 0)
+        counts = {}
+        for word, count in simulator.emitted[("count_bolt", "default")]:
+            counts[word] = max(counts.get(word, 0), count)
+        # Every word went to the same task, so the counts are complete
+        self.assertEqual(counts, {"dog": 3, "cat": 2, "zebra": 1, "elephant": 1})
+
+    def test_all_grouping(self):
+        simulator = TopologySimulator(WordCountTopology, record_emits=True)
+        simulator.run(secs=10, until=_all_done)
+        self.assertEqual(
+            len(simulator.emitted[("all_bolt", "default")]), 2 * len(WORDS)
+        )
+
+    def test_fail(self):
+        simulator = TopologySimulator(FailTopology)
+        simulator.run(secs=10, until=_all_done)
+        self.assertEqual(simulator.acked, 5)
+        self.assertEqual(simulator.failed, 2)
+
+    def test_timeout(self):
+        simulator = TopologySimulator(TimeoutTopology)
+        simulator.run(secs=10, until=_all_done)
+        self.assertEqual(simulator.failed, len(WORDS))
+
+    def test_acking_disabled(self):
+        simulator = TopologySimulator(
+            TimeoutTopology, options={"topology.acker.executors": 0}
+        )
+        simulator.run(secs=10, until=_all_done)
+        self.assertEqual(simulator.acked, len(WORDS))
+
+    def test_tick_tuples(self):
+        simulator = TopologySimulator(TickTopology, record_emits=True)
+        simulator.run(secs=10, until=lambda sim: sim.emitted[("tick_bolt", "default")])
+        self.assertEqual(simulator.emitted[("tick_bolt", "default")][0], [0.05])
+
+    def test_process_mode(self):
+        simulator = TopologySimulator(FailTopology, mode="process")
+        simulator.run(secs=30, until=_all_done)
+        self.assertEqual((simulator.acked, simulator.failed), (5, 2))
+
+    def test_exceptions_on_component_threads(self):
+        simulator = TopologySimulator(AsyncTopology)
+        with self.assertRaisesRegex(RuntimeError, "a_cat_bolt:1 died: .*No cats"):
+            simulator.run(secs=10)
+        dead = [task.component for task in simulator.tasks.values() if task.dead]
+        self.assertEqual(dead, ["a_cat_bolt"])
+
+    def test_java_components_not_supported(self):
+        class JavaTopology(Topology):
+            word_spout = WordSpout.spec()
+            java_bolt = JavaBolt.spec(
+                full_class_name="com.example.Bolt", args_list=[], inputs=[word_spout]
+            )
+
+        with self.assertRaises(ValueError):
+            TopologySimulator(JavaTopology)
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            TopologySimulator(FailTopology, mode="fiber")
+
+
+if __name__ == "__main__":
+    unittest.main()
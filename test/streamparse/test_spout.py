@@ -0,0 +1,70 @@
+"""
+Tests for streamparse-specific Spout extensions
+"""
+
+import io
+import unittest
+
+import simplejson as json
+
+from streamparse.storm import ReliableSpout, Spout
+
+
+def _sent_messages(spout, output):
+    spout.serializer.output_stream.flush()
+    chunks = output.getvalue().decode("utf-8").split("\nend\n")
+    return [json.loads(chunk) for chunk in chunks if chunk]
+
+
+class SpoutEmitManyTests(unittest.TestCase):
+    def test_emit_many(self):
+        output = io.BytesIO()
+        spout = Spout(input_stream=io.BytesIO(), output_stream=output)
+        spout.emit_many([["the"], ["dog"]], tup_ids=["1", "2"], direct_task=4)
+        self.assertEqual(
+            _sent_messages(spout, output),
+            [
+                {
+                    "command": "emit",
+                    "tuple": [word],
+                    "id": tup_id,
+                    "task": 4,
+                    "need_task_ids": False,
+                }
+                for word, tup_id in (("the", "1"), ("dog", "2"))
+            ],
+        )
+        self.assertEqual(spout.message_writes, 1)
+
+    def test_emit_many_unreliable(self):
+        output = io.BytesIO()
+        spout = Spout(input_stream=io.BytesIO(), output_stream=output)
+        spout.emit_many([["the"], ["dog"]])
+        self.assertNotIn("id", _sent_messages(spout, output)[0])
+
+    def test_emit_many_mismatched_ids(self):
+        spout = Spout(input_stream=io.BytesIO(), output_stream=io.BytesIO())
+        with self.assertRaises(ValueError):
+            spout.emit_many([["the"], ["dog"]], tup_ids=["1"])
+
+
+class ReliableSpoutEmitManyTests(unittest.TestCase):
+    def setUp(self):
+        self.output = io.BytesIO()
+        self.spout = ReliableSpout(input_stream=io.BytesIO(), output_stream=self.output)
+
+    def test_requires_ids(self):
+        with self.assertRaises(ValueError):
+            self.spout.emit_many([["dog"]])
+
+    def test_tracks_unacked(self):
+        self.spout.emit_many([["the"], ["dog"]], tup_ids=["1", "2"], stream="words")
+        self.assertEqual(
+            self.spout.unacked_tuples,
+            {
+                "1": (["the"], "words", None, False),
+                "2": (["dog"], "words", None, False),
+            },
+        )
+        self.spout.ack("1")
+        self.assertEqual(list(self.spout.unacked_tuples), ["2"])
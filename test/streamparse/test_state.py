@@ -0,0 +1,164 @@
+"""
+Tests for keyed Bolt state
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import simplejson as json
+
+from streamparse.storm import Bolt
+from streamparse.storm import state as state_module
+from streamparse.storm.state import (
+    LMDBBackend,
+    MemoryBackend,
+    SQLiteBackend,
+    StateStore,
+    open_state_store,
+)
+
+
+class StateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+
+class StateStoreTests(StateTestCase):
+    def test_get_put_incr_delete(self):
+        store = StateStore(MemoryBackend())
+        self.assertIsNone(store.get("dog"))
+        self.assertEqual(store.get("dog", 0), 0)
+        self.assertEqual(store.incr("dog"), 1)
+        self.assertEqual(store.incr("dog", 9), 10)
+        store.put("cat", {"legs": 4})
+        self.assertEqual(store["cat"], {"legs": 4})
+        self.assertIn("cat", store)
+        store.delete("cat")
+        self.assertNotIn("cat", store)
+        with self.assertRaises(KeyError):
+            store["cat"]
+
+    def test_snapshot(self):
+        backend = MemoryBackend()
+        store = StateStore(backend)
+        store.incr("dog")
+        store.put("cat", 1)
+        self.assertEqual(backend.data, {})
+        store.snapshot()
+        self.assertEqual(backend.data, {"dog": 1, "cat": 1})
+        store.delete("cat")
+        store.snapshot()
+        self.assertEqual(backend.data, {"dog": 1})
+
+    def test_eviction_writes_dirty_keys(self):
+        backend = MemoryBackend()
+        store = StateStore(backend, cache_size=2)
+        store.put("a", 1)
+        store.put("b", 2)
+        store.get("a")
+        store.put("c", 3)
+        # "b" was least recently used
+        self.assertEqual(backend.data, {"b": 2})
+        self.assertEqual(list(store._cache), ["a", "c"])
+        # and is read back from the backend
+        self.assertEqual(store.get("b"), 2)
+        self.assertEqual(len(store._cache), 2)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            open_state_store("redis")
+
+
+class SQLiteBackendTests(StateTestCase):
+    def test_recovers_last_snapshot(self):
+        path = os.path.join(self.tmp_dir, "nested", "state.sqlite")
+        store = open_state_store("sqlite", path=path, cache_size=1)
+        store.incr(("dog", "default"), 5)
+        store.incr("cat", 2)  # evicts the dog count
+        store.snapshot()
+        store.incr("cat", 100)
+        store.backend.close()
+
+        store = open_state_store("sqlite", path=path)
+        self.assertEqual(store.get(("dog", "default")), 5)
+        self.assertEqual(store.get("cat"), 2)
+        store.delete("cat")
+        store.close()
+        self.assertNotIn("cat", StateStore(SQLiteBackend(path)))
+
+
+@unittest.skipUnless(state_module.HAVE_LMDB, "lmdb is not installed")
+class LMDBBackendTests(StateTestCase):
+    def test_round_trip(self):
+        backend = LMDBBackend(os.path.join(self.tmp_dir, "state.lmdb"))
+        backend.put_many([("dog", 1), ("cat", [1, 2])])
+        backend.delete_many(["dog", "fish"])
+        self.assertEqual(backend.get("cat"), [1, 2])
+        with self.assertRaises(KeyError):
+            backend.get("dog")
+        backend.close()
+
+
+class BoltStateTests(StateTestCase):
+    def _make_bolt(self, storm_conf, input_messages=()):
+        input_stream = io.BytesIO(
+            "".join(json.dumps(msg) + "\nend\n" for msg in input_messages).encode(
+                "utf-8"
+            )
+        )
+        bolt = Bolt(input_stream=input_stream, output_stream=io.BytesIO())
+        context = {
+            "taskid": 3,
+            "componentid": "count_bolt",
+            "task->component": {"3": "count_bolt"},
+        }
+        bolt._setup_component(storm_conf, context)
+        return bolt
+
+    def test_no_state_by_default(self):
+        bolt = self._make_bolt({})
+        self.assertIsNone(bolt.state)
+
+    def test_state_from_config(self):
+        bolt = self._make_bolt(
+            {
+                "streamparse.bolt.state_backend": "sqlite",
+                "storm.local.dir": self.tmp_dir,
+                "topology.name": "wordcount",
+            }
+        )
+        self.assertIsInstance(bolt.state.backend, SQLiteBackend)
+        self.assertEqual(
+            bolt.state.backend.path,
+            os.path.join(
+                self.tmp_dir, "streamparse_state", "wordcount", "count_bolt-3.sqlite"
+            ),
+        )
+        bolt.state.backend.close()
+
+    def test_snapshot_on_tick(self):
+        tick = {
+            "id": "1",
+            "comp": "__system",
+            "stream": "__tick",
+            "task": -1,
+            "tuple": [1],
+        }
+        word = {"id": "2", "comp": "spout", "stream": "default", "task": 1}
+        word["tuple"] = ["dog"]
+        bolt = self._make_bolt(
+            {
+                "streamparse.bolt.state_backend": "memory",
+                "streamparse.bolt.state_snapshot_ticks": 2,
+            },
+            [tick, word, tick],
+        )
+        bolt.state.incr("dog")
+        bolt.read_tuple()
+        bolt.read_tuple()
+        self.assertEqual(bolt.state.backend.data, {})
+        bolt.read_tuple()
+        self.assertEqual(bolt.state.backend.data, {"dog": 1})
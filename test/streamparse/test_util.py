@@ -0,0 +1,216 @@
+"""
+Tests for streamparse.util
+"""
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import simplejson as json
+
+from streamparse import cache, util
+
+
+class _UIHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            flaky = self.path == "/flaky" and server.requests.count(self.path) == 1
+        time.sleep(0.05)
+        with server.lock:
+            server.in_flight -= 1
+        if flaky:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path == "/broken":
+            data = {"error": "Internal Server Error", "errorMessage": "oops"}
+        else:
+            data = {"path": self.path}
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GetUIJsonsTests(unittest.TestCase):
+    def setUp(self):
+        server = self.server = ThreadingHTTPServer(("127.0.0.1", 0), _UIHandler)
+        server.lock = threading.Lock()
+        server.requests = []
+        server.in_flight = server.max_in_flight = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        @contextmanager
+        def fake_tunnel(env_config, local_port=None, remote_port=None, quiet=False):
+            yield "127.0.0.1", server.server_address[1]
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        for patcher in (
+            mock.patch.object(cache, "CACHE_DIR", cache_dir),
+            mock.patch.object(cache, "_refresh", False),
+            mock.patch.object(util, "ssh_tunnel", fake_tunnel),
+            mock.patch.object(util, "get_env_config", return_value=("prod", {})),
+            mock.patch.object(
+                util, "get_nimbus_host_port", return_value=("nimbus", 6627)
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_concurrent(self):
+        paths = [f"/api/v1/component/{i}" for i in range(20)]
+        data = util.get_ui_jsons("prod", paths + paths[:5], max_workers=8)
+        self.assertEqual(list(data), paths)
+        self.assertEqual(data[paths[3]], {"path": paths[3]})
+        self.assertEqual(len(self.server.requests), 20)
+        self.assertGreater(self.server.max_in_flight, 1)
+        self.assertLessEqual(self.server.max_in_flight, 8)
+
+    def test_retries(self):
+        self.assertEqual(util.get_ui_json("prod", "/flaky"), {"path": "/flaky"})
+        self.assertEqual(self.server.requests, ["/flaky", "/flaky"])
+
+    def test_error_response(self):
+        with self.assertRaisesRegex(RuntimeError, "oops"):
+            util.get_ui_jsons("prod", ["/ok", "/broken"])
+
+    def test_no_paths(self):
+        self.assertEqual(util.get_ui_jsons("prod", []), {})
+        self.assertEqual(self.server.requests, [])
+
+    def test_cached(self):
+        util.get_ui_jsons("prod", ["/a", "/b"])
+        data = util.get_ui_jsons("prod", ["/c", "/b", "/a"])
+        self.assertEqual(list(data), ["/c", "/b", "/a"])
+        self.assertEqual(data["/a"], {"path": "/a"})
+        self.assertEqual(sorted(self.server.requests), ["/a", "/b", "/c"])
+
+    def test_refresh(self):
+        util.get_ui_jsons("prod", ["/a"])
+        cache.set_refresh()
+        util.get_ui_jsons("prod", ["/a"])
+        self.assertEqual(self.server.requests, ["/a", "/a"])
+
+    def test_cache_disabled(self):
+        with mock.patch.object(
+            util, "get_env_config", return_value=("prod", {"ui_cache_ttl": 0})
+        ):
+            util.get_ui_jsons("prod", ["/a"])
+            util.get_ui_jsons("prod", ["/a"])
+        self.assertEqual(self.server.requests, ["/a", "/a"])
+
+
+class SharedSSHTunnelTests(unittest.TestCase):
+    def setUp(self):
+        self.commands = []
+        self.master_running = False
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+
+        def fake_run(cmd, **kwargs):
+            self.commands.append(cmd)
+            returncode = 0
+            if "check" in cmd:
+                returncode = 0 if self.master_running else 255
+            elif "-fNM" in cmd:
+                self.master_running = True
+            return mock.Mock(returncode=returncode)
+
+        for patcher in (
+            mock.patch.object(util.subprocess, "run", fake_run),
+            mock.patch.object(util.tempfile, "gettempdir", return_value=tmp_dir),
+            mock.patch.object(
+                util, "get_nimbus_host_port", return_value=("nimbus", 6627)
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.env_config = {"user": "storm", "ssh_port": 2222}
+
+    def _actions(self):
+        return [
+            next(arg for arg in cmd if arg in ("check", "forward", "cancel", "-fNM"))
+            for cmd in self.commands
+        ]
+
+    def test_reuses_connection(self):
+        with util.ssh_tunnel(self.env_config, quiet=True) as (host, port):
+            self.assertEqual(host, "localhost")
+            forward = self.commands[-1]
+            self.assertEqual(
+                forward[-3:], ["-L", f"{port}:localhost:6627", "storm@nimbus"]
+            )
+            self.assertEqual(forward[:3], ["ssh", "-p", "2222"])
+        self.assertEqual(
+            self._actions(), ["check", "check", "-fNM", "forward", "cancel"]
+        )
+        self.commands = []
+        with util.ssh_tunnel(self.env_config, remote_port=8080, quiet=True):
+            pass
+        self.assertEqual(self._actions(), ["check", "forward", "cancel"])
+
+    def test_nested_tunnels_share_port(self):
+        with util.ssh_tunnel(self.env_config, quiet=True) as (_, port):
+            with util.ssh_tunnel(self.env_config, quiet=True) as (_, inner_port):
+                self.assertEqual(inner_port, port)
+            self.assertEqual(self._actions().count("cancel"), 0)
+        self.assertEqual(
+            self._actions(), ["check", "check", "-fNM", "forward", "cancel"]
+        )
+
+    def test_lock_not_held_while_connecting(self):
+        held = []
+        fake_run = util.subprocess.run
+
+        def checking_run(cmd, **kwargs):
+            if "-fNM" in cmd:
+                held.append(util._shared_tunnels_lock.locked())
+            return fake_run(cmd, **kwargs)
+
+        with mock.patch.object(util.subprocess, "run", checking_run):
+            with util.ssh_tunnel(self.env_config, quiet=True):
+                pass
+        self.assertEqual(held, [False])
+
+    def test_local_port_deprecated(self):
+        with self.assertWarns(DeprecationWarning):
+            with util.ssh_tunnel(self.env_config, local_port=8081, quiet=True):
+                pass
+
+    def test_master_fails(self):
+        def failing_run(cmd, **kwargs):
+            self.commands.append(cmd)
+            return mock.Mock(returncode=255)
+
+        with mock.patch.object(util.subprocess, "run", failing_run):
+            with self.assertRaisesRegex(OSError, "Unable to open ssh connection"):
+                with util.ssh_tunnel(self.env_config, quiet=True):
+                    pass
+        self.assertEqual(util._shared_tunnels, {})
+
+    def test_disabled(self):
+        env_config = dict(self.env_config, use_ssh_for_nimbus=False)
+        with util.ssh_tunnel(env_config) as (host, port):
+            self.assertEqual((host, port), ("nimbus", 6627))
+        self.assertEqual(self.commands, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
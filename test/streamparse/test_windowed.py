@@ -0,0 +1,307 @@
+"""
+Tests for windowed Bolts
+"""
+import io
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+from pystorm.component import Tuple
+
+from streamparse.storm import WindowedBolt
+from streamparse.storm.windowed import (
+    CountAggregator,
+    SessionWindows,
+    SlidingWindows,
+    SumAggregator,
+    TumblingWindows,
+    Window,
+)
+
+Event = namedtuple("Event", ["user", "timestamp", "amount"])
+
+
+def _make_tup(user, timestamp, amount=1, tup_id=None):
+    if tup_id is None:
+        tup_id = f"{user}-{timestamp}"
+    return Tuple(tup_id, "event_spout", "default", 1, Event(user, timestamp, amount))
+
+
+class RecordingBolt(WindowedBolt):
+    timestamp_field = "timestamp"
+
+    def initialize(self, conf, ctx):
+        self.windows = []
+        self.late = []
+
+    def group_key(self, tup):
+        return tup.values.user
+
+    def process_window(self, key, window, result):
+        if isinstance(result, list):
+            result = [tup.id for tup in result]
+        self.windows.append((key, window, result))
+
+    def process_late_tuple(self, tup):
+        self.late.append(tup.id)
+
+
+class WindowedBoltTestCase(unittest.TestCase):
+    def make_bolt(self, **attrs):
+        cls = type("TestBolt", (RecordingBolt,), attrs)
+        bolt = cls(input_stream=io.BytesIO(), output_stream=io.BytesIO())
+        bolt.initialize({}, {})
+        patcher = mock.patch.object(bolt, "ack", autospec=True)
+        self.ack = patcher.start()
+        self.addCleanup(patcher.stop)
+        return bolt
+
+    def acked(self):
+        return [
+            tup.id if isinstance(tup, Tuple) else tup
+            for tup in (call[0][0] for call in self.ack.call_args_list)
+        ]
+
+
+class WindowValidationTests(unittest.TestCase):
+    def test_size_must_be_multiple_of_slide(self):
+        with self.assertRaises(ValueError):
+            SlidingWindows(size=10, slide=3)
+        with self.assertRaises(ValueError):
+            TumblingWindows(size=0)
+        with self.assertRaises(ValueError):
+            SessionWindows(gap=-1)
+        # Not exact in floating point, but still a multiple
+        self.assertEqual(SlidingWindows(size=0.3, slide=0.1).panes, 3)
+
+    def test_window_required(self):
+        with self.assertRaises(TypeError):
+            RecordingBolt(input_stream=io.BytesIO(), output_stream=io.BytesIO())
+
+
+class TumblingWindowTests(WindowedBoltTestCase):
+    def test_fires_and_acks_when_watermark_passes(self):
+        bolt = self.make_bolt(window=TumblingWindows(10))
+        bolt.process(_make_tup("a", 1))
+        bolt.process(_make_tup("a", 5))
+        bolt.process(_make_tup("b", 7))
+        self.assertEqual(bolt.windows, [])
+        self.assertEqual(self.acked(), [])
+        bolt.process(_make_tup("a", 12))
+        self.assertEqual(
+            sorted(bolt.windows),
+            [
+                ("a", Window(0, 10), ["a-1", "a-5"]),
+                ("b", Window(0, 10), ["b-7"]),
+            ],
+        )
+        self.assertEqual(sorted(self.acked()), ["a-1", "a-5", "b-7"])
+
+    def test_watermark_delay(self):
+        bolt = self.make_bolt(window=TumblingWindows(10), watermark_delay=5)
+        bolt.process(_make_tup("a", 1))
+        bolt.process(_make_tup("a", 12))
+        self.assertEqual(bolt.windows, [])
+        # Out of order, but not late
+        bolt.process(_make_tup("a", 8))
+        bolt.process(_make_tup("a", 15))
+        self.assertEqual(bolt.windows, [("a", Window(0, 10), ["a-1", "a-8"])])
+
+    def test_late_tuples(self):
+        bolt = self.make_bolt(window=TumblingWindows(10))
+        bolt.process(_make_tup("a", 1))
+        bolt.process(_make_tup("a", 12))
+        bolt.process(_make_tup("a", 3))
+        self.assertEqual(bolt.late, ["a-3"])
+        self.assertEqual(bolt.late_tuples, 1)
+        self.assertIn("a-3", self.acked())
+        self.assertEqual(len(bolt.windows), 1)
+
+    def test_allowed_lateness_refires(self):
+        bolt = self.make_bolt(window=TumblingWindows(10), allowed_lateness=5)
+        bolt.process(_make_tup("a", 1))
+        bolt.process(_make_tup("a", 12))
+        self.assertEqual(bolt.windows, [("a", Window(0, 10), ["a-1"])])
+        self.assertEqual(self.acked(), [])
+        bolt.process(_make_tup("a", 3))
+        self.assertEqual(bolt.windows[-1], ("a", Window(0, 10), ["a-1", "a-3"]))
+        bolt.process(_make_tup("a", 16))
+        self.assertEqual(sorted(self.acked()), ["a-1", "a-3"])
+        bolt.process(_make_tup("a", 4))
+        self.assertEqual(bolt.late, ["a-4"])
+
+    def test_emits_anchored_to_window(self):
+        class EmittingBolt(WindowedBolt):
+            window = TumblingWindows(10)
+            timestamp_field = 1
+            aggregator = CountAggregator()
+
+            def process_window(self, key, window, count):
+                self.emit([window.start, count])
+
+        bolt = EmittingBolt(input_stream=io.BytesIO(), output_stream=io.BytesIO())
+        with mock.patch.object(bolt, "send_message", autospec=True) as send:
+            bolt.process(Tuple("x", "spout", "default", 1, ["a", 1]))
+            bolt.process(Tuple("y", "spout", "default", 1, ["a", 2]))
+            bolt.process(Tuple("z", "spout", "default", 1, ["a", 11]))
+        emits = [c[0][0] for c in send.call_args_list if c[0][0]["command"] == "emit"]
+        self.assertEqual(len(emits), 1)
+        self.assertEqual(emits[0]["tuple"], [0, 2])
+        self.assertEqual(emits[0]["anchors"], ["x", "y"])
+
+
+class SlidingWindowTests(WindowedBoltTestCase):
+    def test_each_window_fires(self):
+        bolt = self.make_bolt(
+            window=SlidingWindows(size=10, slide=5), aggregator=SumAggregator("amount")
+        )
+        bolt.process(_make_tup("a", 1, amount=1))
+        bolt.process(_make_tup("a", 6, amount=2))
+        bolt.process(_make_tup("a", 11, amount=4))
+        self.assertEqual(
+            bolt.windows,
+            [("a", Window(-5, 5), 1), ("a", Window(0, 10), 3)],
+        )
+        # The first pane is only acked once the last window it is in closes
+        self.assertEqual(self.acked(), ["a-1"])
+        bolt.process(_make_tup("a", 30, amount=8))
+        self.assertEqual(
+            bolt.windows[2:],
+            [("a", Window(5, 15), 6), ("a", Window(10, 20), 4)],
+        )
+        self.assertEqual(self.acked(), ["a-1", "a-6", "a-11"])
+
+    def test_tuples_aggregated_once(self):
+        aggregator = mock.Mock(wraps=CountAggregator())
+        bolt = self.make_bolt(
+            window=SlidingWindows(size=100, slide=1), aggregator=aggregator
+        )
+        for timestamp in range(200):
+            bolt.process(_make_tup("a", timestamp))
+        self.assertEqual(aggregator.add.call_count, 200)
+        self.assertEqual(bolt.windows[-1], ("a", Window(99, 199), 100))
+
+    def test_window_bounds_do_not_drift(self):
+        bolt = self.make_bolt(
+            window=SlidingWindows(size=0.3, slide=0.1), aggregator=CountAggregator()
+        )
+        for i in range(1000):
+            bolt.process(_make_tup("a", i / 10 + 0.05))
+        self.assertEqual(len(bolt.windows), 999)
+        for i, (_, window, count) in enumerate(bolt.windows):
+            self.assertEqual(window, Window((i - 2) * 0.1, (i + 1) * 0.1))
+        self.assertEqual(bolt.windows[500][2], 3)
+
+    def test_only_due_windows_are_looked_at(self):
+        bolt = self.make_bolt(window=SlidingWindows(size=10, slide=1))
+        for key in range(100):
+            bolt.process(_make_tup(key, 1))
+        with mock.patch.object(
+            bolt, "_fire_window_ending", wraps=bolt._fire_window_ending
+        ) as fire:
+            bolt.advance_watermark(1.5)
+            fire.assert_not_called()
+            bolt.advance_watermark(2)
+        self.assertEqual(fire.call_count, 100)
+
+
+class SessionWindowTests(WindowedBoltTestCase):
+    def test_sessions_merge_and_close(self):
+        bolt = self.make_bolt(window=SessionWindows(gap=5))
+        bolt.process(_make_tup("a", 1))
+        bolt.process(_make_tup("a", 3))
+        bolt.process(_make_tup("b", 4))
+        bolt.process(_make_tup("a", 20))
+        self.assertEqual(
+            sorted(bolt.windows),
+            [
+                ("a", Window(1, 8), ["a-1", "a-3"]),
+                ("b", Window(4, 9), ["b-4"]),
+            ],
+        )
+        self.assertEqual(sorted(self.acked()), ["a-1", "a-3", "b-4"])
+
+    def test_out_of_order_tuple_bridges_sessions(self):
+        bolt = self.make_bolt(window=SessionWindows(gap=5), watermark_delay=20)
+        bolt.process(_make_tup("a", 1))
+        bolt.process(_make_tup("a", 10))
+        bolt.process(_make_tup("a", 5))
+        bolt.process(_make_tup("a", 40))
+        self.assertEqual(bolt.windows, [("a", Window(1, 15), ["a-1", "a-5", "a-10"])])
+
+    def test_late_tuple_updates_fired_session(self):
+        bolt = self.make_bolt(window=SessionWindows(gap=5), allowed_lateness=10)
+        bolt.process(_make_tup("a", 1))
+        bolt.process(_make_tup("a", 10))
+        self.assertEqual(bolt.windows, [("a", Window(1, 6), ["a-1"])])
+        bolt.process(_make_tup("a", 2))
+        self.assertEqual(bolt.windows[-1], ("a", Window(1, 7), ["a-1", "a-2"]))
+        bolt.process(_make_tup("a", 30))
+        bolt.process(_make_tup("a", 3))
+        self.assertEqual(bolt.late, ["a-3"])
+
+    def test_sessions_kept_in_order(self):
+        bolt = self.make_bolt(window=SessionWindows(gap=5), watermark_delay=100)
+        for timestamp in (30, 10, 50, 20, 12, 40):
+            bolt.process(_make_tup("a", timestamp))
+        self.assertEqual(
+            [(session.start, session.end) for session in bolt._sessions["a"]],
+            [(10, 17), (20, 25), (30, 35), (40, 45), (50, 55)],
+        )
+
+    def test_only_due_sessions_are_looked_at(self):
+        bolt = self.make_bolt(window=SessionWindows(gap=5), watermark_delay=100)
+        for key in range(100):
+            bolt.process(_make_tup(key, key))
+        bolt.advance_watermark(15)
+        self.assertEqual([key for key, _, _ in bolt.windows], list(range(11)))
+        self.assertEqual(
+            sorted(self.acked()), sorted(f"{key}-{key}" for key in range(11))
+        )
+        self.assertEqual(len(bolt._session_ends), 89)
+        self.assertEqual(len(bolt._sessions), 89)
+
+
+class WindowedBoltRunTests(WindowedBoltTestCase):
+    def test_tick_advances_watermark(self):
+        bolt = self.make_bolt(window=TumblingWindows(10), tick_advances_watermark=True)
+        bolt.process(_make_tup("a", 1))
+        tick = Tuple("t", "__system", "__tick", -1, [])
+        with mock.patch.object(bolt, "read_tuple", return_value=tick):
+            bolt._run()
+        self.assertEqual(bolt.windows, [("a", Window(0, 10), ["a-1"])])
+        self.assertEqual(self.acked(), ["a-1", "t"])
+
+    def test_auto_ack_disabled(self):
+        bolt = self.make_bolt(window=TumblingWindows(10), auto_ack=False)
+        bolt.process(_make_tup("a", 1))
+        bolt.process(_make_tup("a", 12))
+        bolt.process(_make_tup("a", 3))
+        tick = Tuple("t", "__system", "__tick", -1, [])
+        with mock.patch.object(bolt, "read_tuple", return_value=tick):
+            bolt._run()
+        self.assertEqual(bolt.windows, [("a", Window(0, 10), ["a-1"])])
+        self.assertEqual(bolt.late, ["a-3"])
+        self.assertEqual(self.acked(), [])
+
+    def test_tuples_not_acked_on_receipt(self):
+        bolt = self.make_bolt(window=TumblingWindows(10))
+        with mock.patch.object(bolt, "read_tuple", return_value=_make_tup("a", 1)):
+            bolt._run()
+        self.assertEqual(self.acked(), [])
+
+    def test_exit_fails_held_tuples(self):
+        bolt = self.make_bolt(window=TumblingWindows(10))
+        bolt.process(_make_tup("a", 1))
+        bolt.process(_make_tup("b", 2))
+        with mock.patch.object(bolt, "fail", autospec=True) as fail, mock.patch.object(
+            bolt, "raise_exception", autospec=True
+        ):
+            bolt._current_tups = [_make_tup("a", 3)]
+            bolt._handle_run_exception(ValueError("boom"))
+        failed = sorted(call[0][0] for call in fail.call_args_list)
+        self.assertEqual(failed, ["a-1", "a-3", "b-2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+"""
+Tests for streamparse_run zygotes
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from streamparse import util, zygote
+from streamparse.dsl import Topology
+from streamparse.storm import Bolt, JavaSpout, Spout
+
+
+class WordSpout(Spout):
+    outputs = ["word"]
+
+
+class WordCountBolt(Bolt):
+    outputs = ["word", "count"]
+
+
+CLIENT_SCRIPT = """
+import sys
+from streamparse.zygote import run_in_zygote
+exit_code = run_in_zygote(
+    "test.streamparse_run.streamparse_run_target.StreamparseRunEchoTarget",
+    "json",
+    socket_path=sys.argv[1],
+)
+sys.stdout.write("exit_code={}\\n".format(exit_code))
+"""
+
+
+class ZygoteTests(unittest.TestCase):
+    def test_send_recv_with_fds(self):
+        left, right = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        read_fd, write_fd = os.pipe()
+        try:
+            zygote._send_msg(left, {"hello": "world"}, fds=[write_fd])
+            msg, fds = zygote._recv_msg(right)
+            self.assertEqual(msg, {"hello": "world"})
+            self.assertEqual(len(fds), 1)
+            os.write(fds[0], b"ping")
+            os.close(fds[0])
+            self.assertEqual(os.read(read_fd, 4), b"ping")
+        finally:
+            left.close()
+            right.close()
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_socket_path_depends_on_import_path(self):
+        self.assertNotEqual(
+            zygote.get_socket_path("/tmp/topology_a"),
+            zygote.get_socket_path("/tmp/topology_b"),
+        )
+
+    def test_socket_path_in_private_dir(self):
+        tmp_dir = tempfile.mkdtemp()
+        with mock.patch("tempfile.gettempdir", return_value=tmp_dir):
+            socket_path = zygote.get_socket_path("/tmp/topology_a")
+            zygote_dir = os.path.dirname(socket_path)
+            self.assertEqual(os.stat(zygote_dir).st_mode & 0o777, 0o700)
+            os.chmod(zygote_dir, 0o755)
+            with self.assertRaises(PermissionError):
+                zygote.get_socket_path("/tmp/topology_a")
+
+    def test_lock_does_not_follow_symlinks(self):
+        tmp_dir = tempfile.mkdtemp()
+        target = os.path.join(tmp_dir, "precious")
+        with open(target, "w") as f:
+            f.write("data")
+        socket_path = os.path.join(tmp_dir, "zygote.sock")
+        os.symlink(target, f"{socket_path}.lock")
+        with self.assertRaises(OSError):
+            zygote.Zygote(tmp_dir, socket_path).acquire_lock()
+        with open(target) as f:
+            self.assertEqual(f.read(), "data")
+
+    @mock.patch("streamparse.zygote._get_peer_uid", return_value=os.getuid() + 1)
+    def test_refuse_zygote_of_other_user(self, peer_uid_mock):
+        tmp_dir = tempfile.mkdtemp()
+        socket_path = os.path.join(tmp_dir, "zygote.sock")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(socket_path)
+        listener.listen(1)
+        try:
+            with mock.patch("streamparse.zygote._send_msg") as send_mock:
+                exit_code = zygote.run_in_zygote(
+                    "test.streamparse_run.streamparse_run_target.Target",
+                    "json",
+                    socket_path=socket_path,
+                )
+        finally:
+            listener.close()
+        self.assertIsNone(exit_code)
+        send_mock.assert_not_called()
+        peer_uid_mock.assert_called_once()
+
+    def test_fork_from_zygote(self):
+        repo_root = os.path.dirname(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        tmp_dir = tempfile.mkdtemp()
+        socket_path = os.path.join(tmp_dir, "zygote.sock")
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "streamparse.zygote",
+                repo_root,
+                socket_path,
+                "--idle_timeout",
+                "30",
+            ],
+            cwd=repo_root,
+        )
+        try:
+            deadline = time.time() + 10
+            while not os.path.exists(socket_path) and time.time() < deadline:
+                time.sleep(0.05)
+            client = subprocess.run(
+                [sys.executable, "-c", CLIENT_SCRIPT, socket_path],
+                cwd=repo_root,
+                stdout=subprocess.PIPE,
+                check=True,
+            )
+            lines = client.stdout.decode("utf-8").splitlines()
+            self.assertEqual(lines[-1], "exit_code=0")
+            serializer, child_pid = lines[0].split()
+            self.assertEqual(serializer, "json")
+            self.assertNotEqual(int(child_pid), server.pid)
+        finally:
+            server.kill()
+            server.wait()
+
+    def test_set_topology_zygote(self):
+        class WordCount(Topology):
+            word_spout = WordSpout.spec()
+            word_bolt = WordCountBolt.spec(inputs=[word_spout])
+            java_spout = JavaSpout.spec(
+                full_class_name="com.example.Spout", args_list=[], outputs=["x"]
+            )
+
+        util.set_topology_zygote({}, WordCount)
+        bolt_shell = WordCount.thrift_bolts["word_bolt"].bolt_object.shell
+        self.assertFalse(bolt_shell.script.startswith("--zygote"))
+
+        util.set_topology_zygote({"streamparse.run.zygote": True}, WordCount)
+        self.assertTrue(bolt_shell.script.startswith("--zygote "))
+        spout_shell = WordCount.thrift_spouts["word_spout"].spout_object.shell
+        self.assertTrue(spout_shell.script.startswith("--zygote "))
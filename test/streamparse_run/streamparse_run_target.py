@@ -12,3 +12,17 @@ class StreamparseRunTarget:
     def run(self):
         StreamparseRunTests.run_target_invoked = True
         StreamparseRunTests.run_target_invoked_serializer = self.serializer
+
+
+class StreamparseRunEchoTarget:
+    """Target that reports how it was started on the stdout Storm gave it"""
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+
+    def run(self):
+        import os
+        import sys
+
+        sys.stdout.write(f"{self.serializer} {os.getpid()}\n")
+        sys.stdout.flush()